@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+ルールエンジン移行前後の main_logic 1呼び出しあたりのコスト比較
+
+  python -m benchmarks.bench_engine [--number N]
+
+移行前は tests/legacy_logic.py の凍結コピーを計測する。
+evaluate 列はコンパイル済みプランの評価のみ（レスポンス組み立てを除く）。
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import estimate_logic as root_logic  # noqa: E402
+import function_app  # noqa: E402
+from dify_assets.code import estimate_logic as dify_logic  # noqa: E402
+from tests import legacy_logic  # noqa: E402
+
+DIFY_REQUEST = dify_logic.prepare_args({
+    'screen_count': 12, 'table_count': 3, 'complexity': 'high', 'dev_type': 'porting',
+    'target_platform': 'mobile', 'features': ['認証・認可 (Auth/SSO)', 'payment', 'api_external'],
+    'phase2_items': ['基本設計書作成', 'security_review'], 'phase3_items': ['logo_creation'],
+    'confidence': 'low', 'target_margin': '20%',
+    'dept_allocation': 'ＤＴ第１開発部: 0.6\nＣＳ第１システム開発部: 0.4',
+})
+ROOT_REQUEST = {
+    'screen_count': 12, 'table_count': 3, 'profile': 'standard', 'department': 'ＤＴ第１開発部',
+    'features': 'auth, payment, search', 'complexity': 'high', 'target_margin': '15%',
+}
+FUNCTION_APP_REQUEST = {
+    'screen_count': 12, 'complexity': 'high', 'confidence': 'medium',
+    'features': ['ユーザー認証', 'crud', 'payment'], 'phase2_items': ['IA設計', 'wireframe'],
+    'phase3_items': ['ui_design', 'logo_icon'],
+}
+
+
+def _without_unresolved(result):
+    # 凍結コピーには unresolved_items が無い
+    if isinstance(result, tuple):
+        return _without_unresolved(result[0]), result[1]
+    return {k: v for k, v in result.items() if k != 'unresolved_items'}
+
+
+def per_call_us(fn, number: int) -> float:
+    best = min(timeit.repeat(fn, number=number, repeat=5))
+    return best / number * 1e6
+
+
+def run(number: int):
+    snapshot = function_app.CONFIG_STORE.get()
+    function_app_plan = function_app.plan_for(snapshot)
+    cases = [
+        ("dify_assets/code/estimate_logic",
+         lambda: legacy_logic.dify_main_logic(DIFY_REQUEST, []),
+         lambda: dify_logic.main_logic(DIFY_REQUEST, []),
+         lambda: dify_logic.PLAN.evaluate(DIFY_REQUEST, [])),
+        ("estimate_logic",
+         lambda: legacy_logic.root_main_logic(ROOT_REQUEST),
+         lambda: root_logic.main_logic(ROOT_REQUEST),
+         lambda: root_logic.PLAN.evaluate(ROOT_REQUEST)),
+        ("function_app",
+         lambda: legacy_logic.function_app_main_logic(FUNCTION_APP_REQUEST, snapshot),
+         lambda: function_app.main_logic(FUNCTION_APP_REQUEST, snapshot),
+         lambda: function_app_plan.evaluate(FUNCTION_APP_REQUEST)),
+    ]
+    rows = []
+    for name, before, after, evaluate in cases:
+        assert before() == _without_unresolved(after()), name
+        rows.append((name, per_call_us(before, number), per_call_us(after, number), per_call_us(evaluate, number)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+    print(f"{'variant':<34}{'before [us]':>12}{'after [us]':>12}{'speedup':>9}{'evaluate [us]':>15}")
+    for name, before, after, evaluate in run(args.number):
+        print(f"{name:<34}{before:>12.2f}{after:>12.2f}{before / after:>8.2f}x{evaluate:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+見積エンジン・HTTP 経路のベンチマークスイート（ベースライン比較つき）
+
+  python -m benchmarks.bench_suite                      # 計測してベースラインと比較（劣化があれば終了コード1）
+  python -m benchmarks.bench_suite --update-baseline    # 計測結果でベースラインを書き換える
+  python -m benchmarks.bench_suite --only calculate --threshold 0.5
+
+- マイクロ: main_logic 3系統 / load_config / resolve_keys / Dify main（文字列入力のパース込み）
+  / レスポンスの JSON エンコード（標準 json と orjson。orjson 未導入なら encode.orjson は省略）/ /calculate のメモのヒット
+  / Dify 文字列入力のパース（移行前の parse_* の連鎖と estimate_schema）/ 見積セッションの1項目パッチ
+- E2E: /calculate と /report をプロセス内 ASGI クライアント（httpx.ASGITransport）で呼ぶ。
+  Gemini はローカルスタブ（tests/gemini_stub.py）に差し替える
+- 起動: outsystems_api_wrapper / function_app を新しいプロセスで import した時間（-X importtime の累積 µs）
+- 各ケースは repeat 回計測した最良値（1呼び出しあたり µs）。劣化判定は baseline × (1 + threshold) 超
+"""
+
+import argparse
+import asyncio
+import glob
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import timeit
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import estimate_logic as root_logic  # noqa: E402
+import function_app  # noqa: E402
+import json_response  # noqa: E402
+from estimate_diff import diff_estimates  # noqa: E402
+from estimate_memo import EstimateMemo  # noqa: E402
+from estimate_session import EstimateSessions  # noqa: E402
+from dify_assets.code import estimate_logic as dify_logic  # noqa: E402
+from tests import legacy_logic  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_THRESHOLD = 0.3
+
+DIFY_REQUEST = dify_logic.prepare_args({
+    'screen_count': 12, 'table_count': 3, 'complexity': 'high', 'dev_type': 'porting',
+    'target_platform': 'mobile', 'features': ['認証・認可 (Auth/SSO)', 'payment', 'api_external'],
+    'phase2_items': ['基本設計書作成', 'security_review'], 'phase3_items': ['logo_creation'],
+    'confidence': 'low', 'target_margin': '20%',
+    'dept_allocation': 'ＤＴ第１開発部: 0.6\nＣＳ第１システム開発部: 0.4',
+})
+# Dify Code Node から渡される形（すべて文字列）
+DIFY_MAIN_KWARGS = {
+    'screen_count': '12', 'table_count': '3', 'complexity': 'high', 'dev_type': 'porting',
+    'target_platform': 'mobile', 'features': '認証・認可 (Auth/SSO)\npayment, api_external',
+    'phase2_items': '基本設計書作成, security_review', 'phase3_items': 'logo_creation',
+    'confidence': 'low', 'target_margin': '20%', 'team_ratio': 'Rank4:0.2, Rank3:0.5, Rank2:0.3',
+    'dept_allocation': 'ＤＴ第１開発部: 0.6\nＣＳ第１システム開発部: 0.4',
+}
+ROOT_REQUEST = {
+    'screen_count': 12, 'table_count': 3, 'profile': 'standard', 'department': 'ＤＴ第１開発部',
+    'features': 'auth, payment, search', 'complexity': 'high', 'target_margin': '15%',
+}
+FUNCTION_APP_REQUEST = {
+    'screen_count': 12, 'complexity': 'high', 'confidence': 'medium',
+    'features': ['ユーザー認証', 'crud', 'payment'], 'phase2_items': ['IA設計', 'wireframe'],
+    'phase3_items': ['ui_design', 'logo_icon'],
+}
+RESOLVE_INPUT = list(dify_logic.FEATURE_LABEL_MAP) + list(dify_logic.FEATURE_MAN_DAYS) + ['unknown'] * 4
+CALCULATE_BODY = {
+    'screen_count': 12, 'table_count': 3, 'complexity': 'high', 'department': 'ＤＴ第１開発部',
+    'features': ['auth', 'payment'], 'phase2_items': ['basic_design'], 'phase3_items': ['logo_creation'],
+    'confidence': 'low', 'target_margin': 0.2,
+}
+REPORT_BODY = {"estimation_result": {"estimated_amount": "¥1,000"}, "language": "ja", "output_format": "html"}
+
+# 起動時間を計測するエントリポイント
+# 起動時には読み込まない（初回利用まで遅延する）モジュール
+LAZY_MODULES = ("yaml", "httpx", "cProfile", "pstats", "markdown", "multiprocessing",
+                "estimate_pool", "estimate_grid", "estimate_solver", "estimate_simulation",
+                "estimate_departments", "estimate_diff")
+# このリポジトリのモジュール自身の import 時間（self の合計, ms）の上限。フレームワーク（fastapi 等）の読み込みは含まない
+# （ラッパーの self にはモデル定義・ルート登録の時間が入る）
+IMPORT_BUDGET_MS = {"outsystems_api_wrapper": 120.0, "function_app": 50.0}
+OWN_PACKAGES = frozenset(
+    [os.path.splitext(os.path.basename(p))[0] for p in glob.glob(os.path.join(ROOT, "*.py"))] + ["dify_assets"])
+
+
+def _micro_cases() -> List[Tuple[str, Callable[[], Any], int]]:
+    snapshot = function_app.CONFIG_STORE.get()
+    # /calculate と同じ形のレスポンス（日本語ラベル・入れ子の内訳を含む）
+    response = dify_logic.estimate(**CALCULATE_BODY)
+    encoders = [("encode.stdlib", lambda: json_response.dumps_stdlib(response), 20000)]
+    if json_response.orjson is not None:
+        encoders.append(("encode.orjson", lambda: json_response.dumps_orjson(response), 20000))
+    memo = EstimateMemo(max_entries=1024, ttl=0)
+    # 見積セッション: 1ターンに1項目（complexity）を変えるパッチ（入力の解釈 + 下流の中間値だけの部分評価 + 全体の結果 + delta）
+    sessions = EstimateSessions(ttl=0)
+    session_id = sessions.create(CALCULATE_BODY)["session_id"]
+    turns = itertools.cycle([{"complexity": "medium"}, {"complexity": "high"}])
+    # 見積の差分: 2つのリクエスト（メモ済み）の比較（比較項目の抽出 + Phase2/3 費用の部分評価関数 + 原因）
+    diff_base = {"request": CALCULATE_BODY}
+    diff_revised = {"request": dict(CALCULATE_BODY, complexity="medium", target_margin=0.3)}
+    return encoders + [
+        ("memo.hit", lambda: memo.estimate(CALCULATE_BODY), 20000),
+        ("session.patch", lambda: sessions.patch(session_id, next(turns)), 20000),
+        ("diff.requests", lambda: diff_estimates(diff_base, diff_revised, estimate=memo.estimate), 20000),
+        ("main_logic.dify", lambda: dify_logic.main_logic(DIFY_REQUEST, []), 20000),
+        ("main_logic.root", lambda: root_logic.main_logic(ROOT_REQUEST), 20000),
+        ("main_logic.function_app", lambda: function_app.main_logic(FUNCTION_APP_REQUEST, snapshot), 20000),
+        ("load_config", function_app.load_config, 200),
+        ("resolve_keys", lambda: dify_logic.resolve_keys(
+            RESOLVE_INPUT, dify_logic.FEATURE_LABEL_MAP, dify_logic.FEATURE_MAN_DAYS), 20000),
+        ("dify.main", lambda: dify_logic.main(**DIFY_MAIN_KWARGS), 5000),
+        # Dify 文字列入力のパース: 移行前の parse_* の連鎖 / estimate_schema の変換器
+        ("parse.legacy", lambda: legacy_logic.dify_prepare_args(DIFY_MAIN_KWARGS), 20000),
+        ("parse.schema", lambda: dify_logic.prepare_args(DIFY_MAIN_KWARGS), 20000),
+    ]
+
+
+def measure_import(module: str) -> Dict[str, Any]:
+    """新しいインタプリタで module を import し、累積時間・自リポジトリ分の時間・読み込まれたモジュールを返す。"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=ROOT, capture_output=True, text=True, check=True)
+    rows: Dict[str, Tuple[int, int]] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if self_us.strip().isdigit():
+            rows[name.strip()] = (int(self_us), int(cumulative_us))
+    return {
+        "total_us": rows[module][1],
+        "own_us": sum(s for name, (s, _) in rows.items() if name.split(".")[0] in OWN_PACKAGES),
+        "loaded": sorted(rows),
+    }
+
+
+def _time_micro(fn: Callable[[], Any], number: int, repeat: int) -> float:
+    fn()
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+async def _time_async(call: Callable[[], Any], number: int, repeat: int) -> float:
+    await call()
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            await call()
+        best = min(best, time.perf_counter() - started)
+    return best / number * 1e6
+
+
+async def _run_http(scale: float, repeat: int, only: Optional[str]) -> Dict[str, float]:
+    import httpx
+    import outsystems_api_wrapper as wrapper
+    from gemini_client import GeminiClient
+    from tests.gemini_stub import start_stub
+
+    server, base_url = start_stub()
+    saved = (wrapper.GEMINI_API_KEY, wrapper.gemini_client)
+    wrapper.GEMINI_API_KEY = "bench-key"
+    wrapper.gemini_client = GeminiClient(base_url=base_url)
+    results: Dict[str, float] = {}
+    try:
+        transport = httpx.ASGITransport(app=wrapper.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def calculate():
+                res = await client.post("/calculate", json=CALCULATE_BODY)
+                res.raise_for_status()
+
+            async def report_miss():
+                wrapper.report_cache.clear()
+                res = await client.post("/report", json=REPORT_BODY)
+                res.raise_for_status()
+
+            async def report_hit():
+                res = await client.post("/report", json=REPORT_BODY)
+                res.raise_for_status()
+
+            for name, call, number in (("http.calculate", calculate, 500),
+                                       ("http.report.miss", report_miss, 100),
+                                       ("http.report.hit", report_hit, 500)):
+                if only and only not in name:
+                    continue
+                results[name] = await _time_async(call, max(1, int(number * scale)), repeat)
+    finally:
+        await wrapper.gemini_client.aclose()
+        wrapper.GEMINI_API_KEY, wrapper.gemini_client = saved
+        wrapper.report_cache.clear()
+        server.shutdown()
+    return results
+
+
+def run(scale: float = 1.0, repeat: int = 5, only: Optional[str] = None) -> Dict[str, float]:
+    """全ケースを計測し {ケース名: µs/呼び出し} を返す。"""
+    results: Dict[str, float] = {}
+    for name, fn, number in _micro_cases():
+        if only and only not in name:
+            continue
+        results[name] = _time_micro(fn, max(1, int(number * scale)), repeat)
+    results.update(asyncio.run(_run_http(scale, repeat, only)))
+    for module in IMPORT_BUDGET_MS:
+        name = f"import.{module}"
+        if only and only not in name:
+            continue
+        results[name] = min(measure_import(module)["total_us"] for _ in range(repeat))
+    return results
+
+
+def load_baseline(path: str = BASELINE_PATH) -> Dict[str, float]:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {name: entry["us_per_call"] for name, entry in data["results"].items()}
+
+
+def save_baseline(results: Dict[str, float], path: str = BASELINE_PATH) -> None:
+    data = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": {name: {"us_per_call": round(us, 3)} for name, us in sorted(results.items())},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float],
+            threshold: float = DEFAULT_THRESHOLD) -> List[Dict[str, Any]]:
+    """ベースラインとの比較行。ratio = 今回 / ベースライン、regressed = ratio > 1 + threshold"""
+    rows = []
+    for name, us in results.items():
+        base = baseline.get(name)
+        ratio = us / base if base else None
+        rows.append({
+            "name": name, "us_per_call": us, "baseline": base, "ratio": ratio,
+            "regressed": ratio is not None and ratio > 1.0 + threshold,
+        })
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="許容する劣化率（0.3 = ベースラインの 1.3 倍まで）")
+    parser.add_argument("--scale", type=float, default=1.0, help="各ケースの呼び出し回数の倍率")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="ケース名に含まれる文字列で絞り込む")
+    parser.add_argument("--json", action="store_true", help="比較結果を JSON で出力する")
+    args = parser.parse_args(argv)
+
+    results = run(args.scale, args.repeat, args.only)
+    if args.update_baseline:
+        if args.only and os.path.exists(args.baseline):
+            # 絞り込み時は他ケースのベースラインを残す
+            results = dict(load_baseline(args.baseline), **results)
+        save_baseline(results, args.baseline)
+        print(f"baseline written: {args.baseline}")
+        return 0
+
+    baseline = load_baseline(args.baseline) if os.path.exists(args.baseline) else {}
+    rows = compare(results, baseline, args.threshold)
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+    else:
+        print(f"{'case':<26}{'us/call':>12}{'baseline':>12}{'ratio':>8}")
+        for row in rows:
+            base = f"{row['baseline']:.2f}" if row["baseline"] else "-"
+            ratio = f"{row['ratio']:.2f}" if row["ratio"] else "-"
+            mark = "  REGRESSION" if row["regressed"] else ""
+            print(f"{row['name']:<26}{row['us_per_call']:>12.2f}{base:>12}{ratio:>8}{mark}")
+        if "encode.stdlib" in results and "encode.orjson" in results:
+            print(f"json encode speedup (stdlib / orjson): {results['encode.stdlib'] / results['encode.orjson']:.1f}x")
+        if "parse.legacy" in results and "parse.schema" in results:
+            print(f"input parse speedup (legacy / schema): {results['parse.legacy'] / results['parse.schema']:.1f}x")
+    regressed = [row["name"] for row in rows if row["regressed"]]
+    if regressed:
+        print(f"regressed beyond {args.threshold:.0%}: {', '.join(regressed)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+estimate_config.yaml のスナップショット層
+- YAMLは1回だけパースし、検証後に係数・単価を解決済みの不変スナップショットを作る
+- リクエストごとには os.stat のみ行い、mtime/サイズが変わった時だけ再読込する
+- 内容ハッシュが同じなら再パースせず、変わった時だけ参照を丸ごと差し替える（アトミック）
+- コンパイル済み設定（estimate_config.compiled.json）: YAML の内容ハッシュとパース結果を JSON で保持する。
+  ハッシュが一致すれば YAML をパースせず（PyYAML の import もせず）に読み込む。
+  ビルド時（CI の Precompile config）に `python -m config_snapshot` でだけ生成する。実行時は読むだけで、
+  無い/古い場合は YAML をパースする（デプロイ先には書き込まない）
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from functools import cached_property
+from types import MappingProxyType
+from typing import Any, Dict, Mapping, Optional
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "estimate_config.yaml")
+COMPILED_FORMAT = 1
+
+
+class ConfigValidationError(ValueError):
+    pass
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _require_number(value: Any, name: str) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ConfigValidationError(f"{name} must be a number (got {value!r})")
+    return value
+
+
+def _number_map(raw: Any, name: str) -> Mapping[str, float]:
+    if raw is None:
+        return MappingProxyType({})
+    if not isinstance(raw, dict):
+        raise ConfigValidationError(f"{name} must be a mapping")
+    return MappingProxyType({k: _require_number(v, f"{name}.{k}") for k, v in raw.items()})
+
+
+@dataclass(frozen=True)
+class ConfigSnapshot:
+    raw: Mapping[str, Any]
+    version: str
+    digest: str
+    loaded_at: float
+    # 解決済みの係数・単価
+    difficulty_multipliers: Mapping[str, float]
+    buffer_multiplier: float
+    sier_rate: float
+    outsource_rate: float
+    mgmt_fee_rate: float
+    vendor_variance: Mapping[str, float]
+    man_days_per_screen: float
+    require_explicit_productivity: bool
+    require_explicit_vendor_confidence: bool
+    currency: str
+
+    @cached_property
+    def loaded_at_iso(self) -> str:
+        return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.loaded_at))
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "digest": self.digest,
+            "loaded_at": self.loaded_at_iso,
+        }
+
+
+def build_snapshot(config: Dict[str, Any], digest: str = "", loaded_at: Optional[float] = None) -> ConfigSnapshot:
+    """パース済み dict を検証し、main_logic がそのまま使える形に解決する。"""
+    if not isinstance(config, dict):
+        raise ConfigValidationError("config root must be a mapping")
+
+    daily_rates = _number_map(config.get('daily_rates'), 'daily_rates')
+    policy = config.get('policy') or {}
+    design = config.get('design') or {}
+    development = config.get('development') or {}
+    if not isinstance(policy, dict) or not isinstance(design, dict) or not isinstance(development, dict):
+        raise ConfigValidationError("policy/design/development must be mappings")
+
+    return ConfigSnapshot(
+        raw=_freeze(config),
+        version=str(config.get('config_version', '2026-01')),
+        digest=digest,
+        loaded_at=time.time() if loaded_at is None else loaded_at,
+        difficulty_multipliers=_number_map(config.get('difficulty_multipliers'), 'difficulty_multipliers'),
+        buffer_multiplier=_require_number(config.get('buffer_multiplier', 1.1), 'buffer_multiplier'),
+        sier_rate=daily_rates.get('sier_internal', 50000),
+        outsource_rate=daily_rates.get('outsource', 80000),
+        mgmt_fee_rate=_require_number(design.get('phase3_management_fee_rate', 0.15), 'design.phase3_management_fee_rate'),
+        vendor_variance=_number_map(design.get('vendor_variance'), 'design.vendor_variance'),
+        man_days_per_screen=_require_number(development.get('man_days_per_screen', 1.5), 'development.man_days_per_screen'),
+        require_explicit_productivity=bool(policy.get('require_explicit_productivity_for_step_fp', True)),
+        require_explicit_vendor_confidence=bool(policy.get('require_explicit_vendor_confidence', True)),
+        currency=str(config.get('currency', 'JPY')),
+    )
+
+
+def compiled_path_for(path: str) -> str:
+    return os.path.splitext(path)[0] + ".compiled.json"
+
+
+def parse_yaml(data: bytes) -> Any:
+    """YAML をパースする（PyYAML はここで初めて import する。不正な YAML は ConfigValidationError）"""
+    import yaml
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    try:
+        return yaml.load(data.decode("utf-8"), Loader=loader)
+    except yaml.YAMLError as e:
+        raise ConfigValidationError(f"invalid YAML: {e}") from e
+
+
+def read_compiled(compiled_path: str, digest: str) -> Optional[Dict[str, Any]]:
+    """コンパイル済み設定を読む。無い・形式違い・ハッシュ不一致なら None"""
+    try:
+        with open(compiled_path, "rb") as f:
+            data = json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get("format") != COMPILED_FORMAT or data.get("digest") != digest:
+        return None
+    return data.get("config")
+
+
+def write_compiled(compiled_path: str, digest: str, config: Dict[str, Any]) -> bool:
+    """コンパイル済み設定をアトミックに書き出す（compile_config 用）。JSON で同じ値に戻らない設定（非文字列キー等）は書かない"""
+    try:
+        text = json.dumps({"format": COMPILED_FORMAT, "digest": digest, "config": config},
+                          ensure_ascii=False, separators=(",", ":"))
+    except (TypeError, ValueError):
+        return False
+    if json.loads(text)["config"] != config:
+        return False
+    tmp = f"{compiled_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, compiled_path)
+    except OSError:
+        # 読み取り専用のデプロイ先（run-from-package 等）では書けないが、YAML から読めば動作は同じ
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+    return True
+
+
+def compile_config(path: str = DEFAULT_CONFIG_PATH, compiled_path: Optional[str] = None) -> str:
+    """YAML を検証してコンパイル済み設定を書き出す（ビルド/デプロイ時用）。書き出したパスを返す"""
+    compiled_path = compiled_path or compiled_path_for(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    config = parse_yaml(data)
+    build_snapshot(config, digest=digest)
+    if not write_compiled(compiled_path, digest, config):
+        raise ConfigValidationError(f"could not write compiled config: {compiled_path}")
+    return compiled_path
+
+
+class ConfigStore:
+    """設定ファイルのスナップショットを保持し、変更時のみ再読込する。"""
+
+    def __init__(self, path: str = DEFAULT_CONFIG_PATH, compiled_path: Optional[str] = None):
+        self.path = path
+        # "" を渡すとコンパイル済み設定を使わない
+        self.compiled_path = compiled_path_for(path) if compiled_path is None else compiled_path
+        self._lock = threading.Lock()
+        self._snapshot: Optional[ConfigSnapshot] = None
+        self._stat_key = None
+
+    def _build(self, data: bytes, digest: str) -> ConfigSnapshot:
+        if self.compiled_path:
+            config = read_compiled(self.compiled_path, digest)
+            if config is not None:
+                return build_snapshot(config, digest=digest)
+        return build_snapshot(parse_yaml(data), digest=digest)
+
+    def _stat(self):
+        st = os.stat(self.path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _load(self, stat_key) -> None:
+        with open(self.path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        current = self._snapshot
+        if current is not None and current.digest == digest:
+            # touchのみ（内容同一）なら再パースしない
+            self._stat_key = stat_key
+            return
+        try:
+            snapshot = self._build(data, digest)
+        except ConfigValidationError as e:
+            if current is None:
+                raise
+            # 壊れた設定では差し替えない（直前のスナップショットで継続）
+            logging.error(f"Config reload failed, keeping {current.version}/{current.digest}: {e}")
+            self._stat_key = stat_key
+            return
+        self._snapshot = snapshot
+        self._stat_key = stat_key
+
+    def get(self) -> ConfigSnapshot:
+        snapshot = self._snapshot
+        try:
+            stat_key = self._stat()
+        except OSError:
+            if snapshot is not None:
+                return snapshot
+            raise
+        if snapshot is not None and stat_key == self._stat_key:
+            return snapshot
+        with self._lock:
+            if self._snapshot is None or stat_key != self._stat_key:
+                self._load(stat_key)
+            return self._snapshot
+
+
+_shared_store: Optional[ConfigStore] = None
+_shared_lock = threading.Lock()
+
+
+def shared_store() -> ConfigStore:
+    """プロセスで共有する既定の設定（DEFAULT_CONFIG_PATH）のストア。アプリ・シミュレーション・ワーカーが同じものを使う。"""
+    global _shared_store
+    if _shared_store is None:
+        with _shared_lock:
+            if _shared_store is None:
+                _shared_store = ConfigStore()
+    return _shared_store
+
+
+if __name__ == "__main__":
+    # python -m config_snapshot [config.yaml [out.json]]
+    print(compile_config(*sys.argv[1:3]))
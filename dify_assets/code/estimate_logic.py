@@ -4,15 +4,25 @@ BS版 見積ロジック（Dify Code Node用 & Backend共通）
 - FY2026 利益管理表の係数に準拠（1人月=160h、部門別 間接費単金、本部/全社販管費率=BSは47.8%）
 - SG&Aは粗利ベースで控除（= 本部販管費率 + 全社販管費率）
 - 目標営業利益率からの逆算売価式も粗利ベースの定義に合わせて修正
+- 計算式は RULESET に宣言し、estimate_engine でコンパイルした評価プランで実行する
+  （Dify の Code Node には、依存モジュールを埋め込んだ dify_assets/dist/estimate_logic.py を貼り付ける。
+  このファイルを変えたら python -m dify_bundle で作り直すこと）
+- 入力の解釈は INPUT_SCHEMA（estimate_schema）で行い、解釈できなかった値は結果の input_errors に返す
 
 入出力：
-  def main(**kwargs) -> dict:
-    return {"result": json.dumps(data, ensure_ascii=False, indent=2)}
+  def estimate(**kwargs) -> dict:       # 構造化（dictのまま）
+    return main_logic(...)
+  def main(**kwargs) -> dict:           # Dify Code Node 用
+    return {"result": json.dumps(estimate(**kwargs), ensure_ascii=False, indent=2)}
 """
 
 import json
 import math
-from typing import List, Dict, Any
+import time
+from typing import List, Dict, Any, Tuple
+
+from estimate_engine import LabelIndex, OrgRateTable, compile_ruleset
+from estimate_schema import FieldError, InputSchema, allocation, choice, integer, margin, ratio_map, text_list
 
 # =========================================================
 # CONFIGURATION & CONSTANTS
@@ -109,6 +119,14 @@ BS_ORG_CONFIG: Dict[str, Dict[str, float]] = {
 
 DEFAULT_BS_DEPT = "ビジネスイノベーション事業部共通"
 
+# 部門 → (間接費単金, 販管費率)
+BS_ORG_RATES = {
+    dept: (cfg["indirect_per_hour"], cfg["sga_on_propa_labor_rate"]) for dept, cfg in BS_ORG_CONFIG.items()
+}
+
+# 部門を配列インデックスにした単金・販管費率テーブル（応援配分の (インデックス列, シェア列) はリクエスト間で再利用）
+BS_RATE_TABLE = OrgRateTable(BS_ORG_RATES, DEFAULT_BS_DEPT)
+
 # =========================================================
 # Feature & Phase Item Maps（元PoCの構造を踏襲）
 # =========================================================
@@ -168,357 +186,257 @@ PHASE3_LABEL_MAP = {
     "マーケティング素材/LP": "marketing_asset",
 }
 
+# ラベル括弧内の英語名での指定も受け付ける
+FEATURE_ALIASES = {
+    "Auth/SSO": "auth",
+    "Payment": "payment",
+    "Admin": "admin_dashboard",
+    "i18n": "multi_language",
+}
+
+# ラベル/キー → 項目キーの解決インデックス（全角/半角・空白の表記ゆれも吸収）
+FEATURE_INDEX = LabelIndex(FEATURE_MAN_DAYS, FEATURE_LABEL_MAP, FEATURE_ALIASES)
+PHASE2_INDEX = LabelIndex(PHASE2_ITEMS, PHASE2_LABEL_MAP)
+PHASE3_INDEX = LabelIndex(PHASE3_ITEMS, PHASE3_LABEL_MAP)
+
 # =========================================================
 # HELPERS
 # =========================================================
 
+# (id(label_map), id(item_dict)) → (label_map, item_dict, LabelIndex)。参照を保持して id の再利用を防ぐ
+_INDEX_CACHE = {
+    (id(label_map), id(item_dict)): (label_map, item_dict, index)
+    for label_map, item_dict, index in (
+        (FEATURE_LABEL_MAP, FEATURE_MAN_DAYS, FEATURE_INDEX),
+        (PHASE2_LABEL_MAP, PHASE2_ITEMS, PHASE2_INDEX),
+        (PHASE3_LABEL_MAP, PHASE3_ITEMS, PHASE3_INDEX),
+    )
+}
+
+
 def resolve_keys(input_list, label_map, item_dict):
-    if not isinstance(input_list, list):
-        return []
-    resolved = []
-    for x in input_list:
-        if not x:
-            continue
-        if x in label_map:
-            resolved.append(label_map[x])
-        elif x in item_dict:
-            resolved.append(x)
-    # 重複排除
-    return list(dict.fromkeys(resolved))
+    # 入力順を保って重複排除。解決できないラベルは捨てる（未解決の一覧が必要なら LabelIndex.resolve）
+    key = (id(label_map), id(item_dict))
+    cached = _INDEX_CACHE.get(key)
+    if cached is None or cached[0] is not label_map or cached[1] is not item_dict:
+        cached = _INDEX_CACHE[key] = (label_map, item_dict, LabelIndex(item_dict, label_map))
+    return cached[2].resolve(input_list)[0]
+
+
+# 入力スキーマ（estimate_schema の変換器を起動時に組み立てる。API の EstimationRequest も同じ変換器を使う）
+DEFAULT_TEAM_RATIO = {"Rank3": 0.8, "Rank2": 0.2}
+LIST_FIELDS = ('features', 'phase2_items', 'phase3_items', 'tables')
+
+
+def _complete_table_count(args):
+    # tablesがあればtable_countを自動補完
+    if args.get('tables') and (args.get('table_count') is None or args.get('table_count') == 0):
+        args['table_count'] = len(args['tables'])
+
+
+INPUT_SCHEMA = InputSchema(
+    [(key, text_list(), True) for key in LIST_FIELDS] + [
+        ('screen_count', integer(), True),
+        ('table_count', integer(), True),
+        ('target_margin', margin(), True),
+        ('department', choice(BS_ORG_CONFIG, DEFAULT_BS_DEPT), True),
+        # 文字列の時だけ配列/比率に正規化（構造化済みの値はそのまま評価プランへ）
+        ('dept_allocation', allocation(BS_ORG_CONFIG), False),
+        ('team_ratio', ratio_map(CONFIG["profit_config"]["rank_costs"], DEFAULT_TEAM_RATIO), False),
+    ],
+    derive=_complete_table_count,
+)
 
 
 def parse_list_from_text(val):
     # 改行/カンマ区切り → list
-    items = []
-    if isinstance(val, str):
-        for line in val.replace('\r', '').split('\n'):
-            items.extend([x.strip() for x in line.split(',') if x.strip()])
-    elif isinstance(val, list):
-        items = val
-    return [x for x in items if x not in ['なし', '未定', '不明', 'N/A', '-']]
+    return INPUT_SCHEMA.coercers['features'](val)[0]
 
 
 def parse_int(val, default=None):
-    if isinstance(val, (int, float)):
-        return int(val)
-    if isinstance(val, str) and val.strip():
-        try:
-            return int(val)
-        except Exception:
-            return default
-    return default
+    num = INPUT_SCHEMA.coercers['screen_count'](val)[0]
+    return default if num is None else num
 
 
 def parse_target_margin(val):
-    if isinstance(val, (int, float)):
-        return float(val)
-    if isinstance(val, str) and val.strip():
-        try:
-            v = val.replace('%', '').strip()
-            num = float(v)
-            return num/100.0 if num > 1.0 else num
-        except Exception:
-            return None
-    return None
+    return INPUT_SCHEMA.coercers['target_margin'](val)[0]
 
 
 def parse_team_ratio(text):
     # 例: "Rank3:0.8, Rank2:0.2"
-    default = {"Rank3": 0.8, "Rank2": 0.2}
-    if not isinstance(text, str) or not text.strip():
-        return default
-    res = {}
-    for part in text.split(','):
-        if ':' in part:
-            k, v = part.split(':', 1)
-            k = k.strip()
-            try:
-                s = float(v.strip())
-                if s >= 0 and k in CONFIG["profit_config"]["rank_costs"]:
-                    res[k] = s
-            except Exception:
-                pass
-    s = sum(res.values())
-    if s > 0:
-        for k in list(res.keys()):
-            res[k] = res[k] / s
-        return res
-    return default
+    if not isinstance(text, str):
+        return dict(DEFAULT_TEAM_RATIO)
+    return INPUT_SCHEMA.coercers['team_ratio'](text)[0]
 
 
 def parse_dept_allocation(text):
     # 段落: 「部門: 0.6\nＣＳ第１システム開発部: 0.4」→ 正規化list
-    items = []
-    if isinstance(text, str) and text.strip():
-        for line in text.splitlines():
-            if ':' in line:
-                k, v = line.split(':', 1)
-                k = k.strip()
-                try:
-                    s = float(v.strip())
-                    if k in BS_ORG_CONFIG and s > 0:
-                        items.append({"dept": k, "share": s})
-                except Exception:
-                    pass
-    total = sum(i['share'] for i in items)
-    if total > 0:
-        for i in items:
-            i['share'] = i['share'] / total
-    return items
+    if not isinstance(text, str):
+        return []
+    return INPUT_SCHEMA.coercers['dept_allocation'](text)[0]
 
 
 def resolve_bs_org_rates(primary_dept: str, allocations: List[Dict[str, Any]] | None):
-    # デフォルト=主所属100%
-    if not primary_dept or primary_dept not in BS_ORG_CONFIG:
-        primary_dept = DEFAULT_BS_DEPT
-    if not allocations:
-        cfg = BS_ORG_CONFIG[primary_dept]
-        return (cfg["indirect_per_hour"], cfg["sga_on_propa_labor_rate"])
-
-    # 加重平均
-    total = sum(max(0.0, float(a.get("share", 0.0))) for a in allocations)
-    if total <= 0:
-        cfg = BS_ORG_CONFIG[primary_dept]
-        return (cfg["indirect_per_hour"], cfg["sga_on_propa_labor_rate"])
-
-    ipt = 0.0
-    sga_rate = 0.0
-    for a in allocations:
-        dept = a.get("dept")
-        share = max(0.0, float(a.get("share", 0.0))) / total
-        if dept in BS_ORG_CONFIG and share > 0:
-            cfg = BS_ORG_CONFIG[dept]
-            ipt += cfg["indirect_per_hour"] * share
-            sga_rate += cfg["sga_on_propa_labor_rate"] * share
-    return (int(round(ipt)), sga_rate)
-
-
-def compute_direct_labor_cost(total_man_days: float, team_ratio: Dict[str, float], rank_costs: Dict[str, int]) -> int:
-    # 人月換算：20日/月（= 160h/8h）
-    man_months = total_man_days / 20.0
-    avg_monthly_cost = sum(rank_costs.get(r, 0) * w for r, w in team_ratio.items())
-    return int(man_months * avg_monthly_cost)
-
-
-def compute_indirect_cost(total_man_days: float, indirect_yen_per_hour: float) -> int:
-    hours = total_man_days * 8.0
-    return int(hours * indirect_yen_per_hour)
+    # デフォルト=主所属100%、応援配分があれば加重平均
+    return BS_RATE_TABLE.blend(primary_dept, allocations)
 
 
-# Certified FY2026 BS Standard (SGA on Direct Labor)
-def calculate_profitability_ccs(
-    total_price: int,
-    cogs: int,
-    direct_labor_cost: int,
-    sga_rate_on_labor: float,
-    target_margin_input: float | None
-):
-    # 販管費 = 直接労務費 * 販管費率
-    total_sga = int(direct_labor_cost * sga_rate_on_labor)
-    
-    gross_profit = total_price - cogs
-    operating_profit = total_price - cogs - total_sga
-    operating_margin = (operating_profit / total_price) if total_price > 0 else 0.0
-
-    suggested_price = 0
-    if target_margin_input is not None:
-        # 逆算ロジック: TargetPrice = (COGS + SGA) / (1 - TargetMargin)
-        # ガードレール: 目標利益率が100%以上なら計算不能
-        if target_margin_input < 1.0:
-            denom = 1.0 - target_margin_input
-            # SGAは固定費ではなく、この時点では未定のため、COGSとDirectLaborCostから再計算する
-            # suggested_sga = direct_labor_cost * sga_rate_on_labor (これは固定)
-            numerator = cogs + total_sga # total_sgaは売価に依存しないため固定値
-            suggested_price = int(numerator / denom)
+# =========================================================
+# RULESET（estimate_engine で評価プランにコンパイル）
+# =========================================================
+RULESET = {
+    "name": CONFIG["config_version"],
+    "axes": [
+        {"name": "complexity", "default": "medium", "table": CONFIG["difficulty_multipliers"], "fallback": 1.0},
+        {"name": "duration", "default": "normal", "table": CONFIG["duration_multipliers"], "fallback": 1.0},
+        {"name": "dev_type", "default": "new", "table": CONFIG["dev_type_multipliers"],
+         "fallback": {"design": 1.0, "dev": 1.0}},
+        {"name": "target_platform", "default": "web_b2e", "table": CONFIG["platform_multipliers"], "fallback": 1.0},
+        {"name": "profile", "keys": ["estimation_profile"], "default": "enterprise",
+         "table": CONFIG["estimation_profiles"], "fallback": CONFIG["estimation_profiles"]["enterprise"],
+         "default_productivity": CONFIG["fp_simplified"]["default_productivity"]},
+    ],
+    "size": {
+        "screen_count": {"mode": "none_default", "default": 10},
+        "table_count": {"mode": "none_default", "default": 0},
+    },
+    "items": [
+        {"group": "features", "key": "features", "index": FEATURE_INDEX, "table": FEATURE_MAN_DAYS},
+        {"group": "phase2", "key": "phase2_items", "index": PHASE2_INDEX, "table": PHASE2_ITEMS},
+        {"group": "phase3", "key": "phase3_items", "index": PHASE3_INDEX, "table": PHASE3_ITEMS,
+         "value": "fixed"},
+    ],
+    "effort": {
+        "model": "fp_simplified",
+        "screen_weight": CONFIG["fp_simplified"].get("screen_weight", 20),
+        "table_weight": CONFIG["fp_simplified"].get("table_weight", 15),
+    },
+    # 直接労務費（ランク人月×人月）+ 間接費（部門単金×時間）+ Phase2固定費 + Phase3外注費（確度係数）
+    "cost": {
+        "model": "bs_labor",
+        "rank_costs": CONFIG["profit_config"]["rank_costs"],
+        "standard_team_ratio": CONFIG["profit_config"].get("standard_team_ratio", {"Rank3": 0.8, "Rank2": 0.2}),
+        "team_ratio_key": "team_ratio",
+        "org_rates": BS_RATE_TABLE,
+        "default_department": DEFAULT_BS_DEPT,
+        "allocation_key": "dept_allocation",
+        "phase3_confidence": {"low": 1.3, "high": 1.0},
+        "buffer": CONFIG.get("buffer_multiplier", 1.1),
+    },
+    # CCS基準：販管費は直接労務費に賦課
+    "profit": {"model": "sga_on_labor", "target_margin": "raw"},
+}
 
-    return {
-        "sales": total_price,
-        "cogs": cogs,
-        "gross_profit": gross_profit,
-        "sga_cost": total_sga,
-        "operating_profit": operating_profit,
-        "operating_margin": f"{operating_margin:.1%}",
-        "target_margin_specified": f"{target_margin_input:.1%}" if target_margin_input is not None else None,
-        "suggested_price_to_attain_target": suggested_price,
-        "breakdown": {
-            "sga_calculation_base": "direct_labor_cost",
-            "sga_rate_on_propa_labor": f"{sga_rate_on_labor:.1%}",
-        }
-    }
+PLAN = compile_ruleset(RULESET)
+
+# 段階別の計測フック observe(stage, seconds)。None なら計測なしの評価プランを使う
+_stage_observer = None
+
+
+def set_stage_observer(observe):
+    global _stage_observer
+    _stage_observer = observe
 
 # =========================================================
 # MAIN LOGIC
 # =========================================================
 
 def main_logic(req_body, tables=[]):
-    config = CONFIG
-
-    # 入力取得
-    complexity = req_body.get('complexity') or 'medium'
-    duration = req_body.get('duration') or 'normal'
-    dev_type = req_body.get('dev_type') or 'new'
-    target_platform = req_body.get('target_platform') or 'web_b2e'
-    profile_key = req_body.get('estimation_profile') or 'enterprise' # デフォルトをenterpriseに
-    target_margin = req_body.get('target_margin')  # None可（float）
-
-    # 規模
-    screen_count = req_body.get('screen_count'); screen_count = 10 if screen_count is None else screen_count
-    table_count = req_body.get('table_count'); table_count = 0 if table_count is None else table_count
-
-    # 部門・応援配分・ランクミックス
-    primary_dept = req_body.get('department')
-    dept_allocation = req_body.get('dept_allocation')  # list(dict)想定
-    team_ratio = req_body.get('team_ratio')  # dict想定
-
-    # 選択項目の解決
-    selected_features = resolve_keys(req_body.get('features', []), FEATURE_LABEL_MAP, FEATURE_MAN_DAYS)
-    selected_phase2 = resolve_keys(req_body.get('phase2_items', []), PHASE2_LABEL_MAP, PHASE2_ITEMS)
-    selected_phase3 = resolve_keys(req_body.get('phase3_items', []), PHASE3_LABEL_MAP, PHASE3_ITEMS)
-
-    # 係数
-    diff_multipliers = config.get('difficulty_multipliers', {})
-    diff_multiplier = diff_multipliers.get(complexity, 1.0)
-    dur_multipliers = config.get('duration_multipliers', {})
-    dur_multiplier  = dur_multipliers.get(duration, 1.0)
-    dev_type_mults_config = config.get('dev_type_multipliers', {})
-    current_dev_type_mults = dev_type_mults_config.get(dev_type, {"design": 1.0, "dev": 1.0})
-    dev_type_design_mult = current_dev_type_mults.get("design", 1.0)
-    dev_type_dev_mult    = current_dev_type_mults.get("dev", 1.0)
-    plat_mults_config = config.get('platform_multipliers', {})
-    platform_multiplier = plat_mults_config.get(target_platform, 1.0)
-    buffer_multiplier    = config.get('buffer_multiplier', 1.1)
-
-    # プロファイル
-    profiles = config.get('estimation_profiles', {})
-    selected_profile = profiles.get(profile_key, profiles['enterprise'])
-    prod_factor = selected_profile.get('productivity_factor', config['fp_simplified']['default_productivity'])
-
-    # ===== 工数 =====
-    dev_feature_days = sum(FEATURE_MAN_DAYS.get(f, 0) for f in selected_features)
-    fp_conf = config.get('fp_simplified', {})
-    screen_weight = fp_conf.get('screen_weight', 20)
-    table_weight  = fp_conf.get('table_weight', 15)
-    screen_fp = screen_count * screen_weight
-    table_fp  = table_count  * table_weight
-    total_ufp = screen_fp + table_fp
-    dev_fp_based_days = total_ufp * prod_factor
-    dev_base_days = dev_feature_days + dev_fp_based_days
-    dev_total_days = dev_base_days * diff_multiplier * dev_type_dev_mult
-
-    # ===== 費用 =====
-    # 直接労務費：ランク人月×人月
-    pf = config.get("profit_config", {})
-    rank_costs = pf.get("rank_costs", {})
-    team_ratio_dict = team_ratio if isinstance(team_ratio, dict) else CONFIG["profit_config"].get("standard_team_ratio", {"Rank3":0.8, "Rank2":0.2})
-    direct_labor_cost = compute_direct_labor_cost(dev_total_days, team_ratio_dict, rank_costs)
-
-    # 間接費：部門間接費単金×時間、応援PJ加重
-    resolved_alloc = dept_allocation if isinstance(dept_allocation, list) else None
-    indirect_per_hour, sga_rate = resolve_bs_org_rates(primary_dept, resolved_alloc)
-    indirect_cost = compute_indirect_cost(dev_total_days, indirect_per_hour)
-
-    # Phase2：固定費（直接費に含める）
-    p2_base_cost = sum(PHASE2_ITEMS.get(p, 0) for p in selected_phase2)
-    p2_total_cost = int(p2_base_cost * diff_multiplier * dev_type_design_mult)
-
-    # Phase3：外注費（確度係数）
-    confidence = req_body.get('confidence')
-    p3_total_fixed = 0
-    for p in selected_phase3:
-        item = PHASE3_ITEMS.get(p, {})
-        p3_total_fixed += item.get('fixed', 0)
-    conf_multiplier = 1.0
-    if confidence == 'low':
-        conf_multiplier = 1.3
-    elif confidence == 'high':
-        conf_multiplier = 1.0
-    p3_final_cost = int(p3_total_fixed * conf_multiplier)
-
-    # COGS：直接労務費 + 間接費 + 外注費 + Phase2
-    cogs = direct_labor_cost + indirect_cost + p3_final_cost + p2_total_cost
-
-    # ===== 売価（プラットフォーム/納期/バッファは売価側に寄与） =====
-    base_estimated_amount = cogs
-    final_amount = int(base_estimated_amount * platform_multiplier * dur_multiplier * buffer_multiplier)
-
-    # ===== 損益（CCS基準：販管費は直接労務費に賦課） =====
-    profit_data = calculate_profitability_ccs(
-        total_price=final_amount,
-        cogs=cogs,
-        direct_labor_cost=direct_labor_cost,
-        sga_rate_on_labor=sga_rate,
-        target_margin_input=target_margin
-    )
+    observe = _stage_observer
+    if observe is None:
+        c = PLAN.evaluate(req_body, tables)
+    else:
+        c = PLAN.evaluate_timed(observe, req_body, tables)
+    return build_result(c, tables)
+
+
+def build_result(c, tables):
+    # 評価結果（EvalContext）→ レスポンス。見積セッション（estimate_session）も中間値からこれで組み立てる
+    final_amount = c.final
+    target_margin = c.target_margin
+    profile = c.profile
 
     return {
         "status": "success",
         "estimated_amount": f"¥{final_amount:,}",
         "estimated_range": f"¥{int(final_amount*0.9):,} - ¥{int(final_amount*1.2):,}",
         "man_days": {
-            "development_total": round(dev_total_days, 1),
-            "fp_based": round(dev_fp_based_days, 1),
-            "feature_based": round(dev_feature_days, 1),
+            "development_total": round(c.dev_total, 1),
+            "fp_based": round(c.fp_days, 1),
+            "feature_based": round(c.feature_days, 1),
         },
         "bs_input": {
-            "department": primary_dept or DEFAULT_BS_DEPT,
-            "dept_allocation": resolved_alloc,
-            "sga_rate_applied": f"{sga_rate:.1%}",
-            "indirect_yen_per_hour": indirect_per_hour,
-            "team_ratio": team_ratio_dict,
+            "department": c.department,
+            "dept_allocation": c.dept_allocation,
+            "sga_rate_applied": f"{c.sga_rate:.1%}",
+            "indirect_yen_per_hour": c.indirect_per_hour,
+            "team_ratio": c.team_ratio,
         },
         "input_echo": {
-            "profile": selected_profile.get('label'),
-            "profile_description": selected_profile.get('description'),
-            "screen_count": screen_count,
-            "table_count": table_count,
+            "profile": profile.get('label'),
+            "profile_description": profile.get('description'),
+            "screen_count": c.screen_count,
+            "table_count": c.table_count,
             "tables": tables,
-            "complexity": complexity,
-            "duration": duration,
-            "dev_type": dev_type,
-            "target_platform": target_platform,
-            "confidence": confidence,
+            "complexity": c.complexity,
+            "duration": c.duration,
+            "dev_type": c.dev_type,
+            "target_platform": c.target_platform,
+            "confidence": c.confidence,
             "target_margin": target_margin,
-            "features": selected_features,
-            "phase2_items": selected_phase2,
-            "phase3_items": selected_phase3,
+            "features": c.features,
+            "phase2_items": c.phase2,
+            "phase3_items": c.phase3,
+        },
+        # 項目マスタで解決できなかった入力ラベル（計算には含まれない）
+        "unresolved_items": c.unresolved,
+        "profit_analysis": {
+            "sales": final_amount,
+            "cogs": c.cogs,
+            "gross_profit": c.gross_profit,
+            "sga_cost": c.sga,
+            "operating_profit": c.operating_profit,
+            "operating_margin": f"{c.operating_margin:.1%}",
+            "target_margin_specified": f"{target_margin:.1%}" if target_margin is not None else None,
+            "suggested_price_to_attain_target": c.suggested_price,
+            "breakdown": {
+                "sga_calculation_base": "direct_labor_cost",
+                "sga_rate_on_propa_labor": f"{c.sga_rate:.1%}",
+            }
         },
-        "profit_analysis": profit_data,
-        "productivity": f"{prod_factor} MD/FP",
+        "productivity": f"{c.prod} MD/FP",
     }
 
 
-def main(**kwargs) -> dict:
-    # Dify Code Node entrypoint
-    args = dict(kwargs)
+def validate_args(kwargs: Dict[str, Any]) -> Tuple[Dict[str, Any], List[FieldError]]:
+    # Dify入力（文字列混在）→ (main_logic 用の正規化済み dict, 解釈できなかった値の FieldError)
+    return INPUT_SCHEMA.validate(kwargs)
 
-    # list項目の前処理
-    for key in ['features', 'phase2_items', 'phase3_items', 'tables']:
-        val = args.get(key)
-        args[key] = parse_list_from_text(val)
 
-    # 数値項目
-    for key in ['screen_count', 'table_count']:
-        args[key] = parse_int(args.get(key))
+def prepare_args(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    # Dify入力（文字列混在）→ main_logic 用の正規化済み dict（解釈できない値は既定値）
+    return INPUT_SCHEMA.validate(kwargs)[0]
 
-    # tablesがあればtable_countを自動補完
-    if args.get('tables') and (args.get('table_count') is None or args.get('table_count') == 0):
-        args['table_count'] = len(args['tables'])
 
-    # 目標営業利益率
-    args['target_margin'] = parse_target_margin(args.get('target_margin'))
+def with_input_errors(result: Dict[str, Any], errors: List[FieldError]) -> Dict[str, Any]:
+    # 解釈できなかった入力があれば input_errors に返す（無ければ結果はそのまま）
+    if errors:
+        result["input_errors"] = [e.to_dict() for e in errors]
+    return result
 
-    # 部門
-    dept = args.get('department')
-    if not dept or dept not in BS_ORG_CONFIG:
-        args['department'] = DEFAULT_BS_DEPT
 
-    # 応援配分（文字列→配列に正規化）
-    if isinstance(args.get('dept_allocation'), str):
-        args['dept_allocation'] = parse_dept_allocation(args['dept_allocation'])
+def estimate(**kwargs) -> Dict[str, Any]:
+    # 構造化エントリポイント（JSON文字列化せず dict のまま返す。API/バッチ用）
+    observe = _stage_observer
+    if observe is None:
+        args, errors = validate_args(kwargs)
+    else:
+        started = time.perf_counter()
+        args, errors = validate_args(kwargs)
+        observe("parse", time.perf_counter() - started)
+    return with_input_errors(main_logic(args, args.get('tables', [])), errors)
 
-    # ランクミックス
-    if isinstance(args.get('team_ratio'), str):
-        args['team_ratio'] = parse_team_ratio(args['team_ratio'])
 
-    data = main_logic(args, args.get('tables', []))
-    return {"result": json.dumps(data, ensure_ascii=False, indent=2)}
+def main(**kwargs) -> dict:
+    # Dify Code Node entrypoint（Difyは文字列出力のため estimate の結果をJSON化するだけ）
+    return {"result": json.dumps(estimate(**kwargs), ensure_ascii=False, indent=2)}
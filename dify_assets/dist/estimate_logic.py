@@ -0,0 +1,1682 @@
+# -*- coding: utf-8 -*-
+# 生成ファイル（python -m dify_bundle）。直接編集せず、dify_assets/code/estimate_logic.py と埋め込み元のモジュールを直して作り直す
+# Dify の Code Node にはこのファイルの内容をそのまま貼り付ける（他のファイルの配置は不要）
+import sys as _sys
+import types as _types
+
+
+def _install_module(name, source):
+    # 埋め込んだソースをモジュールとして登録する（本体の import はこれを使う）
+    if name in _sys.modules:
+        return
+    module = _types.ModuleType(name)
+    module.__file__ = "<dify bundle: %s>" % name
+    _sys.modules[name] = module
+    try:
+        exec(compile(source, module.__file__, "exec"), module.__dict__)
+    except BaseException:
+        del _sys.modules[name]
+        raise
+
+
+_install_module('estimate_engine', r'''# -*- coding: utf-8 -*-
+"""
+見積ルールエンジン
+- 3系統の見積ロジック（function_app / estimate_logic / dify_assets/code/estimate_logic）の計算式を
+  宣言的なルールセット（dict）で記述し、compile_ruleset() で評価プランに1回だけコンパイルする
+- コンパイル時に係数テーブル・ラベル辞書・標準チーム構成の平均単価・部門単金を解決して定数として束縛し、
+  全段を1本の関数（ローカル変数のみ）に展開する。評価時は入力の取り出しとカテゴリ値ごとの1回の表引きだけ
+- 演算順序は従来の main_logic と同一（出力は完全一致）。レスポンスの形は各エントリポイントが
+  評価結果（EvalContext）から組み立てる
+
+ルールセットのキー:
+  name    : 識別名
+  axes    : カテゴリ軸 [{"name", "keys", "default", "mode"("or"|"get"), "table", "fallback", "unknown_as_default"}]
+            name は complexity / duration / dev_type / target_platform / profile のいずれか
+  size    : {"screen_count" | "table_count": {"key", "mode"("none_default"|"int_or"|"get"), "default"}}
+  items   : [{"group"(features|phase2|phase3), "key", "resolver"("ordered"|"set"|"text"),
+             "label_map", "table", "value"(None|"fixed"|"man_days"), "index"(LabelIndex, 任意)}]
+  effort  : {"model": "fp_simplified", "screen_weight", "table_weight"}
+            {"model": "methods", "default_method", "man_days_per_screen", "require_explicit_productivity"}
+  cost    : {"model": "bs_labor", "rank_costs", "standard_team_ratio", "team_ratio_key", "org_rates"(dict|OrgRateTable),
+             "default_department", "department_key", "allocation_key", "phase3_confidence", "buffer"}
+            {"model": "daily_rate", "sier_rate", "outsource_rate", "mgmt_fee_rate", "vendor_variance",
+             "default_variance", "require_explicit_vendor_confidence", "buffer"}
+  profit  : {"model": "sga_on_labor", "key", "target_margin"("raw"|"parse")}（任意）
+"""
+
+import builtins
+import linecache
+import textwrap
+import time
+import unicodedata
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple, Union
+
+_MISSING = object()
+
+
+class RulesetError(ValueError):
+    """ルールセットの記述誤り（コンパイル時）。"""
+
+
+class EstimateRuleError(ValueError):
+    """入力がポリシー（必須パラメータ等）を満たさない（評価時）。"""
+
+
+class EvalContext:
+    """1リクエスト分の入力値と中間値。"""
+
+    __slots__ = (
+        "req", "tables",
+        # カテゴリ軸（入力値と係数）
+        "complexity", "duration", "dev_type", "target_platform", "profile_key",
+        "diff", "dur", "dt_design", "dt_dev", "plat", "profile", "prod",
+        # 規模・選択項目
+        "screen_count", "table_count", "features", "phase2", "phase3", "unresolved", "confidence", "target_margin",
+        "method", "loc", "fp_count", "man_days_per_unit",
+        # 工数
+        "feature_days", "screen_days", "fp_total", "fp_days", "dev_base", "dev_total",
+        # 原価（BSモデル）
+        "department", "dept_allocation", "team_ratio", "indirect_per_hour", "sga_rate",
+        "direct_labor", "indirect", "p2_base", "p3_fixed",
+        # 原価（日額モデル）
+        "dev_cost", "variance", "p2_days", "p3_days", "p3_base", "p3_fee", "p3_range",
+        "subtotal", "subtotal_min", "subtotal_max", "final_min", "final_max",
+        # 共通
+        "p2_cost", "p3_cost", "cogs", "final",
+        # 損益
+        "sga", "gross_profit", "operating_profit", "operating_margin", "suggested_price",
+    )
+
+    def __init__(self, req: Dict[str, Any], tables: Any):
+        self.req = req
+        self.tables = tables
+        # ルールセットに無い軸・項目の既定値
+        self.diff = self.dur = self.dt_design = self.dt_dev = self.plat = 1.0
+        self.screen_count = self.table_count = 0
+        self.features = self.phase2 = self.phase3 = []
+        self.unresolved = {}
+        self.confidence = None
+        self.dept_allocation = None
+        self.p2_cost = self.p3_cost = 0
+
+
+class EstimatePlan:
+    """コンパイル済みの評価プラン。
+
+    evaluate(req_body, tables=None) -> EvalContext
+    evaluate_timed(observe, req_body, tables=None) -> EvalContext
+        同じ計算に段階ごとの計測を挟んだ版。observe(stage, seconds) を STAGES の順に呼ぶ
+    kernel(given, outputs, columns=()) -> f(req_body, *given)
+        evaluate から outputs の計算に必要な文だけを取り出した関数（given の中間値は引数で与える。
+        columns の中間値は列で与え、行ごとの結果のリストを返す）
+    dependencies() -> {中間値: その値が読むリクエストのキー}
+    affected(keys) -> (given, outputs)
+        リクエストの keys が変わったときに求め直す中間値（outputs）と、そのとき kernel に渡す中間値（given）
+    """
+
+    __slots__ = ("name", "source", "evaluate", "evaluate_timed", "values",
+                 "_namespace", "_statements", "_kernels", "_dependencies", "_affected")
+
+    def __init__(self, name: str, source: str, evaluate: Callable[..., EvalContext],
+                 evaluate_timed: Callable[..., EvalContext], values: Sequence[str] = (),
+                 namespace: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.source = source  # 生成したソース（デバッグ用）
+        self.evaluate = evaluate
+        self.evaluate_timed = evaluate_timed
+        self.values = tuple(values)  # EvalContext に格納する中間値（評価順）
+        self._namespace = namespace or {}
+        self._statements: Optional[List[_Statement]] = None
+        self._kernels: Dict[Tuple[Any, ...], Callable[..., Any]] = {}
+        self._dependencies: Optional[Dict[str, FrozenSet[str]]] = None
+        self._affected: Dict[FrozenSet[str], Tuple[Tuple[str, ...], Tuple[str, ...]]] = {}
+
+    def kernel(self, given: Sequence[str], outputs: Union[str, Sequence[str]],
+               columns: Sequence[str] = ()) -> Callable[..., Any]:
+        """outputs を求める部分評価関数 f(req_body, *given) を返す（同じ引数なら生成済みの関数）。
+
+        given の中間値を代入する文は除き、引数の値をそのまま使う。残りはリクエストから evaluate と同じ文で求める。
+        outputs が文字列ならその値を、列ならタプルを返す。
+        columns（given の一部）を指定すると、その引数は同じ長さの列として受け取り、行ごとの結果のリストを返す。
+        columns に依存しない文はループの外で1回だけ計算する。
+        """
+        key = (tuple(given), outputs if isinstance(outputs, str) else tuple(outputs), tuple(columns))
+        fn = self._kernels.get(key)
+        if fn is None:
+            fn = self._kernels[key] = _compile_kernel(self, *key)
+        return fn
+
+    def dependencies(self) -> Dict[str, FrozenSet[str]]:
+        """中間値ごとに、その値が（上流の中間値を通して）読むリクエストのキー。"""
+        if self._dependencies is None:
+            deps: Dict[str, FrozenSet[str]] = {}
+            for st in _plan_statements(self):
+                reads = st.keys.union(*[deps[name] for name in st.loads if name in deps])
+                for name in st.stores:
+                    deps[name] = reads if name in st.definite else reads | deps.get(name, frozenset())
+            self._dependencies = {name: deps.get(name, frozenset()) for name in self.values}
+        return self._dependencies
+
+    def affected(self, keys: Iterable[str]) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+        """keys（リクエストのキー）が変わったとき → (given, outputs)。評価順で、kernel(given, outputs) にそのまま渡せる。
+
+        outputs は変わった値を読む文（と、その文が代入する値を部分的に書き換える文）が代入する中間値。
+        given は outputs を求める文が読む、変わっていない中間値。
+        """
+        changed = frozenset(keys)
+        found = self._affected.get(changed)
+        if found is None:
+            dirty: set = set()
+            reads: set = set()
+            for st in _plan_statements(self):
+                # 部分的な代入（dict への追記・if の片側の代入）は前の値を引き継ぐため、読みと同じに扱う
+                if st.keys & changed or (st.loads | (st.stores - st.definite)) & dirty:
+                    dirty.update(st.stores)
+                    reads.update(st.loads)
+                else:
+                    dirty.difference_update(st.definite)
+            outputs = tuple(name for name in self.values if name in dirty)
+            given = tuple(name for name in self.values if name in reads and name not in dirty)
+            found = self._affected[changed] = (given, outputs)
+        return found
+
+
+# evaluate_timed が計測する段階（係数引き / 項目解決 / 工数 / 原価 / 損益）
+STAGES = ("axes", "resolve", "effort", "cost", "profit")
+
+
+def parse_target_margin(val):
+    if isinstance(val, (int, float)):
+        return float(val)
+    if isinstance(val, str) and val.strip():
+        try:
+            num = float(val.replace('%', '').strip())
+            return num / 100.0 if num > 1.0 else num
+        except Exception:
+            return None
+    return None
+
+
+class OrgRateTable:
+    """部門別の (間接費単金, 販管費率) を配列化したテーブル（部門 → 配列インデックス）。
+
+    応援配分（dept_allocation）は (インデックス列, シェア列) に変換し、同じ配分の再評価では変換済みの列を再利用する。
+    加重平均は配分先の部門数（通常 1〜3）だけ回る素の Python ループで、配列演算ではない。
+    """
+
+    __slots__ = ("departments", "index", "indirect", "sga", "rates", "default_dept", "cache_size", "_vectors")
+
+    def __init__(self, org_rates: Dict[str, Tuple[float, float]], default_dept: str, cache_size: int = 1024):
+        if default_dept not in org_rates:
+            raise RulesetError(f"default_department {default_dept!r} is not in org_rates")
+        self.departments = tuple(org_rates)
+        self.index = {dept: i for i, dept in enumerate(self.departments)}
+        self.indirect = [org_rates[d][0] for d in self.departments]
+        self.sga = [org_rates[d][1] for d in self.departments]
+        self.rates = dict(org_rates)
+        self.default_dept = default_dept
+        self.cache_size = cache_size
+        self._vectors: Dict[Any, Any] = {}
+
+    def primary_rates(self, primary_dept: Optional[str]) -> Tuple[float, float]:
+        return self.rates.get(primary_dept) or self.rates[self.default_dept]
+
+    def allocation_vector(self, allocations: List[Dict[str, Any]]) -> Optional[Tuple[Tuple[int, ...], Tuple[float, ...]]]:
+        """配分 → (部門インデックス列, 正規化シェア列)。シェア合計が 0 以下なら None（主所属100%）。"""
+        key = tuple([(a.get("dept"), a.get("share", 0.0)) for a in allocations])
+        vector = self._vectors.get(key, _MISSING)
+        if vector is not _MISSING:
+            return vector
+
+        shares = [max(0.0, float(a.get("share", 0.0))) for a in allocations]
+        total = sum(shares)
+        if total <= 0:
+            vector = None
+        else:
+            index = self.index
+            pairs = [(index[a.get("dept")], share / total)
+                     for a, share in zip(allocations, shares) if a.get("dept") in index and share > 0]
+            vector = (tuple([i for i, _ in pairs]), tuple([w for _, w in pairs]))
+        if len(self._vectors) >= self.cache_size:
+            del self._vectors[next(iter(self._vectors))]
+        self._vectors[key] = vector
+        return vector
+
+    def blend(self, primary_dept: Optional[str], allocations: Optional[List[Dict[str, Any]]]) -> Tuple[float, float]:
+        """主所属 → (間接費単金, 販管費率)。応援配分があればシェアで加重平均する（配分先ごとのループ）。"""
+        if not allocations:
+            return self.primary_rates(primary_dept)
+        vector = self.allocation_vector(allocations)
+        if vector is None:
+            return self.primary_rates(primary_dept)
+        indices, weights = vector
+        indirect, sga = self.indirect, self.sga
+        ipt = 0.0
+        sga_rate = 0.0
+        for i, w in zip(indices, weights):
+            ipt += indirect[i] * w
+            sga_rate += sga[i] * w
+        return (int(round(ipt)), sga_rate)
+
+
+def normalize_label(value: str) -> str:
+    """表記ゆれを吸収した照合キー（NFKC で全角/半角を統一し、空白を除去して casefold）。"""
+    return "".join(unicodedata.normalize("NFKC", value).split()).casefold()
+
+
+class LabelIndex:
+    """項目ラベル/エイリアス/キー → 項目キーの解決インデックス（起動時に1回だけ構築）。
+
+    完全一致の辞書を先に引き、無ければ正規化キー（normalize_label）で引く。いずれも1件あたり O(1)。
+    prefer="label" はラベル優先（Dify/ルート）、prefer="key" はキー優先でマップ先が table に無いラベルは無視する（function_app）。
+    """
+
+    __slots__ = ("exact", "normalized")
+
+    def __init__(self, table: Dict[str, Any], label_map: Optional[Dict[str, str]] = None,
+                 aliases: Optional[Dict[str, str]] = None, prefer: str = "label"):
+        label_map = label_map or {}
+        if prefer == "label":
+            exact = {k: k for k in table}
+            exact.update(label_map)
+        elif prefer == "key":
+            exact = {label: m for label, m in label_map.items() if m and m in table}
+            exact.update({k: k for k in table})
+        else:
+            raise RulesetError(f"unknown label preference: {prefer!r}")
+        # エイリアスは最低優先（既存のラベル/キーを上書きしない）
+        for alias, target in (aliases or {}).items():
+            if target not in table:
+                raise RulesetError(f"alias {alias!r} points to unknown item {target!r}")
+            exact.setdefault(alias, target)
+
+        normalized: Dict[str, str] = {}
+        for label, target in exact.items():
+            norm = normalize_label(label)
+            if normalized.get(norm, target) != target:
+                raise RulesetError(f"labels collide after normalization: {label!r} ({norm!r})")
+            normalized[norm] = target
+        self.exact = exact
+        self.normalized = normalized
+
+    def lookup(self, label: Any) -> Optional[str]:
+        key = self.exact.get(label)
+        if key is None and isinstance(label, str):
+            key = self.normalized.get(normalize_label(label))
+        return key
+
+    def resolve(self, labels: Any) -> Tuple[List[str], List[Any]]:
+        """入力順を保って重複排除。空値は無視し、list 以外は空扱い。戻り値は (解決済みキー, 未解決ラベル)。"""
+        if not isinstance(labels, list):
+            return [], []
+        resolved: Dict[str, None] = {}
+        unresolved = []
+        exact = self.exact
+        for x in labels:
+            if not x:
+                continue
+            key = exact.get(x)
+            if key is None:
+                key = self.lookup(x)
+                if key is None:
+                    unresolved.append(x)
+                    continue
+            resolved[key] = None
+        return list(resolved), unresolved
+
+    def resolve_set(self, labels: Any) -> Tuple[List[str], List[Any]]:
+        """function_app 互換（重複排除は set）。戻り値は (解決済みキー, 未解決ラベル)。"""
+        resolved = set()
+        unresolved = []
+        exact = self.exact
+        for x in labels:
+            key = exact.get(x)
+            if key is None:
+                key = self.lookup(x)
+                if key is None:
+                    unresolved.append(x)
+                    continue
+            resolved.add(key)
+        return list(resolved), unresolved
+
+
+def team_average_cost(rank_costs: Dict[str, int], team_ratio: Dict[str, float]) -> float:
+    return sum(rank_costs.get(r, 0) * w for r, w in team_ratio.items())
+
+
+class _Stage:
+    """段階の区切り（計測版では時刻の記録に展開し、通常版では何も出力しない）。"""
+
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class _Emitter:
+    """評価関数のソースを組み立てる。ルールセット由来の値は定数として名前空間に束縛する。"""
+
+    def __init__(self):
+        self.lines: List[Any] = []
+        self.namespace: Dict[str, Any] = {
+            "_MISSING": _MISSING, "_EvalContext": EvalContext, "_EstimateRuleError": EstimateRuleError,
+            "_team_average_cost": team_average_cost,
+            "_parse_target_margin": parse_target_margin, "_clock": time.perf_counter,
+        }
+        self.assigned: List[str] = []
+
+    def const(self, value: Any, hint: str) -> str:
+        name = f"_{hint}_{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def emit(self, *lines: str) -> None:
+        self.lines.extend(lines)
+
+    def stage(self, name: str) -> None:
+        self.lines.append(_Stage(name))
+
+    def render(self, timed: bool) -> str:
+        out = ["_t0 = _clock()"] if timed else []
+        for line in self.lines:
+            if not isinstance(line, _Stage):
+                out.append(line)
+            elif timed:
+                out.extend(["_t1 = _clock()", f"observe({line.name!r}, _t1 - _t0)", "_t0 = _t1"])
+        return "\n".join("    " + line for line in out)
+
+    def assign(self, *names: str) -> None:
+        for name in names:
+            if name not in self.assigned:
+                self.assigned.append(name)
+
+
+# =========================================================
+# カテゴリ軸
+# =========================================================
+
+def _coef_identity(entry, spec):
+    return entry
+
+
+def _coef_dev_type(entry, spec):
+    return (entry.get("design", 1.0), entry.get("dev", 1.0))
+
+
+def _coef_profile(entry, spec):
+    if "default_productivity" in spec:
+        return (entry, entry.get('productivity_factor', spec["default_productivity"]))
+    return (entry, entry["productivity_factor"])
+
+
+# 軸名 → (入力値の変数, 係数の変数, 係数の変換)
+_AXIS_KINDS = {
+    "complexity": ("complexity", "diff", _coef_identity),
+    "duration": ("duration", "dur", _coef_identity),
+    "target_platform": ("target_platform", "plat", _coef_identity),
+    "dev_type": ("dev_type", "dt_design, dt_dev", _coef_dev_type),
+    "profile": ("profile_key", "profile, prod", _coef_profile),
+}
+
+
+def _read_expr(em: _Emitter, keys: List[str], mode: str, default: Any) -> str:
+    d = em.const(default, "default")
+    if mode == "get":
+        if len(keys) != 1:
+            raise RulesetError("mode 'get' takes exactly one key")
+        return f"req.get({keys[0]!r}, {d})"
+    if mode == "or":
+        return " or ".join([f"req.get({k!r})" for k in keys] + [d])
+    raise RulesetError(f"unknown read mode: {mode!r}")
+
+
+def _emit_axis(em: _Emitter, spec: Dict[str, Any]) -> str:
+    name = spec.get("name")
+    if name not in _AXIS_KINDS:
+        raise RulesetError(f"unknown axis: {name!r} (allowed: {list(_AXIS_KINDS)})")
+    var, coef_vars, convert = _AXIS_KINDS[name]
+    default = spec["default"]
+    coefs = {k: convert(v, spec) for k, v in (spec.get("table") or {}).items()}
+    fallback = convert(spec["fallback"], spec)
+    table = em.const(coefs, name)
+    em.emit(f"{var} = {_read_expr(em, list(spec.get('keys') or [name]), spec.get('mode', 'or'), default)}",
+            f"_k = {table}.get({var}, _MISSING)",
+            "if _k is _MISSING:")
+    if spec.get("unknown_as_default"):
+        em.emit(f"    {var} = {em.const(default, 'default')}",
+                f"    _k = {em.const(coefs.get(default, fallback), 'coef')}")
+    else:
+        em.emit(f"    _k = {em.const(fallback, 'coef')}")
+    em.emit(f"{coef_vars} = _k")
+    em.assign(var, *[v.strip() for v in coef_vars.split(",")])
+    return name
+
+
+# =========================================================
+# 規模
+# =========================================================
+
+def _emit_size(em: _Emitter, name: str, spec: Dict[str, Any]) -> None:
+    if name not in ("screen_count", "table_count"):
+        raise RulesetError(f"unknown size field: {name!r}")
+    key = spec.get("key", name)
+    default = em.const(spec.get("default", 0), "default")
+    mode = spec.get("mode", "none_default")
+    if mode == "none_default":
+        em.emit(f"{name} = req.get({key!r})",
+                f"if {name} is None:",
+                f"    {name} = {default}")
+    elif mode == "int_or":
+        em.emit(f"{name} = int(req.get({key!r}) or {default})")
+    elif mode == "get":
+        em.emit(f"{name} = req.get({key!r}, {default})")
+    else:
+        raise RulesetError(f"unknown size mode: {mode!r}")
+    em.assign(name)
+
+
+# =========================================================
+# 選択項目（機能 / Phase2 / Phase3）
+# =========================================================
+
+def _item_values(table: Dict[str, Any], value: Optional[str]) -> Dict[str, Any]:
+    if value is None:
+        return dict(table)
+    if value == "fixed":
+        return {k: v.get('fixed', 0) for k, v in table.items()}
+    if value == "man_days":
+        # (固定か, 人日)。固定でなければ画面数比例
+        return {k: (v.get("type") == "fixed", v.get("man_days", 0)) for k, v in table.items()}
+    raise RulesetError(f"unknown item value: {value!r}")
+
+
+def _emit_items(em: _Emitter, spec: Dict[str, Any]) -> Tuple[str, str]:
+    group = spec.get("group")
+    if group not in ("features", "phase2", "phase3"):
+        raise RulesetError(f"unknown item group: {group!r}")
+    key = spec["key"]
+    table = spec["table"]
+    label_map = spec.get("label_map") or {}
+    resolver = spec.get("resolver", "ordered")
+
+    if resolver in ("ordered", "set"):
+        # ordered: ラベル優先 → キー。入力順を保って重複排除。list 以外は空扱い
+        # set    : キー優先 → ラベル（マップ先が有効なもののみ）。重複排除は set
+        index = spec.get("index") or LabelIndex(table, label_map, prefer="label" if resolver == "ordered" else "key")
+        idx = em.const(index, "index")
+        method = "resolve" if resolver == "ordered" else "resolve_set"
+        em.emit(f"{group}, unresolved[{key!r}] = {idx}.{method}(req.get({key!r}, []))")
+    elif resolver == "text":
+        # 解決せずそのまま（カンマ区切り文字列も可）。未知キーは 0 として扱う
+        em.emit(f"{group} = req.get({key!r}) or []",
+                f"if isinstance({group}, str):",
+                f"    {group} = [f.strip() for f in {group}.split(',') if f.strip()]")
+    else:
+        raise RulesetError(f"unknown resolver: {resolver!r}")
+    em.assign(group)
+    return group, em.const(_item_values(table, spec.get("value")), group)
+
+
+# =========================================================
+# 工数
+# =========================================================
+
+def _emit_effort(em: _Emitter, spec: Dict[str, Any], values: Dict[str, str], axes: List[str]) -> None:
+    model = spec.get("model")
+    days = values.get("features") or em.const({}, "features")
+    diff = " * diff" if "complexity" in axes else ""
+
+    if model == "fp_simplified":
+        sw = em.const(spec["screen_weight"], "screen_weight")
+        tw = em.const(spec["table_weight"], "table_weight")
+        prod = "prod" if "profile" in axes else em.const(spec.get("default_productivity", 1.0), "prod")
+        em.emit(f"feature_days = sum([{days}.get(f, 0) for f in features])",
+                f"fp_total = screen_count * {sw} + table_count * {tw}",
+                f"fp_days = fp_total * {prod}",
+                "dev_base = feature_days + fp_days",
+                f"dev_total = dev_base{diff}{' * dt_dev' if 'dev_type' in axes else ''}")
+        em.assign("feature_days", "fp_total", "fp_days", "dev_base", "dev_total")
+        return
+
+    if model == "methods":
+        # screen（機能+画面数） / step（LOC×人日単価） / fp（FP×人日単価）
+        require = bool(spec.get("require_explicit_productivity"))
+        rate = em.const(spec["man_days_per_screen"], "man_days_per_screen")
+        em.emit(f"method = req.get('method', {em.const(spec.get('default_method', 'screen'), 'default')})",
+                "man_days_per_unit = req.get('man_days_per_unit')",
+                "loc = req.get('loc')",
+                "fp_count = req.get('fp_count')",
+                "feature_days = 0",
+                "screen_days = 0",
+                "if method == 'step':")
+        if require:
+            em.emit("    if loc is None or man_days_per_unit is None:",
+                    "        raise _EstimateRuleError('Missing required params for STEP: loc, man_days_per_unit')")
+        em.emit("    dev_base = loc * man_days_per_unit",
+                "elif method == 'fp':")
+        if require:
+            em.emit("    if fp_count is None or man_days_per_unit is None:",
+                    "        raise _EstimateRuleError('Missing required params for FP: fp_count, man_days_per_unit')")
+        em.emit("    dev_base = fp_count * man_days_per_unit",
+                "else:",
+                f"    feature_days = sum([{days}.get(f, 0) for f in features])",
+                f"    screen_days = screen_count * {rate}",
+                "    dev_base = feature_days + screen_days",
+                f"dev_total = dev_base{diff}")
+        em.assign("method", "man_days_per_unit", "loc", "fp_count", "feature_days", "screen_days",
+                  "dev_base", "dev_total")
+        return
+
+    raise RulesetError(f"unknown effort model: {model!r}")
+
+
+# =========================================================
+# 原価・売価
+# =========================================================
+
+def _emit_bs_labor(em: _Emitter, spec: Dict[str, Any], values: Dict[str, str], axes: List[str]) -> None:
+    # 直接労務費：ランク人月×人月（20日/月）
+    rank_costs = dict(spec["rank_costs"])
+    standard = spec["standard_team_ratio"]
+    std = em.const(standard, "team_ratio")
+    std_avg = em.const(team_average_cost(rank_costs, standard), "avg_cost")
+    if spec.get("team_ratio_key"):
+        em.emit(f"team_ratio = req.get({spec['team_ratio_key']!r})",
+                "if isinstance(team_ratio, dict):",
+                f"    _avg = _team_average_cost({em.const(rank_costs, 'rank_costs')}, team_ratio)",
+                "else:",
+                f"    team_ratio = {std}",
+                f"    _avg = {std_avg}",
+                "direct_labor = int((dev_total / 20.0) * _avg)")
+    else:
+        em.emit(f"team_ratio = {std}",
+                f"direct_labor = int((dev_total / 20.0) * {std_avg})")
+
+    # 間接費：部門間接費単金×時間（応援配分は加重平均）
+    default_dept = spec["default_department"]
+    table = spec["org_rates"]
+    if not isinstance(table, OrgRateTable):
+        table = OrgRateTable(table, default_dept)
+    elif table.default_dept != default_dept:
+        raise RulesetError(f"default_department {default_dept!r} does not match the rate table")
+    org_rates = table.rates
+    org = em.const(org_rates, "org_rates")
+    dflt = em.const(default_dept, "default")
+    dept_key = spec.get("department_key", "department")
+    if spec.get("allocation_key"):
+        em.emit(f"department = req.get({dept_key!r})",
+                f"dept_allocation = req.get({spec['allocation_key']!r})",
+                "if not isinstance(dept_allocation, list):",
+                "    dept_allocation = None",
+                "if dept_allocation:",
+                f"    indirect_per_hour, sga_rate = {em.const(table, 'rate_table')}.blend(department, dept_allocation)",
+                "else:",
+                f"    indirect_per_hour, sga_rate = {org}.get(department) or {org}[{dflt}]",
+                f"department = department or {dflt}")
+    else:
+        em.emit(f"department = req.get({dept_key!r}) or {dflt}",
+                "dept_allocation = None",
+                f"indirect_per_hour, sga_rate = {org}.get(department, {em.const(org_rates[default_dept], 'rates')})")
+    em.emit("indirect = int((dev_total * 8.0) * indirect_per_hour)")
+    em.assign("team_ratio", "direct_labor", "department", "dept_allocation", "indirect_per_hour", "sga_rate",
+              "indirect")
+
+    terms = ["direct_labor", "indirect"]
+    if "phase2" in values or "phase3" in values:
+        em.emit("confidence = req.get('confidence')")
+        em.assign("confidence")
+    # Phase3：外注費（確度係数）
+    if "phase3" in values:
+        conf = em.const(dict(spec.get("phase3_confidence") or {}), "confidence")
+        em.emit(f"p3_fixed = sum([{values['phase3']}.get(p, 0) for p in phase3])",
+                f"p3_cost = int(p3_fixed * {conf}.get(confidence, 1.0))")
+        em.assign("p3_fixed", "p3_cost")
+        terms.append("p3_cost")
+    # Phase2：固定費（難易度・開発タイプの設計係数）
+    if "phase2" in values:
+        scale = (" * diff" if "complexity" in axes else "") + (" * dt_design" if "dev_type" in axes else "")
+        em.emit(f"p2_base = sum([{values['phase2']}.get(p, 0) for p in phase2])",
+                f"p2_cost = int(p2_base{scale})")
+        em.assign("p2_base", "p2_cost")
+        terms.append("p2_cost")
+
+    # 売価：プラットフォーム/納期/バッファは売価側に寄与
+    factors = [f for a, f in (("target_platform", "plat"), ("duration", "dur")) if a in axes]
+    factors.append(em.const(spec["buffer"], "buffer"))
+    em.emit(f"cogs = {' + '.join(terms)}",
+            f"final = int(cogs * {' * '.join(factors)})")
+    em.assign("cogs", "final")
+
+
+def _emit_daily_rate_validation(em: _Emitter, spec: Dict[str, Any], values: Dict[str, str]) -> None:
+    em.emit("confidence = req.get('confidence')")
+    em.assign("confidence")
+    if spec.get("require_explicit_vendor_confidence") and "phase3" in values:
+        em.emit("if phase3 and not confidence:",
+                "    raise _EstimateRuleError('Missing required param: confidence "
+                "(Required for Phase 3 / Vendor Design estimation)')")
+
+
+def _emit_phase_days(em: _Emitter, group: str, values: str, target: str) -> None:
+    em.emit("    _fixed = 0",
+            "    _per_screen = 0",
+            f"    for _item in {group}:",
+            f"        _is_fixed, _days = {values}.get(_item, (False, 0))",
+            "        if _is_fixed:",
+            "            _fixed += _days",
+            "        else:",
+            "            _per_screen += _days * screen_count",
+            f"    {target} = _fixed + _per_screen")
+
+
+def _emit_daily_rate(em: _Emitter, spec: Dict[str, Any], values: Dict[str, str], axes: List[str]) -> None:
+    sier = em.const(spec["sier_rate"], "sier_rate")
+    buffer = em.const(spec["buffer"], "buffer")
+    em.emit(f"dev_cost = int(dev_total * {sier})",
+            "p2_days = 0",
+            "p2_cost = 0")
+    if "phase2" in values:
+        # Phase2（社内単価）
+        em.emit("if phase2:")
+        _emit_phase_days(em, "phase2", values["phase2"], "p2_days")
+        em.emit(f"    p2_cost = int(p2_days * {sier})")
+    # Phase3（外注単価 + 管理費、確度に応じたレンジ）
+    em.emit("p3_days = 0",
+            "p3_cost = 0",
+            "variance = 0.0",
+            "p3_range = {'min': 0, 'max': 0, 'cost': 0}")
+    if "phase3" in values:
+        variance = em.const(dict(spec["vendor_variance"]), "vendor_variance")
+        em.emit("if phase3:",
+                f"    variance = {variance}.get(confidence, {em.const(spec.get('default_variance', 0.2), 'variance')})")
+        _emit_phase_days(em, "phase3", values["phase3"], "p3_days")
+        em.emit(f"    p3_base = int(p3_days * {em.const(spec['outsource_rate'], 'outsource_rate')})",
+                f"    p3_fee = int(p3_base * {em.const(spec['mgmt_fee_rate'], 'mgmt_fee_rate')})",
+                "    p3_cost = p3_base + p3_fee",
+                "    p3_range = {'min': int(p3_cost * (1 - variance)), 'max': int(p3_cost * (1 + variance)),"
+                " 'cost': p3_cost}")
+    em.emit("subtotal = dev_cost + p2_cost + p3_cost",
+            "subtotal_min = dev_cost + p2_cost + p3_range['min']",
+            "subtotal_max = dev_cost + p2_cost + p3_range['max']",
+            "cogs = subtotal",
+            f"final = int(subtotal * {buffer})",
+            f"final_min = int(subtotal_min * {buffer})",
+            f"final_max = int(subtotal_max * {buffer})")
+    em.assign("dev_cost", "p2_days", "p2_cost", "p3_days", "p3_cost", "variance", "p3_range",
+              "subtotal", "subtotal_min", "subtotal_max", "cogs", "final", "final_min", "final_max")
+
+
+# =========================================================
+# 損益
+# =========================================================
+
+def _emit_profit(em: _Emitter, spec: Dict[str, Any]) -> None:
+    if spec.get("model") != "sga_on_labor":
+        raise RulesetError(f"unknown profit model: {spec.get('model')!r}")
+    key = spec.get("key", "target_margin")
+    read = f"req.get({key!r})"
+    if spec.get("target_margin", "raw") == "parse":
+        read = f"_parse_target_margin({read})"
+    # 販管費 = 直接労務費 × 販管費率。逆算: TargetPrice = (COGS + SGA) / (1 - TargetMargin)（100%以上は計算不能）
+    em.emit(f"target_margin = {read}",
+            "sga = int(direct_labor * sga_rate)",
+            "gross_profit = final - cogs",
+            "operating_profit = final - cogs - sga",
+            "operating_margin = (operating_profit / final) if final > 0 else 0.0",
+            "suggested_price = 0",
+            "if target_margin is not None and target_margin < 1.0:",
+            "    suggested_price = int((cogs + sga) / (1.0 - target_margin))")
+    em.assign("target_margin", "sga", "gross_profit", "operating_profit", "operating_margin", "suggested_price")
+
+
+# =========================================================
+# 部分評価（カーネル）
+# =========================================================
+
+class _Statement:
+    """evaluate の1文（if ブロックは丸ごと1文）と、代入・参照する名前。"""
+
+    __slots__ = ("node", "stores", "definite", "loads", "keys", "updates")
+
+    def __init__(self, node: Any):
+        import ast
+        self.node = node
+        stores, loads, keys, local, updated, partial = set(), set(), set(), set(), set(), set()
+        for sub in ast.walk(node):
+            if isinstance(sub, ast.comprehension):
+                local.update(n.id for n in ast.walk(sub.target) if isinstance(n, ast.Name))
+            elif isinstance(sub, ast.Subscript) and isinstance(sub.ctx, ast.Store) and isinstance(sub.value, ast.Name):
+                # unresolved['features'] = ... は既存の dict への追記（読みではなく部分的な代入）
+                stores.add(sub.value.id)
+                partial.add(sub.value.id)
+                updated.add(id(sub.value))
+            elif isinstance(sub, ast.Name) and id(sub) not in updated:
+                (stores if isinstance(sub.ctx, ast.Store) else loads).add(sub.id)
+            elif (isinstance(sub, ast.Call) and isinstance(sub.func, ast.Attribute) and sub.func.attr == "get"
+                  and isinstance(sub.func.value, ast.Name) and sub.func.value.id == "req"
+                  and sub.args and isinstance(sub.args[0], ast.Constant)):
+                keys.add(sub.args[0].value)
+        self.stores = frozenset(stores - local)
+        self.loads = frozenset(loads - local)
+        self.keys = frozenset(keys)
+        self.definite = frozenset(_definite_stores(node))
+        # 部分的に代入する名前（代入先の dict はこの文より前に作られている必要がある）
+        self.updates = frozenset(partial - local)
+
+
+def _definite_stores(node: Any) -> set:
+    """必ず代入される名前（if は両方の分岐で代入されるものだけ。ループ・部分的な代入は含めない）。"""
+    import ast
+    if isinstance(node, ast.If):
+        body = set().union(*[_definite_stores(n) for n in node.body])
+        orelse = set().union(*[_definite_stores(n) for n in node.orelse])
+        return body & orelse
+    if isinstance(node, (ast.Assign, ast.AugAssign, ast.AnnAssign)):
+        targets = list(node.targets if isinstance(node, ast.Assign) else [node.target])
+        names = set()
+        while targets:
+            t = targets.pop()
+            if isinstance(t, ast.Name):
+                names.add(t.id)
+            elif isinstance(t, (ast.Tuple, ast.List)):
+                targets.extend(t.elts)
+            elif isinstance(t, ast.Starred):
+                targets.append(t.value)
+        return names
+    return set()
+
+
+def _plan_statements(plan: EstimatePlan) -> List[_Statement]:
+    # 生成ソースの evaluate 本体（EvalContext への格納より前）を1回だけ解析する
+    if plan._statements is None:
+        import ast
+        tree = ast.parse(plan.source)
+        body = next(n.body for n in tree.body if isinstance(n, ast.FunctionDef) and n.name == "evaluate")
+        statements = []
+        for node in body:
+            if isinstance(node, ast.Assign) and [getattr(t, "id", None) for t in node.targets] == ["c"]:
+                break
+            statements.append(_Statement(node))
+        plan._statements = statements
+    return plan._statements
+
+
+def _compile_kernel(plan: EstimatePlan, given: Tuple[str, ...], outputs: Union[str, Tuple[str, ...]],
+                    columns: Tuple[str, ...] = ()):
+    import ast
+    names = (outputs,) if isinstance(outputs, str) else outputs
+    unknown = [name for name in given + names if name not in plan.values]
+    if unknown or not names:
+        raise ValueError(f"unknown plan values: {unknown}" if unknown else "outputs must not be empty")
+    if not set(columns) <= set(given):
+        raise ValueError(f"columns must be given values: {sorted(set(columns) - set(given))}")
+    provided = frozenset(given)
+    # outputs から逆順にたどり、必要な値を代入する文だけを残す（given を代入する文は引数で置き換える）
+    needed = set(names)
+    selected: List[_Statement] = []
+    for st in reversed(_plan_statements(plan)):
+        if not st.stores & needed:
+            continue
+        if st.stores & provided:
+            if (st.stores - provided) & needed:
+                raise ValueError(f"{sorted(st.stores & provided)} cannot be given without {sorted(st.stores - provided)}")
+            continue
+        selected.append(st)
+        needed = (needed - st.definite) | st.loads | st.updates
+    free = needed - provided - {"req"} - set(plan._namespace) - set(vars(builtins))
+    if free:
+        raise ValueError(f"plan values read before assignment: {sorted(free)}")
+
+    selected.reverse()
+    result = names[0] if isinstance(outputs, str) else "(" + ", ".join(names) + ",)"
+    if not columns:
+        body = "".join(textwrap.indent(ast.unparse(st.node), "    ") + "\n" for st in selected)
+        source = f"def kernel({', '.join(('req',) + given)}):\n{body}    return {result}\n"
+    else:
+        # 列に依存する文（と、それらと同じ名前を代入する文）だけをループに入れる
+        variant, inner = set(columns), set()
+        grown = True
+        while grown:
+            grown = False
+            for i, st in enumerate(selected):
+                if i not in inner and (st.loads | st.stores) & variant:
+                    inner.add(i)
+                    variant.update(st.stores)
+                    grown = True
+        hoisted = "".join(textwrap.indent(ast.unparse(st.node), "    ") + "\n"
+                          for i, st in enumerate(selected) if i not in inner)
+        body = "".join(textwrap.indent(ast.unparse(st.node), "        ") + "\n"
+                       for i, st in enumerate(selected) if i in inner)
+        params = tuple(f"_col_{name}" if name in columns else name for name in given)
+        source = (f"def kernel({', '.join(('req',) + params)}):\n{hoisted}"
+                  f"    _rows = []\n    _append = _rows.append\n"
+                  f"    for {', '.join(columns)}, in zip({', '.join('_col_' + name for name in columns)}):\n"
+                  f"{body}        _append({result})\n    return _rows\n")
+    filename = f"<kernel {plan.name}: {', '.join(names)}>"
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    namespace = dict(plan._namespace)
+    exec(compile(source, filename, "exec"), namespace)
+    return namespace["kernel"]
+
+
+# =========================================================
+# コンパイル
+# =========================================================
+
+def compile_ruleset(ruleset: Dict[str, Any]) -> EstimatePlan:
+    """ルールセットを評価プラン（全段を展開した1本の関数）にコンパイルする。"""
+    em = _Emitter()
+    axes = [_emit_axis(em, spec) for spec in ruleset.get("axes", [])]
+    em.stage("axes")
+    for name, spec in (ruleset.get("size") or {}).items():
+        _emit_size(em, name, spec)
+    for name in ("screen_count", "table_count"):
+        if name not in em.assigned:
+            em.emit(f"{name} = 0")
+
+    values: Dict[str, str] = {}
+    em.emit("unresolved = {}")
+    em.assign("unresolved")
+    for spec in ruleset.get("items", []):
+        group, values[group] = _emit_items(em, spec)
+    if "features" not in values:
+        em.emit("features = []")
+
+    cost = ruleset.get("cost") or {}
+    model = cost.get("model")
+    if model not in ("bs_labor", "daily_rate"):
+        raise RulesetError(f"unknown cost model: {model!r}")
+    if model == "daily_rate":
+        _emit_daily_rate_validation(em, cost, values)
+    em.stage("resolve")
+    _emit_effort(em, ruleset.get("effort") or {}, values, axes)
+    em.stage("effort")
+    if model == "bs_labor":
+        _emit_bs_labor(em, cost, values, axes)
+    else:
+        _emit_daily_rate(em, cost, values, axes)
+    em.stage("cost")
+    if ruleset.get("profit"):
+        _emit_profit(em, ruleset["profit"])
+        em.stage("profit")
+
+    store = "\n".join(f"    c.{name} = {name}" for name in em.assigned)
+    tail = f"    c = _EvalContext(req, tables)\n{store}\n    return c\n"
+    source = (
+        f"def evaluate(req, tables=None):\n{em.render(False)}\n{tail}\n"
+        f"def evaluate_timed(observe, req, tables=None):\n{em.render(True)}\n{tail}"
+    )
+    filename = f"<ruleset {ruleset.get('name', '')}>"
+    # トレースバックに生成ソースの行を表示できるよう登録しておく
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    namespace = dict(em.namespace)
+    exec(compile(source, filename, "exec"), namespace)
+    return EstimatePlan(ruleset.get("name", ""), source, namespace["evaluate"], namespace["evaluate_timed"],
+                        em.assigned, em.namespace)
+''')
+
+_install_module('estimate_schema', r'''# -*- coding: utf-8 -*-
+"""
+見積入力のスキーマ駆動パース（Dify の文字列入力 / API の型付き入力で共通）
+- 項目ごとの変換器（coercer）をスキーマ定義から起動時に1回だけ組み立てる。区切り文字の正規表現・照合辞書・
+  既定値は変換器に束縛済みで、同じ文字列入力のパース結果は LRU でキャッシュする
+- 変換器は value -> (変換後の値, エラー) を返す。変換できない値は従来どおり既定値（None / 空 / 既定の比率）にしつつ、
+  黙って捨てずに FieldError（項目名・コード・メッセージ・元の値）として返す
+- 受け付ける表記
+    数値       : "12" / "１２"（全角数字） / 12.0
+    利益率     : 0.15 / "15%" / "１５％" / "0.15"（1 を超える値は百分率とみなす）
+    リスト     : ["a", "b"] / "a, b\\nc"（改行・カンマ・全角カンマ・読点区切り。なし/未定 等のプレースホルダーは除く）
+    比率       : "Rank3:0.8, Rank2:0.2" / "Rank3：８０％\\nrank2: 20%"（区切り混在可。合計 1 に正規化）
+    部門配分   : "ＤＴ第１開発部: 0.6\\nDT第2開発部: 0.4"（部門名は表記ゆれも照合。合計 1 に正規化）
+- Dify 側へ配置する場合は estimate_engine.py と併せてこのファイルも配置すること
+"""
+
+import math
+import re
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from estimate_engine import normalize_label
+
+# (コード, メッセージ, 元の値)
+Issue = Tuple[str, str, Any]
+Coercer = Callable[[Any], Tuple[Any, Tuple[Issue, ...]]]
+
+NO_ISSUES: Tuple[Issue, ...] = ()
+PLACEHOLDERS = ('なし', '未定', '不明', 'N/A', '-')
+
+_LIST_SEPARATORS = re.compile(r"[,\n\r，、]")
+_KEY_VALUE = re.compile(r"[:：]")
+
+
+def json_safe(value: Any) -> Any:
+    """エラーに載せる元の値: NaN / Infinity は JSON（allow_nan=False）で出力できないので、その値だけ文字列にする。"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else str(value)
+    if isinstance(value, dict):
+        return {k: json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(v) for v in value]
+    return value
+
+
+@dataclass(frozen=True)
+class FieldError:
+    field: str
+    code: str
+    message: str
+    value: Any = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"field": self.field, "code": self.code, "message": self.message, "value": json_safe(self.value)}
+
+
+class InputValidationError(ValueError):
+    """strict な検証で FieldError があった。errors に全件を持つ。"""
+
+    def __init__(self, errors: Sequence[FieldError]):
+        self.errors = tuple(errors)
+        super().__init__("; ".join(f"{e.field}: {e.message}" for e in self.errors))
+
+
+def _nfkc(text: str) -> str:
+    # ASCII だけの文字列（大半の入力）は正規化を省く
+    return text if text.isascii() else unicodedata.normalize("NFKC", text)
+
+
+def _type_issue(value: Any, expected: str) -> Tuple[Issue, ...]:
+    return (("invalid_type", f"expected {expected}, got {type(value).__name__}", None),)
+
+
+def _number(text: str) -> Optional[float]:
+    """"0.8" / "８０％" → 数値（% 付きは 1/100）。数値でなければ None"""
+    text = _nfkc(text).strip()
+    percent = text.endswith("%")
+    if percent:
+        text = text[:-1].strip()
+    try:
+        num = float(text)
+    except ValueError:
+        return None
+    if not math.isfinite(num):
+        return None
+    return num / 100.0 if percent else num
+
+
+def text_list(placeholders: Sequence[str] = PLACEHOLDERS) -> Coercer:
+    """リスト項目: list はプレースホルダーを除いてそのまま、文字列は区切り文字で分割する。"""
+    placeholders = tuple(placeholders)
+    placeholder_set = frozenset(placeholders)
+
+    @lru_cache(maxsize=1024)
+    def from_text(text: str) -> Tuple[str, ...]:
+        return tuple(x for x in (part.strip() for part in _LIST_SEPARATORS.split(text))
+                     if x and x not in placeholders)
+
+    def coerce(value: Any) -> Tuple[Any, Tuple[Issue, ...]]:
+        if isinstance(value, str):
+            return list(from_text(value)), NO_ISSUES
+        if isinstance(value, (list, tuple)):
+            try:
+                # プレースホルダーを含まない（大半の入力）なら集合演算だけで判定してコピーを返す
+                if placeholder_set.isdisjoint(value):
+                    return list(value), NO_ISSUES
+            except TypeError:
+                pass  # ハッシュできない要素を含む
+            return [x for x in value if x not in placeholders], NO_ISSUES
+        if value is None:
+            return [], NO_ISSUES
+        return [], _type_issue(value, "a list or comma/newline separated text")
+
+    return coerce
+
+
+def integer() -> Coercer:
+    """整数項目: 数値は int に切り捨て、文字列は全角数字も解釈する。空・未指定は None。"""
+
+    def coerce(value: Any) -> Tuple[Any, Tuple[Issue, ...]]:
+        if type(value) is int or value is None:
+            return value, NO_ISSUES
+        if isinstance(value, (int, float)):
+            if isinstance(value, float) and not math.isfinite(value):
+                return None, (("invalid_int", "must be a finite number", value),)
+            return int(value), NO_ISSUES
+        if isinstance(value, str):
+            text = value.strip()
+            if not text:
+                return None, NO_ISSUES
+            try:
+                return int(_nfkc(text)), NO_ISSUES
+            except ValueError:
+                return None, (("invalid_int", f"not an integer: {value!r}", value),)
+        return None, _type_issue(value, "an integer")
+
+    return coerce
+
+
+def margin() -> Coercer:
+    """利益率: 数値はそのまま、文字列は % / 全角を解釈して 1 を超える値を百分率とみなす。空・未指定は None。"""
+
+    def coerce(value: Any) -> Tuple[Any, Tuple[Issue, ...]]:
+        if value is None:
+            return None, NO_ISSUES
+        if isinstance(value, (int, float)):
+            if isinstance(value, float) and not math.isfinite(value):
+                return None, (("invalid_margin", "must be a finite number", value),)
+            return float(value), NO_ISSUES
+        if isinstance(value, str):
+            text = _nfkc(value).replace("%", "").strip()
+            if not text:
+                return None, NO_ISSUES
+            num = _number(text)
+            if num is None:
+                return None, (("invalid_margin", f"not a margin: {value!r}", value),)
+            return (num / 100.0 if num > 1.0 else num), NO_ISSUES
+        return None, _type_issue(value, "a number or percentage text")
+
+    return coerce
+
+
+def ratio_map(allowed: Iterable[str], default: Dict[str, float]) -> Coercer:
+    """"キー:比率" の並び（カンマ・改行区切り）→ 合計 1 に正規化した dict。文字列以外はそのまま通す。
+
+    有効な比率が1つも無ければ default を返す（dict で NaN / Infinity を含む場合も）。キーは大文字小文字を区別しない。
+    """
+    keys = {key.casefold(): key for key in allowed}
+    default_items = tuple(default.items())
+
+    @lru_cache(maxsize=1024)
+    def from_text(text: str) -> Tuple[Tuple[Tuple[str, float], ...], Tuple[Issue, ...]]:
+        found: Dict[str, float] = {}
+        issues: List[Issue] = []
+        for part in _LIST_SEPARATORS.split(_nfkc(text)):
+            part = part.strip()
+            if not part:
+                continue
+            pair = _KEY_VALUE.split(part, 1)
+            if len(pair) != 2:
+                issues.append(("invalid_entry", f"expected 'key:ratio': {part!r}", part))
+                continue
+            key = keys.get(pair[0].strip().casefold())
+            num = _number(pair[1])
+            if key is None:
+                issues.append(("unknown_key", f"unknown key {pair[0].strip()!r} (expected one of {list(keys.values())})", part))
+            elif num is None or num < 0:
+                issues.append(("invalid_ratio", f"ratio must be a non-negative number: {part!r}", part))
+            else:
+                found[key] = num
+        total = sum(found.values())
+        if total <= 0:
+            if found or issues:
+                issues.append(("no_valid_entries", "no positive ratio; using the default", text))
+            return default_items, tuple(issues)
+        return tuple((key, num / total) for key, num in found.items()), tuple(issues)
+
+    def coerce(value: Any) -> Tuple[Any, Tuple[Issue, ...]]:
+        if not isinstance(value, str):
+            if isinstance(value, dict) and any(isinstance(v, float) and not math.isfinite(v) for v in value.values()):
+                return dict(default_items), (("invalid_ratio", "ratios must be finite numbers; using the default", value),)
+            return value, NO_ISSUES
+        items, issues = from_text(value)
+        return dict(items), issues
+
+    return coerce
+
+
+def allocation(known: Iterable[str]) -> Coercer:
+    """"部門:シェア" の並び（改行・カンマ区切り）→ [{"dept", "share"}]（合計 1 に正規化）。文字列以外はそのまま通す。
+
+    部門名は完全一致を先に引き、無ければ normalize_label（全角/半角・空白の表記ゆれを吸収）で照合する。
+    """
+    exact = frozenset(known)
+    normalized = {normalize_label(name): name for name in exact}
+
+    @lru_cache(maxsize=1024)
+    def from_text(text: str) -> Tuple[Tuple[Tuple[str, float], ...], Tuple[Issue, ...]]:
+        found: List[List[Any]] = []
+        issues: List[Issue] = []
+        for part in _LIST_SEPARATORS.split(text):
+            part = part.strip()
+            if not part:
+                continue
+            pair = _KEY_VALUE.split(part, 1)
+            if len(pair) != 2:
+                issues.append(("invalid_entry", f"expected 'department:share': {part!r}", part))
+                continue
+            name = pair[0].strip()
+            dept = name if name in exact else normalized.get(normalize_label(name))
+            num = _number(pair[1])
+            if dept is None:
+                issues.append(("unknown_department", f"unknown department {name!r}", part))
+            elif num is None or num <= 0:
+                issues.append(("invalid_share", f"share must be a positive number: {part!r}", part))
+            else:
+                found.append([dept, num])
+        total = sum(item[1] for item in found)
+        return tuple((dept, num / total) for dept, num in found), tuple(issues)
+
+    def coerce(value: Any) -> Tuple[Any, Tuple[Issue, ...]]:
+        if not isinstance(value, str):
+            return value, NO_ISSUES
+        items, issues = from_text(value)
+        return [{"dept": dept, "share": share} for dept, share in items], issues
+
+    return coerce
+
+
+def choice(known: Iterable[str], default: str) -> Coercer:
+    """選択肢: 未指定・空は default、未知の値は default にして unknown_value を返す（表記ゆれは照合する）。"""
+    exact = frozenset(known)
+    normalized = {normalize_label(name): name for name in exact}
+
+    def coerce(value: Any) -> Tuple[Any, Tuple[Issue, ...]]:
+        if not value:
+            return default, NO_ISSUES
+        if isinstance(value, str):
+            if value in exact:
+                return value, NO_ISSUES
+            match = normalized.get(normalize_label(value))
+            if match is not None:
+                return match, NO_ISSUES
+            return default, (("unknown_value", f"unknown value {value!r}; using {default!r}", value),)
+        return default, _type_issue(value, "text")
+
+    return coerce
+
+
+class InputSchema:
+    """項目名 → 変換器の宣言から組み立てた入力パーサー。
+
+    fields: [(項目名, 変換器, always)]。always=False の項目は入力にキーがある時だけ変換する
+    derive: 変換後の dict を受け取り、項目間の補完を行う関数（任意）
+    """
+
+    __slots__ = ("fields", "coercers", "derive", "_always", "_present")
+
+    def __init__(self, fields: Sequence[Tuple[str, Coercer, bool]],
+                 derive: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.fields = tuple(fields)
+        self.coercers = {name: coerce for name, coerce, _ in self.fields}
+        self.derive = derive
+        self._always = tuple((name, coerce) for name, coerce, always in self.fields if always)
+        self._present = tuple((name, coerce) for name, coerce, always in self.fields if not always)
+
+    def coerce(self, name: str, value: Any) -> Tuple[Any, List[FieldError]]:
+        """1項目だけ変換する（API のフィールド検証用）。"""
+        value, issues = self.coercers[name](value)
+        return value, [FieldError(name, *issue) for issue in issues]
+
+    def validate(self, data: Dict[str, Any]) -> Tuple[Dict[str, Any], List[FieldError]]:
+        """入力 dict → (変換後の dict, FieldError のリスト)。入力は変更しない。"""
+        args = dict(data)
+        errors: List[FieldError] = []
+        get = args.get
+        for name, coerce in self._always:
+            value, issues = coerce(get(name))
+            args[name] = value
+            if issues:
+                errors.extend(FieldError(name, *issue) for issue in issues)
+        for name, coerce in self._present:
+            if name in args:
+                value, issues = coerce(args[name])
+                args[name] = value
+                if issues:
+                    errors.extend(FieldError(name, *issue) for issue in issues)
+        if self.derive is not None:
+            self.derive(args)
+        return args, errors
+
+    def parse(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """strict 版: FieldError があれば InputValidationError を送出する。"""
+        args, errors = self.validate(data)
+        if errors:
+            raise InputValidationError(errors)
+        return args
+''')
+
+
+# ===== dify_assets/code/estimate_logic.py =====
+"""
+BS版 見積ロジック（Dify Code Node用 & Backend共通）
+- FY2026 利益管理表の係数に準拠（1人月=160h、部門別 間接費単金、本部/全社販管費率=BSは47.8%）
+- SG&Aは粗利ベースで控除（= 本部販管費率 + 全社販管費率）
+- 目標営業利益率からの逆算売価式も粗利ベースの定義に合わせて修正
+- 計算式は RULESET に宣言し、estimate_engine でコンパイルした評価プランで実行する
+  （Dify の Code Node には、依存モジュールを埋め込んだ dify_assets/dist/estimate_logic.py を貼り付ける。
+  このファイルを変えたら python -m dify_bundle で作り直すこと）
+- 入力の解釈は INPUT_SCHEMA（estimate_schema）で行い、解釈できなかった値は結果の input_errors に返す
+
+入出力：
+  def estimate(**kwargs) -> dict:       # 構造化（dictのまま）
+    return main_logic(...)
+  def main(**kwargs) -> dict:           # Dify Code Node 用
+    return {"result": json.dumps(estimate(**kwargs), ensure_ascii=False, indent=2)}
+"""
+
+import json
+import math
+import time
+from typing import List, Dict, Any, Tuple
+
+from estimate_engine import LabelIndex, OrgRateTable, compile_ruleset
+from estimate_schema import FieldError, InputSchema, allocation, choice, integer, margin, ratio_map, text_list
+
+# =========================================================
+# CONFIGURATION & CONSTANTS
+# =========================================================
+CONFIG = {
+    "config_version": "2026-02-CCS-Standard-v2",
+    "daily_rates": {
+        "sier_internal": 100000,
+        "outsource": 80000
+    },
+    # 生産性プロファイル（MD/FP相当係数）
+    # SI案件の全工程（要件定義〜QA）における標準生産性「10〜15 FP/人月」に準拠
+    # 1人月=20日のため、人日/FP = 20 / (FP/人月) となる。
+    # 10 FP/月 -> 2.0 人日/FP, 15 FP/月 -> 1.33 人日/FP
+    "estimation_profiles": {
+        "poc": {
+            "label": "PoC/開発重視型",
+            "productivity_factor": 0.075,
+            "description": "【注意】SI案件の全工程（要件定義〜QA）には非適用。製造/実制作フェーズのみの参考値。"
+        },
+        "enterprise": {
+            "label": "エンタープライズ型",
+            "productivity_factor": 1.5, # 13.3 FP/人月に相当
+            "description": "要件定義〜品質保証までの標準プロセスを含む（標準モデル）"
+        },
+        "mission_critical": {
+            "label": "高信頼性型",
+            "productivity_factor": 2.0, # 10 FP/人月に相当
+            "description": "金融/基幹等の極めて高い品質基準"
+        }
+    },
+    # 簡易FP基準
+    "fp_simplified": {
+        "screen_weight": 20,  # FP/画面
+        "table_weight": 15,   # FP/テーブル
+        "default_productivity": 1.5 # enterpriseをデフォルトに
+    },
+    # 難易度・納期・開発タイプ係数（工数側）
+    "difficulty_multipliers": {"low": 0.8, "medium": 1.0, "high": 1.5, "very_high": 2.0},
+    "duration_multipliers": {"long": 0.9, "normal": 1.0, "short": 1.2},
+    "dev_type_multipliers": {
+        "new": {"design": 1.0, "dev": 1.0},
+        "porting": {"design": 0.5, "dev": 0.8}
+    },
+    # プラットフォームの売価プレミアム
+    "platform_multipliers": {"web_b2e": 1.0, "web_b2c": 1.2, "mobile": 1.5, "all": 1.8},
+    "buffer_multiplier": 1.1,
+    # 損益計算（ランク人月コスト/標準チーム構成）
+    "profit_config": {
+        # PDFのランク別（時給→人月=160h）に合わせて上書き
+        "rank_costs": {
+            "Rank4": 1098000,  # L4: 6,860×160h
+            "Rank3":  944000,  # L3: 5,900×160h
+            "Rank2":  758000,  # L2: 4,740×160h
+            "Rank1":  541000,  # L1: 3,380×160h
+        },
+        "standard_team_ratio": {"Rank3": 0.8, "Rank2": 0.2}
+    }
+}
+
+# =========================================================
+# BS事業部：部門→(間接費単金[円/h], プロパ労務費に対する販管費率)
+# Certified FY2026 BS Standard (SGA on Direct Labor)
+# =========================================================
+BS_ORG_CONFIG: Dict[str, Dict[str, float]] = {
+    # 【注意】sga_on_propa_labor_rate は直接労務費に乗算する新しい係数。
+    #  値は仮で旧本部販管費率+旧全社販管費率を暫定設定。実態に合わせて要調整。
+    # --- ビジネスイノベーション ---
+    "ビジ・企画営業部":              {"indirect_per_hour": 2340, "sga_on_propa_labor_rate": 0.751},
+    "ビジ・システム開発部":            {"indirect_per_hour": 2340, "sga_on_propa_labor_rate": 0.751},
+    "ビジネスイノベーション事業部共通": {"indirect_per_hour": 2340, "sga_on_propa_labor_rate": 0.751},
+    # --- SF&M ---
+    "ＳＦ＆Ｍ営業部":                {"indirect_per_hour": 2030, "sga_on_propa_labor_rate": 0.741},
+    "ＳＦ＆Ｍ第１システム開発部":        {"indirect_per_hour": 2030, "sga_on_propa_labor_rate": 0.741},
+    "ＳＦ＆Ｍ第２システム開発部":        {"indirect_per_hour": 2030, "sga_on_propa_labor_rate": 0.741},
+    "ＳＦ＆Ｍ事業部（共通）":           {"indirect_per_hour": 2030, "sga_on_propa_labor_rate": 0.741},
+    # --- CS ---
+    "ＣＳ営業部":                   {"indirect_per_hour": 1940, "sga_on_propa_labor_rate": 0.787},
+    "ＣＳ第１システム開発部":           {"indirect_per_hour": 1940, "sga_on_propa_labor_rate": 0.787},
+    "ＣＳ第２システム開発部":           {"indirect_per_hour": 1940, "sga_on_propa_labor_rate": 0.787},
+    "ＣＳシステム事業部（共通）":         {"indirect_per_hour": 1940, "sga_on_propa_labor_rate": 0.787},
+    # --- DT ---
+    "ＤＴ営業部":                   {"indirect_per_hour": 2320, "sga_on_propa_labor_rate": 0.859},
+    "ＤＴ第１開発部":                 {"indirect_per_hour": 2320, "sga_on_propa_labor_rate": 0.859},
+    "ＤＴ第２開発部":                 {"indirect_per_hour": 2320, "sga_on_propa_labor_rate": 0.859},
+    "ＤＴ事業部（共通）":              {"indirect_per_hour": 2320, "sga_on_propa_labor_rate": 0.859},
+    # --- 社会・科学システム ---
+    "社会・科学システム営業部":           {"indirect_per_hour": 2220, "sga_on_propa_labor_rate": 0.886},
+    "データサイエンスシステム部":         {"indirect_per_hour": 2220, "sga_on_propa_labor_rate": 0.886},
+    "社会・科学システム事業部（共通）":     {"indirect_per_hour": 2220, "sga_on_propa_labor_rate": 0.886},
+    # --- ソリューションビジネス推進室 ---
+    "ソリューションビジネス推進室":         {"indirect_per_hour": 3570, "sga_on_propa_labor_rate": 1.415},
+}
+
+DEFAULT_BS_DEPT = "ビジネスイノベーション事業部共通"
+
+# 部門 → (間接費単金, 販管費率)
+BS_ORG_RATES = {
+    dept: (cfg["indirect_per_hour"], cfg["sga_on_propa_labor_rate"]) for dept, cfg in BS_ORG_CONFIG.items()
+}
+
+# 部門を配列インデックスにした単金・販管費率テーブル（応援配分の (インデックス列, シェア列) はリクエスト間で再利用）
+BS_RATE_TABLE = OrgRateTable(BS_ORG_RATES, DEFAULT_BS_DEPT)
+
+# =========================================================
+# Feature & Phase Item Maps（元PoCの構造を踏襲）
+# =========================================================
+FEATURE_MAN_DAYS = {
+    "auth": 3.0,
+    "payment": 5.0,
+    "search_basic": 2.0,
+    "search_advanced": 4.0,
+    "push_notification": 2.0,
+    "sns_integration": 3.0,
+    "admin_dashboard": 5.0,
+    "api_external": 4.0,
+    "offline_mode": 6.0,
+    "multi_language": 3.0,
+}
+
+FEATURE_LABEL_MAP = {
+    "認証・認可 (Auth/SSO)": "auth",
+    "決済基盤連携 (Payment)": "payment",
+    "検索・フィルタリング (Basic)": "search_basic",
+    "高度な検索 (AI/ベクトル)": "search_advanced",
+    "プッシュ通知": "push_notification",
+    "SNS連携・シェア": "sns_integration",
+    "管理画面 (Admin)": "admin_dashboard",
+    "外部API連携": "api_external",
+    "オフライン対応": "offline_mode",
+    "多言語対応 (i18n)": "multi_language",
+}
+
+PHASE2_ITEMS = {
+    "basic_design": 1000000,
+    "detail_design": 1500000,
+    "infra_design": 800000,
+    "security_review": 500000,
+    "standardization": 1200000,
+}
+
+PHASE2_LABEL_MAP = {
+    "基本設計書作成": "basic_design",
+    "詳細設計書作成": "detail_design",
+    "インフラ・クラウド設計": "infra_design",
+    "セキュリティ審査・対策案": "security_review",
+    "開発標準化・共通部設計": "standardization",
+}
+
+PHASE3_ITEMS = {
+    "logo_creation": {"fixed": 650000, "range": [500000, 800000]},
+    "brand_guideline": {"fixed": 1200000, "range": [1000000, 1500000]},
+    "ui_prototype": {"fixed": 800000, "range": [600000, 1200000]},
+    "marketing_asset": {"fixed": 450000, "range": [300000, 600000]},
+}
+
+PHASE3_LABEL_MAP = {
+    "企業/プロダクトロゴ制作": "logo_creation",
+    "ブランドガイドライン策定": "brand_guideline",
+    "高精度UIプロトタイプ": "ui_prototype",
+    "マーケティング素材/LP": "marketing_asset",
+}
+
+# ラベル括弧内の英語名での指定も受け付ける
+FEATURE_ALIASES = {
+    "Auth/SSO": "auth",
+    "Payment": "payment",
+    "Admin": "admin_dashboard",
+    "i18n": "multi_language",
+}
+
+# ラベル/キー → 項目キーの解決インデックス（全角/半角・空白の表記ゆれも吸収）
+FEATURE_INDEX = LabelIndex(FEATURE_MAN_DAYS, FEATURE_LABEL_MAP, FEATURE_ALIASES)
+PHASE2_INDEX = LabelIndex(PHASE2_ITEMS, PHASE2_LABEL_MAP)
+PHASE3_INDEX = LabelIndex(PHASE3_ITEMS, PHASE3_LABEL_MAP)
+
+# =========================================================
+# HELPERS
+# =========================================================
+
+# (id(label_map), id(item_dict)) → (label_map, item_dict, LabelIndex)。参照を保持して id の再利用を防ぐ
+_INDEX_CACHE = {
+    (id(label_map), id(item_dict)): (label_map, item_dict, index)
+    for label_map, item_dict, index in (
+        (FEATURE_LABEL_MAP, FEATURE_MAN_DAYS, FEATURE_INDEX),
+        (PHASE2_LABEL_MAP, PHASE2_ITEMS, PHASE2_INDEX),
+        (PHASE3_LABEL_MAP, PHASE3_ITEMS, PHASE3_INDEX),
+    )
+}
+
+
+def resolve_keys(input_list, label_map, item_dict):
+    # 入力順を保って重複排除。解決できないラベルは捨てる（未解決の一覧が必要なら LabelIndex.resolve）
+    key = (id(label_map), id(item_dict))
+    cached = _INDEX_CACHE.get(key)
+    if cached is None or cached[0] is not label_map or cached[1] is not item_dict:
+        cached = _INDEX_CACHE[key] = (label_map, item_dict, LabelIndex(item_dict, label_map))
+    return cached[2].resolve(input_list)[0]
+
+
+# 入力スキーマ（estimate_schema の変換器を起動時に組み立てる。API の EstimationRequest も同じ変換器を使う）
+DEFAULT_TEAM_RATIO = {"Rank3": 0.8, "Rank2": 0.2}
+LIST_FIELDS = ('features', 'phase2_items', 'phase3_items', 'tables')
+
+
+def _complete_table_count(args):
+    # tablesがあればtable_countを自動補完
+    if args.get('tables') and (args.get('table_count') is None or args.get('table_count') == 0):
+        args['table_count'] = len(args['tables'])
+
+
+INPUT_SCHEMA = InputSchema(
+    [(key, text_list(), True) for key in LIST_FIELDS] + [
+        ('screen_count', integer(), True),
+        ('table_count', integer(), True),
+        ('target_margin', margin(), True),
+        ('department', choice(BS_ORG_CONFIG, DEFAULT_BS_DEPT), True),
+        # 文字列の時だけ配列/比率に正規化（構造化済みの値はそのまま評価プランへ）
+        ('dept_allocation', allocation(BS_ORG_CONFIG), False),
+        ('team_ratio', ratio_map(CONFIG["profit_config"]["rank_costs"], DEFAULT_TEAM_RATIO), False),
+    ],
+    derive=_complete_table_count,
+)
+
+
+def parse_list_from_text(val):
+    # 改行/カンマ区切り → list
+    return INPUT_SCHEMA.coercers['features'](val)[0]
+
+
+def parse_int(val, default=None):
+    num = INPUT_SCHEMA.coercers['screen_count'](val)[0]
+    return default if num is None else num
+
+
+def parse_target_margin(val):
+    return INPUT_SCHEMA.coercers['target_margin'](val)[0]
+
+
+def parse_team_ratio(text):
+    # 例: "Rank3:0.8, Rank2:0.2"
+    if not isinstance(text, str):
+        return dict(DEFAULT_TEAM_RATIO)
+    return INPUT_SCHEMA.coercers['team_ratio'](text)[0]
+
+
+def parse_dept_allocation(text):
+    # 段落: 「部門: 0.6\nＣＳ第１システム開発部: 0.4」→ 正規化list
+    if not isinstance(text, str):
+        return []
+    return INPUT_SCHEMA.coercers['dept_allocation'](text)[0]
+
+
+def resolve_bs_org_rates(primary_dept: str, allocations: List[Dict[str, Any]] | None):
+    # デフォルト=主所属100%、応援配分があれば加重平均
+    return BS_RATE_TABLE.blend(primary_dept, allocations)
+
+
+# =========================================================
+# RULESET（estimate_engine で評価プランにコンパイル）
+# =========================================================
+RULESET = {
+    "name": CONFIG["config_version"],
+    "axes": [
+        {"name": "complexity", "default": "medium", "table": CONFIG["difficulty_multipliers"], "fallback": 1.0},
+        {"name": "duration", "default": "normal", "table": CONFIG["duration_multipliers"], "fallback": 1.0},
+        {"name": "dev_type", "default": "new", "table": CONFIG["dev_type_multipliers"],
+         "fallback": {"design": 1.0, "dev": 1.0}},
+        {"name": "target_platform", "default": "web_b2e", "table": CONFIG["platform_multipliers"], "fallback": 1.0},
+        {"name": "profile", "keys": ["estimation_profile"], "default": "enterprise",
+         "table": CONFIG["estimation_profiles"], "fallback": CONFIG["estimation_profiles"]["enterprise"],
+         "default_productivity": CONFIG["fp_simplified"]["default_productivity"]},
+    ],
+    "size": {
+        "screen_count": {"mode": "none_default", "default": 10},
+        "table_count": {"mode": "none_default", "default": 0},
+    },
+    "items": [
+        {"group": "features", "key": "features", "index": FEATURE_INDEX, "table": FEATURE_MAN_DAYS},
+        {"group": "phase2", "key": "phase2_items", "index": PHASE2_INDEX, "table": PHASE2_ITEMS},
+        {"group": "phase3", "key": "phase3_items", "index": PHASE3_INDEX, "table": PHASE3_ITEMS,
+         "value": "fixed"},
+    ],
+    "effort": {
+        "model": "fp_simplified",
+        "screen_weight": CONFIG["fp_simplified"].get("screen_weight", 20),
+        "table_weight": CONFIG["fp_simplified"].get("table_weight", 15),
+    },
+    # 直接労務費（ランク人月×人月）+ 間接費（部門単金×時間）+ Phase2固定費 + Phase3外注費（確度係数）
+    "cost": {
+        "model": "bs_labor",
+        "rank_costs": CONFIG["profit_config"]["rank_costs"],
+        "standard_team_ratio": CONFIG["profit_config"].get("standard_team_ratio", {"Rank3": 0.8, "Rank2": 0.2}),
+        "team_ratio_key": "team_ratio",
+        "org_rates": BS_RATE_TABLE,
+        "default_department": DEFAULT_BS_DEPT,
+        "allocation_key": "dept_allocation",
+        "phase3_confidence": {"low": 1.3, "high": 1.0},
+        "buffer": CONFIG.get("buffer_multiplier", 1.1),
+    },
+    # CCS基準：販管費は直接労務費に賦課
+    "profit": {"model": "sga_on_labor", "target_margin": "raw"},
+}
+
+PLAN = compile_ruleset(RULESET)
+
+# 段階別の計測フック observe(stage, seconds)。None なら計測なしの評価プランを使う
+_stage_observer = None
+
+
+def set_stage_observer(observe):
+    global _stage_observer
+    _stage_observer = observe
+
+# =========================================================
+# MAIN LOGIC
+# =========================================================
+
+def main_logic(req_body, tables=[]):
+    observe = _stage_observer
+    if observe is None:
+        c = PLAN.evaluate(req_body, tables)
+    else:
+        c = PLAN.evaluate_timed(observe, req_body, tables)
+    return build_result(c, tables)
+
+
+def build_result(c, tables):
+    # 評価結果（EvalContext）→ レスポンス。見積セッション（estimate_session）も中間値からこれで組み立てる
+    final_amount = c.final
+    target_margin = c.target_margin
+    profile = c.profile
+
+    return {
+        "status": "success",
+        "estimated_amount": f"¥{final_amount:,}",
+        "estimated_range": f"¥{int(final_amount*0.9):,} - ¥{int(final_amount*1.2):,}",
+        "man_days": {
+            "development_total": round(c.dev_total, 1),
+            "fp_based": round(c.fp_days, 1),
+            "feature_based": round(c.feature_days, 1),
+        },
+        "bs_input": {
+            "department": c.department,
+            "dept_allocation": c.dept_allocation,
+            "sga_rate_applied": f"{c.sga_rate:.1%}",
+            "indirect_yen_per_hour": c.indirect_per_hour,
+            "team_ratio": c.team_ratio,
+        },
+        "input_echo": {
+            "profile": profile.get('label'),
+            "profile_description": profile.get('description'),
+            "screen_count": c.screen_count,
+            "table_count": c.table_count,
+            "tables": tables,
+            "complexity": c.complexity,
+            "duration": c.duration,
+            "dev_type": c.dev_type,
+            "target_platform": c.target_platform,
+            "confidence": c.confidence,
+            "target_margin": target_margin,
+            "features": c.features,
+            "phase2_items": c.phase2,
+            "phase3_items": c.phase3,
+        },
+        # 項目マスタで解決できなかった入力ラベル（計算には含まれない）
+        "unresolved_items": c.unresolved,
+        "profit_analysis": {
+            "sales": final_amount,
+            "cogs": c.cogs,
+            "gross_profit": c.gross_profit,
+            "sga_cost": c.sga,
+            "operating_profit": c.operating_profit,
+            "operating_margin": f"{c.operating_margin:.1%}",
+            "target_margin_specified": f"{target_margin:.1%}" if target_margin is not None else None,
+            "suggested_price_to_attain_target": c.suggested_price,
+            "breakdown": {
+                "sga_calculation_base": "direct_labor_cost",
+                "sga_rate_on_propa_labor": f"{c.sga_rate:.1%}",
+            }
+        },
+        "productivity": f"{c.prod} MD/FP",
+    }
+
+
+def validate_args(kwargs: Dict[str, Any]) -> Tuple[Dict[str, Any], List[FieldError]]:
+    # Dify入力（文字列混在）→ (main_logic 用の正規化済み dict, 解釈できなかった値の FieldError)
+    return INPUT_SCHEMA.validate(kwargs)
+
+
+def prepare_args(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    # Dify入力（文字列混在）→ main_logic 用の正規化済み dict（解釈できない値は既定値）
+    return INPUT_SCHEMA.validate(kwargs)[0]
+
+
+def with_input_errors(result: Dict[str, Any], errors: List[FieldError]) -> Dict[str, Any]:
+    # 解釈できなかった入力があれば input_errors に返す（無ければ結果はそのまま）
+    if errors:
+        result["input_errors"] = [e.to_dict() for e in errors]
+    return result
+
+
+def estimate(**kwargs) -> Dict[str, Any]:
+    # 構造化エントリポイント（JSON文字列化せず dict のまま返す。API/バッチ用）
+    observe = _stage_observer
+    if observe is None:
+        args, errors = validate_args(kwargs)
+    else:
+        started = time.perf_counter()
+        args, errors = validate_args(kwargs)
+        observe("parse", time.perf_counter() - started)
+    return with_input_errors(main_logic(args, args.get('tables', [])), errors)
+
+
+def main(**kwargs) -> dict:
+    # Dify Code Node entrypoint（Difyは文字列出力のため estimate の結果をJSON化するだけ）
+    return {"result": json.dumps(estimate(**kwargs), ensure_ascii=False, indent=2)}
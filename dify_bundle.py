@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Dify Code Node 用の1ファイル版ロジックの生成
+- Code Node には1ファイルのコードしか置けないため、dify_assets/code/estimate_logic.py が（間接的にも）import する
+  本リポジトリのモジュールのソースを埋め込んだ1ファイルを dify_assets/dist/estimate_logic.py に生成する
+- 埋め込むモジュールは import 文から求める（estimate_schema → estimate_engine のように、import される側を先に登録する）
+- 埋め込んだモジュールは実行時に sys.modules へ登録してから本体を実行する（本体の import 文は書き換えない）
+- ソースを変えたら python -m dify_bundle で作り直す。--check は書き出さずに最新かだけを確認する（古ければ終了コード 1）
+"""
+
+import ast
+import os
+import sys
+from typing import List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+SOURCE_PATH = os.path.join(ROOT, "dify_assets", "code", "estimate_logic.py")
+BUNDLE_PATH = os.path.join(ROOT, "dify_assets", "dist", "estimate_logic.py")
+
+_HEADER = '''# -*- coding: utf-8 -*-
+# 生成ファイル（python -m dify_bundle）。直接編集せず、dify_assets/code/estimate_logic.py と埋め込み元のモジュールを直して作り直す
+# Dify の Code Node にはこのファイルの内容をそのまま貼り付ける（他のファイルの配置は不要）
+import sys as _sys
+import types as _types
+
+
+def _install_module(name, source):
+    # 埋め込んだソースをモジュールとして登録する（本体の import はこれを使う）
+    if name in _sys.modules:
+        return
+    module = _types.ModuleType(name)
+    module.__file__ = "<dify bundle: %s>" % name
+    _sys.modules[name] = module
+    try:
+        exec(compile(source, module.__file__, "exec"), module.__dict__)
+    except BaseException:
+        del _sys.modules[name]
+        raise
+
+'''
+
+
+def _read(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def _literal(source: str) -> str:
+    # 読めるように r'''...''' で埋め込む（使えない文字列のときだけ repr）
+    literal = "r'''" + source + "'''"
+    if "'''" in source or source.endswith("\\") or ast.literal_eval(literal) != source:
+        literal = repr(source)
+    return literal
+
+
+def local_imports(source: str) -> List[str]:
+    """ソースが import する本リポジトリのモジュール名（トップレベルの .py。登場順）。"""
+    names: List[str] = []
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            found = [node.module]
+        elif isinstance(node, ast.Import):
+            found = [alias.name for alias in node.names]
+        else:
+            continue
+        for name in found:
+            top = name.split(".")[0]
+            if os.path.exists(os.path.join(ROOT, top + ".py")) and top not in names:
+                if top != name:
+                    raise ValueError(f"cannot bundle submodule import: {name}")
+                names.append(top)
+            elif os.path.isdir(os.path.join(ROOT, top)):
+                raise ValueError(f"cannot bundle package import: {name}")
+    return names
+
+
+def bundled_modules() -> Tuple[str, ...]:
+    """埋め込むモジュール（dify_assets/code/estimate_logic.py から import をたどる。import される側が先）。"""
+    order: List[str] = []
+
+    def visit(name: str, path: Tuple[str, ...]) -> None:
+        if name in path:
+            raise ValueError(f"circular import: {' -> '.join(path + (name,))}")
+        if name in order:
+            return
+        for dep in local_imports(_read(os.path.join(ROOT, name + ".py"))):
+            visit(dep, path + (name,))
+        order.append(name)
+
+    for name in local_imports(_read(SOURCE_PATH)):
+        visit(name, ())
+    return tuple(order)
+
+
+def build() -> str:
+    """埋め込みモジュール + dify_assets/code/estimate_logic.py → 1ファイル版のソース。"""
+    parts: List[str] = [_HEADER]
+    for name in bundled_modules():
+        source = _read(os.path.join(ROOT, name + ".py"))
+        parts.append(f"\n_install_module({name!r}, {_literal(source)})\n")
+    body = _read(SOURCE_PATH)
+    if body.startswith("# -*- coding"):
+        body = body.split("\n", 1)[1]
+    parts.append("\n\n# ===== dify_assets/code/estimate_logic.py =====\n" + body)
+    return "".join(parts)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = sys.argv[1:] if argv is None else argv
+    source = build()
+    if "--check" in args:
+        current = _read(BUNDLE_PATH) if os.path.exists(BUNDLE_PATH) else None
+        if current != source:
+            print(f"{BUNDLE_PATH} is out of date (run python -m dify_bundle)", file=sys.stderr)
+            return 1
+        return 0
+    os.makedirs(os.path.dirname(BUNDLE_PATH), exist_ok=True)
+    with open(BUNDLE_PATH, "w", encoding="utf-8", newline="\n") as f:
+        f.write(source)
+    print(BUNDLE_PATH)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
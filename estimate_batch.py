@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+バッチ見積
+- dify_assets/code/estimate_logic.estimate を N 件分、1件ずつ順に呼ぶだけのループ（列単位のベクトル化はしない）。
+  計算式は評価プラン PLAN の1本だけで、結果は1件ずつの評価と完全一致する
+- 1件あたりの時間は単発の /calculate と同じ（数十µs。1万件で数百ms）。大きなバッチの高速化は
+  estimate_pool（ワーカープロセスへのチャンク分割）で行い、ここでは行わない
+"""
+
+from typing import Any, Dict, List
+
+from dify_assets.code import estimate_logic as dify_logic
+
+
+def main_batch(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Dify形式の入力（main(**kwargs) と同じ）を入力順に1件ずつ評価する。"""
+    estimate = dify_logic.estimate
+    return [estimate(**item) for item in items]
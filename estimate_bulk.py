@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+ポートフォリオ一括見積 CLI（JSONL / CSV をストリーミング処理）
+
+  python -m estimate_bulk portfolio.csv -o results.csv --workers 4
+  python -m estimate_bulk requests.jsonl -o results.jsonl
+  cat requests.jsonl | python -m estimate_bulk - --input-format jsonl > results.jsonl
+
+- 1行ずつ読み、dify_assets/code/estimate_logic の validate_args（Dify と同じ文字列入力のパース）→ main_logic で評価する
+  （解釈できなかった値は JSONL 出力の result.input_errors に入る）
+- 入力は chunk_size 行ずつワーカー（プロセス）に渡し、処理中のチャンクは workers × 2 個までに制限する
+  （入力サイズによらずメモリは一定）。出力は入力順で、各行に行番号（row）と ID 列（既定 id）の値を付ける
+- 行ごとのエラー（JSON 不正・計算エラー・出力できない値）は status=error の行として出力し、処理は止めない
+- CSV 入力: 1行目がヘッダー。空セルは未指定扱い。features 等は Dify と同じくカンマ/改行区切り
+- CSV 出力: BULK_CSV_COLUMNS の列（金額は数値）。JSONL 出力: main_logic の結果をそのまま result に入れる
+- 評価と書式化はワーカー側で行い、プロセス間は出力テキストだけを受け渡す
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+import json_response
+from dify_assets.code import estimate_logic as dify_logic
+
+FORMATS = ("jsonl", "csv")
+DEFAULT_CHUNK_SIZE = 256
+BULK_CSV_COLUMNS = (
+    "row", "id", "status", "estimated_amount", "estimated_range", "man_days", "department",
+    "cogs", "gross_profit", "sga_cost", "operating_profit", "operating_margin",
+    "suggested_price_to_attain_target", "unresolved_items", "input_errors", "error",
+)
+
+# (行番号, ID, 入力 dict または入力エラーの文言)
+Row = Tuple[int, Any, Any]
+
+
+def detect_format(path: str, explicit: Optional[str] = None) -> str:
+    if explicit:
+        if explicit not in FORMATS:
+            raise ValueError(f"format must be one of {list(FORMATS)}")
+        return explicit
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def read_rows(stream: TextIO, fmt: str, id_column: str = "id") -> Iterator[Row]:
+    """入力を1行ずつ (行番号, ID, 入力) に変換する（行番号はデータ行の 1 始まり）。"""
+    if fmt == "csv":
+        for row_no, record in enumerate(csv.DictReader(stream), 1):
+            item = {k: v for k, v in record.items() if k and v not in ("", None)}
+            yield row_no, item.pop(id_column, None), item
+        return
+    row_no = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        row_no += 1
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            yield row_no, None, f"invalid JSON: {e}"
+            continue
+        if not isinstance(item, dict):
+            yield row_no, None, "each line must be a JSON object"
+            continue
+        yield row_no, item.pop(id_column, None), item
+
+
+def estimate_row(row: Row) -> Dict[str, Any]:
+    row_no, row_id, item = row
+    if isinstance(item, str):
+        return {"row": row_no, "id": row_id, "status": "error", "error": item}
+    try:
+        args, errors = dify_logic.validate_args(item)
+        result = dify_logic.with_input_errors(dify_logic.main_logic(args, args.get('tables', [])), errors)
+    except Exception as e:
+        return {"row": row_no, "id": row_id, "status": "error", "error": f"{type(e).__name__}: {e}"}
+    return {"row": row_no, "id": row_id, "status": "ok", "result": result}
+
+
+def _chunks(rows: Iterable[Row], size: int) -> Iterator[List[Row]]:
+    chunk: List[Row] = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def format_row(out: Dict[str, Any], fmt: str) -> str:
+    """1行分の出力テキスト（改行込み）"""
+    if fmt == "csv":
+        buf = io.StringIO()
+        record = csv_record(out)
+        csv.writer(buf).writerow([record.get(name) for name in BULK_CSV_COLUMNS])
+        return buf.getvalue()
+    return json_response.dumps_bytes(out).decode("utf-8") + "\n"
+
+
+def format_result(out: Dict[str, Any], fmt: str) -> Tuple[bool, str]:
+    """(成否, 出力テキスト)。書式化できない行（stdlib エンコーダでの NaN など）はその行だけ status=error にする。"""
+    try:
+        return out["status"] == "ok", format_row(out, fmt)
+    except Exception as e:
+        row_id = out["id"]
+        if not isinstance(row_id, (str, int, type(None))):
+            row_id = str(row_id)  # ID 自体が出力できない値のこともある
+        error = {"row": out["row"], "id": row_id, "status": "error",
+                 "error": f"cannot format result: {type(e).__name__}: {e}"}
+        return False, format_row(error, fmt)
+
+
+def process_chunk(rows: List[Row], fmt: str) -> List[Tuple[bool, str]]:
+    # 評価と書式化までワーカー側で行い、プロセス間では (成否, 出力テキスト) だけを受け渡す
+    return [format_result(estimate_row(row), fmt) for row in rows]
+
+
+def _warm_up() -> None:
+    # ワーカー起動時に評価プランを1回通しておく（初回のキャッシュ構築を最初のチャンクに持ち込まない）
+    dify_logic.main_logic(dify_logic.prepare_args({}), [])
+
+
+def run_rows(rows: Iterable[Row], fmt: str, workers: int = 1,
+             chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[bool, str]]:
+    """行を評価・書式化して入力順に返す。workers > 1 ならプロセスプールで並列に処理する。"""
+    if workers <= 1:
+        for chunk in _chunks(rows, chunk_size):
+            yield from process_chunk(chunk, fmt)
+        return
+    window = workers * 2
+    with ProcessPoolExecutor(max_workers=workers, initializer=_warm_up) as pool:
+        pending: deque = deque()
+        for chunk in _chunks(rows, chunk_size):
+            pending.append(pool.submit(process_chunk, chunk, fmt))
+            if len(pending) >= window:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def csv_record(out: Dict[str, Any]) -> Dict[str, Any]:
+    record = {"row": out["row"], "id": out["id"], "status": out["status"], "error": out.get("error")}
+    result = out.get("result")
+    if result is not None:
+        profit = result["profit_analysis"]
+        unresolved = [str(x) for items in result["unresolved_items"].values() for x in items]
+        record.update({
+            "estimated_amount": profit["sales"],
+            "estimated_range": result["estimated_range"],
+            "man_days": result["man_days"]["development_total"],
+            "department": result["bs_input"]["department"],
+            "cogs": profit["cogs"],
+            "gross_profit": profit["gross_profit"],
+            "sga_cost": profit["sga_cost"],
+            "operating_profit": profit["operating_profit"],
+            "operating_margin": profit["operating_margin"],
+            "suggested_price_to_attain_target": profit["suggested_price_to_attain_target"],
+            "unresolved_items": "; ".join(unresolved),
+            "input_errors": "; ".join(f"{e['field']}: {e['message']}" for e in result.get("input_errors", [])),
+        })
+    return record
+
+
+def write_results(lines: Iterable[Tuple[bool, str]], stream: TextIO, fmt: str) -> Dict[str, int]:
+    """出力テキストを順に書き出し、件数を返す。"""
+    counts = {"rows": 0, "ok": 0, "errors": 0}
+    if fmt == "csv":
+        csv.writer(stream).writerow(BULK_CSV_COLUMNS)
+    for ok, text in lines:
+        counts["rows"] += 1
+        counts["ok" if ok else "errors"] += 1
+        stream.write(text)
+    return counts
+
+
+@contextmanager
+def _open(path: str, mode: str) -> Iterator[TextIO]:
+    if path != "-":
+        # utf-8-sig: Excel で保存した CSV の BOM を読み飛ばす
+        with open(path, mode, encoding="utf-8-sig" if "r" in mode else "utf-8", newline="") as f:
+            yield f
+        return
+    std = sys.stdin if "r" in mode else sys.stdout
+    if not hasattr(std, "buffer"):
+        yield std
+        return
+    # 標準入出力は UTF-8 に固定し、終了時も閉じない
+    stream = io.TextIOWrapper(std.buffer, encoding="utf-8", newline="")
+    try:
+        yield stream
+    finally:
+        if "w" in mode:
+            stream.flush()
+        stream.detach()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="入力ファイル（- で標準入力）")
+    parser.add_argument("-o", "--output", default="-", help="出力ファイル（既定: 標準出力）")
+    parser.add_argument("--input-format", choices=FORMATS, help="既定は拡張子から判定（.csv 以外は jsonl）")
+    parser.add_argument("--output-format", choices=FORMATS, help="既定は出力の拡張子（標準出力なら入力と同じ）")
+    parser.add_argument("--workers", type=int, default=1, help="ワーカープロセス数（0 で CPU コア数）")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--id-column", default="id", help="行 ID として出力に引き継ぐ列")
+    parser.add_argument("--strict", action="store_true", help="エラー行があれば終了コード 1")
+    args = parser.parse_args(argv)
+
+    in_fmt = detect_format(args.input, args.input_format)
+    out_fmt = detect_format(args.output, args.output_format) if args.output != "-" else (args.output_format or in_fmt)
+    workers = args.workers or os.cpu_count() or 1
+
+    started = time.perf_counter()
+    with _open(args.input, "r") as src, _open(args.output, "w") as dst:
+        rows = read_rows(src, in_fmt, args.id_column)
+        counts = write_results(run_rows(rows, out_fmt, workers, max(1, args.chunk_size)), dst, out_fmt)
+    elapsed = time.perf_counter() - started
+    print(f"rows={counts['rows']} ok={counts['ok']} errors={counts['errors']} "
+          f"workers={workers} elapsed={elapsed:.2f}s", file=sys.stderr)
+    return 1 if args.strict and counts["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+全部門比較（この案件をどの部門で受けるか）
+- ベース入力を1回だけ評価し、部門に依存しない値（工数・直接労務費・Phase2/3費用・売価係数）を確定させる
+- 部門ごとの後段（間接費・原価・売価・販管費・逆算売価）は評価プランの部分評価関数（PLAN.kernel）で求める。
+  計算式は評価プランの1本だけで、部門に依存しない段は再評価しない
+- 各行は department を指定（dept_allocation なし）した main_logic の結果と一致する
+- 売価の安い順・営業利益率の高い順の順位を付けて返す
+"""
+
+from typing import Any, Dict, List
+
+from dify_assets.code import estimate_logic as dify_logic
+
+SORT_KEYS = ("price", "operating_margin")
+
+# 部門に依存しない中間値（ベースの評価結果を渡す）と、部門ごとに求める値
+DEPARTMENT_GIVEN = ("dev_total", "direct_labor", "p2_cost", "p3_cost", "plat", "dur", "target_margin")
+DEPARTMENT_OUTPUTS = ("indirect_per_hour", "sga_rate", "cogs", "final", "sga",
+                      "operating_profit", "operating_margin", "suggested_price")
+
+
+def rank_departments(base: Dict[str, Any], sort_by: str = "price") -> Dict[str, Any]:
+    """base（Dify形式の入力）を BS_ORG_CONFIG の全部門で見積もり、売価と営業利益率で順位付けする。"""
+    if sort_by not in SORT_KEYS:
+        raise ValueError(f"sort_by must be one of {list(SORT_KEYS)}")
+
+    req_body = dify_logic.prepare_args(base)
+    # 応援配分は無視し、各部門100%で評価する
+    req_body['dept_allocation'] = None
+    c = dify_logic.PLAN.evaluate(req_body, req_body.get('tables', []))
+
+    # ===== 部門ごとの後段（評価プランから取り出した部分評価関数。式は main_logic と同じ1本） =====
+    tail = dify_logic.PLAN.kernel(DEPARTMENT_GIVEN, DEPARTMENT_OUTPUTS)
+    fixed = [getattr(c, name) for name in DEPARTMENT_GIVEN]
+    table = dify_logic.BS_RATE_TABLE
+    rows = [tail(dict(req_body, department=dept), *fixed) for dept in table.departments]
+    indirect, sga_rates, cogs, prices, sga, profits, margins, suggested = zip(*rows)
+    direct_labor = c.direct_labor
+    target_margin = c.target_margin
+
+    n = len(table.departments)
+    price_order = sorted(range(n), key=prices.__getitem__)
+    margin_order = sorted(range(n), key=lambda i: -margins[i])
+    price_rank: List[int] = [0] * n
+    margin_rank: List[int] = [0] * n
+    for rank, i in enumerate(price_order, 1):
+        price_rank[i] = rank
+    for rank, i in enumerate(margin_order, 1):
+        margin_rank[i] = rank
+
+    rows = [{
+        "department": table.departments[i],
+        "estimated_amount": prices[i],
+        "cogs": cogs[i],
+        "sga_cost": sga[i],
+        "operating_profit": profits[i],
+        "operating_margin": f"{margins[i]:.1%}",
+        "suggested_price_to_attain_target": suggested[i],
+        "indirect_yen_per_hour": indirect[i],
+        "sga_rate_applied": f"{sga_rates[i]:.1%}",
+        "price_rank": price_rank[i],
+        "margin_rank": margin_rank[i],
+    } for i in (price_order if sort_by == "price" else margin_order)]
+
+    return {
+        "status": "success",
+        "count": n,
+        "sort_by": sort_by,
+        "man_days": round(c.dev_total, 1),
+        "direct_labor_cost": direct_labor,
+        "target_margin_specified": f"{target_margin:.1%}" if target_margin is not None else None,
+        "departments": rows,
+    }
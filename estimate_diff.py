@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+見積の構造差分（版の比較）
+- 比較する2つの見積は、それぞれ見積リクエスト（/calculate の入力。メモを通して計算）・保存済みの結果（/calculate の
+  レスポンスそのもの）・見積セッションの現在の結果のいずれかで渡す
+- main_logic の結果の内訳（profit_analysis / man_days / input_echo / bs_input）から比較項目を1回ずつ取り出す。
+  Phase2/3 費用は結果に無いため、input_echo の項目から評価プランの部分評価関数（PLAN.kernel）で求める
+  （改訂側は Phase2/3 費用が読む入力項目が変わっていなければ基準側の値を使う）
+- 入力項目の変化も input_echo / bs_input から取り出し（項目は解決済みキーで比較するため表記ゆれは変化にならない）、
+  各差分の原因は評価プランの依存関係（PLAN.dependencies()）と変わった入力項目の積で示す
+- 返すのは値が変わった項目だけ（金額・工数は差と比、利益率は差）
+"""
+
+from functools import lru_cache
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from dify_assets.code import estimate_logic as dify_logic
+from estimate_engine import EstimatePlan
+
+# 比較項目 → その値を求める評価プランの中間値（原因の特定に使う）
+FIELDS = (
+    ("estimated_amount", ("final",)),
+    ("cogs", ("cogs",)),
+    ("labor_cost", ("direct_labor", "indirect")),
+    ("phase2_cost", ("p2_cost",)),
+    ("phase3_cost", ("p3_cost",)),
+    ("gross_profit", ("gross_profit",)),
+    ("sga_cost", ("sga",)),
+    ("operating_profit", ("operating_profit",)),
+    ("operating_margin", ("operating_margin",)),
+    ("suggested_price", ("suggested_price",)),
+    ("man_days.development_total", ("dev_total",)),
+    ("man_days.fp_based", ("fp_days",)),
+    ("man_days.feature_based", ("feature_days",)),
+)
+
+# 入力項目名 → 結果の (区画, キー)。profile はラベルで比較する
+INPUT_PATHS = (
+    ("estimation_profile", "input_echo", "profile"),
+    ("screen_count", "input_echo", "screen_count"),
+    ("table_count", "input_echo", "table_count"),
+    ("tables", "input_echo", "tables"),
+    ("complexity", "input_echo", "complexity"),
+    ("duration", "input_echo", "duration"),
+    ("dev_type", "input_echo", "dev_type"),
+    ("target_platform", "input_echo", "target_platform"),
+    ("features", "input_echo", "features"),
+    ("phase2_items", "input_echo", "phase2_items"),
+    ("phase3_items", "input_echo", "phase3_items"),
+    ("confidence", "input_echo", "confidence"),
+    ("target_margin", "input_echo", "target_margin"),
+    ("department", "bs_input", "department"),
+    ("dept_allocation", "bs_input", "dept_allocation"),
+    ("team_ratio", "bs_input", "team_ratio"),
+)
+LIST_INPUTS = frozenset(["tables", "features", "phase2_items", "phase3_items"])
+INPUT_ORDER = {name: i for i, (name, _, _) in enumerate(INPUT_PATHS)}
+
+PHASE_VALUES = ("p2_cost", "p3_cost")
+REQUIRED_SECTIONS = ("profit_analysis", "man_days", "input_echo", "bs_input")
+
+SIDES = ("request", "result", "session_id")
+
+
+@lru_cache(maxsize=4)
+def field_causes(plan: EstimatePlan) -> Dict[str, Tuple[str, ...]]:
+    """比較項目 → 依存する入力項目（INPUT_PATHS の順。原因はこれを変わった入力項目で絞るだけ）。"""
+    deps = plan.dependencies()
+    return {
+        name: tuple(sorted(frozenset().union(*[deps[value] for value in values]).intersection(INPUT_ORDER),
+                           key=INPUT_ORDER.__getitem__))
+        for name, values in FIELDS
+    }
+
+
+def _check_result(result: Any, label: str) -> Dict[str, Any]:
+    if not isinstance(result, dict):
+        raise ValueError(f"{label}: result must be an object")
+    missing = [key for key in REQUIRED_SECTIONS if not isinstance(result.get(key), dict)]
+    if missing:
+        raise ValueError(f"{label}: result is missing {missing} (pass a /calculate response)")
+    return result
+
+
+def resolve_side(side: Dict[str, Any], label: str, estimate: Callable[[Dict[str, Any]], Dict[str, Any]],
+                 sessions: Any = None) -> Tuple[str, Dict[str, Any]]:
+    """{"request"} / {"result"} / {"session_id"} のいずれか1つ → (種別, 結果)。"""
+    given = [key for key in SIDES if side.get(key) is not None]
+    if len(given) != 1:
+        raise ValueError(f"{label}: give exactly one of {list(SIDES)}")
+    kind = given[0]
+    if kind == "request":
+        return kind, estimate(dict(side["request"]))
+    if kind == "result":
+        return kind, _check_result(side["result"], label)
+    if sessions is None:
+        raise ValueError(f"{label}: sessions are not available")
+    # 未知・期限切れのセッションは KeyError（API では 404）
+    return "session", sessions.get(side["session_id"])["result"]
+
+
+def _inputs(result: Dict[str, Any]) -> Dict[str, Any]:
+    return {name: result[section].get(key) for name, section, key in INPUT_PATHS}
+
+
+def _phase_costs(plan: EstimatePlan, inputs: Dict[str, Any]) -> Tuple[int, int]:
+    # 入力項目名は input_echo / bs_input から取り出した名前 = リクエストのキー（項目は解決済みキーのまま渡す）
+    return plan.kernel((), PHASE_VALUES)(inputs)
+
+
+def _figures(result: Dict[str, Any], p2_cost: int, p3_cost: int) -> Dict[str, Any]:
+    pa = result["profit_analysis"]
+    md = result["man_days"]
+    sales, cogs = pa["sales"], pa["cogs"]
+    return {
+        "estimated_amount": sales,
+        "cogs": cogs,
+        "labor_cost": cogs - p2_cost - p3_cost,
+        "phase2_cost": p2_cost,
+        "phase3_cost": p3_cost,
+        "gross_profit": pa["gross_profit"],
+        "sga_cost": pa["sga_cost"],
+        "operating_profit": pa["operating_profit"],
+        # 表示用の "12.3%" ではなく main_logic と同じ式で数値に戻す（丸めた値で比較する）
+        "operating_margin": round(pa["operating_profit"] / sales, 4) if sales > 0 else 0.0,
+        "suggested_price": pa["suggested_price_to_attain_target"],
+        "man_days.development_total": md["development_total"],
+        "man_days.fp_based": md["fp_based"],
+        "man_days.feature_based": md["feature_based"],
+    }
+
+
+def _input_change(name: str, before: Any, after: Any) -> Dict[str, Any]:
+    if name in LIST_INPUTS and isinstance(before or [], list) and isinstance(after or [], list):
+        old, new = before or [], after or []
+        return {"added": [x for x in new if x not in old], "removed": [x for x in old if x not in new]}
+    return {"before": before, "after": after}
+
+
+def diff_estimates(base: Dict[str, Any], revised: Dict[str, Any],
+                   estimate: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+                   sessions: Any = None) -> Dict[str, Any]:
+    """2つの見積（リクエスト / 結果 / セッション）を比較し、変わった項目と原因の入力項目を返す。
+
+    estimate: リクエストを結果にする関数（既定は dify_logic.estimate。API はメモを渡す）
+    """
+    if estimate is None:
+        estimate = lambda kwargs: dify_logic.estimate(**kwargs)  # noqa: E731
+    base_kind, before = resolve_side(base, "base", estimate, sessions)
+    revised_kind, after = resolve_side(revised, "revised", estimate, sessions)
+
+    old_inputs, new_inputs = _inputs(before), _inputs(after)
+    changed = {name for name in old_inputs if old_inputs[name] != new_inputs[name]}
+    plan = dify_logic.PLAN
+    deps = plan.dependencies()
+    old_phase = _phase_costs(plan, old_inputs)
+    if changed.isdisjoint(deps["p2_cost"] | deps["p3_cost"]):
+        new_phase = old_phase
+    else:
+        new_phase = _phase_costs(plan, new_inputs)
+    old_figures = _figures(before, *old_phase)
+    new_figures = old_figures if after is before else _figures(after, *new_phase)
+    causes = field_causes(plan)
+
+    changes: Dict[str, Dict[str, Any]] = {}
+    for name, _ in FIELDS:
+        old, new = old_figures[name], new_figures[name]
+        if old == new:
+            continue
+        entry: Dict[str, Any] = {"before": old, "after": new}
+        if name == "operating_margin":
+            entry["delta"] = round(new - old, 4)
+        else:
+            entry["delta"] = round(new - old, 1) if isinstance(new - old, float) else new - old
+            entry["ratio"] = round(new / old - 1.0, 4) if old else None
+        # 依存しない入力の変化は原因に含めない。空なら入力以外（設定の版など）の違い
+        entry["caused_by"] = [cause for cause in causes[name] if cause in changed]
+        changes[name] = entry
+
+    ordered = sorted(changed, key=INPUT_ORDER.__getitem__)
+    return {
+        "status": "success",
+        "sources": {"base": base_kind, "revised": revised_kind},
+        "changed_inputs": {name: _input_change(name, old_inputs[name], new_inputs[name]) for name in ordered},
+        "changes": changes,
+        "unchanged": len(FIELDS) - len(changes),
+    }
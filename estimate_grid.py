@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+感度分析グリッド（What-if）
+- ベース入力に対し、係数軸（complexity / duration / dev_type / target_platform / estimation_profile）と
+  規模軸（screen_count / table_count）の直積を一括評価する
+- 各軸が影響する計算段（FP工数 → 工数・原価 → 売価）ごとに低次元の列を先に作り、
+  最終段だけを全セルに展開する（セルごとの main_logic 呼び出しはしない）
+- 各段は列版の部分評価関数（PLAN.kernel(..., columns=...)）を1回呼ぶ。numpy は使わず、行ごとの計算は
+  生成コードの Python ループで行う（最終段は全セル分回るので、時間はセル数に比例する。5760 セルで数 ms）
+- 係数と各段の式は評価プラン（PLAN.kernel の部分評価関数）から取り出す。式の写しは持たないため、
+  各セルは個別評価の結果と一致する
+"""
+
+from itertools import product
+from typing import Any, Dict, List, Optional
+
+from dify_assets.code import estimate_logic as dify_logic
+
+# 出力の軸順（行優先で平坦化）。計算段の順に並べる
+GRID_AXES = (
+    "estimation_profile", "screen_count", "table_count",
+    "complexity", "dev_type",
+    "target_platform", "duration",
+)
+
+CONFIG_AXES = {
+    "complexity": "difficulty_multipliers",
+    "duration": "duration_multipliers",
+    "dev_type": "dev_type_multipliers",
+    "target_platform": "platform_multipliers",
+    "estimation_profile": "estimation_profiles",
+}
+
+MAX_GRID_CELLS = 200000
+
+# 段2（工数・原価）に引数で渡す中間値
+STAGE2_GIVEN = ("fp_days", "feature_days", "diff", "dt_design", "dt_dev",
+                "p2_base", "p3_cost", "indirect_per_hour", "sga_rate")
+
+
+def _axis_values(name: str, requested: Optional[List[Any]]) -> List[Any]:
+    if name in CONFIG_AXES:
+        allowed = list(dify_logic.CONFIG[CONFIG_AXES[name]].keys())
+        if not requested:
+            return allowed
+        unknown = [v for v in requested if v not in allowed]
+        if unknown:
+            raise ValueError(f"Unknown {name} values: {unknown} (allowed: {allowed})")
+        return list(dict.fromkeys(requested))
+    if not requested:
+        raise ValueError(f"{name} axis requires explicit values")
+    values = []
+    for v in requested:
+        n = dify_logic.parse_int(v)
+        if n is None or n < 0:
+            raise ValueError(f"Invalid {name} value: {v!r}")
+        values.append(n)
+    return list(dict.fromkeys(values))
+
+
+def sensitivity_grid(base: Dict[str, Any], axes: Dict[str, Optional[List[Any]]]) -> Dict[str, Any]:
+    """base（Dify形式の入力）に axes の直積を適用し、金額・工数・営業利益率の行列を返す。"""
+    unknown_axes = [a for a in axes if a not in GRID_AXES]
+    if unknown_axes:
+        raise ValueError(f"Unknown axes: {unknown_axes} (allowed: {list(GRID_AXES)})")
+
+    req_body = dify_logic.prepare_args(base)
+    plan = dify_logic.PLAN
+    c = plan.evaluate(req_body, req_body.get('tables', []))
+
+    # 軸ごとの値（スイープしない軸はベース値1点。既定値・正規化は評価プランのもの）
+    base_values = {
+        "complexity": c.complexity,
+        "duration": c.duration,
+        "dev_type": c.dev_type,
+        "target_platform": c.target_platform,
+        "estimation_profile": c.profile_key,
+        "screen_count": c.screen_count,
+        "table_count": c.table_count,
+    }
+    values = {
+        name: _axis_values(name, axes[name]) if name in axes else [base_values[name]]
+        for name in GRID_AXES
+    }
+    shape = [len(values[name]) for name in GRID_AXES]
+    cells = 1
+    for n in shape:
+        cells *= n
+    if cells > MAX_GRID_CELLS:
+        raise ValueError(f"Grid too large: {cells} cells (max {MAX_GRID_CELLS})")
+
+    # 軸値 → 係数（評価プランの表引きだけを取り出した部分評価関数で求める）
+    def coefficients(name: str, output: Any) -> List[Any]:
+        lookup = plan.kernel((), output)
+        return [lookup({name: v}) for v in values[name]]
+
+    prod = coefficients("estimation_profile", "prod")
+    diff = coefficients("complexity", "diff")
+    dev_types = coefficients("dev_type", ("dt_design", "dt_dev"))
+    plat = coefficients("target_platform", "plat")
+    dur = coefficients("duration", "dur")
+
+    # 各段は評価プランの列版の部分評価関数（段ごとに1回の呼び出しで全行を計算する。ループは生成コードの中の1本だけ）。
+    # 軸に依存しない値（機能工数・Phase2/3・部門単金）はベースの評価結果を渡す
+    fp_stage = plan.kernel(("screen_count", "table_count", "prod"), "fp_days",
+                           ("screen_count", "table_count", "prod"))
+    cost_stage = plan.kernel(STAGE2_GIVEN, ("dev_total", "cogs", "sga"), ("fp_days", "diff", "dt_design", "dt_dev"))
+    price_stage = plan.kernel(("cogs", "sga", "plat", "dur"), ("final", "operating_margin"),
+                              ("cogs", "sga", "plat", "dur"))
+    feature_days, p2_base, p3_cost = c.feature_days, c.p2_base, c.p3_cost
+    indirect_per_hour, sga_rate = c.indirect_per_hour, c.sga_rate
+
+    # 段1: (profile, screen, table) → FP工数
+    p_col, s_col, t_col = zip(*product(prod, values["screen_count"], values["table_count"]))
+    fp_days = fp_stage(req_body, s_col, t_col, p_col)
+
+    # 段2: (+ complexity, dev_type) → 開発工数・原価・販管費
+    fp_col, d_col, dev_col = zip(*product(fp_days, diff, dev_types))
+    design_col, dev_mult_col = zip(*dev_col)
+    stage2 = cost_stage(req_body, fp_col, feature_days, d_col, design_col, dev_mult_col,
+                        p2_base, p3_cost, indirect_per_hour, sga_rate)
+
+    # 段3: (+ platform, duration) → 売価・営業利益率
+    n_tail = len(plat) * len(dur)
+    cogs_col, sga_col, plat_col, dur_col = zip(*[(cogs, sga, pl, du) for _, cogs, sga in stage2
+                                                 for pl in plat for du in dur])
+    stage3 = price_stage(req_body, cogs_col, sga_col, plat_col, dur_col)
+    amounts: List[int] = [final for final, _ in stage3]
+    margins: List[float] = [round(margin, 4) for _, margin in stage3]
+    man_days: List[float] = [days for days in (round(dev_total, 1) for dev_total, _, _ in stage2)
+                             for _ in range(n_tail)]
+
+    return {
+        "status": "success",
+        "axes": [{"name": name, "values": values[name]} for name in GRID_AXES],
+        "shape": shape,
+        "cells": cells,
+        "order": "row-major",
+        "estimated_amount": amounts,
+        "man_days": man_days,
+        "operating_margin": margins,
+    }
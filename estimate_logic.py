@@ -2,6 +2,8 @@
 import json
 import math
 
+from estimate_engine import compile_ruleset
+
 # ==============================================================================
 # CONFIGURATION: FY2026 BS事業部 財務・生産性基準 (Certified V2.1 - Dify Optimized)
 # ==============================================================================
@@ -52,84 +54,71 @@ BS_ORG_CONFIG = {
     "ソリューションビジネス推進室": {"indirect_h": 3570, "sga_on_propa_labor_rate": 1.415},
 }
 
-def calculate_profitability_ccs(total_price, cogs, direct_labor_cost, sga_rate_on_labor, target_margin_input):
-    total_sga = int(direct_labor_cost * sga_rate_on_labor)
-    operating_profit = total_price - cogs - total_sga
-    operating_margin = (operating_profit / total_price) if total_price > 0 else 0.0
-    suggested_price = 0
-    if target_margin_input is not None:
-        denom = 1.0 - target_margin_input
-        if denom > 0: suggested_price = int((cogs + total_sga) / denom)
-    return {
-        "sales": total_price, "cogs": cogs, "operating_profit": operating_profit,
-        "operating_margin": f"{operating_margin:.1%}", "total_sga_cost": total_sga,
-        "sga_rate_applied": f"{sga_rate_on_labor:.1%}", "suggested_price_to_attain_target": suggested_price
-    }
-
-def main_logic(req_body):
-    config = CONFIG
-    # Dify UI変数 (profile / estimation_profile 両対応)
-    profile_key = req_body.get('profile') or req_body.get('estimation_profile') or 'standard'
-    screen_count = int(req_body.get('screen_count') or 0)
-    table_count = int(req_body.get('table_count') or 0)
-    dept_name = req_body.get('department') or "ビジネスイノベーション事業部共通"
+DEFAULT_DEPT = "ビジネスイノベーション事業部共通"
 
+# 計算式の宣言（estimate_engine で評価プランにコンパイル）
+RULESET = {
+    "name": CONFIG["config_version"],
+    "axes": [
+        # Dify UI変数 (profile / estimation_profile 両対応)
+        {"name": "profile", "keys": ["profile", "estimation_profile"], "default": "standard",
+         "table": CONFIG["estimation_profiles"], "fallback": CONFIG["estimation_profiles"]["standard"]},
+        {"name": "complexity", "mode": "get", "default": "medium",
+         "table": CONFIG["difficulty_multipliers"], "fallback": 1.0},
+    ],
+    "size": {
+        "screen_count": {"mode": "int_or", "default": 0},
+        "table_count": {"mode": "int_or", "default": 0},
+    },
+    # features はリスト または カンマ区切り文字列
+    "items": [
+        {"group": "features", "key": "features", "resolver": "text", "table": FEATURE_MAN_DAYS},
+    ],
+    "effort": {
+        "model": "fp_simplified",
+        "screen_weight": CONFIG["fp_weights"]["screen"],
+        "table_weight": CONFIG["fp_weights"]["table"],
+    },
+    "cost": {
+        "model": "bs_labor",
+        "rank_costs": CONFIG["profit_config"]["rank_costs"],
+        "standard_team_ratio": CONFIG["profit_config"]["standard_team_ratio"],
+        "org_rates": {d: (c["indirect_h"], c["sga_on_propa_labor_rate"]) for d, c in BS_ORG_CONFIG.items()},
+        "default_department": DEFAULT_DEPT,
+        "buffer": CONFIG["buffer_multiplier"],
+    },
     # target_margin 文字列パース (e.g. "15%" -> 0.15)
-    target_margin_raw = req_body.get('target_margin')
-    target_margin = None
-    if isinstance(target_margin_raw, str) and target_margin_raw.strip():
-        try:
-            v = target_margin_raw.replace('%', '').strip()
-            num = float(v)
-            target_margin = num / 100.0 if num > 1.0 else num
-        except:
-            target_margin = None
-    elif isinstance(target_margin_raw, (int, float)):
-        target_margin = float(target_margin_raw)
-
-    # features パース (リスト または カンマ区切り文字列)
-    features_raw = req_body.get('features') or []
-    if isinstance(features_raw, str):
-        features = [f.strip() for f in features_raw.split(',') if f.strip()]
-    else:
-        features = features_raw
-
-    dept_cfg = BS_ORG_CONFIG.get(dept_name, BS_ORG_CONFIG["ビジネスイノベーション事業部共通"])
-    selected_profile = config["estimation_profiles"].get(profile_key, config["estimation_profiles"]["standard"])
-    prod_factor = selected_profile["productivity_factor"]
+    "profit": {"model": "sga_on_labor", "target_margin": "parse"},
+}
 
-    total_fp = (screen_count * config["fp_weights"]["screen"]) + (table_count * config["fp_weights"]["table"])
-    dev_fp_days = total_fp * prod_factor
-    dev_feature_days = sum(FEATURE_MAN_DAYS.get(f, 0) for f in features)
-    
-    dev_base_days = (dev_fp_days + dev_feature_days)
-    dev_total_days = dev_base_days * config["difficulty_multipliers"].get(req_body.get('complexity', 'medium'), 1.0)
+PLAN = compile_ruleset(RULESET)
 
-    rank_costs = config["profit_config"]["rank_costs"]
-    team_ratio = config["profit_config"]["standard_team_ratio"]
-    man_months = dev_total_days / 20.0
-    direct_labor_cost = int(man_months * sum(rank_costs.get(r, 0) * w for r, w in team_ratio.items()))
-    indirect_cost = int(dev_total_days * 8.0 * dept_cfg["indirect_h"])
-    cogs = direct_labor_cost + indirect_cost
+def main_logic(req_body):
+    c = PLAN.evaluate(req_body)
+    nominal_price = c.final
+    target_margin = c.target_margin
+    selected_profile = c.profile
 
-    nominal_price = int(cogs * config["buffer_multiplier"])
-    profit_analysis = calculate_profitability_ccs(nominal_price, cogs, direct_labor_cost, dept_cfg["sga_on_propa_labor_rate"], target_margin)
-    
+    profit_analysis = {
+        "sales": nominal_price, "cogs": c.cogs, "operating_profit": c.operating_profit,
+        "operating_margin": f"{c.operating_margin:.1%}", "total_sga_cost": c.sga,
+        "sga_rate_applied": f"{c.sga_rate:.1%}", "suggested_price_to_attain_target": c.suggested_price
+    }
     estimated_range = { "min": int(nominal_price * 0.85), "max": int(nominal_price * 1.15) }
 
     return {
-        "status": "success", "estimated_amount": nominal_price, "total_man_days": round(dev_total_days, 1),
+        "status": "success", "estimated_amount": nominal_price, "total_man_days": round(c.dev_total, 1),
         "estimated_range": f"¥{estimated_range['min']:,} 〜 ¥{estimated_range['max']:,}",
         "profile": selected_profile["label"], "profile_description": selected_profile["description"],
         "profit_analysis": profit_analysis,
         "input_echo": {
-            "profile": selected_profile["label"], "department": dept_name, "screen_count": screen_count,
-            "table_count": table_count, "features": features, "complexity": req_body.get('complexity', 'medium'),
+            "profile": selected_profile["label"], "department": c.department, "screen_count": c.screen_count,
+            "table_count": c.table_count, "features": c.features, "complexity": c.complexity,
             "target_margin": f"{target_margin*100:.1f}%" if target_margin is not None else "未指定"
         },
         "details": {
-            "direct_labor": direct_labor_cost, "indirect_cost": indirect_cost, "total_fp": total_fp,
-            "fp_days": round(dev_fp_days, 1), "feature_days": round(dev_feature_days, 1)
+            "direct_labor": c.direct_labor, "indirect_cost": c.indirect, "total_fp": c.fp_total,
+            "fp_days": round(c.fp_days, 1), "feature_days": round(c.feature_days, 1)
         }
     }
 
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+/calculate のメモ化（見積は入力と設定だけで決まる純粋関数）
+- 正規化キー: prepare_args 後の入力を、評価プランが読む項目だけに絞って正規化する
+    機能/Phase2/Phase3 : ラベル索引で項目キーに解決し、重複排除してソート（未解決ラベルは計算に効かないため含めない）
+    カテゴリ軸         : 未指定/空は既定値（評価プランと同じ `or 既定値`）。規模は None を既定値に
+    team_ratio / dept_allocation : 合計の演算順に効くため順序を保持。dict/list 以外は未指定扱い
+    数値は型も区別する（1 と 1.0 はエコーの表記が変わるため）。profile・tables 等の計算に使わない項目は含めない
+- エントリは評価した評価プラン（dify_logic.PLAN）ごと。プランが差し替わったら（設定の再読込・再コンパイル）全エントリを破棄する
+- ヒット時は input_echo の項目リスト・tables と unresolved_items だけをリクエストのものに差し替える
+  （それ以外の値は項目の入力順・重複・表記ゆれに依存しない）。input_errors もリクエストごとに付け直す
+- 返す結果は常に入れ子の区画まで複製したもの（呼び出し側が書き換えても共有エントリは変わらない）
+- 件数上限つき LRU + TTL（ESTIMATE_MEMO_SIZE / ESTIMATE_MEMO_TTL、件数 0 で無効）。ヒット率・件数は metrics に出す
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from dify_assets.code import estimate_logic as dify_logic
+from estimate_engine import EstimatePlan
+from metrics import MEMO_ENTRIES, MEMO_HIT_RATIO, MEMO_LOOKUPS
+
+RULESET = dify_logic.RULESET
+AXIS_DEFAULTS = tuple(((spec.get("keys") or [spec["name"]])[0], spec["default"]) for spec in RULESET["axes"])
+SIZE_DEFAULTS = tuple((spec.get("key", name), spec.get("default", 0)) for name, spec in RULESET["size"].items())
+ITEM_INDEXES = tuple((spec["key"], spec["index"]) for spec in RULESET["items"])
+# 評価プランがそのまま読む項目（正規化なし）
+PLAIN_KEYS = ("department", "confidence", "target_margin")
+
+
+def _integral(value: Any) -> bool:
+    return isinstance(value, int) or float(value).is_integer()
+
+
+# 項目の工数・費用が整数値なら合計は加算順に依存しない（浮動小数の丸め誤差が出ない）ので、項目キーをソートできる
+SORT_ITEMS = all(_integral(v) for v in dify_logic.FEATURE_MAN_DAYS.values()) \
+    and all(_integral(v) for v in dify_logic.PHASE2_ITEMS.values()) \
+    and all(_integral(v["fixed"]) for v in dify_logic.PHASE3_ITEMS.values())
+
+
+def _freeze(value: Any) -> Any:
+    """順序を保ったままハッシュ可能にする（数値は型付き）"""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        return ("dict",) + tuple((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return ("list",) + tuple(_freeze(v) for v in value)
+    return (type(value).__name__, value)
+
+
+def canonical_key(args: Dict[str, Any]) -> Tuple[Tuple, Dict[str, Any]]:
+    """prepare_args（validate_args）済みの入力 → (正規化キー, ヒット時に差し替えるリクエスト固有の値)"""
+    key = []
+    for name, default in AXIS_DEFAULTS:
+        key.append(args.get(name) or default)
+    for name, default in SIZE_DEFAULTS:
+        value = args.get(name)
+        key.append(_freeze(default if value is None else value))
+    items: Dict[str, Any] = {}
+    unresolved: Dict[str, Any] = {}
+    for name, index in ITEM_INDEXES:
+        items[name], unresolved[name] = index.resolve(args.get(name, []))
+        key.append(tuple(sorted(items[name]) if SORT_ITEMS else items[name]))
+    team_ratio = args.get("team_ratio")
+    key.append(_freeze(team_ratio) if isinstance(team_ratio, dict) else None)
+    allocation = args.get("dept_allocation")
+    key.append(_freeze(allocation) if isinstance(allocation, list) else None)
+    for name in PLAIN_KEYS:
+        key.append(_freeze(args.get(name)))
+    return tuple(key), {"items": items, "unresolved": unresolved, "tables": args.get("tables", [])}
+
+
+_NESTED = (dict, list)
+
+
+def _copy(value: Any) -> Any:
+    # 結果は JSON 相当（dict / list / スカラー）なので、copy.deepcopy より軽い再帰で複製する（スカラーは呼び出さない）
+    if type(value) is dict:
+        return {k: _copy(v) if type(v) in _NESTED else v for k, v in value.items()}
+    return [_copy(v) if type(v) in _NESTED else v for v in value]
+
+
+def _personalize(result: Dict[str, Any], request: Dict[str, Any]) -> Dict[str, Any]:
+    # 共有エントリは変更しない（入れ子の区画まで複製してから差し替える）
+    result = _copy(result)
+    echo = result["input_echo"]
+    echo["tables"] = request["tables"]
+    for name, keys in request["items"].items():
+        echo[name] = keys
+    result["unresolved_items"] = request["unresolved"]
+    return result
+
+
+class EstimateMemo:
+    def __init__(self, max_entries: int = 1024, ttl: float = 600.0):
+        self.max_entries = max_entries  # 0以下なら無効
+        self.ttl = ttl  # 0以下なら無期限
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._plan: Optional[EstimatePlan] = None
+        self.stats = {"hits": 0, "misses": 0, "bypassed": 0, "evictions": 0, "expired": 0, "invalidations": 0}
+
+    @classmethod
+    def from_env(cls) -> "EstimateMemo":
+        return cls(
+            max_entries=int(os.getenv("ESTIMATE_MEMO_SIZE", "1024")),
+            ttl=float(os.getenv("ESTIMATE_MEMO_TTL", "600")),
+        )
+
+    def _publish(self) -> None:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        MEMO_ENTRIES.set(len(self._entries))
+        MEMO_HIT_RATIO.set(self.stats["hits"] / lookups if lookups else 0.0)
+
+    def _lookup(self, key: Tuple, plan: EstimatePlan) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            if plan is not self._plan:
+                # 評価プランが差し替わったら全件破棄
+                if self._entries:
+                    self.stats["invalidations"] += 1
+                self._entries.clear()
+                self._plan = plan
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self.ttl <= 0 or now - entry[0] <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    self._publish()
+                    return entry[1]
+                del self._entries[key]
+                self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            self._publish()
+            return None
+
+    def _store(self, key: Tuple, plan: EstimatePlan, result: Dict[str, Any]) -> None:
+        with self._lock:
+            if plan is not self._plan:
+                return
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+            self._publish()
+
+    def estimate(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """dify_logic.estimate(**kwargs) と同じ結果を返す（同値な入力は2回目以降キャッシュから）。"""
+        observe = dify_logic._stage_observer
+        started = time.perf_counter()
+        args, errors = dify_logic.validate_args(kwargs)
+        if observe is not None:
+            observe("parse", time.perf_counter() - started)
+        if self.max_entries <= 0:
+            return dify_logic.with_input_errors(dify_logic.main_logic(args, args.get('tables', [])), errors)
+
+        try:
+            key, request = canonical_key(args)
+            hash(key)
+        except TypeError:
+            # ハッシュできない入力（想定外の型）はキャッシュせずに計算する
+            with self._lock:
+                self.stats["bypassed"] += 1
+            MEMO_LOOKUPS.inc(("bypass",))
+            return dify_logic.with_input_errors(dify_logic.main_logic(args, args.get('tables', [])), errors)
+
+        # main_logic が評価するプラン（キーの一部。差し替えの前後で結果を混ぜない）
+        plan = dify_logic.PLAN
+        cached = self._lookup(key, plan)
+        if cached is not None:
+            MEMO_LOOKUPS.inc(("hit",))
+            return dify_logic.with_input_errors(_personalize(cached, request), errors)
+        MEMO_LOOKUPS.inc(("miss",))
+        result = dify_logic.main_logic(args, args.get('tables', []))
+        self._store(key, plan, result)
+        # 共有エントリは返さない。input_errors はリクエスト固有なので共有エントリには入れない
+        return dify_logic.with_input_errors(_copy(result), errors)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self.stats)
+            lookups = data["hits"] + data["misses"]
+            data["hit_ratio"] = round(data["hits"] / lookups, 4) if lookups else 0.0
+            data["entries"] = len(self._entries)
+            data["max_entries"] = self.max_entries
+            data["ttl"] = self.ttl
+            data["config_version"] = dify_logic.CONFIG["config_version"] if self._plan is not None else None
+            return data
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            for name in self.stats:
+                self.stats[name] = 0
+            self._publish()
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+CPU 負荷の高い見積ジョブ（/calculate/batch・grid・solve・simulate）のプロセスプール実行
+- アプリの lifespan で start() / shutdown() する。start() はワーカーの起動（評価プランと設定スナップショットの
+  読み込み）をバックグラウンドで始めるだけで、完了を待たない（アプリの起動を遅らせない）。shutdown() は
+  ワーカーの終了待ちをスレッドで行う（イベントループを止めない）
+- ワーカー数は ESTIMATE_POOL_WORKERS（既定 0 = 無効。auto で CPU コア数）。プロセスの起動と受け渡しの費用が
+  かかるため明示的に有効にした場合だけ使う。無効時や start() 前はスレッド（asyncio.to_thread）で計算する
+  （GIL があるので並列にはならないが、計算中もイベントループが他のリクエストを処理できる）
+- バッチは chunk ずつワーカーに配り（ESTIMATE_POOL_CHUNK、既定 256 件。ワーカー数で均等割りした方が小さければそちら）、
+  入力順に結合して返す。ESTIMATE_POOL_MIN_BATCH 件未満はプロセス間の受け渡しの方が高くつくので呼び出し元で計算する
+- ワーカーは spawn で起動する（uvicorn のスレッドや開いた接続を fork で引き継がない）
+- ワーカーが異常終了したプールは作り直し、その呼び出しはエラーにする
+- multiprocessing は start() まで import しない（プール無効時・function_app の起動時間に載せない）
+"""
+
+import asyncio
+import logging
+import math
+import os
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
+
+from config_snapshot import shared_store
+from dify_assets.code import estimate_logic as dify_logic
+from estimate_batch import main_batch
+from metrics import POOL_TASKS, POOL_WORKERS
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_CHUNK_SIZE = 256
+DEFAULT_MIN_BATCH = 64
+
+
+def _warm_up(ready: Any = None) -> None:
+    # ワーカーの initializer: 評価プランを1回通し、シミュレーション用の設定スナップショットを読み込んでおく
+    main_batch([{}])
+    dify_logic.main_logic(dify_logic.prepare_args({}), [])
+    shared_store().get()
+    if ready is not None:
+        ready.put(os.getpid())
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+def _workers_from_env() -> int:
+    value = os.getenv("ESTIMATE_POOL_WORKERS", "0").strip().lower()
+    if value == "auto":
+        return os.cpu_count() or 1
+    return int(value or "0")
+
+
+class EstimatePool:
+    def __init__(self, workers: int = 0, chunk_size: int = DEFAULT_CHUNK_SIZE, min_batch: int = DEFAULT_MIN_BATCH):
+        self.workers = workers  # 0以下なら無効
+        self.chunk_size = max(1, chunk_size)
+        self.min_batch = min_batch
+        self._executor: Optional["ProcessPoolExecutor"] = None
+        self._warming: Optional["asyncio.Future[None]"] = None
+        self.pids: List[int] = []
+        self.stats = {"pool_tasks": 0, "thread_tasks": 0, "inline_tasks": 0, "chunks": 0, "restarts": 0}
+
+    @classmethod
+    def from_env(cls) -> "EstimatePool":
+        return cls(
+            workers=_workers_from_env(),
+            chunk_size=int(os.getenv("ESTIMATE_POOL_CHUNK", str(DEFAULT_CHUNK_SIZE))),
+            min_batch=int(os.getenv("ESTIMATE_POOL_MIN_BATCH", str(DEFAULT_MIN_BATCH))),
+        )
+
+    @property
+    def running(self) -> bool:
+        return self._executor is not None
+
+    def _create(self, ready: Any = None) -> "ProcessPoolExecutor":
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_warm_up, initargs=(ready,))
+
+    async def start(self) -> None:
+        """プールを作り、全ワーカーの起動（initializer）をバックグラウンドで始める。起動の完了は待たない。"""
+        if self.workers <= 0 or self._executor is not None:
+            return
+        import multiprocessing
+        ready = multiprocessing.get_context("spawn").SimpleQueue()
+        self._executor = self._create(ready)
+        self._warming = asyncio.ensure_future(self._warm(self._executor, ready))
+        POOL_WORKERS.set(self.workers)
+
+    async def _warm(self, executor: "ProcessPoolExecutor", ready: Any) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            # 空きワーカーが無い間は submit ごとにプロセスが増えるので、workers 個投げれば全員が起動する。
+            # 各ワーカーは initializer の最後に pid を ready に入れる
+            await asyncio.gather(*(loop.run_in_executor(executor, _ping) for _ in range(self.workers)))
+            pids = [await asyncio.to_thread(ready.get) for _ in range(self.workers)]
+        except Exception as e:
+            # 起動に失敗したワーカーは最初の submit で BrokenProcessPool になり、そこでプールを作り直す
+            logging.warning(f"Estimate pool warm-up failed: {e!r}")
+            return
+        ready.close()
+        if self._executor is executor:
+            self.pids = sorted(pids)
+
+    async def wait_ready(self) -> None:
+        """バックグラウンドのワーカー起動が終わるまで待つ（起動済み・無効なら何もしない）。"""
+        if self._warming is not None:
+            await self._warming
+
+    async def shutdown(self) -> None:
+        executor, self._executor = self._executor, None
+        warming, self._warming = self._warming, None
+        if warming is not None and not warming.done():
+            warming.cancel()
+        if executor is not None:
+            # ワーカーの終了待ちはブロックするのでスレッドで行う
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+        self.pids = []
+        POOL_WORKERS.set(0)
+
+    async def _submit(self, job: str, fn: Callable[..., Any], *args: Any) -> Any:
+        from concurrent.futures.process import BrokenProcessPool
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            return await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # ワーカーが落ちたプールは以後使えないので作り直す（ワーカーは次の submit で起動する）。
+            # 同じプールの他のチャンクも失敗するので、作り直すのは最初の1回だけ
+            if self._executor is executor:
+                self._executor = self._create()
+                executor.shutdown(wait=False, cancel_futures=True)
+                self.stats["restarts"] += 1
+            raise
+        finally:
+            POOL_TASKS.inc((job, "pool"))
+
+    async def _in_thread(self, job: str, fn: Callable[..., Any], *args: Any) -> Any:
+        # プール無効時: イベントループを止めないようにスレッドで計算する
+        self.stats["thread_tasks"] += 1
+        POOL_TASKS.inc((job, "thread"))
+        return await asyncio.to_thread(fn, *args)
+
+    async def run(self, job: str, fn: Callable[..., Any], *args: Any) -> Any:
+        """fn(*args) をワーカーで実行する（プール無効時はスレッドで実行）。fn と引数は pickle できること。"""
+        if self._executor is None:
+            return await self._in_thread(job, fn, *args)
+        self.stats["pool_tasks"] += 1
+        return await self._submit(job, fn, *args)
+
+    def _chunk_size(self, n: int) -> int:
+        return max(1, min(self.chunk_size, math.ceil(n / self.workers)))
+
+    async def map_chunks(self, job: str, fn: Callable[[List[Any]], List[Any]], items: List[Any]) -> List[Any]:
+        """items をチャンクに分けて fn(chunk) をワーカーで並列に実行し、結果を入力順に結合して返す。"""
+        if self._executor is None:
+            return await self._in_thread(job, fn, items)
+        if len(items) < max(2, self.min_batch):
+            self.stats["inline_tasks"] += 1
+            POOL_TASKS.inc((job, "inline"))
+            return fn(items)
+        size = self._chunk_size(len(items))
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        self.stats["pool_tasks"] += 1
+        self.stats["chunks"] += len(chunks)
+        parts = await asyncio.gather(*(self._submit(job, fn, chunk) for chunk in chunks))
+        return [result for part in parts for result in part]
+
+    def snapshot(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = dict(self.stats)
+        data.update({"running": self.running, "workers": self.workers if self.running else 0,
+                     "pids": list(self.pids), "chunk_size": self.chunk_size, "min_batch": self.min_batch})
+        return data
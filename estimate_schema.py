@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+見積入力のスキーマ駆動パース（Dify の文字列入力 / API の型付き入力で共通）
+- 項目ごとの変換器（coercer）をスキーマ定義から起動時に1回だけ組み立てる。区切り文字の正規表現・照合辞書・
+  既定値は変換器に束縛済みで、同じ文字列入力のパース結果は LRU でキャッシュする
+- 変換器は value -> (変換後の値, エラー) を返す。変換できない値は従来どおり既定値（None / 空 / 既定の比率）にしつつ、
+  黙って捨てずに FieldError（項目名・コード・メッセージ・元の値）として返す
+- 受け付ける表記
+    数値       : "12" / "１２"（全角数字） / 12.0
+    利益率     : 0.15 / "15%" / "１５％" / "0.15"（1 を超える値は百分率とみなす）
+    リスト     : ["a", "b"] / "a, b\\nc"（改行・カンマ・全角カンマ・読点区切り。なし/未定 等のプレースホルダーは除く）
+    比率       : "Rank3:0.8, Rank2:0.2" / "Rank3：８０％\\nrank2: 20%"（区切り混在可。合計 1 に正規化）
+    部門配分   : "ＤＴ第１開発部: 0.6\\nDT第2開発部: 0.4"（部門名は表記ゆれも照合。合計 1 に正規化）
+- Dify 側へ配置する場合は estimate_engine.py と併せてこのファイルも配置すること
+"""
+
+import math
+import re
+import unicodedata
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from estimate_engine import normalize_label
+
+# (コード, メッセージ, 元の値)
+Issue = Tuple[str, str, Any]
+Coercer = Callable[[Any], Tuple[Any, Tuple[Issue, ...]]]
+
+NO_ISSUES: Tuple[Issue, ...] = ()
+PLACEHOLDERS = ('なし', '未定', '不明', 'N/A', '-')
+
+_LIST_SEPARATORS = re.compile(r"[,\n\r，、]")
+_KEY_VALUE = re.compile(r"[:：]")
+
+
+def json_safe(value: Any) -> Any:
+    """エラーに載せる元の値: NaN / Infinity は JSON（allow_nan=False）で出力できないので、その値だけ文字列にする。"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else str(value)
+    if isinstance(value, dict):
+        return {k: json_safe(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [json_safe(v) for v in value]
+    return value
+
+
+@dataclass(frozen=True)
+class FieldError:
+    field: str
+    code: str
+    message: str
+    value: Any = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"field": self.field, "code": self.code, "message": self.message, "value": json_safe(self.value)}
+
+
+class InputValidationError(ValueError):
+    """strict な検証で FieldError があった。errors に全件を持つ。"""
+
+    def __init__(self, errors: Sequence[FieldError]):
+        self.errors = tuple(errors)
+        super().__init__("; ".join(f"{e.field}: {e.message}" for e in self.errors))
+
+
+def _nfkc(text: str) -> str:
+    # ASCII だけの文字列（大半の入力）は正規化を省く
+    return text if text.isascii() else unicodedata.normalize("NFKC", text)
+
+
+def _type_issue(value: Any, expected: str) -> Tuple[Issue, ...]:
+    return (("invalid_type", f"expected {expected}, got {type(value).__name__}", None),)
+
+
+def _number(text: str) -> Optional[float]:
+    """"0.8" / "８０％" → 数値（% 付きは 1/100）。数値でなければ None"""
+    text = _nfkc(text).strip()
+    percent = text.endswith("%")
+    if percent:
+        text = text[:-1].strip()
+    try:
+        num = float(text)
+    except ValueError:
+        return None
+    if not math.isfinite(num):
+        return None
+    return num / 100.0 if percent else num
+
+
+def text_list(placeholders: Sequence[str] = PLACEHOLDERS) -> Coercer:
+    """リスト項目: list はプレースホルダーを除いてそのまま、文字列は区切り文字で分割する。"""
+    placeholders = tuple(placeholders)
+    placeholder_set = frozenset(placeholders)
+
+    @lru_cache(maxsize=1024)
+    def from_text(text: str) -> Tuple[str, ...]:
+        return tuple(x for x in (part.strip() for part in _LIST_SEPARATORS.split(text))
+                     if x and x not in placeholders)
+
+    def coerce(value: Any) -> Tuple[Any, Tuple[Issue, ...]]:
+        if isinstance(value, str):
+            return list(from_text(value)), NO_ISSUES
+        if isinstance(value, (list, tuple)):
+            try:
+                # プレースホルダーを含まない（大半の入力）なら集合演算だけで判定してコピーを返す
+                if placeholder_set.isdisjoint(value):
+                    return list(value), NO_ISSUES
+            except TypeError:
+                pass  # ハッシュできない要素を含む
+            return [x for x in value if x not in placeholders], NO_ISSUES
+        if value is None:
+            return [], NO_ISSUES
+        return [], _type_issue(value, "a list or comma/newline separated text")
+
+    return coerce
+
+
+def integer() -> Coercer:
+    """整数項目: 数値は int に切り捨て、文字列は全角数字も解釈する。空・未指定は None。"""
+
+    def coerce(value: Any) -> Tuple[Any, Tuple[Issue, ...]]:
+        if type(value) is int or value is None:
+            return value, NO_ISSUES
+        if isinstance(value, (int, float)):
+            if isinstance(value, float) and not math.isfinite(value):
+                return None, (("invalid_int", "must be a finite number", value),)
+            return int(value), NO_ISSUES
+        if isinstance(value, str):
+            text = value.strip()
+            if not text:
+                return None, NO_ISSUES
+            try:
+                return int(_nfkc(text)), NO_ISSUES
+            except ValueError:
+                return None, (("invalid_int", f"not an integer: {value!r}", value),)
+        return None, _type_issue(value, "an integer")
+
+    return coerce
+
+
+def margin() -> Coercer:
+    """利益率: 数値はそのまま、文字列は % / 全角を解釈して 1 を超える値を百分率とみなす。空・未指定は None。"""
+
+    def coerce(value: Any) -> Tuple[Any, Tuple[Issue, ...]]:
+        if value is None:
+            return None, NO_ISSUES
+        if isinstance(value, (int, float)):
+            if isinstance(value, float) and not math.isfinite(value):
+                return None, (("invalid_margin", "must be a finite number", value),)
+            return float(value), NO_ISSUES
+        if isinstance(value, str):
+            text = _nfkc(value).replace("%", "").strip()
+            if not text:
+                return None, NO_ISSUES
+            num = _number(text)
+            if num is None:
+                return None, (("invalid_margin", f"not a margin: {value!r}", value),)
+            return (num / 100.0 if num > 1.0 else num), NO_ISSUES
+        return None, _type_issue(value, "a number or percentage text")
+
+    return coerce
+
+
+def ratio_map(allowed: Iterable[str], default: Dict[str, float]) -> Coercer:
+    """"キー:比率" の並び（カンマ・改行区切り）→ 合計 1 に正規化した dict。文字列以外はそのまま通す。
+
+    有効な比率が1つも無ければ default を返す（dict で NaN / Infinity を含む場合も）。キーは大文字小文字を区別しない。
+    """
+    keys = {key.casefold(): key for key in allowed}
+    default_items = tuple(default.items())
+
+    @lru_cache(maxsize=1024)
+    def from_text(text: str) -> Tuple[Tuple[Tuple[str, float], ...], Tuple[Issue, ...]]:
+        found: Dict[str, float] = {}
+        issues: List[Issue] = []
+        for part in _LIST_SEPARATORS.split(_nfkc(text)):
+            part = part.strip()
+            if not part:
+                continue
+            pair = _KEY_VALUE.split(part, 1)
+            if len(pair) != 2:
+                issues.append(("invalid_entry", f"expected 'key:ratio': {part!r}", part))
+                continue
+            key = keys.get(pair[0].strip().casefold())
+            num = _number(pair[1])
+            if key is None:
+                issues.append(("unknown_key", f"unknown key {pair[0].strip()!r} (expected one of {list(keys.values())})", part))
+            elif num is None or num < 0:
+                issues.append(("invalid_ratio", f"ratio must be a non-negative number: {part!r}", part))
+            else:
+                found[key] = num
+        total = sum(found.values())
+        if total <= 0:
+            if found or issues:
+                issues.append(("no_valid_entries", "no positive ratio; using the default", text))
+            return default_items, tuple(issues)
+        return tuple((key, num / total) for key, num in found.items()), tuple(issues)
+
+    def coerce(value: Any) -> Tuple[Any, Tuple[Issue, ...]]:
+        if not isinstance(value, str):
+            if isinstance(value, dict) and any(isinstance(v, float) and not math.isfinite(v) for v in value.values()):
+                return dict(default_items), (("invalid_ratio", "ratios must be finite numbers; using the default", value),)
+            return value, NO_ISSUES
+        items, issues = from_text(value)
+        return dict(items), issues
+
+    return coerce
+
+
+def allocation(known: Iterable[str]) -> Coercer:
+    """"部門:シェア" の並び（改行・カンマ区切り）→ [{"dept", "share"}]（合計 1 に正規化）。文字列以外はそのまま通す。
+
+    部門名は完全一致を先に引き、無ければ normalize_label（全角/半角・空白の表記ゆれを吸収）で照合する。
+    """
+    exact = frozenset(known)
+    normalized = {normalize_label(name): name for name in exact}
+
+    @lru_cache(maxsize=1024)
+    def from_text(text: str) -> Tuple[Tuple[Tuple[str, float], ...], Tuple[Issue, ...]]:
+        found: List[List[Any]] = []
+        issues: List[Issue] = []
+        for part in _LIST_SEPARATORS.split(text):
+            part = part.strip()
+            if not part:
+                continue
+            pair = _KEY_VALUE.split(part, 1)
+            if len(pair) != 2:
+                issues.append(("invalid_entry", f"expected 'department:share': {part!r}", part))
+                continue
+            name = pair[0].strip()
+            dept = name if name in exact else normalized.get(normalize_label(name))
+            num = _number(pair[1])
+            if dept is None:
+                issues.append(("unknown_department", f"unknown department {name!r}", part))
+            elif num is None or num <= 0:
+                issues.append(("invalid_share", f"share must be a positive number: {part!r}", part))
+            else:
+                found.append([dept, num])
+        total = sum(item[1] for item in found)
+        return tuple((dept, num / total) for dept, num in found), tuple(issues)
+
+    def coerce(value: Any) -> Tuple[Any, Tuple[Issue, ...]]:
+        if not isinstance(value, str):
+            return value, NO_ISSUES
+        items, issues = from_text(value)
+        return [{"dept": dept, "share": share} for dept, share in items], issues
+
+    return coerce
+
+
+def choice(known: Iterable[str], default: str) -> Coercer:
+    """選択肢: 未指定・空は default、未知の値は default にして unknown_value を返す（表記ゆれは照合する）。"""
+    exact = frozenset(known)
+    normalized = {normalize_label(name): name for name in exact}
+
+    def coerce(value: Any) -> Tuple[Any, Tuple[Issue, ...]]:
+        if not value:
+            return default, NO_ISSUES
+        if isinstance(value, str):
+            if value in exact:
+                return value, NO_ISSUES
+            match = normalized.get(normalize_label(value))
+            if match is not None:
+                return match, NO_ISSUES
+            return default, (("unknown_value", f"unknown value {value!r}; using {default!r}", value),)
+        return default, _type_issue(value, "text")
+
+    return coerce
+
+
+class InputSchema:
+    """項目名 → 変換器の宣言から組み立てた入力パーサー。
+
+    fields: [(項目名, 変換器, always)]。always=False の項目は入力にキーがある時だけ変換する
+    derive: 変換後の dict を受け取り、項目間の補完を行う関数（任意）
+    """
+
+    __slots__ = ("fields", "coercers", "derive", "_always", "_present")
+
+    def __init__(self, fields: Sequence[Tuple[str, Coercer, bool]],
+                 derive: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.fields = tuple(fields)
+        self.coercers = {name: coerce for name, coerce, _ in self.fields}
+        self.derive = derive
+        self._always = tuple((name, coerce) for name, coerce, always in self.fields if always)
+        self._present = tuple((name, coerce) for name, coerce, always in self.fields if not always)
+
+    def coerce(self, name: str, value: Any) -> Tuple[Any, List[FieldError]]:
+        """1項目だけ変換する（API のフィールド検証用）。"""
+        value, issues = self.coercers[name](value)
+        return value, [FieldError(name, *issue) for issue in issues]
+
+    def validate(self, data: Dict[str, Any]) -> Tuple[Dict[str, Any], List[FieldError]]:
+        """入力 dict → (変換後の dict, FieldError のリスト)。入力は変更しない。"""
+        args = dict(data)
+        errors: List[FieldError] = []
+        get = args.get
+        for name, coerce in self._always:
+            value, issues = coerce(get(name))
+            args[name] = value
+            if issues:
+                errors.extend(FieldError(name, *issue) for issue in issues)
+        for name, coerce in self._present:
+            if name in args:
+                value, issues = coerce(args[name])
+                args[name] = value
+                if issues:
+                    errors.extend(FieldError(name, *issue) for issue in issues)
+        if self.derive is not None:
+            self.derive(args)
+        return args, errors
+
+    def parse(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """strict 版: FieldError があれば InputValidationError を送出する。"""
+        args, errors = self.validate(data)
+        if errors:
+            raise InputValidationError(errors)
+        return args
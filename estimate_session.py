@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+見積セッション（条件を1項目ずつ変える見積）
+- Dify のチャットのように1ターンに1項目ずつ条件を変える用途向けに、直前の入力（Dify 形式）・解釈済みの入力・
+  評価プランの中間値（工数・原価・損益の各段の値）・結果をセッションに保持する
+- パッチは前回の入力に上書きし、値が変わった入力項目の下流の中間値だけを評価プランの部分評価関数で求め直す
+  （PLAN.affected で求め直す値と引数に渡す値を決め、PLAN.kernel(given, outputs) で計算する。式の写しは持たない）。
+  結果は同じ入力の dify_logic.estimate と一致する
+- レスポンスは全体の結果・前回の結果からの差分（delta）・変わった入力項目・求め直した中間値（recomputed）
+  （include_result=False なら全体の結果を省く）
+- 評価と差分はロックの外で行い、ロックはセッションの読み出しと差し替えだけに使う。同じセッションへの同時パッチで
+  先に別のパッチが反映されていたら、最新の入力に上書きし直して評価する（送られた項目は失われない）
+- セッションは件数上限つき LRU + TTL（ESTIMATE_SESSION_MAX / ESTIMATE_SESSION_TTL）。評価プランが差し替わったら次のパッチで全体を評価し直す
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from dify_assets.code import estimate_logic as dify_logic
+from metrics import SESSION_PATCHES, SESSIONS
+
+_MISSING = object()
+
+# 中間値を経由せずに結果へそのまま出る入力項目
+ECHOED_INPUTS = frozenset(["tables"])
+
+
+def changed_inputs(before: Dict[str, Any], after: Dict[str, Any]) -> List[str]:
+    """解釈済みの入力2つ → 値が変わった項目名（名前順）。"""
+    changed = []
+    for name in sorted(before.keys() | after.keys()):
+        old, new = before.get(name, _MISSING), after.get(name, _MISSING)
+        # 1 と 1.0 はエコーの表記が変わるため型も比較する
+        if old is not new and (type(old) is not type(new) or old != new):
+            changed.append(name)
+    return changed
+
+
+class _Values:
+    """中間値の dict をそのまま属性として読ませる（dify_logic.build_result は EvalContext と同じ名前で読む）。"""
+
+    def __init__(self, values: Dict[str, Any]):
+        self.__dict__ = values
+
+
+def evaluate(args: Dict[str, Any]) -> Dict[str, Any]:
+    """解釈済みの入力 → 評価プランの全中間値。"""
+    plan = dify_logic.PLAN
+    c = plan.evaluate(args, args.get('tables', []))
+    return {name: getattr(c, name) for name in plan.values}
+
+
+def recompute(plan, args: Dict[str, Any], values: Dict[str, Any],
+              changed: Sequence[str]) -> Tuple[Dict[str, Any], Tuple[str, ...]]:
+    """changed（変わった入力項目）の下流の中間値だけを求め直す → (新しい中間値, 求め直した値の名前)。"""
+    given, outputs = plan.affected(changed)
+    if not outputs:
+        return values, outputs
+    values = dict(values)
+    values.update(zip(outputs, plan.kernel(given, outputs)(args, *[values[name] for name in given])))
+    return values, outputs
+
+
+def build_result(args: Dict[str, Any], values: Dict[str, Any], errors) -> Dict[str, Any]:
+    """中間値 → dify_logic.estimate と同じ形のレスポンス。"""
+    return dify_logic.with_input_errors(dify_logic.build_result(_Values(values), args.get('tables', [])), errors)
+
+
+def diff_results(before: Dict[str, Any], after: Dict[str, Any], path: str = "",
+                 out: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """2つの結果の差分を "a.b.c" → {"before", "after"} で返す（dict は再帰、それ以外は値ごと比較）。
+
+    等しい dict の部分木は一括比較で読み飛ばす。葉の比較は関数を呼ばずにループ内で行う。
+    """
+    if out is None:
+        out = {}
+    prefix = f"{path}." if path else ""
+    keys = list(before)
+    if after.keys() != before.keys():
+        keys.extend(key for key in after if key not in before)
+    for key in keys:
+        old = before.get(key)
+        new = after.get(key)
+        if old is new:
+            continue
+        if type(old) is dict and type(new) is dict:
+            if old != new:
+                diff_results(old, new, prefix + key, out)
+        elif type(old) is not type(new) or old != new:
+            out[prefix + key] = {"before": old, "after": new}
+    return out
+
+
+class EstimateSession:
+    __slots__ = ("session_id", "kwargs", "args", "errors", "values", "result", "plan", "version", "revision",
+                 "touched")
+
+    def __init__(self, session_id: str, kwargs: Dict[str, Any]):
+        self.session_id = session_id
+        self.kwargs = dict(kwargs)
+        self.args, self.errors = dify_logic.validate_args(self.kwargs)
+        self.plan = dify_logic.PLAN
+        self.version = dify_logic.CONFIG["config_version"]
+        self.values = evaluate(self.args)
+        self.result = build_result(self.args, self.values, self.errors)
+        self.revision = 0
+        self.touched = time.monotonic()
+
+    def response(self, changed: Sequence[str], recomputed: Sequence[str], delta: Dict[str, Any],
+                 include_result: bool = True) -> Dict[str, Any]:
+        data = {
+            "session_id": self.session_id,
+            "revision": self.revision,
+            "config_version": self.version,
+            "changed_inputs": list(changed),
+            "recomputed": list(recomputed),
+            "delta": delta,
+        }
+        if include_result:
+            data["result"] = self.result
+        return data
+
+
+class EstimateSessions:
+    """セッションの保持（件数上限つき LRU + TTL）と作成・パッチ。"""
+
+    def __init__(self, max_sessions: int = 1000, ttl: float = 1800.0):
+        self.max_sessions = max_sessions
+        self.ttl = ttl  # 0以下なら無期限
+        self._lock = threading.Lock()
+        self._sessions: "OrderedDict[str, EstimateSession]" = OrderedDict()
+        self.stats = {"created": 0, "patches": 0, "full": 0, "incremental": 0, "reused": 0, "retries": 0,
+                      "values_recomputed": 0, "evictions": 0, "expired": 0}
+
+    @classmethod
+    def from_env(cls) -> "EstimateSessions":
+        return cls(
+            max_sessions=int(os.getenv("ESTIMATE_SESSION_MAX", "1000")),
+            ttl=float(os.getenv("ESTIMATE_SESSION_TTL", "1800")),
+        )
+
+    def _get(self, session_id: str) -> EstimateSession:
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        if self.ttl > 0 and time.monotonic() - session.touched > self.ttl:
+            del self._sessions[session_id]
+            self.stats["expired"] += 1
+            SESSIONS.set(len(self._sessions))
+            raise KeyError(session_id)
+        session.touched = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def create(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """入力（Dify 形式）を評価してセッションを開く。"""
+        session = EstimateSession(uuid.uuid4().hex, kwargs)
+        with self._lock:
+            self._sessions[session.session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.stats["evictions"] += 1
+            self.stats["created"] += 1
+            SESSIONS.set(len(self._sessions))
+        return session.response(sorted(session.args), session.plan.values, {})
+
+    def patch(self, session_id: str, fields: Dict[str, Any], include_result: bool = True) -> Dict[str, Any]:
+        """fields を前回の入力に上書きし、変わった入力項目の下流だけを求め直して結果と差分を返す（KeyError: 不明なセッション）。"""
+        while True:
+            with self._lock:
+                session = self._get(session_id)
+                revision, previous, values = session.revision, session.result, session.values
+                kwargs, args, errors, plan = session.kwargs, session.args, session.errors, session.plan
+
+            # ===== ロックの外: 入力の解釈・評価・差分 =====
+            kwargs = dict(kwargs)
+            kwargs.update(fields)
+            new_args, new_errors = dify_logic.validate_args(kwargs)
+            changed = changed_inputs(args, new_args)
+            current = dify_logic.PLAN
+            if current is not plan:
+                # 評価プランが差し替わったら前回の中間値は使えない
+                values, recomputed, outcome = evaluate(new_args), current.values, "full"
+            else:
+                values, recomputed = recompute(plan, new_args, values, changed)
+                outcome = "incremental" if recomputed else "reused"
+            if recomputed or new_errors != errors or not ECHOED_INPUTS.isdisjoint(changed):
+                result = build_result(new_args, values, new_errors)
+                delta = diff_results(previous, result)
+            else:
+                # 結果に効く値が何も変わっていなければ前回の結果をそのまま使う
+                result, delta = previous, {}
+
+            with self._lock:
+                session = self._get(session_id)
+                if session.revision != revision:
+                    # 評価中に別のパッチが反映された。その入力に上書きし直す
+                    self.stats["retries"] += 1
+                    continue
+                session.kwargs, session.args, session.errors = kwargs, new_args, new_errors
+                session.values, session.result = values, result
+                session.plan, session.version = current, dify_logic.CONFIG["config_version"]
+                session.revision += 1
+                self.stats["patches"] += 1
+                self.stats[outcome] += 1
+                self.stats["values_recomputed"] += len(recomputed)
+                SESSION_PATCHES.inc((outcome,))
+                return session.response(changed, recomputed, delta, include_result)
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        with self._lock:
+            session = self._get(session_id)
+            return session.response([], [], {})
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            if self._sessions.pop(session_id, None) is None:
+                raise KeyError(session_id)
+            SESSIONS.set(len(self._sessions))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self.stats)
+            data["sessions"] = len(self._sessions)
+            data["max_sessions"] = self.max_sessions
+            data["ttl"] = self.ttl
+            return data
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+モンテカルロ・リスクシミュレーション
+- 不確実な入力（画面数/テーブル数、機能工数、Phase3 外注費のブレ、難易度）を列単位で抽出し、
+  評価プランの列版の部分評価関数（PLAN.kernel(..., columns=...)）で全標本の売価・原価を1回の呼び出しで計算する
+  （標本ごとの関数呼び出しはせず、標本に依存しない文はループの外で1回だけ計算する。式・係数の写しは持たない）
+- Phase3 のブレ幅は設定スナップショットの design.vendor_variance（confidence 別）を既定値にする。
+  呼び出し側（API）は自分の設定スナップショットの値を vendor_variance で渡す（未指定なら config_snapshot.shared_store() の値）
+- 既定の標本数は DEFAULT_SAMPLES（2万。P10/P90 の誤差は売価の 0.1% 程度）
+- 出力: 売価の P10/P50/P90、決定論見積（固定売価）での営業利益率分布と margin-at-risk
+- seed 指定で再現可能。samples で標本数（=レイテンシ）を制御する
+"""
+
+import bisect
+import math
+import random
+from typing import Any, Dict, List, Optional
+
+from config_snapshot import shared_store
+from dify_assets.code import estimate_logic as dify_logic
+from estimate_engine import EvalContext
+
+DEFAULT_SAMPLES = 20000
+MAX_SAMPLES = 1000000
+COMPLEXITY_LEVELS = ("low", "medium", "high", "very_high")
+DISTRIBUTIONS = ("fixed", "uniform", "triangular", "normal")
+
+# シナリオごとに引数で渡す中間値（抽出した値と、ベース入力で決まる係数）
+SCENARIO_GIVEN = ("feature_days", "screen_count", "table_count", "diff", "p3_fixed",
+                  "prod", "dt_design", "dt_dev", "p2_base", "plat", "dur", "indirect_per_hour", "sga_rate")
+
+# 標本ごとに変わる中間値（SCENARIO_GIVEN のうち列で渡すもの）
+SCENARIO_COLUMNS = ("feature_days", "screen_count", "table_count", "diff", "p3_fixed")
+
+
+def _vendor_variance(confidence: Optional[str], vendor_variance: Optional[Dict[str, float]] = None) -> float:
+    variance = shared_store().get().vendor_variance if vendor_variance is None else vendor_variance
+    return variance.get(confidence or "medium", variance.get("medium", 0.2))
+
+
+def default_distributions(req_body: Dict[str, Any], c: Optional[EvalContext] = None,
+                          vendor_variance: Optional[Dict[str, float]] = None) -> Dict[str, Dict[str, Any]]:
+    # 規模・難易度の中心は評価プランが解決した値（既定値・正規化は /calculate と同じ）
+    if c is None:
+        c = dify_logic.PLAN.evaluate(req_body, req_body.get('tables', []))
+    screens, tables, complexity = c.screen_count, c.table_count, c.complexity
+    v = _vendor_variance(req_body.get('confidence'), vendor_variance)
+
+    # 難易度: ベース 70%、1段上 20%、1段下 10%
+    weights = {complexity: 0.7}
+    if complexity in COMPLEXITY_LEVELS:
+        i = COMPLEXITY_LEVELS.index(complexity)
+        if i + 1 < len(COMPLEXITY_LEVELS):
+            weights[COMPLEXITY_LEVELS[i + 1]] = 0.2
+        if i > 0:
+            weights[COMPLEXITY_LEVELS[i - 1]] = 0.1
+    return {
+        # 規模はスコープクリープ側に歪ませる
+        "screen_count": {"dist": "triangular", "low": screens * 0.9, "mode": screens, "high": screens * 1.3},
+        "table_count": {"dist": "triangular", "low": tables * 0.9, "mode": tables, "high": tables * 1.3},
+        # 機能工数・外注費は倍率として抽出
+        "feature_days": {"dist": "triangular", "low": 0.8, "mode": 1.0, "high": 1.5},
+        "vendor": {"dist": "uniform", "low": 1.0 - v, "high": 1.0 + v},
+        "complexity": {"dist": "categorical", "weights": weights},
+    }
+
+
+def _draw(rng: random.Random, spec: Dict[str, Any], n: int, name: str) -> List[float]:
+    dist = spec.get("dist", "fixed")
+    try:
+        if dist == "fixed":
+            return [float(spec["value"])] * n
+        if dist == "uniform":
+            lo, hi = float(spec["low"]), float(spec["high"])
+            rand = rng.random
+            return [lo + (hi - lo) * rand() for _ in range(n)]
+        if dist == "triangular":
+            lo, mode, hi = float(spec["low"]), float(spec["mode"]), float(spec["high"])
+            if lo == hi:
+                return [lo] * n
+            # 逆関数法（random.triangular を1本ずつ呼ぶより速い）
+            c = (mode - lo) / (hi - lo)
+            a, b = (hi - lo) * (mode - lo), (hi - lo) * (hi - mode)
+            rand = rng.random
+            return [lo + math.sqrt(u * a) if u < c else hi - math.sqrt((1.0 - u) * b)
+                    for u in (rand() for _ in range(n))]
+        if dist == "normal":
+            mean, sd = float(spec["mean"]), float(spec["sd"])
+            gauss = rng.gauss
+            return [max(0.0, gauss(mean, sd)) for _ in range(n)]
+    except KeyError as e:
+        raise ValueError(f"{name}: missing parameter {e.args[0]} for {dist}")
+    raise ValueError(f"{name}: unknown distribution {dist!r} (allowed: {list(DISTRIBUTIONS)})")
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    # 線形補間（numpy.percentile の既定と同じ）
+    pos = (len(sorted_values) - 1) * q
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def simulate(
+    base: Dict[str, Any],
+    samples: int = DEFAULT_SAMPLES,
+    seed: Optional[int] = None,
+    distributions: Optional[Dict[str, Dict[str, Any]]] = None,
+    vendor_variance: Optional[Dict[str, float]] = None,
+) -> Dict[str, Any]:
+    """base（Dify形式の入力）を中心に samples 本のシナリオを抽出し、価格と利益率の分布を返す。
+
+    vendor_variance: confidence → Phase3 外注費のブレ幅（呼び出し側の設定スナップショットの値。既定は shared_store()）
+    """
+    if samples <= 0 or samples > MAX_SAMPLES:
+        raise ValueError(f"samples must be between 1 and {MAX_SAMPLES}")
+    if seed is None:
+        seed = random.SystemRandom().randrange(2 ** 32)
+    rng = random.Random(seed)
+
+    req_body = dify_logic.prepare_args(base)
+    plan = dify_logic.PLAN
+    c = plan.evaluate(req_body, req_body.get('tables', []))
+    dists = default_distributions(req_body, c, vendor_variance)
+    for name, spec in (distributions or {}).items():
+        if name not in dists:
+            raise ValueError(f"Unknown distribution target: {name} (allowed: {list(dists)})")
+        dists[name] = spec
+    quote = c.final
+
+    # ===== 抽出（列単位） =====
+    n = samples
+    screens = [round(x) for x in _draw(rng, dists["screen_count"], n, "screen_count")]
+    tables = [round(x) for x in _draw(rng, dists["table_count"], n, "table_count")]
+    feature_factor = _draw(rng, dists["feature_days"], n, "feature_days")
+    vendor = _draw(rng, dists["vendor"], n, "vendor")
+    cx = dists["complexity"]
+    if cx.get("dist") == "categorical":
+        weights = cx.get("weights") or {}
+        if not weights:
+            raise ValueError("complexity: categorical weights must not be empty")
+        # 難易度の係数は評価プランの表引き（未知の値は /calculate と同じく既定の係数）
+        lookup = plan.kernel((), "diff")
+        diff = rng.choices([lookup({"complexity": k}) for k in weights], weights=list(weights.values()), k=n)
+    else:
+        diff = _draw(rng, cx, n, "complexity")
+
+    # ===== 計算（評価プランの列版の部分評価関数を1回ずつ。式・係数は main_logic と同じ1本） =====
+    scenario = plan.kernel(SCENARIO_GIVEN, ("cogs", "sga", "final"), SCENARIO_COLUMNS)
+    at_quote = plan.kernel(("cogs", "sga", "final"), "operating_margin", ("cogs", "sga"))
+    feature_days, p3_fixed = c.feature_days, c.p3_fixed
+    fixed = (c.prod, c.dt_design, c.dt_dev, c.p2_base, c.plat, c.dur, c.indirect_per_hour, c.sga_rate)
+    # Phase3 外注費のブレは確度倍率を掛ける前の固定費に掛ける
+    cogs, sga, finals = zip(*scenario(req_body, [feature_days * ff for ff in feature_factor], screens, tables,
+                                      diff, [p3_fixed * v for v in vendor], *fixed))
+    prices = sorted(finals)
+    # 売価を決定論見積で固定した場合の営業利益率
+    margins = sorted(at_quote(req_body, cogs, sga, quote))
+
+    base_margin = c.operating_margin
+    p10_margin = _percentile(margins, 0.10)
+    return {
+        "status": "success",
+        "samples": n,
+        "seed": seed,
+        "distributions": dists,
+        "deterministic_price": quote,
+        "price": {
+            "mean": int(sum(prices) / n),
+            "p10": int(_percentile(prices, 0.10)),
+            "p50": int(_percentile(prices, 0.50)),
+            "p90": int(_percentile(prices, 0.90)),
+        },
+        "operating_margin_at_quote": {
+            "base": round(base_margin, 4),
+            "p10": round(p10_margin, 4),
+            "p50": round(_percentile(margins, 0.50), 4),
+            "p90": round(_percentile(margins, 0.90), 4),
+        },
+        # P10（悪い側10%点）までに失い得る利益率と、赤字確率
+        "margin_at_risk": round(base_margin - p10_margin, 4),
+        "loss_probability": round(bisect.bisect_left(margins, 0.0) / n, 4),
+    }
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""
+予算 → スコープの逆算ソルバー
+- 売価は COGS の単調関数、COGS は「開発工数由来（画面/テーブル/機能）」「Phase2」「Phase3」の和に分解できる
+  （各項は区分線形＋int切り捨て）
+- 各項は評価プランの部分評価関数（PLAN.kernel）で求め、係数・式の写しは持たない
+- 予算から許容 COGS の上限を、続けて画面数/テーブル数を、各項の単調性を使って二分探索で逆算する
+- 任意項目は、グループごとに到達可能な合計値をDPで列挙し（機能=人日、Phase2/3=金額）、
+  3グループの組合せを二分探索で詰める（部分集合の総当たりはしない）
+- 解は最後に estimate() で検証し、予算を超えていれば成功として返さない
+"""
+
+import bisect
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dify_assets.code import estimate_logic as dify_logic
+
+MAXIMIZE_TARGETS = ("screen_count", "table_count", "items")
+
+# 開発工数由来の原価（直接労務費＋間接費）に引数で渡す中間値
+DEV_COST_GIVEN = ("feature_days", "screen_count", "table_count", "prod", "diff", "dt_dev",
+                  "indirect_per_hour", "sga_rate")
+# 値が変わらないことの確認に使う十分大きな件数・金額
+SEARCH_LIMIT = 1 << 40
+
+
+class _Model:
+    """ベース入力の評価結果で係数を固定し、スコープ変数の関数とした価格モデル。
+
+    各項は評価プランの部分評価関数（PLAN.kernel）で、式・係数（確度倍率・バッファ等）は main_logic と同じ1本。
+    """
+
+    def __init__(self, req_body: Dict[str, Any]):
+        plan = dify_logic.PLAN
+        self.req = req_body
+        self.base = c = plan.evaluate(req_body, req_body.get('tables', []))
+        self._dev = plan.kernel(DEV_COST_GIVEN, ("direct_labor", "indirect"))
+        self._dev_coefs = (c.prod, c.diff, c.dt_dev, c.indirect_per_hour, c.sga_rate)
+        self._phase2 = plan.kernel(("p2_base", "diff", "dt_design"), "p2_cost")
+        self._phase3 = plan.kernel(("p3_fixed", "confidence"), "p3_cost")
+        self._price = plan.kernel(("cogs", "plat", "dur"), "final")
+
+    def dev_cost(self, feature_days: float, screens: int, tables: int) -> int:
+        direct_labor, indirect = self._dev(self.req, feature_days, screens, tables, *self._dev_coefs)
+        return direct_labor + indirect
+
+    def phase2_cost(self, p2_base: float) -> int:
+        c = self.base
+        return self._phase2(self.req, p2_base, c.diff, c.dt_design)
+
+    def phase3_cost(self, p3_fixed: float) -> int:
+        return self._phase3(self.req, p3_fixed, self.base.confidence)
+
+    def price(self, cogs: int) -> int:
+        return self._price(self.req, cogs, self.base.plat, self.base.dur)
+
+    # --- 逆算（各項は非減少のため、倍々に広げた区間を二分探索する） ---
+    def max_cogs(self, budget: int) -> int:
+        """price(cogs) <= budget を満たす最大の COGS。"""
+        return _max_within(self.price, budget, "cost")
+
+    def max_count(self, cap: int, feature_days: float, fixed_screens: int, fixed_tables: int, target: str) -> int:
+        """dev_cost <= cap を満たす最大の画面数（またはテーブル数）。"""
+        def cost(n: int) -> int:
+            if target == "screen_count":
+                return self.dev_cost(feature_days, n, fixed_tables)
+            return self.dev_cost(feature_days, fixed_screens, n)
+
+        return _max_within(cost, cap, target)
+
+
+def _max_within(f: Callable[[int], int], cap: int, name: str) -> int:
+    """非減少の f について f(n) <= cap を満たす最大の n（f(0) > cap なら -1）。"""
+    if f(0) > cap:
+        return -1
+    if f(SEARCH_LIMIT) <= f(0):
+        raise ValueError(f"{name} does not affect the price under this profile")
+    lo, hi = 0, 1
+    while f(hi) <= cap:
+        lo, hi = hi, hi * 2
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if f(mid) <= cap:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+def _reachable(items: List[Tuple[str, float]]) -> List[Tuple[float, List[str]]]:
+    """各部分集合の合計値 → 部分集合（同値なら項目数が多い方）を DP で列挙する。"""
+    states: Dict[float, List[str]] = {0: []}
+    for key, value in items:
+        for total, subset in list(states.items()):
+            new_total = total + value
+            candidate = subset + [key]
+            current = states.get(new_total)
+            if current is None or len(candidate) > len(current):
+                states[new_total] = candidate
+    return sorted(states.items())
+
+
+def solve_budget(
+    budget: int,
+    base: Dict[str, Any],
+    maximize: str = "screen_count",
+    optional_features: Optional[List[str]] = None,
+    optional_phase2: Optional[List[str]] = None,
+    optional_phase3: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """予算内に収まる最大スコープを返す。base の features / phase2_items / phase3_items は必須項目として扱う。"""
+    if maximize not in MAXIMIZE_TARGETS:
+        raise ValueError(f"maximize must be one of {list(MAXIMIZE_TARGETS)}")
+    if budget is None or budget <= 0:
+        raise ValueError("budget must be positive")
+
+    req_body = dify_logic.prepare_args(base)
+    model = _Model(req_body)
+
+    c = model.base
+    must_features, must_p2, must_p3 = c.features, c.phase2, c.phase3
+
+    def optional(requested, index, item_dict, must):
+        keys = list(item_dict.keys()) if requested is None else index.resolve(requested)[0]
+        return [k for k in keys if k not in must]
+
+    opt_features = optional(optional_features, dify_logic.FEATURE_INDEX, dify_logic.FEATURE_MAN_DAYS, must_features)
+    opt_p2 = optional(optional_phase2, dify_logic.PHASE2_INDEX, dify_logic.PHASE2_ITEMS, must_p2)
+    opt_p3 = optional(optional_phase3, dify_logic.PHASE3_INDEX, dify_logic.PHASE3_ITEMS, must_p3)
+
+    must_days, must_p2_base, must_p3_fixed = c.feature_days, c.p2_base, c.p3_fixed
+    screens, tables = c.screen_count, c.table_count
+    cogs_cap = model.max_cogs(budget)
+    fixed_cost = model.phase2_cost(must_p2_base) + model.phase3_cost(must_p3_fixed)
+
+    # 1) 画面数/テーブル数の最大化（必須項目のみで逆算）
+    if maximize != "items":
+        n = model.max_count(cogs_cap - fixed_cost, must_days, screens, tables, maximize)
+        if n < 0:
+            return _infeasible(budget, req_body, maximize)
+        if maximize == "screen_count":
+            screens = n
+        else:
+            tables = n
+
+    # 2) 残り予算に任意項目を詰める（3グループの到達可能合計 × 二分探索）
+    feature_opts = [(model.dev_cost(must_days + days, screens, tables), subset)
+                    for days, subset in _reachable([(f, dify_logic.FEATURE_MAN_DAYS[f]) for f in opt_features])]
+    p2_opts = [(model.phase2_cost(must_p2_base + base_sum), subset)
+               for base_sum, subset in _reachable([(p, dify_logic.PHASE2_ITEMS[p]) for p in opt_p2])]
+    p3_opts = sorted((model.phase3_cost(must_p3_fixed + fixed), subset)
+                     for fixed, subset in _reachable([(p, dify_logic.PHASE3_ITEMS[p]['fixed']) for p in opt_p3]))
+    p3_costs = [cost for cost, _ in p3_opts]
+
+    best = None
+    for f_cost, f_subset in feature_opts:
+        for p2_cost, p2_subset in p2_opts:
+            remaining = cogs_cap - f_cost - p2_cost
+            idx = bisect.bisect_right(p3_costs, remaining) - 1
+            if idx < 0:
+                continue
+            p3_cost, p3_subset = p3_opts[idx]
+            score = (f_cost + p2_cost + p3_cost, len(f_subset) + len(p2_subset) + len(p3_subset))
+            if best is None or score > best[0]:
+                best = (score, f_subset, p2_subset, p3_subset)
+    if best is None:
+        return _infeasible(budget, req_body, maximize)
+
+    _, f_subset, p2_subset, p3_subset = best
+    scope = dict(base)
+    scope.update({
+        "screen_count": screens,
+        "table_count": tables,
+        "features": must_features + f_subset,
+        "phase2_items": must_p2 + p2_subset,
+        "phase3_items": must_p3 + p3_subset,
+    })
+    if maximize == "table_count":
+        # tables の件数で table_count が上書きされないように
+        scope.pop("tables", None)
+    # 解は estimate() で検証する。予算を超えた場合は最大化した件数を減らし、それでも超えるなら成功としない
+    estimate = dify_logic.estimate(**scope)
+    while estimate["profit_analysis"]["sales"] > budget and maximize != "items" and scope[maximize] > 0:
+        scope[maximize] -= 1
+        estimate = dify_logic.estimate(**scope)
+    price = estimate["profit_analysis"]["sales"]
+    if price > budget:
+        return _infeasible(budget, req_body, maximize, "No scope within the budget could be verified")
+    screens, tables = scope["screen_count"], scope["table_count"]
+    return {
+        "status": "success",
+        "budget": budget,
+        "maximize": maximize,
+        "screen_count": screens,
+        "table_count": tables,
+        "features": scope["features"],
+        "phase2_items": scope["phase2_items"],
+        "phase3_items": scope["phase3_items"],
+        "optional_selected": {"features": f_subset, "phase2_items": p2_subset, "phase3_items": p3_subset},
+        "estimated_price": price,
+        "remaining_budget": budget - price,
+        "estimate": estimate,
+    }
+
+
+def _infeasible(budget: int, req_body: Dict[str, Any], maximize: str,
+                message: str = "Must-have scope exceeds the budget") -> Dict[str, Any]:
+    minimum = dict(req_body)
+    if maximize in ("screen_count", "table_count"):
+        minimum[maximize] = 0
+    price = dify_logic.main_logic(minimum, minimum.get('tables', []))["profit_analysis"]["sales"]
+    return {
+        "status": "infeasible",
+        "budget": budget,
+        "maximize": maximize,
+        "message": message,
+        "minimum_price": price,
+    }
@@ -1,16 +1,27 @@
 import azure.functions as func
 import logging
 import json
-import yaml
 import os
+from config_snapshot import shared_store
+import json_response
+from profiling import PROFILE_HEADER, PROFILE_PARAM, ProfilingSettings, profile_call, record_stage, requested_mode, server_timing
+from estimate_engine import EstimateRuleError, LabelIndex, compile_ruleset
 
 app = func.FunctionApp(http_auth_level=func.AuthLevel.ANONYMOUS)
 
 def load_config():
+    # PyYAML は起動時には読み込まない（通常の計算は CONFIG_STORE のコンパイル済み設定を使う）
+    import yaml
     config_path = os.path.join(os.path.dirname(__file__), "estimate_config.yaml")
     with open(config_path, "r", encoding="utf-8") as f:
         return yaml.safe_load(f)
 
+# 設定スナップショット（ファイル変更時のみ再読込。シミュレーション等と同じプロセス共有のストア）
+CONFIG_STORE = shared_store()
+
+# リクエスト単位のプロファイリング（アプリ設定 ESTIMATE_PROFILING=1 で有効）
+PROFILING = ProfilingSettings.from_env()
+
 # 工数マスタ
 FEATURE_MAN_DAYS = {
     "auth": 5,              # ユーザー認証
@@ -65,194 +76,173 @@ PHASE3_LABEL_MAP = {
     "アイコン・ロゴ": "logo_icon",
 }
 
-def resolve_keys(input_list, label_map, item_dict):
-    """JPラベルを英語キーに変換し、有効なキーのみを抽出する"""
-    resolved = []
-    for item in input_list:
-        if item in item_dict:
-            resolved.append(item)
-            continue
-        mapped = label_map.get(item)
-        if mapped and mapped in item_dict:
-            resolved.append(mapped)
-    return list(set(resolved))
-
-def main_logic(req_body):
-    config = load_config()
-    
-    # Common Params
-    method = req_body.get('method', 'screen') 
-    complexity = req_body.get('complexity', 'medium')
-    screen_count = req_body.get('screen_count', 10) 
-    confidence = req_body.get('confidence') 
-    
-    # Method-specific Params
-    man_days_per_unit = req_body.get('man_days_per_unit') 
-    loc = req_body.get('loc') 
-    fp_count = req_body.get('fp_count') 
-
-    # Resolve keys
-    selected_features = resolve_keys(req_body.get('features', []), FEATURE_LABEL_MAP, FEATURE_MAN_DAYS)
-    selected_phase2 = resolve_keys(req_body.get('phase2_items', []), PHASE2_LABEL_MAP, PHASE2_ITEMS)
-    selected_phase3 = resolve_keys(req_body.get('phase3_items', []), PHASE3_LABEL_MAP, PHASE3_ITEMS)
-
-    # Policy Check
-    policy = config.get('policy', {})
-    require_explicit_prod = policy.get('require_explicit_productivity_for_step_fp', True)
-    require_explicit_conf = policy.get('require_explicit_vendor_confidence', True)
-
-    # Validate Confidence if Phase 3 (Vendor Design) items present
-    has_phase3_items = (len(selected_phase3) > 0)
-    if require_explicit_conf and has_phase3_items and not confidence:
-         return {"status": "error", "message": "Missing required param: confidence (Required for Phase 3 / Vendor Design estimation)"}, 400
-
-    # Config Values
-    diff_multipliers = config.get('difficulty_multipliers', {})
-    if complexity not in diff_multipliers: complexity = 'medium'
-    diff_multiplier = diff_multipliers.get(complexity, 1.0)
-    
-    buffer_multiplier = config.get('buffer_multiplier', 1.1)
-    
-    daily_rates = config.get('daily_rates', {})
-    sier_rate = daily_rates.get('sier_internal', 50000)
-    outsource_rate = daily_rates.get('outsource', 80000)
-    
-    design_config = config.get('design', {})
-    mgmt_fee_rate = design_config.get('phase3_management_fee_rate', 0.15)
-    vendor_variance_map = design_config.get('vendor_variance', {})
-    
-    # Variance Factor (Only for Phase 3)
-    variance = 0.0
-    if has_phase3_items:
-        variance = vendor_variance_map.get(confidence, 0.2) 
-
-    dev_config = config.get('development', {})
-    dev_screen_rate = dev_config.get('man_days_per_screen', 1.5)
-
-    # ===== Development Cost (Fixed) =====
-    dev_feature_days = 0 
-    dev_screen_days = 0
-    dev_base_days = 0 
-
-    if method == 'step':
-        if require_explicit_prod and (loc is None or man_days_per_unit is None):
-             return {"status": "error", "message": "Missing required params for STEP: loc, man_days_per_unit"}, 400
-        dev_base_days = loc * man_days_per_unit
-        
-    elif method == 'fp':
-        if require_explicit_prod and (fp_count is None or man_days_per_unit is None):
-             return {"status": "error", "message": "Missing required params for FP: fp_count, man_days_per_unit"}, 400
-        dev_base_days = fp_count * man_days_per_unit
-        
-    else:
-        dev_feature_days = sum(FEATURE_MAN_DAYS.get(f, 0) for f in selected_features)
-        dev_screen_days = screen_count * dev_screen_rate
-        dev_base_days = dev_feature_days + dev_screen_days
-
-    dev_total_days = dev_base_days * diff_multiplier
-    dev_cost = int(dev_total_days * sier_rate)
+# ラベル/キー → 項目キーの解決インデックス（キー優先、全角/半角・空白の表記ゆれも吸収）
+FEATURE_INDEX = LabelIndex(FEATURE_MAN_DAYS, FEATURE_LABEL_MAP, prefer="key")
+PHASE2_INDEX = LabelIndex(PHASE2_ITEMS, PHASE2_LABEL_MAP, prefer="key")
+PHASE3_INDEX = LabelIndex(PHASE3_ITEMS, PHASE3_LABEL_MAP, prefer="key")
 
-    # ===== Phase 2 (Design) (Fixed - Internal) =====
-    phase2_total_days = 0
-    phase2_cost = 0
-    
-    if selected_phase2:
-        p2_fixed = 0
-        p2_screen = 0
-        for item in selected_phase2:
-            item_info = PHASE2_ITEMS.get(item, {})
-            if item_info.get("type") == "fixed":
-                p2_fixed += item_info.get("man_days", 0)
-            else:
-                p2_screen += item_info.get("man_days", 0) * screen_count
-        
-        phase2_total_days = p2_fixed + p2_screen
-        phase2_cost = int(phase2_total_days * sier_rate)
-
-    # ===== Phase 3 (Visual) (Range - Vendor) =====
-    phase3_total_days = 0
-    phase3_cost = 0
-    phase3_range = {"min": 0, "max": 0, "cost": 0}
-
-    if selected_phase3:
-        p3_fixed = 0
-        p3_screen = 0
-        for item in selected_phase3:
-            item_info = PHASE3_ITEMS.get(item, {})
-            if item_info.get("type") == "fixed":
-                p3_fixed += item_info.get("man_days", 0)
-            else:
-                p3_screen += item_info.get("man_days", 0) * screen_count
-        
-        phase3_total_days = p3_fixed + p3_screen
-        phase3_base_cost = int(phase3_total_days * outsource_rate)
-        phase3_management_fee = int(phase3_base_cost * mgmt_fee_rate)
-        phase3_cost = phase3_base_cost + phase3_management_fee
-        
-        # Apply Variance
-        phase3_range = {
-            "min": int(phase3_cost * (1 - variance)),
-            "max": int(phase3_cost * (1 + variance)),
-            "cost": phase3_cost
-        }
-
-    # ===== Total =====
-    # Dev: Fixed. P2: Fixed. P3: Range.
-    subtotal_nominal = dev_cost + phase2_cost + phase3_cost
-    subtotal_min = dev_cost + phase2_cost + phase3_range.get("min", 0)
-    subtotal_max = dev_cost + phase2_cost + phase3_range.get("max", 0)
-
-    final_nominal = int(subtotal_nominal * buffer_multiplier)
-    final_min = int(subtotal_min * buffer_multiplier)
-    final_max = int(subtotal_max * buffer_multiplier)
-
-    complexity_labels = {
-        "low": "簡易", "medium": "標準", "high": "高難度"
+def build_ruleset(snapshot):
+    """設定スナップショットの係数・単価で計算式を宣言する（estimate_engine でコンパイル）"""
+    return {
+        "name": snapshot.version,
+        "axes": [
+            # 未知の complexity は medium として扱う
+            {"name": "complexity", "mode": "get", "default": "medium", "unknown_as_default": True,
+             "table": snapshot.difficulty_multipliers, "fallback": 1.0},
+        ],
+        "size": {"screen_count": {"mode": "get", "default": 10}},
+        "items": [
+            {"group": "features", "key": "features", "resolver": "set",
+             "index": FEATURE_INDEX, "table": FEATURE_MAN_DAYS},
+            {"group": "phase2", "key": "phase2_items", "resolver": "set",
+             "index": PHASE2_INDEX, "table": PHASE2_ITEMS, "value": "man_days"},
+            {"group": "phase3", "key": "phase3_items", "resolver": "set",
+             "index": PHASE3_INDEX, "table": PHASE3_ITEMS, "value": "man_days"},
+        ],
+        # screen（機能+画面数） / step（LOC×人日） / fp（FP×人日）
+        "effort": {
+            "model": "methods",
+            "default_method": "screen",
+            "man_days_per_screen": snapshot.man_days_per_screen,
+            "require_explicit_productivity": snapshot.require_explicit_productivity,
+        },
+        # Dev/P2: 社内単価で固定。P3: 外注単価+管理費、確度に応じたレンジ
+        "cost": {
+            "model": "daily_rate",
+            "sier_rate": snapshot.sier_rate,
+            "outsource_rate": snapshot.outsource_rate,
+            "mgmt_fee_rate": snapshot.mgmt_fee_rate,
+            "vendor_variance": snapshot.vendor_variance,
+            "default_variance": 0.2,
+            "require_explicit_vendor_confidence": snapshot.require_explicit_vendor_confidence,
+            "buffer": snapshot.buffer_multiplier,
+        },
     }
 
+# スナップショットごとに1回だけコンパイル（設定が差し替わった時のみ再コンパイル）
+_compiled = (None, None)
+
+def plan_for(snapshot):
+    global _compiled
+    cached_snapshot, plan = _compiled
+    if cached_snapshot is not snapshot:
+        plan = compile_ruleset(build_ruleset(snapshot))
+        _compiled = (snapshot, plan)
+    return plan
+
+COMPLEXITY_LABELS = {
+    "low": "簡易", "medium": "標準", "high": "高難度"
+}
+
+def main_logic(req_body, snapshot=None, observe=None):
+    if snapshot is None:
+        snapshot = CONFIG_STORE.get()
+
+    try:
+        if observe is None:
+            c = plan_for(snapshot).evaluate(req_body)
+        else:
+            # 段階別時間 observe(stage, seconds) を記録する計測付きの評価
+            c = plan_for(snapshot).evaluate_timed(observe, req_body)
+    except EstimateRuleError as e:
+        return {"status": "error", "message": str(e)}, 400
+
     response_data = {
         "status": "ok",
-        "estimated_amount": final_nominal,
-        "estimated_range": {"min": final_min, "max": final_max},
-        "currency": config.get('currency', 'JPY'),
-        "method": method,
-        "screen_count": screen_count,
-        "complexity": complexity,
-        "confidence": confidence,
+        "estimated_amount": c.final,
+        "estimated_range": {"min": c.final_min, "max": c.final_max},
+        "currency": snapshot.currency,
+        "method": c.method,
+        "screen_count": c.screen_count,
+        "complexity": c.complexity,
+        "confidence": c.confidence,
         "breakdown": {
             "development": {
-                "method": method,
-                "base_days": dev_base_days,
-                "total_days": dev_total_days,
-                "cost": dev_cost,
+                "method": c.method,
+                "base_days": c.dev_base,
+                "total_days": c.dev_total,
+                "cost": c.dev_cost,
                 "details": {
-                    "loc": loc,
-                    "fp_count": fp_count,
-                    "man_days_per_unit": man_days_per_unit,
-                    "feature_days": dev_feature_days,
-                    "screen_days": dev_screen_days
+                    "loc": c.loc,
+                    "fp_count": c.fp_count,
+                    "man_days_per_unit": c.man_days_per_unit,
+                    "feature_days": c.feature_days,
+                    "screen_days": c.screen_days
                 }
             },
             "phase2_design": {
-                "total_days": phase2_total_days,
-                "cost": phase2_cost,
-                "selected_items": selected_phase2
+                "total_days": c.p2_days,
+                "cost": c.p2_cost,
+                "selected_items": c.phase2
             },
             "phase3_visual": {
-                "total_days": phase3_total_days,
-                "cost": phase3_cost,
-                "range": phase3_range,
-                "selected_items": selected_phase3
+                "total_days": c.p3_days,
+                "cost": c.p3_cost,
+                "range": c.p3_range,
+                "selected_items": c.phase3
             },
-            "subtotal": subtotal_nominal,
-            "buffer_multiplier": buffer_multiplier,
-            "final": final_nominal,
-            "complexity_label": complexity_labels.get(complexity, complexity)
+            "subtotal": c.subtotal,
+            "buffer_multiplier": snapshot.buffer_multiplier,
+            "final": c.final,
+            "complexity_label": COMPLEXITY_LABELS.get(c.complexity, c.complexity)
         },
-        "config_version": config.get('config_version', '2026-01')
+        "unresolved_items": c.unresolved,
+        "config_version": snapshot.version,
+        "config_snapshot": snapshot.info()
     }
     return response_data, 200
 
+NDJSON_MIMETYPE = "application/x-ndjson"
+# NDJSON バッチの本文の上限（バイト）。本文も結果もメモリ上にまとめて持つため、1回のバッチの大きさをここで抑える
+MAX_BATCH_BYTES = int(os.getenv("ESTIMATE_BATCH_MAX_BYTES", str(4 * 1024 * 1024)))
+
+def iter_ndjson(body):
+    """NDJSON の本文 → (行番号, 行のバイト列)。空行は飛ばす（行番号は本文の物理行、1 始まり）
+
+    本文を行のリストに分割せず、改行位置を順に探して1行ずつ切り出す。
+    """
+    start = 3 if body.startswith(b"\xef\xbb\xbf") else 0
+    size = len(body)
+    line_no = 0
+    while start < size:
+        end = body.find(b"\n", start)
+        if end < 0:
+            end = size
+        line_no += 1
+        line = body[start:end].strip()
+        if line:
+            yield line_no, line
+        start = end + 1
+
+def _batch_line(line_no, line, snapshot):
+    try:
+        req_body = json_response.loads(line)
+    except ValueError:
+        return {"line": line_no, "id": None, "status_code": 400,
+                "result": {"status": "error", "message": "Invalid JSON"}}
+    if not isinstance(req_body, dict):
+        return {"line": line_no, "id": None, "status_code": 400,
+                "result": {"status": "error", "message": "Each line must be a JSON object"}}
+    row_id = req_body.pop("id", None)
+    try:
+        result_data, status_code = main_logic(req_body, snapshot)
+    except Exception as e:
+        logging.exception("Estimation failed on NDJSON line %d", line_no)
+        result_data, status_code = {"status": "error", "message": f"{type(e).__name__}: {e}"}, 500
+    return {"line": line_no, "id": row_id, "status_code": status_code, "result": result_data}
+
+def calculate_ndjson(body, snapshot=None):
+    """NDJSON の各行を見積もり、1行ずつエンコード済みの結果行（改行込みのバイト列）を返すジェネレーター
+
+    設定スナップショットはバッチ全体で1回だけ解決する（途中で設定ファイルが差し替わっても同じ版で計算する）。
+    行ごとのエラーは status_code 付きの結果行として返し、残りの行の処理は続ける。
+    """
+    if snapshot is None:
+        snapshot = CONFIG_STORE.get()
+    plan_for(snapshot)
+    for line_no, line in iter_ndjson(body):
+        yield json_response.dumps_bytes(_batch_line(line_no, line, snapshot)) + b"\n"
+
 @app.route(route="calculate_estimate", methods=["POST", "OPTIONS"])
 def calculate_estimate(req: func.HttpRequest) -> func.HttpResponse:
     if req.method == "OPTIONS":
@@ -277,13 +267,78 @@ def calculate_estimate(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json"
         )
 
-    result_data, status_code = main_logic(req_body)
+    snapshot = CONFIG_STORE.get()
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Expose-Headers": "X-Config-Version, X-Config-Digest, X-Config-Loaded-At",
+        "X-Config-Version": snapshot.version,
+        "X-Config-Digest": snapshot.digest,
+        "X-Config-Loaded-At": snapshot.info()["loaded_at"]
+    }
+    mode = None
+    if PROFILING.enabled:
+        mode = requested_mode(req.headers.get(PROFILE_HEADER), req.params.get(PROFILE_PARAM))
+    if mode is None:
+        result_data, status_code = main_logic(req_body, snapshot)
+    else:
+        (result_data, status_code), trace = profile_call(
+            lambda: main_logic(req_body, snapshot, observe=record_stage), mode, PROFILING, "calculate_estimate")
+        result_data["profile_trace"] = trace
+        headers["Server-Timing"] = server_timing(trace)
+        headers["Access-Control-Expose-Headers"] += ", Server-Timing"
 
     return func.HttpResponse(
-        json.dumps(result_data, ensure_ascii=False),
+        json_response.dumps_bytes(result_data),
         status_code=status_code,
         mimetype="application/json",
-        headers={
-            "Access-Control-Allow-Origin": "*"
-        }
+        headers=headers
+    )
+
+@app.route(route="calculate_estimate_batch", methods=["POST", "OPTIONS"])
+def calculate_estimate_batch(req: func.HttpRequest) -> func.HttpResponse:
+    """NDJSON（1行1リクエスト）を受け取り、入力順に NDJSON の結果行を返す
+
+    ストリーミングではない: HttpRequest の本文は Functions ホストがまとめて渡し、HttpResponse も完成した本文しか
+    受け取れないため、結果はバッチ全体の計算後に1回で返す。本文は MAX_BATCH_BYTES までに制限する（超えたら 413）。
+    """
+    if req.method == "OPTIONS":
+        return func.HttpResponse(
+            "",
+            status_code=200,
+            headers={
+                "Access-Control-Allow-Origin": "*",
+                "Access-Control-Allow-Methods": "POST, OPTIONS",
+                "Access-Control-Allow-Headers": "Content-Type"
+            }
+        )
+
+    logging.info('Processing NDJSON estimation batch.')
+
+    snapshot = CONFIG_STORE.get()
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Expose-Headers": "X-Config-Version, X-Config-Digest, X-Config-Loaded-At",
+        "X-Config-Version": snapshot.version,
+        "X-Config-Digest": snapshot.digest,
+        "X-Config-Loaded-At": snapshot.info()["loaded_at"]
+    }
+    declared = req.headers.get("Content-Length")
+    payload = req.get_body() if not (declared and declared.isdigit() and int(declared) > MAX_BATCH_BYTES) else None
+    if payload is None or len(payload) > MAX_BATCH_BYTES:
+        return func.HttpResponse(
+            json_response.dumps_bytes({"status": "error",
+                                       "message": f"Request body exceeds {MAX_BATCH_BYTES} bytes; split the batch"}),
+            status_code=413,
+            mimetype="application/json",
+            headers=headers
+        )
+    # 結果行はエンコード済みのバイト列だけを連結する（行ごとの入力 dict・結果 dict は次の行に進む前に手放す）
+    body = bytearray()
+    for chunk in calculate_ndjson(payload, snapshot):
+        body += chunk
+    return func.HttpResponse(
+        body,
+        status_code=200,
+        mimetype=NDJSON_MIMETYPE,
+        headers=headers
     )
@@ -0,0 +1,339 @@
+# -*- coding: utf-8 -*-
+"""
+Gemini generateContent 用の asyncio クライアント
+- httpx.AsyncClient の keep-alive 接続をプールして使い回す
+- 同時実行数（in-flight）をセマフォで上限制御
+- base_url を差し替えればローカルのスタブサーバーでテスト/ベンチマーク可能
+- モデル可用性レジストリ（404/503をTTL付きで記憶）で既知の利用不可モデルをスキップ
+- ヘッジモード: 一定時間応答がなければ次候補モデルにも並行して投げ、先に返った方を採用
+- streamGenerateContent（SSE）のテキスト断片を逐次取り出すストリーミングAPI
+- モデル別のレイテンシ・送受信バイト数・フォールバック回数を metrics に記録
+- httpx は最初の呼び出しまで import しない（コールドスタート短縮。/calculate だけのプロセスでは読み込まれない）
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from metrics import GEMINI_BYTES_IN, GEMINI_BYTES_OUT, GEMINI_FALLBACKS, GEMINI_LATENCY
+
+if TYPE_CHECKING:
+    import httpx
+
+DEFAULT_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+
+
+class GeminiAPIError(RuntimeError):
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+
+
+# フォールバック対象のステータス（404: モデル未対応, 503: 一時的に利用不可）
+FALLBACK_STATUS_CODES = (404, 503)
+
+
+class ModelHealthRegistry:
+    """プロセス共通のモデル可用性キャッシュ（ネガティブキャッシュ）。"""
+
+    def __init__(self, not_found_ttl: float = 3600.0, unavailable_ttl: float = 60.0):
+        self.ttls = {404: not_found_ttl, 503: unavailable_ttl}
+        self._lock = threading.Lock()
+        self._bad: Dict[str, Tuple[float, int, str]] = {}
+
+    @classmethod
+    def from_env(cls) -> "ModelHealthRegistry":
+        return cls(
+            not_found_ttl=float(os.getenv("GEMINI_MODEL_NOT_FOUND_TTL", "3600")),
+            unavailable_ttl=float(os.getenv("GEMINI_MODEL_UNAVAILABLE_TTL", "60")),
+        )
+
+    def mark_unavailable(self, model: str, status_code: int, reason: str) -> None:
+        ttl = self.ttls.get(status_code, 0)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._bad[model] = (time.monotonic() + ttl, status_code, reason)
+
+    def mark_available(self, model: str) -> None:
+        if model in self._bad:
+            with self._lock:
+                self._bad.pop(model, None)
+
+    def is_available(self, model: str) -> bool:
+        record = self._bad.get(model)
+        if record is None:
+            return True
+        if record[0] <= time.monotonic():
+            with self._lock:
+                self._bad.pop(model, None)
+            return True
+        return False
+
+    def filter(self, models: List[str]) -> List[str]:
+        return [m for m in models if self.is_available(m)]
+
+    def candidates(self, models: List[str]) -> List[str]:
+        """試す候補: filter の結果。全候補が利用不可として記録中なら、記録の期限が最も近いモデル1つ（同じなら先頭）。
+
+        全滅のまま何も試さずに失敗し続けないよう、少なくとも1モデルには問い合わせる。
+        """
+        available = self.filter(models)
+        if available or not models:
+            return available
+        with self._lock:
+            until = {m: self._bad[m][0] for m in models if m in self._bad}
+        # filter の後に期限が切れて消えたモデルは最優先
+        return [min(models, key=lambda m: until.get(m, float("-inf")))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                m: {"status_code": code, "reason": reason, "retry_in": round(until - now, 1)}
+                for m, (until, code, reason) in self._bad.items() if until > now
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._bad.clear()
+
+
+MODEL_HEALTH = ModelHealthRegistry.from_env()
+
+
+def normalize_model_name(model: str) -> str:
+    value = (model or "").strip()
+    if value.startswith("models/"):
+        value = value[len("models/") :]
+    return value
+
+
+def extract_text(body: Dict[str, Any]) -> str:
+    # generateContent / streamGenerateContent の1レスポンスからテキストを取り出す
+    candidates = body.get("candidates") or []
+    if not candidates:
+        return ""
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(p.get("text", "") for p in parts)
+
+
+def parse_api_error_detail(detail: str) -> str:
+    try:
+        data = json.loads(detail)
+        return data.get("error", {}).get("message", detail)
+    except Exception:
+        return detail
+
+
+class GeminiClient:
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        max_in_flight: Optional[int] = None,
+        max_connections: Optional[int] = None,
+        timeout: Optional[float] = None,
+        hedge_after: Optional[float] = None,
+        registry: Optional[ModelHealthRegistry] = None,
+    ):
+        self.base_url = (base_url or os.getenv("GEMINI_BASE_URL") or DEFAULT_BASE_URL).rstrip("/")
+        self.max_in_flight = max_in_flight or int(os.getenv("GEMINI_MAX_IN_FLIGHT", "8"))
+        self.max_connections = max_connections or int(os.getenv("GEMINI_MAX_CONNECTIONS", "16"))
+        self.timeout = timeout or float(os.getenv("GEMINI_TIMEOUT", "30"))
+        # 0/未設定ならヘッジしない（従来どおり順番にフォールバック）
+        self.hedge_after = hedge_after if hedge_after is not None else float(os.getenv("GEMINI_HEDGE_AFTER", "0"))
+        self.registry = registry or MODEL_HEALTH
+        self._client: Optional["httpx.AsyncClient"] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def endpoint(self, model: str, method: str = "generateContent") -> str:
+        return f"{self.base_url}/models/{normalize_model_name(model)}:{method}"
+
+    async def _ensure(self) -> "httpx.AsyncClient":
+        # 接続プールとセマフォはイベントループ単位（ループが変わったら前のクライアントを閉じて作り直す）
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            import httpx
+            previous = self._client
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._loop = loop
+            if previous is not None:
+                await _close_quietly(previous)
+        return self._client
+
+    async def generate_content(self, model: str, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        import httpx
+        client = await self._ensure()
+        model = normalize_model_name(model)
+        async with self._semaphore:
+            started = time.perf_counter()
+            try:
+                resp = await client.post(
+                    self.endpoint(model),
+                    params={"key": api_key},
+                    json=payload,
+                )
+            except httpx.HTTPError as e:
+                GEMINI_LATENCY.observe((model, "error"), time.perf_counter() - started)
+                raise RuntimeError(f"Gemini API request failed: {str(e)}") from e
+        GEMINI_LATENCY.observe((model, str(resp.status_code)), time.perf_counter() - started)
+        GEMINI_BYTES_OUT.inc((model,), len(resp.request.content))
+        GEMINI_BYTES_IN.inc((model,), len(resp.content))
+        if resp.status_code >= 400:
+            raise GeminiAPIError(resp.status_code, parse_api_error_detail(resp.text))
+        return resp.json()
+
+    async def generate_with_fallback(
+        self, models: List[str], payload: Dict[str, Any], api_key: str
+    ) -> Tuple[Dict[str, Any], str]:
+        """候補モデルを順に試し (body, 応答したモデル) を返す。既知の利用不可モデルはスキップする。"""
+        queue = self.registry.candidates(models)
+        skipped = [m for m in models if m not in queue]
+        hedge_after = self.hedge_after if self.hedge_after > 0 else None
+        pending: Dict[asyncio.Task, str] = {}
+        last_error = None
+        # フォールバック対象外のエラー（400・通信エラー等）。次候補は投げず、並行中の応答をすべて待ってから送出する
+        fatal: Optional[BaseException] = None
+
+        def launch() -> None:
+            model = queue.pop(0)
+            pending[asyncio.create_task(self.generate_content(model, payload, api_key))] = model
+
+        if queue:
+            launch()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, timeout=hedge_after if queue and fatal is None else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    # 応答待ちが予算を超えたら次候補にも並行して投げる
+                    launch()
+                    continue
+                finished = [(task, pending.pop(task)) for task in done]
+                # 同時に終わった中に成功があればエラーより優先する
+                for task, model in finished:
+                    if task.exception() is None:
+                        self.registry.mark_available(model)
+                        return task.result(), model
+                for task, model in finished:
+                    e = task.exception()
+                    if isinstance(e, GeminiAPIError) and e.status_code in FALLBACK_STATUS_CODES:
+                        self.registry.mark_unavailable(model, e.status_code, e.message)
+                        GEMINI_FALLBACKS.inc((normalize_model_name(model),))
+                        last_error = f"{model}: {e.message}"
+                    elif fatal is None:
+                        fatal = e
+                if queue and not pending and fatal is None:
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if isinstance(fatal, GeminiAPIError):
+            raise RuntimeError(f"Gemini API error: {fatal.message}") from fatal
+        if fatal is not None:
+            raise fatal
+        tried = [m for m in models if m not in skipped]
+        detail = f"Tried: {', '.join(tried) or '-'}."
+        if skipped:
+            detail += f" Skipped (recently unavailable): {', '.join(skipped)}."
+        raise RuntimeError(
+            "No available Gemini model for generateContent. "
+            f"{detail} Last error: {last_error or 'unknown'}"
+        )
+
+    async def stream_content(self, model: str, payload: Dict[str, Any], api_key: str) -> AsyncIterator[str]:
+        """streamGenerateContent を SSE で受け、テキスト断片を届いた順に返す。"""
+        import httpx
+        client = await self._ensure()
+        model = normalize_model_name(model)
+        async with self._semaphore:
+            started = time.perf_counter()
+            status = "error"
+            try:
+                async with client.stream(
+                    "POST",
+                    self.endpoint(model, "streamGenerateContent"),
+                    params={"alt": "sse", "key": api_key},
+                    json=payload,
+                ) as resp:
+                    status = str(resp.status_code)
+                    GEMINI_BYTES_OUT.inc((model,), len(resp.request.content))
+                    try:
+                        if resp.status_code >= 400:
+                            detail = (await resp.aread()).decode("utf-8", errors="replace")
+                            raise GeminiAPIError(resp.status_code, parse_api_error_detail(detail))
+                        async for line in resp.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if not data or data == "[DONE]":
+                                continue
+                            text = extract_text(json.loads(data))
+                            if text:
+                                yield text
+                    finally:
+                        GEMINI_BYTES_IN.inc((model,), resp.num_bytes_downloaded)
+            except httpx.HTTPError as e:
+                raise RuntimeError(f"Gemini API request failed: {str(e)}") from e
+            finally:
+                # ストリームは最後の断片を受け取るまでの時間
+                GEMINI_LATENCY.observe((model, status), time.perf_counter() - started)
+
+    async def stream_with_fallback(
+        self, models: List[str], payload: Dict[str, Any], api_key: str
+    ) -> AsyncIterator[Tuple[str, str]]:
+        """(モデル, テキスト断片) を返す。最初の断片より前の 404/503 のみ次候補へフォールバックする。"""
+        queue = self.registry.candidates(models)
+        skipped = [m for m in models if m not in queue]
+        last_error = None
+        for model in queue:
+            started = False
+            try:
+                async for text in self.stream_content(model, payload, api_key):
+                    started = True
+                    yield model, text
+            except GeminiAPIError as e:
+                if started or e.status_code not in FALLBACK_STATUS_CODES:
+                    raise RuntimeError(f"Gemini API error: {e.message}") from e
+                self.registry.mark_unavailable(model, e.status_code, e.message)
+                GEMINI_FALLBACKS.inc((normalize_model_name(model),))
+                last_error = f"{model}: {e.message}"
+                continue
+            self.registry.mark_available(model)
+            return
+        detail = f"Tried: {', '.join(queue) or '-'}."
+        if skipped:
+            detail += f" Skipped (recently unavailable): {', '.join(skipped)}."
+        raise RuntimeError(
+            "No available Gemini model for streamGenerateContent. "
+            f"{detail} Last error: {last_error or 'unknown'}"
+        )
+
+    async def aclose(self) -> None:
+        client, self._client = self._client, None
+        self._loop = None
+        if client is not None:
+            await _close_quietly(client)
+
+
+async def _close_quietly(client: "httpx.AsyncClient") -> None:
+    # 別ループで作った接続プールも閉じる（ソケットの解放が目的なので、閉じる途中の失敗は無視する）
+    try:
+        await client.aclose()
+    except Exception:
+        pass
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+見積レスポンスの JSON エンコード（UTF-8 バイト列を直接生成）
+- orjson があれば使う（インデントなし・中間の str を作らない）。無ければ標準 json にフォールバック
+  （ensure_ascii=False・区切りの空白なし。Starlette の JSONResponse と同じ出力）
+- ESTIMATE_JSON_ENCODER=stdlib で標準 json に固定できる（既定 auto）。set_encoder() で実行中にも切り替え可能
+- orjson が扱えない値（64bit を超える整数など）はその呼び出しだけ標準 json で書き出す
+- loads: JSON のデコード（orjson があれば使う。bytes をそのまま受け取る。不正な入力は ValueError）
+- FastJSONResponse: FastAPI / Starlette の JSONResponse の置き換え（参照時に作る。function_app は starlette を読み込まない）
+"""
+
+import json
+import os
+from typing import Any, Callable
+
+try:
+    import orjson  # type: ignore
+except ImportError:  # pragma: no cover - orjson 未導入環境（Dify など）
+    orjson = None
+
+ENCODERS = ("orjson", "stdlib")
+
+
+def dumps_stdlib(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_orjson(obj: Any) -> bytes:
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        return dumps_stdlib(obj)
+
+
+def _select(name: str) -> Callable[[Any], bytes]:
+    if name not in ("auto",) + ENCODERS:
+        raise ValueError(f"unknown JSON encoder: {name!r} (expected auto, orjson or stdlib)")
+    if name == "stdlib" or orjson is None:
+        if name == "orjson":
+            raise ValueError("orjson is not installed")
+        return dumps_stdlib
+    return dumps_orjson
+
+
+dumps_bytes: Callable[[Any], bytes] = _select(os.getenv("ESTIMATE_JSON_ENCODER", "auto").strip().lower())
+
+
+def set_encoder(name: str) -> str:
+    """エンコーダーを切り替え、実際に使われるエンコーダー名を返す。"""
+    global dumps_bytes
+    dumps_bytes = _select(name)
+    return encoder_name()
+
+
+def encoder_name() -> str:
+    return "orjson" if dumps_bytes is dumps_orjson else "stdlib"
+
+
+def loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def __getattr__(name: str) -> Any:
+    if name != "FastJSONResponse":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from starlette.responses import JSONResponse
+
+    class FastJSONResponse(JSONResponse):
+        def render(self, content: Any) -> bytes:
+            return dumps_bytes(content)
+
+    globals()["FastJSONResponse"] = FastJSONResponse
+    return FastJSONResponse
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Prometheus テキスト形式（exposition format 0.0.4）のメトリクス
+- 外部依存なしの Counter / Gauge / Histogram とレジストリ。GET /metrics で REGISTRY.render() を返す
+- 記録はラベル値タプル → 値の dict 更新のみ（ホットパスではロックを取らない。
+  asyncio の単一スレッド前提で、スレッド間の競合では稀にカウントを取りこぼし得る）
+- MetricsMiddleware: 指定パス配下の HTTP リクエスト数・ステータス・レイテンシ（ASGI ミドルウェア）
+- observe_stage: 見積の段階別時間（estimate_engine の計測付き評価から呼ばれる）
+"""
+
+import bisect
+import time
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 秒単位の既定バケット（見積の段階は µs〜ms、HTTP/Gemini は ms〜s）
+STAGE_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3, 1e-2)
+HTTP_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+GEMINI_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, labels: Tuple = (), amount: float = 1) -> None:
+        values = self._values
+        values[labels] = values.get(labels, 0) + amount
+
+    def value(self, labels: Tuple = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def clear(self) -> None:
+        self._values.clear()
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}"
+                for labels, v in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, labels: Tuple = ()) -> None:
+        self._values[labels] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Iterable[float] = HTTP_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベル値 → [バケットごとの件数（非累積、最後は +Inf）..., 合計, 件数]
+        self._series: Dict[Tuple, List[float]] = {}
+
+    def observe(self, labels: Tuple, value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def count(self, labels: Tuple = ()) -> int:
+        series = self._series.get(labels)
+        return series[-1] if series else 0
+
+    def clear(self) -> None:
+        self._series.clear()
+
+    def render(self) -> List[str]:
+        lines = []
+        bounds = self.buckets + (float("inf"),)
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(bounds, series):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            tag = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{tag} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{tag} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Iterable[float] = HTTP_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def clear(self) -> None:
+        for metric in self._metrics.values():
+            metric.clear()
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    "estimate_http_requests_total", "HTTP requests by route, method and status code.",
+    ("route", "method", "status"))
+HTTP_LATENCY = REGISTRY.histogram(
+    "estimate_http_request_duration_seconds", "HTTP request latency until the last response byte.",
+    ("route", "method"), HTTP_BUCKETS)
+STAGE_LATENCY = REGISTRY.histogram(
+    "estimate_stage_duration_seconds",
+    "Time spent per estimate stage (parse, axes, resolve, effort, cost, profit).",
+    ("stage",), STAGE_BUCKETS)
+GEMINI_LATENCY = REGISTRY.histogram(
+    "gemini_request_duration_seconds", "Gemini API call latency by model and status.",
+    ("model", "status"), GEMINI_BUCKETS)
+GEMINI_FALLBACKS = REGISTRY.counter(
+    "gemini_fallbacks_total", "Gemini calls that fell back to the next candidate, by failed model.",
+    ("model",))
+GEMINI_BYTES_OUT = REGISTRY.counter(
+    "gemini_request_bytes_total", "Request body bytes sent to Gemini.", ("model",))
+GEMINI_BYTES_IN = REGISTRY.counter(
+    "gemini_response_bytes_total", "Response body bytes received from Gemini.", ("model",))
+
+MEMO_LOOKUPS = REGISTRY.counter(
+    "estimate_memo_lookups_total", "Memoized /calculate lookups by result (hit, miss, bypass).", ("result",))
+MEMO_ENTRIES = REGISTRY.gauge("estimate_memo_entries", "Entries held by the /calculate memo.")
+MEMO_HIT_RATIO = REGISTRY.gauge(
+    "estimate_memo_hit_ratio", "Hits / (hits + misses) of the /calculate memo since start or last clear.")
+
+POOL_TASKS = REGISTRY.counter(
+    "estimate_pool_tasks_total", "CPU-bound estimate tasks by job and where they ran (pool chunk, thread when the pool is off, or inline for small batches).",
+    ("job", "mode"))
+POOL_WORKERS = REGISTRY.gauge("estimate_pool_workers", "Running worker processes of the estimate pool.")
+
+SESSION_PATCHES = REGISTRY.counter(
+    "estimate_session_patches_total",
+    "Estimate session patches by outcome (incremental: downstream values only, full: plan changed, reused: nothing to recompute).",
+    ("outcome",))
+SESSIONS = REGISTRY.gauge("estimate_sessions", "Open estimate sessions.")
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    STAGE_LATENCY.observe((stage,), seconds)
+
+
+class MetricsMiddleware:
+    """prefixes 配下の HTTP リクエストについて件数・ステータス・レイテンシを記録する ASGI ミドルウェア。"""
+
+    def __init__(self, app, prefixes: Sequence[str] = ("/",)):
+        self.app = app
+        self.prefixes = tuple(prefixes)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # ルーティング後はマッチしたルートのパス（パスパラメータを含まない）でまとめる
+            route = scope.get("route")
+            name = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_LATENCY.observe((name, method), time.perf_counter() - started)
+            HTTP_REQUESTS.inc((name, method, str(status[0])))
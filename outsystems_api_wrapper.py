@@ -1,46 +1,131 @@
 # -*- coding: utf-8 -*-
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from contextlib import asynccontextmanager
+from functools import partial
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, BeforeValidator
+from pydantic_core import PydanticCustomError
+from typing import TYPE_CHECKING, Annotated, List, Optional, Dict, Any
 import json
 import os
 import sys
-import urllib.request
-import urllib.error
-import html
+import time
 
-# dify_assets/code/estimate_logic.py があるディレクトリをパスに追加
-sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "dify_assets", "code"))
-from estimate_logic import main as dify_main
+# dify_assets/code/estimate_logic.py を明示的に参照（ルートの estimate_logic.py と取り違えないため）
+# 別ディレクトリから起動された場合だけ sys.path に追加する
+_HERE = os.path.dirname(os.path.abspath(__file__))
+if _HERE not in sys.path:
+    sys.path.append(_HERE)
+from dify_assets.code.estimate_logic import INPUT_SCHEMA, estimate as dify_estimate, set_stage_observer
+from config_snapshot import shared_store
+from estimate_schema import json_safe
+from estimate_batch import main_batch
+from estimate_memo import EstimateMemo
+from estimate_session import EstimateSessions
+from gemini_client import MODEL_HEALTH, GeminiClient, normalize_model_name
+from json_response import FastJSONResponse
+from report_cache import ReportCache, make_report_key, render_report_html
+from profiling import PROFILE_HEADER, PROFILE_PARAM, ProfilingSettings, profile_call, record_stage, requested_mode, server_timing
+import metrics
 
-app = FastAPI(title="AI Estimation API for OutSystems")
+# 利用頻度の低い機能（grid / solve / simulate / departments / diff とプロセスプール）のモジュールは
+# 各ルート（プールは lifespan）で初めて使う時に import する（import 時間に載せない）
+if TYPE_CHECKING:
+    from estimate_pool import EstimatePool
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
 
+# /report/stream の途中経過の html イベントの最小間隔（秒）。途中の HTML はそこまでの全文を描き直すため間引く
+# （最後の HTML は done イベントで1回だけ作る）
+REPORT_STREAM_HTML_INTERVAL = float(os.getenv("REPORT_STREAM_HTML_INTERVAL", "1.0"))
 
-def _normalize_model_name(model: str) -> str:
-    value = (model or "").strip()
-    if value.startswith("models/"):
-        value = value[len("models/") :]
-    return value
+# keep-alive 接続をプールする Gemini クライアント（GEMINI_BASE_URL でスタブに差し替え可）
+gemini_client = GeminiClient()
 
+# 設定スナップショット（estimate_config.yaml。シミュレーションのブレ幅などに使う。プロセス共有のストア）
+CONFIG_STORE = shared_store()
 
-def _build_gemini_endpoint(model: str) -> str:
-    normalized = _normalize_model_name(model)
-    return f"https://generativelanguage.googleapis.com/v1beta/models/{normalized}:generateContent"
+# /report のキャッシュ（REPORT_CACHE_SIZE / REPORT_CACHE_TTL / REPORT_CACHE_DB）
+report_cache = ReportCache.from_env()
 
+# /calculate のメモ化（ESTIMATE_MEMO_SIZE / ESTIMATE_MEMO_TTL、config_version が変わると全件破棄）
+estimate_memo = EstimateMemo.from_env()
+
+# 差分再計算の見積セッション（ESTIMATE_SESSION_MAX / ESTIMATE_SESSION_TTL）
+estimate_sessions = EstimateSessions.from_env()
+
+# batch / grid / solve / simulate のプロセスプール（ESTIMATE_POOL_WORKERS、既定は無効。lifespan で起動・停止）。
+# 初回の _pool() で作る
+estimate_pool: Optional["EstimatePool"] = None
+
+
+def _pool() -> "EstimatePool":
+    global estimate_pool
+    if estimate_pool is None:
+        from estimate_pool import EstimatePool
+        estimate_pool = EstimatePool.from_env()
+    return estimate_pool
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await _pool().start()
+    yield
+    await _pool().shutdown()
+    await gemini_client.aclose()
+    report_cache.close()
+
+
+# レスポンスは orjson（無ければ標準 json）で UTF-8 バイト列に直接エンコードする
+app = FastAPI(title="AI Estimation API for OutSystems", lifespan=lifespan, default_response_class=FastJSONResponse)
+
+
+@app.exception_handler(RequestValidationError)
+async def validation_error(request: Request, exc: RequestValidationError) -> FastJSONResponse:
+    # 既定のハンドラと同じ 422。入力の NaN / Infinity（errors の input）は出力できないので文字列にする
+    return FastJSONResponse(status_code=422, content={"detail": json_safe(jsonable_encoder(exc.errors()))})
+
+
+# /metrics: /calculate*・/report* のリクエスト数・ステータス・レイテンシと、見積の段階別時間
+app.add_middleware(metrics.MetricsMiddleware, prefixes=("/calculate", "/report"))
+
+
+def _observe_stage_profiled(stage: str, seconds: float) -> None:
+    metrics.observe_stage(stage, seconds)
+    record_stage(stage, seconds)
+
+
+def configure_profiling(settings: ProfilingSettings) -> None:
+    # 無効時は段階別時間の観測先を metrics のみにする（プロファイル用のフックを経由しない）
+    global PROFILING
+    PROFILING = settings
+    set_stage_observer(_observe_stage_profiled if settings.enabled else metrics.observe_stage)
+
+
+# リクエスト単位のプロファイリング（ESTIMATE_PROFILING=1 で有効、X-Estimate-Profile / ?profile= で要求）
+PROFILING = ProfilingSettings()
+configure_profiling(ProfilingSettings.from_env())
+
+def _schema_field(name: str) -> BeforeValidator:
+    # Dify と同じ変換器で文字列入力（"15%"・全角数字・カンマ/改行区切り・"Rank3:0.8"）を型付きの値にする。
+    # 解釈できない値は 422（type は FieldError のコード、ctx.errors に全件）
+    def validate(value: Any) -> Any:
+        if value is None:
+            return value
+        value, errors = INPUT_SCHEMA.coerce(name, value)
+        if errors:
+            raise PydanticCustomError(errors[0].code, "; ".join(e.message for e in errors),
+                                      {"errors": [e.to_dict() for e in errors]})
+        return value
+    return BeforeValidator(validate)
 
-def _parse_api_error_detail(detail: str) -> str:
-    try:
-        data = json.loads(detail)
-        return data.get("error", {}).get("message", detail)
-    except Exception:
-        return detail
 
 class EstimationRequest(BaseModel):
-    screen_count: int = 0
-    table_count: int = 0
+    screen_count: Annotated[int, _schema_field("screen_count")] = 0
+    table_count: Annotated[int, _schema_field("table_count")] = 0
     estimation_profile: Optional[str] = None
     profile: Optional[str] = None
     department: Optional[str] = None
@@ -49,13 +134,61 @@ class EstimationRequest(BaseModel):
     dev_type: Optional[str] = None
     target_platform: Optional[str] = None
     confidence: Optional[str] = None
-    features: Optional[List[str]] = None
-    phase2_items: Optional[List[str]] = None
-    phase3_items: Optional[List[str]] = None
-    tables: Optional[List[str]] = None
-    dept_allocation: Optional[List[Dict[str, Any]]] = None
-    team_ratio: Optional[Dict[str, float]] = None
-    target_margin: Optional[float] = None
+    features: Annotated[Optional[List[str]], _schema_field("features")] = None
+    phase2_items: Annotated[Optional[List[str]], _schema_field("phase2_items")] = None
+    phase3_items: Annotated[Optional[List[str]], _schema_field("phase3_items")] = None
+    tables: Annotated[Optional[List[str]], _schema_field("tables")] = None
+    dept_allocation: Annotated[Optional[List[Dict[str, Any]]], _schema_field("dept_allocation")] = None
+    team_ratio: Annotated[Optional[Dict[str, float]], _schema_field("team_ratio")] = None
+    target_margin: Annotated[Optional[float], _schema_field("target_margin")] = None
+
+
+class BatchEstimationRequest(BaseModel):
+    requests: List[EstimationRequest]
+
+
+class GridRequest(BaseModel):
+    base: EstimationRequest = EstimationRequest()
+    # 軸名 → 値リスト（係数軸は null/空 で CONFIG の全値）
+    axes: Dict[str, Optional[List[Any]]]
+
+
+class BudgetSolveRequest(BaseModel):
+    budget: int
+    # features / phase2_items / phase3_items は必須項目、その他は固定条件
+    base: EstimationRequest = EstimationRequest()
+    maximize: str = "screen_count"
+    # 任意項目の候補（null なら必須以外の全項目）
+    optional_features: Optional[List[str]] = None
+    optional_phase2: Optional[List[str]] = None
+    optional_phase3: Optional[List[str]] = None
+
+
+class SimulationRequest(BaseModel):
+    base: EstimationRequest = EstimationRequest()
+    # estimate_simulation.DEFAULT_SAMPLES と同じ（標本数は計算時間に比例する）
+    samples: int = 20000
+    seed: Optional[int] = None
+    # 対象 → 分布（screen_count / table_count / feature_days / vendor / complexity）
+    distributions: Optional[Dict[str, Dict[str, Any]]] = None
+
+
+class DepartmentRankingRequest(BaseModel):
+    base: EstimationRequest = EstimationRequest()
+    # price（売価の安い順） / operating_margin（営業利益率の高い順）
+    sort_by: str = "price"
+
+
+class EstimateDiffSide(BaseModel):
+    # いずれか1つ: 見積リクエスト / 保存済みの /calculate の結果 / 見積セッションID（現在の結果）
+    request: Optional[EstimationRequest] = None
+    result: Optional[Dict[str, Any]] = None
+    session_id: Optional[str] = None
+
+
+class EstimateDiffRequest(BaseModel):
+    base: EstimateDiffSide
+    revised: EstimateDiffSide
 
 
 class ReportRequest(BaseModel):
@@ -66,10 +199,7 @@ class ReportRequest(BaseModel):
     output_format: Optional[str] = "markdown"
 
 
-def generate_report_with_gemini(request: ReportRequest) -> str:
-    if not GEMINI_API_KEY:
-        raise RuntimeError("GEMINI_API_KEY is not set")
-
+def build_report_payload(request: ReportRequest) -> Dict[str, Any]:
     system_instruction = (
         "You are an expert estimation consultant. "
         "Write a clear, concise Markdown report in the requested language."
@@ -87,7 +217,7 @@ def generate_report_with_gemini(request: ReportRequest) -> str:
         parts.append({"text": "User Notes:"})
         parts.append({"text": request.user_notes})
 
-    payload = {
+    return {
         "contents": [
             {
                 "role": "user",
@@ -96,39 +226,20 @@ def generate_report_with_gemini(request: ReportRequest) -> str:
         ]
     }
 
-    data = json.dumps(payload).encode("utf-8")
 
-    primary_model = _normalize_model_name(GEMINI_MODEL)
+def _model_candidates() -> List[str]:
+    primary_model = normalize_model_name(GEMINI_MODEL)
     fallback_models = ["gemini-2.5-flash", "gemini-2.0-flash", "gemini-1.5-flash"]
-    model_candidates = [primary_model] + [m for m in fallback_models if m != primary_model]
-    last_error = None
-
-    for model in model_candidates:
-        req = urllib.request.Request(
-            _build_gemini_endpoint(model) + f"?key={GEMINI_API_KEY}",
-            data=data,
-            headers={"Content-Type": "application/json"},
-            method="POST",
-        )
-        try:
-            with urllib.request.urlopen(req, timeout=30) as resp:
-                body = json.loads(resp.read().decode("utf-8"))
-                break
-        except urllib.error.HTTPError as e:
-            detail = e.read().decode("utf-8")
-            message = _parse_api_error_detail(detail)
-            # モデル未対応時のみ次候補へフォールバック
-            if e.code == 404:
-                last_error = f"{model}: {message}"
-                continue
-            raise RuntimeError(f"Gemini API error: {message}") from e
-        except Exception as e:
-            raise RuntimeError(f"Gemini API request failed: {str(e)}") from e
-    else:
-        raise RuntimeError(
-            "No available Gemini model for generateContent. "
-            f"Tried: {', '.join(model_candidates)}. Last error: {last_error or 'unknown'}"
-        )
+    return [primary_model] + [m for m in fallback_models if m != primary_model]
+
+
+async def generate_report_with_gemini(request: ReportRequest) -> str:
+    if not GEMINI_API_KEY:
+        raise RuntimeError("GEMINI_API_KEY is not set")
+
+    payload = build_report_payload(request)
+
+    body, _ = await gemini_client.generate_with_fallback(_model_candidates(), payload, GEMINI_API_KEY)
 
     candidates = body.get("candidates", [])
     if not candidates:
@@ -139,17 +250,176 @@ def generate_report_with_gemini(request: ReportRequest) -> str:
         raise RuntimeError("Gemini API returned empty content")
     return parts[0].get("text", "").strip()
 
+
+def _to_logic_args(request: EstimationRequest) -> Dict[str, Any]:
+    # Pydanticモデルを辞書に変換してDify互換ロジックに渡す
+    req_data = request.model_dump()
+    if not req_data.get("estimation_profile") and req_data.get("profile"):
+        req_data["estimation_profile"] = req_data["profile"]
+    return req_data
+
+
+def _to_patch_args(request: EstimationRequest) -> Dict[str, Any]:
+    # パッチは送られた項目だけ（null は明示的な未指定として上書きする）
+    fields = request.model_dump(exclude_unset=True)
+    if fields.get("profile") and not fields.get("estimation_profile"):
+        fields["estimation_profile"] = fields["profile"]
+    return fields
+
+
+def _profile_mode(http_request: Request) -> Optional[str]:
+    if not PROFILING.enabled:
+        return None
+    return requested_mode(http_request.headers.get(PROFILE_HEADER), http_request.query_params.get(PROFILE_PARAM))
+
+
 @app.post("/calculate")
-async def calculate(request: EstimationRequest):
+async def calculate(request: EstimationRequest, http_request: Request):
     try:
-        # Pydanticモデルを辞書に変換してDify互換ロジックに渡す
-        req_data = request.dict()
-        if not req_data.get("estimation_profile") and req_data.get("profile"):
-            req_data["estimation_profile"] = req_data["profile"]
-        result = dify_main(**req_data)
-        if isinstance(result, dict) and "result" in result:
-            return json.loads(result["result"])
-        return result
+        mode = _profile_mode(http_request)
+        if mode is None:
+            # dict のまま受け取り、そのまま1回だけJSON化して返す（同値な入力はメモから）
+            return FastJSONResponse(estimate_memo.estimate(_to_logic_args(request)))
+        result, trace = profile_call(lambda: dify_estimate(**_to_logic_args(request)), mode, PROFILING, "calculate")
+        result["profile_trace"] = trace
+        return FastJSONResponse(result, headers={"Server-Timing": server_timing(trace)})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/calculate/cache")
+async def calculate_cache_stats():
+    return estimate_memo.snapshot()
+
+
+@app.get("/calculate/pool")
+async def calculate_pool_stats():
+    return _pool().snapshot()
+
+
+@app.get("/calculate/sessions")
+async def calculate_session_stats():
+    return estimate_sessions.snapshot()
+
+
+@app.post("/calculate/sessions")
+async def create_session(request: EstimationRequest):
+    try:
+        return FastJSONResponse(estimate_sessions.create(_to_logic_args(request)))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/calculate/sessions/{session_id}")
+async def get_session(session_id: str):
+    try:
+        return FastJSONResponse(estimate_sessions.get(session_id))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired session: {session_id}")
+
+
+@app.patch("/calculate/sessions/{session_id}")
+async def patch_session(session_id: str, request: EstimationRequest, include_result: bool = True):
+    try:
+        return FastJSONResponse(estimate_sessions.patch(session_id, _to_patch_args(request), include_result))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired session: {session_id}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.delete("/calculate/sessions/{session_id}")
+async def delete_session(session_id: str):
+    try:
+        estimate_sessions.delete(session_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired session: {session_id}")
+    return {"status": "deleted", "session_id": session_id}
+
+
+def _to_diff_side(side: EstimateDiffSide) -> Dict[str, Any]:
+    fields = side.model_dump(exclude_none=True)
+    if side.request is not None:
+        fields["request"] = _to_logic_args(side.request)
+    return fields
+
+
+@app.post("/calculate/diff")
+async def calculate_diff(request: EstimateDiffRequest):
+    try:
+        # リクエスト側はメモを通して計算する（同じ入力の再計算をしない）
+        from estimate_diff import diff_estimates
+        return FastJSONResponse(diff_estimates(_to_diff_side(request.base), _to_diff_side(request.revised),
+                                               estimate=estimate_memo.estimate, sessions=estimate_sessions))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired session: {e.args[0]}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/calculate/batch")
+async def calculate_batch(request: BatchEstimationRequest):
+    try:
+        results = await _pool().map_chunks("batch", main_batch, [_to_logic_args(r) for r in request.requests])
+        return FastJSONResponse({"status": "success", "count": len(results), "results": results})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/calculate/grid")
+async def calculate_grid(request: GridRequest):
+    try:
+        from estimate_grid import sensitivity_grid
+        return FastJSONResponse(await _pool().run("grid", sensitivity_grid, _to_logic_args(request.base), request.axes))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/calculate/solve")
+async def calculate_solve(request: BudgetSolveRequest):
+    try:
+        from estimate_solver import solve_budget
+        return FastJSONResponse(await _pool().run("solve", partial(
+            solve_budget,
+            request.budget,
+            _to_logic_args(request.base),
+            maximize=request.maximize,
+            optional_features=request.optional_features,
+            optional_phase2=request.optional_phase2,
+            optional_phase3=request.optional_phase3,
+        )))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/calculate/simulate")
+async def calculate_simulate(request: SimulationRequest):
+    try:
+        from estimate_simulation import simulate
+        return FastJSONResponse(await _pool().run("simulate", partial(
+            simulate,
+            _to_logic_args(request.base),
+            samples=request.samples,
+            seed=request.seed,
+            distributions=request.distributions,
+            # ブレ幅はアプリの設定スナップショットから渡す（ワーカーも同じ値で計算する）
+            vendor_variance=dict(CONFIG_STORE.get().vendor_variance),
+        )))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/calculate/departments")
+async def calculate_departments(request: DepartmentRankingRequest):
+    try:
+        from estimate_departments import rank_departments
+        return FastJSONResponse(rank_departments(_to_logic_args(request.base), sort_by=request.sort_by))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -158,21 +428,94 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def get_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.post("/report")
-async def report(request: ReportRequest):
+async def report(request: ReportRequest, http_response: Response):
     try:
-        report_text = generate_report_with_gemini(request)
-        response = {"status": "success", "report_markdown": report_text}
+        cache_key = make_report_key(
+            request.estimation_result, request.rag_context, request.user_notes,
+            request.language, normalize_model_name(GEMINI_MODEL),
+        )
+        entry = report_cache.get(cache_key)
+        http_response.headers["X-Report-Cache"] = "hit" if entry is not None else "miss"
+        if entry is None:
+            report_text = await generate_report_with_gemini(request)
+            entry = report_cache.put(cache_key, report_text)
+        response = {"status": "success", "report_markdown": entry.markdown}
         if (request.output_format or "").lower() == "html":
-            try:
-                import markdown  # type: ignore
-                response["report_html"] = markdown.markdown(report_text)
-            except Exception:
-                response["report_html"] = f"<pre>{html.escape(report_text)}</pre>"
+            response["report_html"] = report_cache.html_for(cache_key, entry)
         return response
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/report/stream")
+async def report_stream(request: ReportRequest):
+    # Gemini の生成をそのまま SSE で中継（markdown 断片 → 任意で HTML の途中経過（間引き） → done）
+    with_html = (request.output_format or "").lower() == "html"
+    cache_key = make_report_key(
+        request.estimation_result, request.rag_context, request.user_notes,
+        request.language, normalize_model_name(GEMINI_MODEL),
+    )
+
+    async def events():
+        entry = report_cache.get(cache_key)
+        try:
+            if entry is None:
+                if not GEMINI_API_KEY:
+                    raise RuntimeError("GEMINI_API_KEY is not set")
+                chunks = []
+                rendered_at = None
+                async for model, text in gemini_client.stream_with_fallback(
+                    _model_candidates(), build_report_payload(request), GEMINI_API_KEY
+                ):
+                    if not chunks:
+                        yield _sse("meta", {"model": model, "cache": "miss"})
+                    chunks.append(text)
+                    yield _sse("markdown", {"text": text})
+                    if with_html and "\n" in text:
+                        now = time.monotonic()
+                        if rendered_at is None or now - rendered_at >= REPORT_STREAM_HTML_INTERVAL:
+                            rendered_at = now
+                            yield _sse("html", {"html": render_report_html("".join(chunks))})
+                if not chunks:
+                    raise RuntimeError("Gemini API returned empty content")
+                entry = report_cache.put(cache_key, "".join(chunks).strip())
+            else:
+                yield _sse("meta", {"cache": "hit"})
+                yield _sse("markdown", {"text": entry.markdown})
+            done = {"status": "success", "report_markdown": entry.markdown}
+            if with_html:
+                done["report_html"] = report_cache.html_for(cache_key, entry)
+            yield _sse("done", done)
+        except Exception as e:
+            yield _sse("error", {"status": "error", "detail": str(e)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/report/cache")
+async def report_cache_stats():
+    return report_cache.snapshot()
+
+
+@app.get("/report/models")
+async def report_model_health():
+    # 利用不可として記憶中のモデル（TTL内のみ）
+    return {"unavailable": MODEL_HEALTH.snapshot(), "hedge_after": gemini_client.hedge_after}
+
 if __name__ == "__main__":
     import uvicorn
     # OutSystemsサーバーからアクセス可能なホスト・ポートで起動
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+リクエスト単位のプロファイリング（オプトイン）
+- ESTIMATE_PROFILING=1 のときだけ有効。無効時は呼び出し側が通常経路をそのまま通す（計測コードを経由しない）
+- X-Estimate-Profile ヘッダー または ?profile= で要求する
+    timing（または 1 / true）: 段階別の時間（parse / axes / resolve / effort / cost / profit）と合計
+    cprofile                  : timing に加えて cProfile の上位 N 関数（累積時間順）
+- ESTIMATE_PROFILING_DIR を指定すると、トレース JSON（cprofile 時は .prof も）をそのディレクトリに書き出す
+- cProfile / pstats は cprofile 要求時にだけ import する（起動時には読み込まない）
+"""
+
+import contextvars
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import cProfile
+
+PROFILE_HEADER = "X-Estimate-Profile"
+PROFILE_PARAM = "profile"
+
+# 実行中のリクエストの段階別時間（profile_call の間だけ list が入る）
+_active_stages: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar(
+    "estimate_profile_stages", default=None)
+
+
+@dataclass(frozen=True)
+class ProfilingSettings:
+    enabled: bool = False
+    top_n: int = 20
+    output_dir: Optional[str] = None
+
+    @classmethod
+    def from_env(cls) -> "ProfilingSettings":
+        return cls(
+            enabled=os.getenv("ESTIMATE_PROFILING", "0").strip().lower() in ("1", "true", "yes", "on"),
+            top_n=int(os.getenv("ESTIMATE_PROFILING_TOP_N", "20")),
+            output_dir=os.getenv("ESTIMATE_PROFILING_DIR") or None,
+        )
+
+
+def requested_mode(header_value: Optional[str], param_value: Optional[str]) -> Optional[str]:
+    """ヘッダー/クエリの値 → "timing" / "cprofile" / None（要求なし）"""
+    value = (header_value or param_value or "").strip().lower()
+    if value in ("1", "true", "timing"):
+        return "timing"
+    if value == "cprofile":
+        return "cprofile"
+    return None
+
+
+def record_stage(stage: str, seconds: float) -> None:
+    """段階別時間の観測フック（profile_call の外では何もしない）。"""
+    stages = _active_stages.get()
+    if stages is not None:
+        stages.append((stage, seconds))
+
+
+def _top_stats(profiler: "cProfile.Profile", top_n: int) -> List[Dict[str, Any]]:
+    import pstats
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:top_n]
+    return [{
+        "function": f"{os.path.basename(filename)}:{line}({name})",
+        "calls": nc,
+        "primitive_calls": cc,
+        "tottime_ms": round(tt * 1000, 4),
+        "cumtime_ms": round(ct * 1000, 4),
+    } for (filename, line, name), (cc, nc, tt, ct, _) in rows]
+
+
+def _write(trace: Dict[str, Any], profiler: Optional["cProfile.Profile"], output_dir: str, label: str) -> str:
+    import uuid
+    os.makedirs(output_dir, exist_ok=True)
+    base = os.path.join(output_dir, f"{time.strftime('%Y%m%dT%H%M%S')}-{label}-{uuid.uuid4().hex[:8]}")
+    if profiler is not None:
+        profiler.dump_stats(base + ".prof")
+    with open(base + ".json", "w", encoding="utf-8") as f:
+        json.dump(trace, f, ensure_ascii=False, indent=2)
+    return base + ".json"
+
+
+def profile_call(fn: Callable[[], Any], mode: str, settings: ProfilingSettings, label: str) -> Tuple[Any, Dict[str, Any]]:
+    """fn() を計測付きで実行し (結果, トレース) を返す。"""
+    stages: List[Tuple[str, float]] = []
+    token = _active_stages.set(stages)
+    profiler = None
+    if mode == "cprofile":
+        import cProfile
+        profiler = cProfile.Profile()
+    started = time.perf_counter()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            result = fn()
+        finally:
+            if profiler is not None:
+                profiler.disable()
+    finally:
+        total = time.perf_counter() - started
+        _active_stages.reset(token)
+
+    trace: Dict[str, Any] = {
+        "mode": mode,
+        "total_ms": round(total * 1000, 4),
+        "stages": [{"stage": stage, "ms": round(seconds * 1000, 4)} for stage, seconds in stages],
+    }
+    if profiler is not None:
+        trace["cprofile"] = _top_stats(profiler, settings.top_n)
+    if settings.output_dir:
+        trace["file"] = _write(trace, profiler, settings.output_dir, label)
+    return result, trace
+
+
+def server_timing(trace: Dict[str, Any]) -> str:
+    """Server-Timing ヘッダー値（ブラウザの開発者ツールで段階別に表示される）"""
+    parts = [f"{s['stage']};dur={s['ms']}" for s in trace["stages"]]
+    parts.append(f"total;dur={trace['total_ms']}")
+    return ", ".join(parts)
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+/report 用のコンテンツアドレス型キャッシュ
+- キー: estimation_result / rag_context / user_notes / language / model の正規化JSONの SHA-256
+- 1次: メモリ上の LRU（件数上限・TTL）
+- 2次: SQLite（任意。REPORT_CACHE_DB を指定した場合のみ。再起動後も有効）
+- report_html のレンダリング結果もエントリに保持する
+"""
+
+import hashlib
+import html
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+# markdown モジュール（未解決: None / 未インストール: False）。import の成否は初回の1回だけ判定する
+_markdown: Any = None
+
+
+def _markdown_module():
+    global _markdown
+    if _markdown is None:
+        try:
+            import markdown  # type: ignore
+            _markdown = markdown
+        except ImportError:
+            _markdown = False
+    return _markdown
+
+
+def render_report_html(report_text: str) -> str:
+    md = _markdown_module()
+    if md:
+        try:
+            return md.markdown(report_text)
+        except Exception:
+            pass
+    return f"<pre>{html.escape(report_text)}</pre>"
+
+
+def make_report_key(estimation_result: Dict[str, Any], rag_context: Optional[str], user_notes: Optional[str],
+                    language: Optional[str], model: str) -> str:
+    canonical = json.dumps(
+        {
+            "estimation_result": estimation_result,
+            "rag_context": rag_context or None,
+            "user_notes": user_notes or None,
+            "language": language or "ja",
+            "model": model,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class CacheEntry:
+    __slots__ = ("markdown", "html", "created_at")
+
+    def __init__(self, markdown: str, html: Optional[str] = None, created_at: Optional[float] = None):
+        self.markdown = markdown
+        self.html = html
+        self.created_at = time.time() if created_at is None else created_at
+
+
+class ReportCache:
+    def __init__(self, max_entries: int = 256, ttl: float = 86400.0, db_path: Optional[str] = None,
+                 max_db_entries: int = 10000):
+        self.max_entries = max_entries
+        self.ttl = ttl  # 0以下なら無期限
+        self.max_db_entries = max_db_entries
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.stats = {"hits_memory": 0, "hits_disk": 0, "misses": 0, "evictions": 0, "expired": 0}
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS report_cache ("
+                " key TEXT PRIMARY KEY, markdown TEXT NOT NULL, html TEXT,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+
+    @classmethod
+    def from_env(cls) -> "ReportCache":
+        return cls(
+            max_entries=int(os.getenv("REPORT_CACHE_SIZE", "256")),
+            ttl=float(os.getenv("REPORT_CACHE_TTL", "86400")),
+            db_path=os.getenv("REPORT_CACHE_DB") or None,
+            max_db_entries=int(os.getenv("REPORT_CACHE_DB_SIZE", "10000")),
+        )
+
+    def _expired(self, entry: CacheEntry, now: float) -> bool:
+        return self.ttl > 0 and now - entry.created_at > self.ttl
+
+    def _remember(self, key: str, entry: CacheEntry) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry, now):
+                    self._memory.move_to_end(key)
+                    self.stats["hits_memory"] += 1
+                    return entry
+                del self._memory[key]
+                self.stats["expired"] += 1
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT markdown, html, created_at FROM report_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = CacheEntry(row[0], row[1], row[2])
+                    if not self._expired(entry, now):
+                        self._db.execute("UPDATE report_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                        self._remember(key, entry)
+                        self.stats["hits_disk"] += 1
+                        return entry
+                    self._db.execute("DELETE FROM report_cache WHERE key = ?", (key,))
+                    self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, key: str, markdown: str) -> CacheEntry:
+        entry = CacheEntry(markdown)
+        with self._lock:
+            self._remember(key, entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO report_cache (key, markdown, html, created_at, accessed_at)"
+                    " VALUES (?, ?, NULL, ?, ?)",
+                    (key, markdown, entry.created_at, entry.created_at),
+                )
+                self._db.execute(
+                    "DELETE FROM report_cache WHERE key IN ("
+                    " SELECT key FROM report_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_db_entries,),
+                )
+        return entry
+
+    def html_for(self, key: str, entry: CacheEntry) -> str:
+        # HTMLは初回要求時に1回だけレンダリングして保持
+        if entry.html is None:
+            entry.html = render_report_html(entry.markdown)
+            if self._db is not None:
+                with self._lock:
+                    self._db.execute("UPDATE report_cache SET html = ? WHERE key = ?", (entry.html, key))
+        return entry.html
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            data = dict(self.stats)
+            data["memory_entries"] = len(self._memory)
+            data["max_entries"] = self.max_entries
+            data["ttl"] = self.ttl
+            if self._db is not None:
+                data["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM report_cache").fetchone()[0]
+            return data
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM report_cache")
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
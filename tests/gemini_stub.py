@@ -0,0 +1,76 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class GeminiStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # テストから差し替える挙動
+    unavailable_models = set()
+    # モデル → フォールバック対象外のエラー（400 等）
+    error_models = {}
+    delay = 0.0
+    model_delays = {}
+    stream_interval = 0.0
+    calls = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        model = self.path.split("/models/", 1)[1].split(":", 1)[0]
+        type(self).calls.append(model)
+        delay = self.model_delays.get(model, self.delay)
+        if delay:
+            time.sleep(delay)
+        if model in self.unavailable_models:
+            self._send(404, {"error": {"code": 404, "message": f"models/{model} is not found"}})
+            return
+        if model in self.error_models:
+            status = self.error_models[model]
+            self._send(status, {"error": {"code": status, "message": f"models/{model} rejected the request"}})
+            return
+        text = body["contents"][0]["parts"][1]["text"]
+        if self.path.split("?", 1)[0].endswith(":streamGenerateContent"):
+            self._stream([f"# Report ({model})\n\n", f"{text}\n"])
+            return
+        self._send(200, {"candidates": [{"content": {"parts": [{"text": f"# Report ({model})\n\n{text}\n"}]}}]})
+
+    def _stream(self, chunks):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(self.stream_interval)
+            event = {"candidates": [{"content": {"parts": [{"text": chunk}]}}]}
+            self.wfile.write(f"data: {json.dumps(event)}\r\n\r\n".encode("utf-8"))
+            self.wfile.flush()
+        self.close_connection = True
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class GeminiStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # ヘッジでキャンセルされた接続の BrokenPipe などは無視
+        pass
+
+
+def start_stub():
+    """ローカルの Gemini スタブを起動し (server, base_url) を返す。"""
+    server = GeminiStubServer(("127.0.0.1", 0), GeminiStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1beta"
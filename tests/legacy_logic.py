@@ -0,0 +1,642 @@
+# -*- coding: utf-8 -*-
+"""
+ルールエンジン移行前の main_logic（3系統）と、入力スキーマ（estimate_schema）移行前の Dify prepare_args の凍結コピー
+- エンジン版・スキーマ版との出力一致テストと、ベンチマークの「移行前」計測に使う
+- テーブル類は各モジュールのものを参照する（計算式のみ凍結）
+"""
+
+from functools import lru_cache
+from typing import Any, Dict, List
+
+from dify_assets.code.estimate_logic import (
+    BS_ORG_CONFIG, CONFIG, DEFAULT_BS_DEPT, FEATURE_LABEL_MAP, FEATURE_MAN_DAYS, PHASE2_ITEMS, PHASE2_LABEL_MAP,
+    PHASE3_ITEMS, PHASE3_LABEL_MAP,
+)
+import estimate_logic as _root
+import function_app as _func
+
+
+def resolve_keys(input_list, label_map, item_dict):
+    if not isinstance(input_list, list):
+        return []
+    resolved = []
+    for x in input_list:
+        if not x:
+            continue
+        if x in label_map:
+            resolved.append(label_map[x])
+        elif x in item_dict:
+            resolved.append(x)
+    # 重複排除
+    return list(dict.fromkeys(resolved))
+
+
+def resolve_bs_org_rates(primary_dept: str, allocations: List[Dict[str, Any]] | None):
+    # デフォルト=主所属100%
+    if not primary_dept or primary_dept not in BS_ORG_CONFIG:
+        primary_dept = DEFAULT_BS_DEPT
+    if not allocations:
+        cfg = BS_ORG_CONFIG[primary_dept]
+        return (cfg["indirect_per_hour"], cfg["sga_on_propa_labor_rate"])
+
+    # 加重平均
+    total = sum(max(0.0, float(a.get("share", 0.0))) for a in allocations)
+    if total <= 0:
+        cfg = BS_ORG_CONFIG[primary_dept]
+        return (cfg["indirect_per_hour"], cfg["sga_on_propa_labor_rate"])
+
+    ipt = 0.0
+    sga_rate = 0.0
+    for a in allocations:
+        dept = a.get("dept")
+        share = max(0.0, float(a.get("share", 0.0))) / total
+        if dept in BS_ORG_CONFIG and share > 0:
+            cfg = BS_ORG_CONFIG[dept]
+            ipt += cfg["indirect_per_hour"] * share
+            sga_rate += cfg["sga_on_propa_labor_rate"] * share
+    return (int(round(ipt)), sga_rate)
+
+
+def compute_direct_labor_cost(total_man_days: float, team_ratio: Dict[str, float], rank_costs: Dict[str, int]) -> int:
+    # 人月換算：20日/月（= 160h/8h）
+    man_months = total_man_days / 20.0
+    avg_monthly_cost = sum(rank_costs.get(r, 0) * w for r, w in team_ratio.items())
+    return int(man_months * avg_monthly_cost)
+
+
+def compute_indirect_cost(total_man_days: float, indirect_yen_per_hour: float) -> int:
+    hours = total_man_days * 8.0
+    return int(hours * indirect_yen_per_hour)
+
+
+def calculate_profitability_ccs(
+    total_price: int,
+    cogs: int,
+    direct_labor_cost: int,
+    sga_rate_on_labor: float,
+    target_margin_input: float | None
+):
+    # 販管費 = 直接労務費 * 販管費率
+    total_sga = int(direct_labor_cost * sga_rate_on_labor)
+    
+    gross_profit = total_price - cogs
+    operating_profit = total_price - cogs - total_sga
+    operating_margin = (operating_profit / total_price) if total_price > 0 else 0.0
+
+    suggested_price = 0
+    if target_margin_input is not None:
+        # 逆算ロジック: TargetPrice = (COGS + SGA) / (1 - TargetMargin)
+        # ガードレール: 目標利益率が100%以上なら計算不能
+        if target_margin_input < 1.0:
+            denom = 1.0 - target_margin_input
+            # SGAは固定費ではなく、この時点では未定のため、COGSとDirectLaborCostから再計算する
+            # suggested_sga = direct_labor_cost * sga_rate_on_labor (これは固定)
+            numerator = cogs + total_sga # total_sgaは売価に依存しないため固定値
+            suggested_price = int(numerator / denom)
+
+    return {
+        "sales": total_price,
+        "cogs": cogs,
+        "gross_profit": gross_profit,
+        "sga_cost": total_sga,
+        "operating_profit": operating_profit,
+        "operating_margin": f"{operating_margin:.1%}",
+        "target_margin_specified": f"{target_margin_input:.1%}" if target_margin_input is not None else None,
+        "suggested_price_to_attain_target": suggested_price,
+        "breakdown": {
+            "sga_calculation_base": "direct_labor_cost",
+            "sga_rate_on_propa_labor": f"{sga_rate_on_labor:.1%}",
+        }
+    }
+
+
+def root_calculate_profitability_ccs(total_price, cogs, direct_labor_cost, sga_rate_on_labor, target_margin_input):
+    total_sga = int(direct_labor_cost * sga_rate_on_labor)
+    operating_profit = total_price - cogs - total_sga
+    operating_margin = (operating_profit / total_price) if total_price > 0 else 0.0
+    suggested_price = 0
+    if target_margin_input is not None:
+        denom = 1.0 - target_margin_input
+        if denom > 0: suggested_price = int((cogs + total_sga) / denom)
+    return {
+        "sales": total_price, "cogs": cogs, "operating_profit": operating_profit,
+        "operating_margin": f"{operating_margin:.1%}", "total_sga_cost": total_sga,
+        "sga_rate_applied": f"{sga_rate_on_labor:.1%}", "suggested_price_to_attain_target": suggested_price
+    }
+
+
+def function_app_resolve_keys(input_list, label_map, item_dict):
+    """JPラベルを英語キーに変換し、有効なキーのみを抽出する"""
+    resolved = []
+    for item in input_list:
+        if item in item_dict:
+            resolved.append(item)
+            continue
+        mapped = label_map.get(item)
+        if mapped and mapped in item_dict:
+            resolved.append(mapped)
+    return list(set(resolved))
+
+
+def dify_main_logic(req_body, tables=[]):
+    config = CONFIG
+
+    # 入力取得
+    complexity = req_body.get('complexity') or 'medium'
+    duration = req_body.get('duration') or 'normal'
+    dev_type = req_body.get('dev_type') or 'new'
+    target_platform = req_body.get('target_platform') or 'web_b2e'
+    profile_key = req_body.get('estimation_profile') or 'enterprise' # デフォルトをenterpriseに
+    target_margin = req_body.get('target_margin')  # None可（float）
+
+    # 規模
+    screen_count = req_body.get('screen_count'); screen_count = 10 if screen_count is None else screen_count
+    table_count = req_body.get('table_count'); table_count = 0 if table_count is None else table_count
+
+    # 部門・応援配分・ランクミックス
+    primary_dept = req_body.get('department')
+    dept_allocation = req_body.get('dept_allocation')  # list(dict)想定
+    team_ratio = req_body.get('team_ratio')  # dict想定
+
+    # 選択項目の解決
+    selected_features = resolve_keys(req_body.get('features', []), FEATURE_LABEL_MAP, FEATURE_MAN_DAYS)
+    selected_phase2 = resolve_keys(req_body.get('phase2_items', []), PHASE2_LABEL_MAP, PHASE2_ITEMS)
+    selected_phase3 = resolve_keys(req_body.get('phase3_items', []), PHASE3_LABEL_MAP, PHASE3_ITEMS)
+
+    # 係数
+    diff_multipliers = config.get('difficulty_multipliers', {})
+    diff_multiplier = diff_multipliers.get(complexity, 1.0)
+    dur_multipliers = config.get('duration_multipliers', {})
+    dur_multiplier  = dur_multipliers.get(duration, 1.0)
+    dev_type_mults_config = config.get('dev_type_multipliers', {})
+    current_dev_type_mults = dev_type_mults_config.get(dev_type, {"design": 1.0, "dev": 1.0})
+    dev_type_design_mult = current_dev_type_mults.get("design", 1.0)
+    dev_type_dev_mult    = current_dev_type_mults.get("dev", 1.0)
+    plat_mults_config = config.get('platform_multipliers', {})
+    platform_multiplier = plat_mults_config.get(target_platform, 1.0)
+    buffer_multiplier    = config.get('buffer_multiplier', 1.1)
+
+    # プロファイル
+    profiles = config.get('estimation_profiles', {})
+    selected_profile = profiles.get(profile_key, profiles['enterprise'])
+    prod_factor = selected_profile.get('productivity_factor', config['fp_simplified']['default_productivity'])
+
+    # ===== 工数 =====
+    dev_feature_days = sum(FEATURE_MAN_DAYS.get(f, 0) for f in selected_features)
+    fp_conf = config.get('fp_simplified', {})
+    screen_weight = fp_conf.get('screen_weight', 20)
+    table_weight  = fp_conf.get('table_weight', 15)
+    screen_fp = screen_count * screen_weight
+    table_fp  = table_count  * table_weight
+    total_ufp = screen_fp + table_fp
+    dev_fp_based_days = total_ufp * prod_factor
+    dev_base_days = dev_feature_days + dev_fp_based_days
+    dev_total_days = dev_base_days * diff_multiplier * dev_type_dev_mult
+
+    # ===== 費用 =====
+    # 直接労務費：ランク人月×人月
+    pf = config.get("profit_config", {})
+    rank_costs = pf.get("rank_costs", {})
+    team_ratio_dict = team_ratio if isinstance(team_ratio, dict) else CONFIG["profit_config"].get("standard_team_ratio", {"Rank3":0.8, "Rank2":0.2})
+    direct_labor_cost = compute_direct_labor_cost(dev_total_days, team_ratio_dict, rank_costs)
+
+    # 間接費：部門間接費単金×時間、応援PJ加重
+    resolved_alloc = dept_allocation if isinstance(dept_allocation, list) else None
+    indirect_per_hour, sga_rate = resolve_bs_org_rates(primary_dept, resolved_alloc)
+    indirect_cost = compute_indirect_cost(dev_total_days, indirect_per_hour)
+
+    # Phase2：固定費（直接費に含める）
+    p2_base_cost = sum(PHASE2_ITEMS.get(p, 0) for p in selected_phase2)
+    p2_total_cost = int(p2_base_cost * diff_multiplier * dev_type_design_mult)
+
+    # Phase3：外注費（確度係数）
+    confidence = req_body.get('confidence')
+    p3_total_fixed = 0
+    for p in selected_phase3:
+        item = PHASE3_ITEMS.get(p, {})
+        p3_total_fixed += item.get('fixed', 0)
+    conf_multiplier = 1.0
+    if confidence == 'low':
+        conf_multiplier = 1.3
+    elif confidence == 'high':
+        conf_multiplier = 1.0
+    p3_final_cost = int(p3_total_fixed * conf_multiplier)
+
+    # COGS：直接労務費 + 間接費 + 外注費 + Phase2
+    cogs = direct_labor_cost + indirect_cost + p3_final_cost + p2_total_cost
+
+    # ===== 売価（プラットフォーム/納期/バッファは売価側に寄与） =====
+    base_estimated_amount = cogs
+    final_amount = int(base_estimated_amount * platform_multiplier * dur_multiplier * buffer_multiplier)
+
+    # ===== 損益（CCS基準：販管費は直接労務費に賦課） =====
+    profit_data = calculate_profitability_ccs(
+        total_price=final_amount,
+        cogs=cogs,
+        direct_labor_cost=direct_labor_cost,
+        sga_rate_on_labor=sga_rate,
+        target_margin_input=target_margin
+    )
+
+    return {
+        "status": "success",
+        "estimated_amount": f"¥{final_amount:,}",
+        "estimated_range": f"¥{int(final_amount*0.9):,} - ¥{int(final_amount*1.2):,}",
+        "man_days": {
+            "development_total": round(dev_total_days, 1),
+            "fp_based": round(dev_fp_based_days, 1),
+            "feature_based": round(dev_feature_days, 1),
+        },
+        "bs_input": {
+            "department": primary_dept or DEFAULT_BS_DEPT,
+            "dept_allocation": resolved_alloc,
+            "sga_rate_applied": f"{sga_rate:.1%}",
+            "indirect_yen_per_hour": indirect_per_hour,
+            "team_ratio": team_ratio_dict,
+        },
+        "input_echo": {
+            "profile": selected_profile.get('label'),
+            "profile_description": selected_profile.get('description'),
+            "screen_count": screen_count,
+            "table_count": table_count,
+            "tables": tables,
+            "complexity": complexity,
+            "duration": duration,
+            "dev_type": dev_type,
+            "target_platform": target_platform,
+            "confidence": confidence,
+            "target_margin": target_margin,
+            "features": selected_features,
+            "phase2_items": selected_phase2,
+            "phase3_items": selected_phase3,
+        },
+        "profit_analysis": profit_data,
+        "productivity": f"{prod_factor} MD/FP",
+    }
+
+
+def root_main_logic(req_body):
+    config = _root.CONFIG
+    # Dify UI変数 (profile / estimation_profile 両対応)
+    profile_key = req_body.get('profile') or req_body.get('estimation_profile') or 'standard'
+    screen_count = int(req_body.get('screen_count') or 0)
+    table_count = int(req_body.get('table_count') or 0)
+    dept_name = req_body.get('department') or "ビジネスイノベーション事業部共通"
+
+    # target_margin 文字列パース (e.g. "15%" -> 0.15)
+    target_margin_raw = req_body.get('target_margin')
+    target_margin = None
+    if isinstance(target_margin_raw, str) and target_margin_raw.strip():
+        try:
+            v = target_margin_raw.replace('%', '').strip()
+            num = float(v)
+            target_margin = num / 100.0 if num > 1.0 else num
+        except:
+            target_margin = None
+    elif isinstance(target_margin_raw, (int, float)):
+        target_margin = float(target_margin_raw)
+
+    # features パース (リスト または カンマ区切り文字列)
+    features_raw = req_body.get('features') or []
+    if isinstance(features_raw, str):
+        features = [f.strip() for f in features_raw.split(',') if f.strip()]
+    else:
+        features = features_raw
+
+    dept_cfg = _root.BS_ORG_CONFIG.get(dept_name, _root.BS_ORG_CONFIG["ビジネスイノベーション事業部共通"])
+    selected_profile = config["estimation_profiles"].get(profile_key, config["estimation_profiles"]["standard"])
+    prod_factor = selected_profile["productivity_factor"]
+
+    total_fp = (screen_count * config["fp_weights"]["screen"]) + (table_count * config["fp_weights"]["table"])
+    dev_fp_days = total_fp * prod_factor
+    dev_feature_days = sum(_root.FEATURE_MAN_DAYS.get(f, 0) for f in features)
+    
+    dev_base_days = (dev_fp_days + dev_feature_days)
+    dev_total_days = dev_base_days * config["difficulty_multipliers"].get(req_body.get('complexity', 'medium'), 1.0)
+
+    rank_costs = config["profit_config"]["rank_costs"]
+    team_ratio = config["profit_config"]["standard_team_ratio"]
+    man_months = dev_total_days / 20.0
+    direct_labor_cost = int(man_months * sum(rank_costs.get(r, 0) * w for r, w in team_ratio.items()))
+    indirect_cost = int(dev_total_days * 8.0 * dept_cfg["indirect_h"])
+    cogs = direct_labor_cost + indirect_cost
+
+    nominal_price = int(cogs * config["buffer_multiplier"])
+    profit_analysis = root_calculate_profitability_ccs(nominal_price, cogs, direct_labor_cost, dept_cfg["sga_on_propa_labor_rate"], target_margin)
+    
+    estimated_range = { "min": int(nominal_price * 0.85), "max": int(nominal_price * 1.15) }
+
+    return {
+        "status": "success", "estimated_amount": nominal_price, "total_man_days": round(dev_total_days, 1),
+        "estimated_range": f"¥{estimated_range['min']:,} 〜 ¥{estimated_range['max']:,}",
+        "profile": selected_profile["label"], "profile_description": selected_profile["description"],
+        "profit_analysis": profit_analysis,
+        "input_echo": {
+            "profile": selected_profile["label"], "department": dept_name, "screen_count": screen_count,
+            "table_count": table_count, "features": features, "complexity": req_body.get('complexity', 'medium'),
+            "target_margin": f"{target_margin*100:.1f}%" if target_margin is not None else "未指定"
+        },
+        "details": {
+            "direct_labor": direct_labor_cost, "indirect_cost": indirect_cost, "total_fp": total_fp,
+            "fp_days": round(dev_fp_days, 1), "feature_days": round(dev_feature_days, 1)
+        }
+    }
+
+
+def function_app_main_logic(req_body, snapshot):
+    
+    # Common Params
+    method = req_body.get('method', 'screen') 
+    complexity = req_body.get('complexity', 'medium')
+    screen_count = req_body.get('screen_count', 10) 
+    confidence = req_body.get('confidence') 
+    
+    # Method-specific Params
+    man_days_per_unit = req_body.get('man_days_per_unit') 
+    loc = req_body.get('loc') 
+    fp_count = req_body.get('fp_count') 
+
+    # Resolve keys
+    selected_features = function_app_resolve_keys(req_body.get('features', []), _func.FEATURE_LABEL_MAP, _func.FEATURE_MAN_DAYS)
+    selected_phase2 = function_app_resolve_keys(req_body.get('phase2_items', []), _func.PHASE2_LABEL_MAP, _func.PHASE2_ITEMS)
+    selected_phase3 = function_app_resolve_keys(req_body.get('phase3_items', []), _func.PHASE3_LABEL_MAP, _func.PHASE3_ITEMS)
+
+    # Policy Check
+    require_explicit_prod = snapshot.require_explicit_productivity
+    require_explicit_conf = snapshot.require_explicit_vendor_confidence
+
+    # Validate Confidence if Phase 3 (Vendor Design) items present
+    has_phase3_items = (len(selected_phase3) > 0)
+    if require_explicit_conf and has_phase3_items and not confidence:
+         return {"status": "error", "message": "Missing required param: confidence (Required for Phase 3 / Vendor Design estimation)"}, 400
+
+    # Config Values
+    diff_multipliers = snapshot.difficulty_multipliers
+    if complexity not in diff_multipliers: complexity = 'medium'
+    diff_multiplier = diff_multipliers.get(complexity, 1.0)
+    
+    buffer_multiplier = snapshot.buffer_multiplier
+    
+    sier_rate = snapshot.sier_rate
+    outsource_rate = snapshot.outsource_rate
+    
+    mgmt_fee_rate = snapshot.mgmt_fee_rate
+    vendor_variance_map = snapshot.vendor_variance
+    
+    # Variance Factor (Only for Phase 3)
+    variance = 0.0
+    if has_phase3_items:
+        variance = vendor_variance_map.get(confidence, 0.2) 
+
+    dev_screen_rate = snapshot.man_days_per_screen
+
+    # ===== Development Cost (Fixed) =====
+    dev_feature_days = 0 
+    dev_screen_days = 0
+    dev_base_days = 0 
+
+    if method == 'step':
+        if require_explicit_prod and (loc is None or man_days_per_unit is None):
+             return {"status": "error", "message": "Missing required params for STEP: loc, man_days_per_unit"}, 400
+        dev_base_days = loc * man_days_per_unit
+        
+    elif method == 'fp':
+        if require_explicit_prod and (fp_count is None or man_days_per_unit is None):
+             return {"status": "error", "message": "Missing required params for FP: fp_count, man_days_per_unit"}, 400
+        dev_base_days = fp_count * man_days_per_unit
+        
+    else:
+        dev_feature_days = sum(_func.FEATURE_MAN_DAYS.get(f, 0) for f in selected_features)
+        dev_screen_days = screen_count * dev_screen_rate
+        dev_base_days = dev_feature_days + dev_screen_days
+
+    dev_total_days = dev_base_days * diff_multiplier
+    dev_cost = int(dev_total_days * sier_rate)
+
+    # ===== Phase 2 (Design) (Fixed - Internal) =====
+    phase2_total_days = 0
+    phase2_cost = 0
+    
+    if selected_phase2:
+        p2_fixed = 0
+        p2_screen = 0
+        for item in selected_phase2:
+            item_info = _func.PHASE2_ITEMS.get(item, {})
+            if item_info.get("type") == "fixed":
+                p2_fixed += item_info.get("man_days", 0)
+            else:
+                p2_screen += item_info.get("man_days", 0) * screen_count
+        
+        phase2_total_days = p2_fixed + p2_screen
+        phase2_cost = int(phase2_total_days * sier_rate)
+
+    # ===== Phase 3 (Visual) (Range - Vendor) =====
+    phase3_total_days = 0
+    phase3_cost = 0
+    phase3_range = {"min": 0, "max": 0, "cost": 0}
+
+    if selected_phase3:
+        p3_fixed = 0
+        p3_screen = 0
+        for item in selected_phase3:
+            item_info = _func.PHASE3_ITEMS.get(item, {})
+            if item_info.get("type") == "fixed":
+                p3_fixed += item_info.get("man_days", 0)
+            else:
+                p3_screen += item_info.get("man_days", 0) * screen_count
+        
+        phase3_total_days = p3_fixed + p3_screen
+        phase3_base_cost = int(phase3_total_days * outsource_rate)
+        phase3_management_fee = int(phase3_base_cost * mgmt_fee_rate)
+        phase3_cost = phase3_base_cost + phase3_management_fee
+        
+        # Apply Variance
+        phase3_range = {
+            "min": int(phase3_cost * (1 - variance)),
+            "max": int(phase3_cost * (1 + variance)),
+            "cost": phase3_cost
+        }
+
+    # ===== Total =====
+    # Dev: Fixed. P2: Fixed. P3: Range.
+    subtotal_nominal = dev_cost + phase2_cost + phase3_cost
+    subtotal_min = dev_cost + phase2_cost + phase3_range.get("min", 0)
+    subtotal_max = dev_cost + phase2_cost + phase3_range.get("max", 0)
+
+    final_nominal = int(subtotal_nominal * buffer_multiplier)
+    final_min = int(subtotal_min * buffer_multiplier)
+    final_max = int(subtotal_max * buffer_multiplier)
+
+    complexity_labels = {
+        "low": "簡易", "medium": "標準", "high": "高難度"
+    }
+
+    response_data = {
+        "status": "ok",
+        "estimated_amount": final_nominal,
+        "estimated_range": {"min": final_min, "max": final_max},
+        "currency": snapshot.currency,
+        "method": method,
+        "screen_count": screen_count,
+        "complexity": complexity,
+        "confidence": confidence,
+        "breakdown": {
+            "development": {
+                "method": method,
+                "base_days": dev_base_days,
+                "total_days": dev_total_days,
+                "cost": dev_cost,
+                "details": {
+                    "loc": loc,
+                    "fp_count": fp_count,
+                    "man_days_per_unit": man_days_per_unit,
+                    "feature_days": dev_feature_days,
+                    "screen_days": dev_screen_days
+                }
+            },
+            "phase2_design": {
+                "total_days": phase2_total_days,
+                "cost": phase2_cost,
+                "selected_items": selected_phase2
+            },
+            "phase3_visual": {
+                "total_days": phase3_total_days,
+                "cost": phase3_cost,
+                "range": phase3_range,
+                "selected_items": selected_phase3
+            },
+            "subtotal": subtotal_nominal,
+            "buffer_multiplier": buffer_multiplier,
+            "final": final_nominal,
+            "complexity_label": complexity_labels.get(complexity, complexity)
+        },
+        "config_version": snapshot.version,
+        "config_snapshot": snapshot.info()
+    }
+    return response_data, 200
+
+
+# ===== Dify 入力パース（estimate_schema 移行前） =====
+
+def dify_parse_list_from_text(val):
+    # 改行/カンマ区切り → list
+    items = []
+    if isinstance(val, str):
+        for line in val.replace('\r', '').split('\n'):
+            items.extend([x.strip() for x in line.split(',') if x.strip()])
+    elif isinstance(val, list):
+        items = val
+    return [x for x in items if x not in ['なし', '未定', '不明', 'N/A', '-']]
+
+
+def dify_parse_int(val, default=None):
+    if isinstance(val, (int, float)):
+        return int(val)
+    if isinstance(val, str) and val.strip():
+        try:
+            return int(val)
+        except Exception:
+            return default
+    return default
+
+
+def dify_parse_target_margin(val):
+    if isinstance(val, (int, float)):
+        return float(val)
+    if isinstance(val, str) and val.strip():
+        try:
+            v = val.replace('%', '').strip()
+            num = float(v)
+            return num/100.0 if num > 1.0 else num
+        except Exception:
+            return None
+    return None
+
+
+def dify_parse_team_ratio(text):
+    # 例: "Rank3:0.8, Rank2:0.2"
+    default = {"Rank3": 0.8, "Rank2": 0.2}
+    if not isinstance(text, str) or not text.strip():
+        return default
+    res = {}
+    for part in text.split(','):
+        if ':' in part:
+            k, v = part.split(':', 1)
+            k = k.strip()
+            try:
+                s = float(v.strip())
+                if s >= 0 and k in CONFIG["profit_config"]["rank_costs"]:
+                    res[k] = s
+            except Exception:
+                pass
+    s = sum(res.values())
+    if s > 0:
+        for k in list(res.keys()):
+            res[k] = res[k] / s
+        return res
+    return default
+
+
+def dify_parse_dept_allocation(text):
+    # 段落: 「部門: 0.6\nＣＳ第１システム開発部: 0.4」→ 正規化list
+    if not isinstance(text, str):
+        return []
+    return [{"dept": k, "share": s} for k, s in _dify_parse_dept_allocation(text)]
+
+
+@lru_cache(maxsize=1024)
+def _dify_parse_dept_allocation(text):
+    # 同じ配分テキストは1回だけパースする（戻り値は不変の tuple）
+    items = []
+    if text.strip():
+        for line in text.splitlines():
+            if ':' in line:
+                k, v = line.split(':', 1)
+                k = k.strip()
+                try:
+                    s = float(v.strip())
+                    if k in BS_ORG_CONFIG and s > 0:
+                        items.append([k, s])
+                except Exception:
+                    pass
+    total = sum(i[1] for i in items)
+    if total > 0:
+        for i in items:
+            i[1] = i[1] / total
+    return tuple((k, s) for k, s in items)
+
+
+def dify_prepare_args(kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    # Dify入力（文字列混在）→ main_logic 用の正規化済み dict
+    args = dict(kwargs)
+
+    # list項目の前処理
+    for key in ['features', 'phase2_items', 'phase3_items', 'tables']:
+        val = args.get(key)
+        args[key] = dify_parse_list_from_text(val)
+
+    # 数値項目
+    for key in ['screen_count', 'table_count']:
+        args[key] = dify_parse_int(args.get(key))
+
+    # tablesがあればtable_countを自動補完
+    if args.get('tables') and (args.get('table_count') is None or args.get('table_count') == 0):
+        args['table_count'] = len(args['tables'])
+
+    # 目標営業利益率
+    args['target_margin'] = dify_parse_target_margin(args.get('target_margin'))
+
+    # 部門
+    dept = args.get('department')
+    if not dept or dept not in BS_ORG_CONFIG:
+        args['department'] = DEFAULT_BS_DEPT
+
+    # 応援配分（文字列→配列に正規化）
+    if isinstance(args.get('dept_allocation'), str):
+        args['dept_allocation'] = dify_parse_dept_allocation(args['dept_allocation'])
+
+    # ランクミックス
+    if isinstance(args.get('team_ratio'), str):
+        args['team_ratio'] = dify_parse_team_ratio(args['team_ratio'])
+
+    return args
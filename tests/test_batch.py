@@ -0,0 +1,58 @@
+import unittest
+import json
+from dify_assets.code.estimate_logic import main as dify_main
+from estimate_batch import main_batch
+
+CASES = [
+    {},
+    {'screen_count': 15, 'complexity': 'medium'},
+    {'screen_count': '12', 'table_count': 0, 'tables': 'users, orders\nitems', 'complexity': 'high',
+     'duration': 'short', 'dev_type': 'porting', 'target_platform': 'mobile'},
+    {'screen_count': 8, 'features': ['認証・認可 (Auth/SSO)', 'payment', 'unknown', 'payment'],
+     'phase2_items': '基本設計書作成, security_review', 'phase3_items': ['logo_creation', 'ui_prototype'],
+     'confidence': 'low', 'target_margin': '15%'},
+    {'screen_count': 20, 'estimation_profile': 'mission_critical', 'department': 'ＤＴ第１開発部',
+     'dept_allocation': 'ＤＴ第１開発部: 0.6\nＣＳ第１システム開発部: 0.4', 'team_ratio': 'Rank4:1, Rank3:3',
+     'target_margin': 0.2},
+    {'screen_count': 5, 'department': '存在しない部門', 'estimation_profile': 'unknown', 'complexity': 'very_high',
+     'target_platform': 'all', 'dept_allocation': [{'dept': 'ソリューションビジネス推進室', 'share': 1.0}],
+     'team_ratio': {'Rank1': 0.5, 'Rank2': 0.5}, 'target_margin': 1.5},
+    {'screen_count': 0, 'table_count': 0},
+]
+
+
+class TestBatchEstimation(unittest.TestCase):
+    def test_batch_matches_single(self):
+        batch = main_batch(CASES)
+        self.assertEqual(len(batch), len(CASES))
+        for case, result in zip(CASES, batch):
+            expected = json.loads(dify_main(**case)["result"])
+            self.assertEqual(json.loads(json.dumps(result, ensure_ascii=False)), expected)
+
+    def test_empty_batch(self):
+        self.assertEqual(main_batch([]), [])
+
+
+class TestBatchEndpoint(unittest.TestCase):
+    def setUp(self):
+        from fastapi.testclient import TestClient
+        from outsystems_api_wrapper import app
+        self.client = TestClient(app)
+
+    def test_calculate_batch(self):
+        reqs = [
+            {'screen_count': 10, 'features': ['auth']},
+            {'screen_count': 3, 'table_count': 4, 'profile': 'poc'},
+        ]
+        res = self.client.post('/calculate/batch', json={'requests': reqs})
+        self.assertEqual(res.status_code, 200)
+        data = res.json()
+        self.assertEqual(data['count'], 2)
+        for req, result in zip(reqs, data['results']):
+            single = self.client.post('/calculate', json=req)
+            self.assertEqual(single.status_code, 200)
+            self.assertEqual(result, single.json())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+import json
+import os
+import tempfile
+from benchmarks import bench_suite
+
+
+class TestBenchSuite(unittest.TestCase):
+    def test_compare_flags_regressions_beyond_threshold(self):
+        rows = bench_suite.compare({'a': 13.0, 'b': 14.0, 'new': 1.0}, {'a': 10.0, 'b': 10.0}, threshold=0.3)
+        by_name = {row['name']: row for row in rows}
+        self.assertFalse(by_name['a']['regressed'])
+        self.assertTrue(by_name['b']['regressed'])
+        self.assertAlmostEqual(by_name['b']['ratio'], 1.4)
+        self.assertIsNone(by_name['new']['ratio'])
+        self.assertFalse(by_name['new']['regressed'])
+
+    def test_baseline_round_trip_and_exit_code(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'baseline.json')
+            args = ['--baseline', path, '--only', 'resolve_keys', '--scale', '0.01', '--repeat', '1']
+            self.assertEqual(bench_suite.main(args + ['--update-baseline']), 0)
+            baseline = bench_suite.load_baseline(path)
+            self.assertEqual(list(baseline), ['resolve_keys'])
+
+            # ベースラインを極端に速く書き換えると劣化として失敗する
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            data['results']['resolve_keys']['us_per_call'] = 1e-6
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            self.assertEqual(bench_suite.main(args + ['--json']), 1)
+
+    def test_committed_baseline_covers_every_case(self):
+        baseline = bench_suite.load_baseline()
+        micro = [name for name, _, _ in bench_suite._micro_cases()]
+        imports = {f'import.{module}' for module in bench_suite.IMPORT_BUDGET_MS}
+        self.assertTrue(set(micro) | imports | {'http.calculate', 'http.report.miss', 'http.report.hit'} <= set(baseline))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+import io
+import itertools
+import json
+import os
+import tempfile
+import estimate_bulk
+import json_response
+from dify_assets.code import estimate_logic as dify_logic
+
+ROWS = [
+    {"id": "P1", "screen_count": 12, "features": ["auth", "payment"], "complexity": "high"},
+    {"id": "P2", "screen_count": "8", "features": "認証・認可 (Auth/SSO), unknown", "target_margin": "20%"},
+    {"screen_count": 3, "dept_allocation": "ＤＴ第１開発部: 0.6\nＣＳ第１システム開発部: 0.4"},
+    {"id": "P4", "screen_count": 5, "team_ratio": {"Rank3": "x"}},
+]
+CSV_INPUT = (
+    "id,screen_count,features,complexity,target_margin\r\n"
+    "A,12,\"auth, payment\",high,\r\n"
+    "B,,,,15%\r\n"
+)
+
+
+def _jsonl(rows):
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows)
+
+
+class TestBulk(unittest.TestCase):
+    def _run(self, text, fmt, workers=1, chunk_size=2, out_fmt="jsonl"):
+        rows = estimate_bulk.read_rows(io.StringIO(text), fmt)
+        out = io.StringIO()
+        counts = estimate_bulk.write_results(estimate_bulk.run_rows(rows, out_fmt, workers, chunk_size), out, out_fmt)
+        return out.getvalue(), counts
+
+    def test_jsonl_rows_match_estimate_and_keep_order(self):
+        text, counts = self._run(_jsonl(ROWS) + "\n{broken\n[1]\n", "jsonl")
+        lines = [json.loads(line) for line in text.splitlines()]
+        self.assertEqual([line["row"] for line in lines], [1, 2, 3, 4, 5, 6])
+        self.assertEqual([line["id"] for line in lines[:4]], ["P1", "P2", None, "P4"])
+        for line, row in zip(lines, ROWS):
+            if line["status"] == "ok":
+                expected = dify_logic.estimate(**{k: v for k, v in row.items() if k != "id"})
+                self.assertEqual(line["result"], json.loads(json.dumps(expected)))
+        # 計算エラー・JSON 不正・オブジェクト以外は行単位のエラーとして出力し、処理を続ける
+        self.assertEqual(lines[3]["status"], "error")
+        self.assertIn("TypeError", lines[3]["error"])
+        self.assertTrue(lines[4]["error"].startswith("invalid JSON"))
+        self.assertEqual(lines[5]["error"], "each line must be a JSON object")
+        self.assertEqual(counts, {"rows": 6, "ok": 3, "errors": 3})
+
+    def test_csv_input_and_output(self):
+        text, counts = self._run(CSV_INPUT, "csv", out_fmt="csv")
+        lines = text.splitlines()
+        self.assertEqual(lines[0], ",".join(estimate_bulk.BULK_CSV_COLUMNS))
+        first = dify_logic.estimate(screen_count="12", features="auth, payment", complexity="high")
+        self.assertTrue(lines[1].startswith(f"1,A,ok,{first['profit_analysis']['sales']},"))
+        second = dify_logic.estimate(target_margin="15%")
+        self.assertIn(str(second['profit_analysis']['suggested_price_to_attain_target']), lines[2])
+        self.assertEqual(counts["ok"], 2)
+
+    def test_unencodable_rows_become_error_rows(self):
+        # stdlib エンコーダは NaN を出力できない。その行だけ status=error にして続ける
+        orig = json_response.encoder_name()
+        json_response.set_encoder("stdlib")
+        try:
+            text, counts = self._run('{"id": NaN, "screen_count": 3}\n{"id": "ok", "screen_count": 3}\n', "jsonl")
+        finally:
+            json_response.set_encoder(orig)
+        lines = [json.loads(line) for line in text.splitlines()]
+        self.assertEqual([(line["row"], line["id"], line["status"]) for line in lines],
+                         [(1, "nan", "error"), (2, "ok", "ok")])
+        self.assertTrue(lines[0]["error"].startswith("cannot format result: ValueError"))
+        self.assertEqual(counts, {"rows": 2, "ok": 1, "errors": 1})
+
+    def test_worker_pool_matches_inline(self):
+        text = _jsonl(ROWS * 10)
+        self.assertEqual(self._run(text, "jsonl", workers=2), self._run(text, "jsonl", workers=1))
+
+    def test_input_is_consumed_incrementally(self):
+        consumed = itertools.count()
+
+        def rows():
+            for i in itertools.count(1):
+                next(consumed)
+                yield i, None, {"screen_count": i % 50}
+
+        results = estimate_bulk.run_rows(rows(), "jsonl", workers=1, chunk_size=10)
+        for _ in range(25):
+            next(results)
+        # 出力に必要な分（チャンク単位）しか読まない
+        self.assertLessEqual(next(consumed), 31)
+
+    def test_cli_files_and_strict_exit_code(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            src = os.path.join(tmp, "in.csv")
+            dst = os.path.join(tmp, "out.jsonl")
+            with open(src, "w", encoding="utf-8-sig", newline="") as f:
+                f.write(CSV_INPUT)
+            self.assertEqual(estimate_bulk.main([src, "-o", dst, "--strict"]), 0)
+            with open(dst, encoding="utf-8") as f:
+                self.assertEqual([json.loads(line)["id"] for line in f], ["A", "B"])
+
+            src = os.path.join(tmp, "in.jsonl")
+            with open(src, "w", encoding="utf-8") as f:
+                f.write(_jsonl(ROWS))
+            self.assertEqual(estimate_bulk.main([src, "-o", dst]), 0)
+            self.assertEqual(estimate_bulk.main([src, "-o", dst, "--strict"]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,46 +11,59 @@ class TestEstimateCalculation(unittest.TestCase):
         with open(config_path, "r", encoding="utf-8") as f:
             self.config = yaml.safe_load(f)
 
+    def expected_amount(self, screen_count, complexity):
+        # screens × man_days_per_screen × difficulty × sier rate, then × buffer (each step truncated)
+        days = screen_count * self.config['development']['man_days_per_screen']
+        days *= self.config['difficulty_multipliers'][complexity]
+        cost = int(days * self.config['daily_rates']['sier_internal'])
+        return int(cost * self.config['buffer_multiplier'])
+
     def test_calculate_medium_complexity(self):
-        # 15 screens * 120,000 * 1.0 (medium) * 1.1 (buffer) = 1,980,000
+        # 15 screens * 1.5 MD * 1.0 (medium) * ¥50,000 * 1.1 (buffer) = 1,237,500
         req_body = {'screen_count': 15, 'complexity': 'medium'}
         data, status_code = main_logic(req_body)
         
         self.assertEqual(status_code, 200)
         self.assertEqual(data['status'], 'ok')
-        self.assertEqual(data['estimated_amount'], 1980000)
-        self.assertEqual(data['breakdown']['difficulty_multiplier'], 1.0)
+        self.assertEqual(data['estimated_amount'], self.expected_amount(15, 'medium'))
+        self.assertEqual(data['breakdown']['complexity_label'], '標準')
 
     def test_calculate_low_complexity(self):
-        # 10 screens * 120,000 * 0.8 (low) * 1.1 (buffer) = 1,056,000
         req_body = {'screen_count': 10, 'complexity': 'low'}
         data, status_code = main_logic(req_body)
         
         self.assertEqual(status_code, 200)
-        self.assertEqual(data['estimated_amount'], 1056000)
-        self.assertEqual(data['breakdown']['difficulty_multiplier'], 0.8)
+        self.assertEqual(data['estimated_amount'], self.expected_amount(10, 'low'))
+        self.assertEqual(data['breakdown']['development']['total_days'], 10 * 1.5 * 0.8)
 
     def test_calculate_high_complexity(self):
-        # 20 screens * 120,000 * 1.3 (high) * 1.1 (buffer) = 3,432,000
         req_body = {'screen_count': 20, 'complexity': 'high'}
         data, status_code = main_logic(req_body)
         
         self.assertEqual(status_code, 200)
-        self.assertEqual(data['estimated_amount'], 3432000)
-        self.assertEqual(data['breakdown']['difficulty_multiplier'], 1.3)
+        self.assertEqual(data['estimated_amount'], self.expected_amount(20, 'high'))
+        self.assertEqual(data['breakdown']['complexity_label'], '高難度')
 
-    def test_invalid_complexity(self):
+    def test_unknown_complexity_falls_back_to_medium(self):
         req_body = {'screen_count': 10, 'complexity': 'impossible'}
         data, status_code = main_logic(req_body)
         
-        self.assertEqual(status_code, 400)
-        self.assertEqual(data['status'], 'error')
+        self.assertEqual(status_code, 200)
+        self.assertEqual(data['complexity'], 'medium')
+        self.assertEqual(data['estimated_amount'], self.expected_amount(10, 'medium'))
 
-    def test_invalid_screen_count(self):
+    def test_zero_screen_count(self):
         req_body = {'screen_count': 0, 'complexity': 'medium'}
         data, status_code = main_logic(req_body)
         
+        self.assertEqual(status_code, 200)
+        self.assertEqual(data['estimated_amount'], 0)
+
+    def test_missing_step_params(self):
+        data, status_code = main_logic({'method': 'step', 'loc': 1000})
+
         self.assertEqual(status_code, 400)
+        self.assertEqual(data['status'], 'error')
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import os
+import shutil
+import tempfile
+from config_snapshot import ConfigStore, ConfigValidationError, build_snapshot
+from function_app import main_logic
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "estimate_config.yaml")
+
+
+class TestConfigSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "estimate_config.yaml")
+        shutil.copy(CONFIG_PATH, self.path)
+        self.store = ConfigStore(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _rewrite(self, old, new):
+        with open(self.path, "r", encoding="utf-8") as f:
+            text = f.read()
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(text.replace(old, new))
+        st = os.stat(self.path)
+        os.utime(self.path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+    def test_snapshot_is_cached(self):
+        first = self.store.get()
+        self.assertIs(self.store.get(), first)
+        self.assertEqual(first.difficulty_multipliers["high"], 1.3)
+        with self.assertRaises(TypeError):
+            first.difficulty_multipliers["high"] = 2.0
+
+    def test_reload_on_change(self):
+        first = self.store.get()
+        self._rewrite('config_version: "2026-01"', 'config_version: "2026-02"')
+        second = self.store.get()
+        self.assertIsNot(second, first)
+        self.assertEqual(second.version, "2026-02")
+        self.assertNotEqual(second.digest, first.digest)
+
+    def test_touch_without_change_keeps_snapshot(self):
+        first = self.store.get()
+        self._rewrite('config_version', 'config_version')
+        self.assertIs(self.store.get(), first)
+
+    def test_invalid_reload_keeps_previous(self):
+        first = self.store.get()
+        self._rewrite('buffer_multiplier: 1.1', 'buffer_multiplier: "x"')
+        self.assertIs(self.store.get(), first)
+
+    def test_validation(self):
+        with self.assertRaises(ConfigValidationError):
+            build_snapshot({"difficulty_multipliers": {"low": "fast"}})
+
+    def test_main_logic_reports_snapshot(self):
+        snapshot = self.store.get()
+        data, status_code = main_logic({'screen_count': 10, 'complexity': 'medium'}, snapshot)
+        self.assertEqual(status_code, 200)
+        self.assertEqual(data['config_version'], snapshot.version)
+        self.assertEqual(data['config_snapshot']['digest'], snapshot.digest)
+
+
+if __name__ == '__main__':
+    unittest.main()
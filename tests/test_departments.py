@@ -0,0 +1,58 @@
+import unittest
+from dify_assets.code.estimate_logic import BS_ORG_CONFIG, estimate
+from estimate_departments import rank_departments
+
+BASE = {
+    'screen_count': 12, 'table_count': 3, 'complexity': 'high', 'target_platform': 'mobile',
+    'features': ['auth', 'payment'], 'phase2_items': ['basic_design'], 'phase3_items': ['logo_creation'],
+    'confidence': 'low', 'team_ratio': 'Rank4:0.2, Rank3:0.5, Rank2:0.3', 'target_margin': '20%',
+    'dept_allocation': 'ＤＴ第１開発部: 0.6\nＣＳ第１システム開発部: 0.4',
+}
+
+
+class TestDepartmentRanking(unittest.TestCase):
+    def test_rows_match_single(self):
+        result = rank_departments(BASE)
+        self.assertEqual(result['count'], len(BS_ORG_CONFIG))
+        self.assertEqual(sorted(r['department'] for r in result['departments']), sorted(BS_ORG_CONFIG))
+        for row in result['departments']:
+            single = estimate(**dict(BASE, department=row['department'], dept_allocation=''))
+            profit = single['profit_analysis']
+            self.assertEqual(row['estimated_amount'], profit['sales'])
+            self.assertEqual(row['cogs'], profit['cogs'])
+            self.assertEqual(row['sga_cost'], profit['sga_cost'])
+            self.assertEqual(row['operating_profit'], profit['operating_profit'])
+            self.assertEqual(row['operating_margin'], profit['operating_margin'])
+            self.assertEqual(row['suggested_price_to_attain_target'], profit['suggested_price_to_attain_target'])
+            self.assertEqual(row['indirect_yen_per_hour'], single['bs_input']['indirect_yen_per_hour'])
+
+    def test_ranking_order(self):
+        by_price = rank_departments(BASE)['departments']
+        prices = [r['estimated_amount'] for r in by_price]
+        self.assertEqual(prices, sorted(prices))
+        self.assertEqual([r['price_rank'] for r in by_price], list(range(1, len(by_price) + 1)))
+
+        by_margin = rank_departments(BASE, sort_by='operating_margin')['departments']
+        profits = [r['operating_profit'] / r['estimated_amount'] for r in by_margin]
+        self.assertEqual(profits, sorted(profits, reverse=True))
+        self.assertEqual([r['margin_rank'] for r in by_margin], list(range(1, len(by_margin) + 1)))
+        ranks = {r['department']: (r['price_rank'], r['margin_rank']) for r in by_price}
+        self.assertEqual(ranks, {r['department']: (r['price_rank'], r['margin_rank']) for r in by_margin})
+
+    def test_invalid_sort_key(self):
+        with self.assertRaises(ValueError):
+            rank_departments(BASE, sort_by='bogus')
+
+    def test_api(self):
+        from fastapi.testclient import TestClient
+        from outsystems_api_wrapper import app
+        client = TestClient(app)
+        res = client.post('/calculate/departments', json={'base': {'screen_count': 10}, 'sort_by': 'operating_margin'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['count'], len(BS_ORG_CONFIG))
+        res = client.post('/calculate/departments', json={'base': {'screen_count': 10}, 'sort_by': 'x'})
+        self.assertEqual(res.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
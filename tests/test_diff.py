@@ -0,0 +1,114 @@
+import unittest
+import asyncio
+import random
+import httpx
+import estimate_diff
+import outsystems_api_wrapper as wrapper
+from estimate_diff import diff_estimates
+from estimate_memo import EstimateMemo
+from estimate_session import EstimateSessions
+from dify_assets.code import estimate_logic as dify_logic
+from tests.test_session import PATCHES
+
+
+def _values(kwargs):
+    # 評価プランで求めた中間値（比較項目の正解）
+    args, _ = dify_logic.validate_args(kwargs)
+    c = dify_logic.PLAN.evaluate(args, args.get('tables', []))
+    return {name: getattr(c, name) for name in ('p2_cost', 'p3_cost', 'final', 'cogs', 'direct_labor', 'indirect')}
+
+
+class TestDiffEstimates(unittest.TestCase):
+    def test_changes_match_graph_values(self):
+        rng = random.Random(25)
+        for _ in range(300):
+            base = {name: rng.choice(PATCHES[name]) for name in rng.sample(list(PATCHES), 4)}
+            revised = dict(base, **{name: rng.choice(PATCHES[name]) for name in rng.sample(list(PATCHES), 2)})
+            res = diff_estimates({'request': base}, {'request': revised})
+            old, new = _values(base), _values(revised)
+            changed = set(res['changed_inputs'])
+            with self.subTest(base=base, revised=revised):
+                for field, value in (('phase2_cost', 'p2_cost'), ('phase3_cost', 'p3_cost'),
+                                     ('estimated_amount', 'final'), ('cogs', 'cogs')):
+                    if old[value] == new[value]:
+                        self.assertNotIn(field, res['changes'])
+                    else:
+                        self.assertEqual((res['changes'][field]['before'], res['changes'][field]['after']),
+                                         (old[value], new[value]))
+                labor = old['direct_labor'] + old['indirect'], new['direct_labor'] + new['indirect']
+                self.assertEqual(labor[0] != labor[1], 'labor_cost' in res['changes'])
+                for entry in res['changes'].values():
+                    self.assertLessEqual(set(entry['caused_by']), changed)
+                self.assertEqual(res['unchanged'] + len(res['changes']), len(estimate_diff.FIELDS))
+
+    def test_caused_by_follows_dependencies(self):
+        base = {'screen_count': 10, 'features': ['auth']}
+        res = diff_estimates({'request': base}, {'request': dict(base, target_margin=0.2)})
+        self.assertEqual(list(res['changes']), ['suggested_price'])
+        self.assertEqual(res['changes']['suggested_price']['caused_by'], ['target_margin'])
+
+        res = diff_estimates({'request': base}, {'request': dict(base, phase3_items=['logo_creation'],
+                                                                 features=['auth', 'payment'])})
+        self.assertEqual(res['changed_inputs']['features'], {'added': ['payment'], 'removed': []})
+        self.assertEqual(res['changes']['phase3_cost']['caused_by'], ['phase3_items'])
+        self.assertEqual(res['changes']['man_days.feature_based']['caused_by'], ['features'])
+        self.assertEqual(res['changes']['estimated_amount']['caused_by'], ['features', 'phase3_items'])
+        self.assertNotIn('phase2_cost', res['changes'])
+
+    def test_sources(self):
+        memo = EstimateMemo()
+        sessions = EstimateSessions()
+        kwargs = {'screen_count': 6, 'features': 'auth', 'phase2_items': ['basic_design']}
+        stored = dify_logic.estimate(**kwargs)
+        sid = sessions.create(dict(kwargs))['session_id']
+        sessions.patch(sid, {'complexity': 'high'})
+
+        res = diff_estimates({'result': stored}, {'session_id': sid}, estimate=memo.estimate, sessions=sessions)
+        self.assertEqual(res['sources'], {'base': 'result', 'revised': 'session'})
+        self.assertEqual(list(res['changed_inputs']), ['complexity'])
+        self.assertEqual(res['changes']['phase2_cost']['caused_by'], ['complexity'])
+
+        # 表記ゆれは解決済みキーで比べるため変化にならない。同じリクエストはメモの結果を使う
+        res = diff_estimates({'request': kwargs}, {'request': dict(kwargs, features=['認証・認可（Auth/SSO）'])},
+                             estimate=memo.estimate)
+        self.assertEqual((res['changed_inputs'], res['changes']), ({}, {}))
+        self.assertEqual(memo.snapshot()['hits'], 1)
+
+    def test_invalid_sides(self):
+        with self.assertRaises(ValueError):
+            diff_estimates({'request': {}, 'result': {}}, {'request': {}})
+        with self.assertRaises(ValueError):
+            diff_estimates({}, {'request': {}})
+        with self.assertRaises(ValueError):
+            diff_estimates({'result': {'status': 'success'}}, {'request': {}})
+        with self.assertRaises(ValueError):
+            diff_estimates({'session_id': 'x'}, {'request': {}})
+        with self.assertRaises(KeyError):
+            diff_estimates({'session_id': 'x'}, {'request': {}}, sessions=EstimateSessions())
+
+
+def _post(path, body):
+    async def call():
+        transport = httpx.ASGITransport(app=wrapper.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(path, json=body)
+    return asyncio.run(call())
+
+
+class TestDiffEndpoint(unittest.TestCase):
+    def test_diff(self):
+        stored = wrapper.dify_estimate(**wrapper._to_logic_args(wrapper.EstimationRequest(screen_count=8)))
+        res = _post('/calculate/diff', {'base': {'result': stored},
+                                        'revised': {'request': {'screen_count': '12', 'profile': 'poc'}}})
+        self.assertEqual(res.status_code, 200)
+        body = res.json()
+        self.assertEqual(list(body['changed_inputs']), ['estimation_profile', 'screen_count'])
+        self.assertEqual(body['changes']['man_days.fp_based']['caused_by'], ['estimation_profile', 'screen_count'])
+
+        self.assertEqual(_post('/calculate/diff', {'base': {}, 'revised': {'result': stored}}).status_code, 400)
+        self.assertEqual(_post('/calculate/diff', {'base': {'session_id': 'nope'},
+                                                   'revised': {'result': stored}}).status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import dify_bundle
+from dify_assets.code.estimate_logic import main
+from tests.test_batch import CASES
+
+# 入力スキーマ（estimate_schema）の解釈を通る入力: 文字列のリスト・全角数字・百分率・解釈できない値（input_errors）
+SCHEMA_CASES = [
+    {'screen_count': '１２', 'features': 'auth, payment', 'target_margin': '15%'},
+    {'screen_count': 'x', 'team_ratio': 'Rank3:0.8, Rank2:0.2', 'dept_allocation': 'ＤＴ第１開発部: 0.6\nＣＳ第１システム開発部: 0.4'},
+]
+
+# 空のディレクトリで Code Node と同じく1ファイルだけを読み込み、main の結果と埋め込みモジュールの出所を返す
+RUN_ALONE = '''
+import json, runpy, sys
+ns = runpy.run_path("code_node.py")
+cases = json.loads(sys.stdin.read())
+print(json.dumps({
+    "results": [ns["main"](**case)["result"] for case in cases],
+    "modules": {name: sys.modules[name].__file__ for name in ("estimate_engine", "estimate_schema")},
+}))
+'''
+
+
+class TestDifyBundle(unittest.TestCase):
+    def test_bundle_is_up_to_date(self):
+        with open(dify_bundle.BUNDLE_PATH, encoding="utf-8") as f:
+            self.assertEqual(f.read(), dify_bundle.build(), "run python -m dify_bundle")
+        self.assertEqual(dify_bundle.main(["--check"]), 0)
+
+    def test_bundles_local_imports_in_dependency_order(self):
+        # estimate_schema は estimate_engine を import するため、engine を先に登録する
+        self.assertEqual(dify_bundle.bundled_modules(), ('estimate_engine', 'estimate_schema'))
+        self.assertEqual(dify_bundle.local_imports('import json\nfrom estimate_schema import text_list\n'),
+                         ['estimate_schema'])
+        with self.assertRaises(ValueError):
+            dify_bundle.local_imports('from tests.test_batch import CASES\n')
+
+    def test_bundle_runs_alone(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            shutil.copy(dify_bundle.BUNDLE_PATH, os.path.join(tmp, "code_node.py"))
+            # -I: カレントディレクトリ・PYTHONPATH・ユーザー site を見ない（リポジトリのモジュールは import できない）
+            proc = subprocess.run([sys.executable, "-I", "-c", RUN_ALONE], cwd=tmp,
+                                  input=json.dumps(CASES + SCHEMA_CASES),
+                                  capture_output=True, text=True, encoding="utf-8", timeout=60)
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        out = json.loads(proc.stdout)
+        self.assertEqual(out["results"], [main(**case)["result"] for case in CASES + SCHEMA_CASES])
+        self.assertIn('"input_errors"', out["results"][-1])
+        self.assertEqual(out["modules"], {"estimate_engine": "<dify bundle: estimate_engine>",
+                                          "estimate_schema": "<dify bundle: estimate_schema>"})
+
+
+if __name__ == '__main__':
+    unittest.main()
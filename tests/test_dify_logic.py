@@ -0,0 +1,20 @@
+import unittest
+import json
+from dify_assets.code.estimate_logic import estimate, main
+from tests.test_batch import CASES
+
+
+class TestDifyEntrypoints(unittest.TestCase):
+    def test_estimate_returns_dict(self):
+        data = estimate(screen_count=10, features=['auth'])
+        self.assertIsInstance(data, dict)
+        self.assertEqual(data['status'], 'success')
+        self.assertEqual(data['input_echo']['features'], ['auth'])
+
+    def test_main_is_json_of_estimate(self):
+        for case in CASES:
+            self.assertEqual(json.loads(main(**case)["result"]), json.loads(json.dumps(estimate(**case))))
+
+
+if __name__ == '__main__':
+    unittest.main()
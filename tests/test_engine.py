@@ -0,0 +1,293 @@
+import unittest
+import copy
+import itertools
+import random
+import yaml
+from config_snapshot import build_snapshot
+from estimate_engine import LabelIndex, RulesetError, compile_ruleset, normalize_label
+from dify_assets.code import estimate_logic as dify_logic
+import estimate_logic as root_logic
+import function_app
+from tests import legacy_logic
+from tests.test_batch import CASES
+
+
+def _without_unresolved(result):
+    # 凍結コピーには unresolved_items が無い
+    if isinstance(result, tuple):
+        return _without_unresolved(result[0]), result[1]
+    return {k: v for k, v in result.items() if k != 'unresolved_items'}
+
+
+def _random_dify_requests(n, seed=7):
+    rng = random.Random(seed)
+    features = list(dify_logic.FEATURE_MAN_DAYS) + list(dify_logic.FEATURE_LABEL_MAP) + ['unknown', '']
+    phase2 = list(dify_logic.PHASE2_ITEMS) + list(dify_logic.PHASE2_LABEL_MAP) + ['unknown']
+    phase3 = list(dify_logic.PHASE3_ITEMS) + list(dify_logic.PHASE3_LABEL_MAP) + ['unknown']
+    depts = list(dify_logic.BS_ORG_CONFIG) + ['存在しない部門', None]
+    reqs = []
+    for _ in range(n):
+        req = {
+            'screen_count': rng.choice([None, 0, 1, 7, 12, 30, 2.5]),
+            'table_count': rng.choice([None, 0, 3, 11]),
+            'complexity': rng.choice([None, 'low', 'medium', 'high', 'very_high', 'bogus']),
+            'duration': rng.choice([None, 'long', 'normal', 'short', 'bogus']),
+            'dev_type': rng.choice([None, 'new', 'porting', 'bogus']),
+            'target_platform': rng.choice([None, 'web_b2e', 'web_b2c', 'mobile', 'all', 'bogus']),
+            'estimation_profile': rng.choice([None, 'poc', 'enterprise', 'mission_critical', 'bogus']),
+            'features': rng.sample(features, rng.randint(0, 5)),
+            'phase2_items': rng.sample(phase2, rng.randint(0, 3)),
+            'phase3_items': rng.sample(phase3, rng.randint(0, 3)),
+            'confidence': rng.choice([None, 'low', 'medium', 'high']),
+            'target_margin': rng.choice([None, 0.1, 0.25, 1.0, 1.5]),
+            'department': rng.choice(depts),
+        }
+        if rng.random() < 0.3:
+            req['dept_allocation'] = [{'dept': rng.choice(depts), 'share': rng.choice([0, 0.3, 1, -1])}
+                                      for _ in range(rng.randint(0, 3))]
+        if rng.random() < 0.3:
+            req['team_ratio'] = {'Rank4': rng.random(), 'Rank1': rng.random()}
+        reqs.append(req)
+    return reqs
+
+
+class TestDifyEngine(unittest.TestCase):
+    def test_matches_legacy(self):
+        for req in _random_dify_requests(500) + [dify_logic.prepare_args(c) for c in CASES]:
+            with self.subTest(req=req):
+                self.assertEqual(_without_unresolved(dify_logic.main_logic(req, ['t'])), legacy_logic.dify_main_logic(req, ['t']))
+
+    def test_org_rates_match_legacy(self):
+        alloc = [{'dept': 'ＤＴ第１開発部', 'share': 0.6}, {'dept': 'ＣＳ第１システム開発部', 'share': 0.4}]
+        for primary, allocations in [(None, None), ('ＤＴ第１開発部', None), ('x', alloc), ('x', []),
+                                     ('x', [{'dept': 'x', 'share': 0}])]:
+            self.assertEqual(dify_logic.resolve_bs_org_rates(primary, allocations),
+                             legacy_logic.resolve_bs_org_rates(primary, allocations))
+
+
+    def test_rate_table_reuses_allocation_vectors(self):
+        table = dify_logic.BS_RATE_TABLE
+        alloc = [{'dept': 'ＤＴ第１開発部', 'share': 0.6}, {'dept': 'ＣＳ第１システム開発部', 'share': 0.4}]
+        vector = table.allocation_vector(alloc)
+        self.assertIs(table.allocation_vector([dict(a) for a in alloc]), vector)
+        self.assertEqual([table.departments[i] for i in vector[0]], ['ＤＴ第１開発部', 'ＣＳ第１システム開発部'])
+
+    def test_rate_table_matches_legacy_random(self):
+        rng = random.Random(5)
+        depts = list(dify_logic.BS_ORG_CONFIG) + ['存在しない部門', None]
+        for _ in range(300):
+            alloc = [{'dept': rng.choice(depts), 'share': rng.choice([0, 0.1, 0.25, 1, 3, -1, '0.5'])}
+                     for _ in range(rng.randint(0, 4))]
+            primary = rng.choice(depts)
+            with self.subTest(primary=primary, alloc=alloc):
+                self.assertEqual(dify_logic.resolve_bs_org_rates(primary, alloc),
+                                 legacy_logic.resolve_bs_org_rates(primary, alloc))
+
+    def test_parse_dept_allocation_returns_fresh_lists(self):
+        text = 'ＤＴ第１開発部: 3\nＣＳ第１システム開発部: 1\n不明: 1'
+        first = dify_logic.parse_dept_allocation(text)
+        first[0]['share'] = 0
+        self.assertEqual(dify_logic.parse_dept_allocation(text),
+                         [{'dept': 'ＤＴ第１開発部', 'share': 0.75}, {'dept': 'ＣＳ第１システム開発部', 'share': 0.25}])
+
+
+class TestRootEngine(unittest.TestCase):
+    def test_matches_legacy(self):
+        rng = random.Random(11)
+        for _ in range(300):
+            req = {
+                'screen_count': rng.choice([None, 0, 5, '12', 40]),
+                'table_count': rng.choice([None, 0, 4, '3']),
+                'profile': rng.choice([None, '', 'poc', 'standard', 'enterprise', 'bogus']),
+                'estimation_profile': rng.choice([None, 'poc', 'enterprise']),
+                'department': rng.choice([None, 'ＤＴ第１開発部', 'ソリューションビジネス推進室', 'unknown']),
+                'features': rng.choice([[], ['auth', 'payment'], 'auth, search,admin', 'unknown', None]),
+                'target_margin': rng.choice([None, '15%', '0.2', 'abc', 0.3, 25, '']),
+            }
+            if rng.random() < 0.8:
+                req['complexity'] = rng.choice([None, 'low', 'medium', 'high', 'bogus'])
+            with self.subTest(req=req):
+                self.assertEqual(root_logic.main_logic(req), legacy_logic.root_main_logic(req))
+
+
+class TestFunctionAppEngine(unittest.TestCase):
+    def setUp(self):
+        with open(function_app.CONFIG_STORE.path, "r", encoding="utf-8") as f:
+            self.config = yaml.safe_load(f)
+
+    def _snapshot(self, **policy):
+        config = copy.deepcopy(self.config)
+        config['policy'].update(policy)
+        return build_snapshot(config)
+
+    def test_matches_legacy(self):
+        features = list(function_app.FEATURE_MAN_DAYS) + list(function_app.FEATURE_LABEL_MAP) + ['unknown']
+        phase2 = list(function_app.PHASE2_ITEMS) + list(function_app.PHASE2_LABEL_MAP)
+        phase3 = list(function_app.PHASE3_ITEMS) + list(function_app.PHASE3_LABEL_MAP)
+        rng = random.Random(3)
+        strict = self._snapshot()
+        loose = self._snapshot(require_explicit_productivity_for_step_fp=False,
+                               require_explicit_vendor_confidence=False)
+        for snapshot, _ in itertools.product([strict, loose], range(200)):
+            req = {
+                'method': rng.choice(['screen', 'step', 'fp', 'bogus']),
+                'complexity': rng.choice(['low', 'medium', 'high', 'very_high']),
+                'screen_count': rng.choice([0, 5, 10, 17]),
+                'confidence': rng.choice([None, 'low', 'medium', 'high', 'unknown']),
+                'features': rng.sample(features, rng.randint(0, 4)),
+                'phase2_items': rng.sample(phase2, rng.randint(0, 3)),
+                'phase3_items': rng.sample(phase3, rng.randint(0, 3)),
+                'loc': rng.choice([None, 1000, 2500]),
+                'fp_count': rng.choice([None, 80]),
+                'man_days_per_unit': rng.choice([None, 0.05, 1.0]),
+            }
+            if snapshot is loose and req['method'] in ('step', 'fp'):
+                # 必須チェックなしでは None × 数値の TypeError になる（従来どおり）
+                req['loc'] = req['loc'] or 1000
+                req['fp_count'] = req['fp_count'] or 80
+                req['man_days_per_unit'] = req['man_days_per_unit'] or 0.05
+            with self.subTest(req=req):
+                self.assertEqual(_without_unresolved(function_app.main_logic(req, snapshot)),
+                                 legacy_logic.function_app_main_logic(req, snapshot))
+
+    def test_plan_is_compiled_once_per_snapshot(self):
+        snapshot = self._snapshot()
+        plan = function_app.plan_for(snapshot)
+        self.assertIs(function_app.plan_for(snapshot), plan)
+        self.assertIsNot(function_app.plan_for(self._snapshot()), plan)
+
+    def test_policy_errors(self):
+        data, status = function_app.main_logic({'method': 'step'}, self._snapshot())
+        self.assertEqual(status, 400)
+        self.assertIn('STEP', data['message'])
+        data, status = function_app.main_logic({'phase3_items': ['ui_design']}, self._snapshot())
+        self.assertEqual(status, 400)
+        self.assertIn('confidence', data['message'])
+
+
+class TestLabelIndex(unittest.TestCase):
+    def test_normalize_label_folds_width_and_spacing(self):
+        self.assertEqual(normalize_label('認証・認可（Auth/SSO）'), normalize_label('認証・認可 (Auth/SSO)'))
+        self.assertEqual(normalize_label('　ＣＲＵＤ 操作 '), normalize_label('CRUD操作'))
+        self.assertEqual(normalize_label('ｾｷｭﾘﾃｨ審査･対策案'), normalize_label('セキュリティ審査・対策案'))
+
+    def test_dify_resolves_variants_and_reports_unresolved(self):
+        data = dify_logic.main_logic({
+            'features': ['認証・認可（Auth/SSO）', 'auth', '管理画面(Admin)', 'i18n', 'ブロックチェーン', ''],
+            'phase2_items': ['ｾｷｭﾘﾃｨ審査･対策案'],
+            'phase3_items': ['不明な項目'],
+        }, [])
+        self.assertEqual(data['input_echo']['features'], ['auth', 'admin_dashboard', 'multi_language'])
+        self.assertEqual(data['input_echo']['phase2_items'], ['security_review'])
+        self.assertEqual(data['unresolved_items'],
+                         {'features': ['ブロックチェーン'], 'phase2_items': [], 'phase3_items': ['不明な項目']})
+        self.assertEqual(data, dify_logic.main_logic({
+            'features': ['auth', 'admin_dashboard', 'multi_language', 'ブロックチェーン'],
+            'phase2_items': ['security_review'], 'phase3_items': ['不明な項目'],
+        }, []))
+
+    def test_function_app_resolves_variants_and_reports_unresolved(self):
+        data, status = function_app.main_logic({'features': ['ＣＲＵＤ操作', 'ユーザー 認証', 'unknown'],
+                                                'phase2_items': ['figma化']})
+        self.assertEqual(status, 200)
+        self.assertEqual(data['breakdown']['development']['details']['feature_days'],
+                         function_app.FEATURE_MAN_DAYS['crud'] + function_app.FEATURE_MAN_DAYS['auth'])
+        self.assertEqual(data['breakdown']['phase2_design']['selected_items'], ['figma'])
+        self.assertEqual(data['unresolved_items'],
+                         {'features': ['unknown'], 'phase2_items': [], 'phase3_items': []})
+
+    def test_resolve_keeps_legacy_precedence(self):
+        table = {'a': 1, 'b': 2}
+        self.assertEqual(LabelIndex(table, {'b': 'a'}).resolve(['b', 'a', None, 'x']), (['a'], ['x']))
+        self.assertEqual(LabelIndex(table, {'b': 'a'}, prefer='key').lookup('b'), 'b')
+        self.assertEqual(LabelIndex(table, {'ラベル': 'zzz'}, prefer='key').resolve_set(['ラベル']), ([], ['ラベル']))
+        self.assertEqual(LabelIndex(table).resolve('a, b'), ([], []))
+
+    def test_conflicting_labels_are_rejected(self):
+        with self.assertRaises(RulesetError):
+            LabelIndex({'a': 1, 'b': 2}, {'ラベルＡ': 'a', 'ラベル A': 'b'})
+        with self.assertRaises(RulesetError):
+            LabelIndex({'a': 1}, aliases={'x': 'missing'})
+
+
+class TestPlanKernel(unittest.TestCase):
+    def test_kernel_matches_evaluate(self):
+        plan = dify_logic.PLAN
+        given = ('dev_total', 'direct_labor', 'p2_cost', 'p3_cost', 'plat', 'dur')
+        outputs = ('indirect_per_hour', 'cogs', 'final', 'sga', 'operating_margin', 'suggested_price')
+        tail = plan.kernel(given, outputs)
+        self.assertIs(plan.kernel(given, outputs), tail)
+        for req in _random_dify_requests(300, seed=11):
+            c = plan.evaluate(req)
+            with self.subTest(req=req):
+                self.assertEqual(tail(req, *[getattr(c, n) for n in given]), tuple(getattr(c, n) for n in outputs))
+                self.assertEqual(plan.kernel((), 'diff')(req), c.diff)
+                # 項目の解決は unresolved への部分的な代入を含む（dict を作る文も残す）
+                self.assertEqual(plan.kernel((), ('p2_cost', 'p3_cost'))(req), (c.p2_cost, c.p3_cost))
+
+    def test_column_kernel_matches_row_kernel(self):
+        plan = dify_logic.PLAN
+        given, outputs = ('screen_count', 'table_count', 'p3_fixed'), ('cogs', 'final')
+        row = plan.kernel(given, outputs)
+        rows = plan.kernel(given, outputs, ('screen_count', 'p3_fixed'))
+        self.assertIs(plan.kernel(given, outputs, ('screen_count', 'p3_fixed')), rows)
+        for req in _random_dify_requests(50, seed=17):
+            c = plan.evaluate(req)
+            screens, fixed = [1, c.screen_count, 40], [0.0, c.p3_fixed, 250000.0]
+            with self.subTest(req=req):
+                self.assertEqual(rows(req, screens, c.table_count, fixed),
+                                 [row(req, s, c.table_count, f) for s, f in zip(screens, fixed)])
+                self.assertEqual(rows(req, [], c.table_count, []), [])
+        with self.assertRaises(ValueError):
+            plan.kernel(given, outputs, ('diff',))
+
+    def test_kernel_rejects_unknown_and_split_values(self):
+        with self.assertRaises(ValueError):
+            dify_logic.PLAN.kernel((), 'bogus')
+        with self.assertRaises(ValueError):
+            # dt_design と dt_dev は同じ文で代入される
+            dify_logic.PLAN.kernel(('dt_dev',), 'p2_cost')
+
+    def test_affected_recomputes_downstream_values(self):
+        plan = dify_logic.PLAN
+        rng = random.Random(13)
+        reqs = _random_dify_requests(300, seed=13)
+        for before, other in zip(reqs, reqs[1:] + reqs[:1]):
+            # 1〜2項目だけを変えたリクエスト
+            after = dict(before, **{k: other.get(k) for k in rng.sample(sorted(other), rng.randint(1, 2))})
+            changed = [k for k in set(before) | set(after) if before.get(k) != after.get(k)]
+            given, outputs = plan.affected(changed)
+            old, new = plan.evaluate(before), plan.evaluate(after)
+            with self.subTest(changed=changed):
+                if outputs:
+                    self.assertEqual(plan.kernel(given, outputs)(after, *[getattr(old, n) for n in given]),
+                                     tuple(getattr(new, n) for n in outputs))
+                for name in set(plan.values) - set(outputs):
+                    self.assertEqual(getattr(old, name), getattr(new, name), name)
+        self.assertEqual(plan.affected(['target_margin']), (('cogs', 'sga'), ('target_margin', 'suggested_price')))
+        self.assertEqual(plan.affected(['profile']), ((), ()))
+
+    def test_dependencies(self):
+        deps = dify_logic.PLAN.dependencies()
+        self.assertEqual(deps['p2_cost'], {'phase2_items', 'complexity', 'dev_type'})
+        self.assertEqual(deps['unresolved'], {'features', 'phase2_items', 'phase3_items'})
+        self.assertNotIn('target_margin', deps['operating_margin'])
+        self.assertIn('target_margin', deps['suggested_price'])
+
+
+class TestCompileErrors(unittest.TestCase):
+    def test_unknown_models_are_rejected(self):
+        base = copy.deepcopy(dify_logic.RULESET)
+        for path, value in [(("cost", "model"), "bogus"), (("effort", "model"), "bogus")]:
+            ruleset = copy.deepcopy(base)
+            ruleset[path[0]][path[1]] = value
+            with self.assertRaises(RulesetError):
+                compile_ruleset(ruleset)
+        ruleset = copy.deepcopy(base)
+        ruleset["axes"].append({"name": "bogus", "default": None, "fallback": 1.0})
+        with self.assertRaises(RulesetError):
+            compile_ruleset(ruleset)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import os
+import itertools
+import time
+from dify_assets.code.estimate_logic import estimate
+from estimate_grid import GRID_AXES, sensitivity_grid
+
+BASE = {
+    'screen_count': 12, 'table_count': 3, 'features': ['auth', 'payment'],
+    'phase2_items': ['basic_design'], 'phase3_items': ['logo_creation'], 'confidence': 'low',
+    'department': 'ＣＳ第１システム開発部', 'team_ratio': 'Rank4:0.2, Rank3:0.5, Rank2:0.3',
+}
+
+
+class TestSensitivityGrid(unittest.TestCase):
+    def test_full_config_grid_matches_single(self):
+        axes = {name: None for name in ("complexity", "duration", "dev_type", "target_platform", "estimation_profile")}
+        grid = sensitivity_grid(BASE, axes)
+        self.assertEqual(grid['cells'], 4 * 3 * 2 * 4 * 3)
+        self.assertEqual(len(grid['estimated_amount']), grid['cells'])
+
+        values = [axis['values'] for axis in grid['axes']]
+        for i, combo in enumerate(itertools.product(*values)):
+            req = dict(BASE, **dict(zip(GRID_AXES, combo)))
+            single = estimate(**req)
+            profit = single['profit_analysis']
+            self.assertEqual(grid['estimated_amount'][i], profit['sales'])
+            self.assertEqual(grid['man_days'][i], single['man_days']['development_total'])
+            self.assertAlmostEqual(grid['operating_margin'][i], profit['operating_profit'] / profit['sales'], places=4)
+
+    def test_size_axes(self):
+        grid = sensitivity_grid(BASE, {'screen_count': [5, 10, '20'], 'complexity': ['low', 'high']})
+        self.assertEqual(grid['shape'], [1, 3, 1, 2, 1, 1, 1])
+        single = estimate(**dict(BASE, screen_count=20, complexity='high'))
+        self.assertEqual(grid['estimated_amount'][-1], single['profit_analysis']['sales'])
+
+    def test_invalid_axes(self):
+        with self.assertRaises(ValueError):
+            sensitivity_grid(BASE, {'color': ['red']})
+        with self.assertRaises(ValueError):
+            sensitivity_grid(BASE, {'complexity': ['extreme']})
+        with self.assertRaises(ValueError):
+            sensitivity_grid(BASE, {'screen_count': None})
+
+    @unittest.skipUnless(os.environ.get("RUN_TIMING_TESTS"), "wall-clock budget; set RUN_TIMING_TESTS=1 to run")
+    def test_large_grid_latency(self):
+        axes = {name: None for name in ("complexity", "duration", "dev_type", "target_platform", "estimation_profile")}
+        axes['screen_count'] = list(range(1, 21))
+        started = time.perf_counter()
+        grid = sensitivity_grid(BASE, axes)
+        self.assertEqual(grid['cells'], 5760)
+        self.assertLess(time.perf_counter() - started, 0.1)
+
+
+class TestGridEndpoint(unittest.TestCase):
+    def test_calculate_grid(self):
+        from fastapi.testclient import TestClient
+        from outsystems_api_wrapper import app
+        client = TestClient(app)
+        res = client.post('/calculate/grid', json={'base': {'screen_count': 10}, 'axes': {'complexity': None}})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['cells'], 4)
+        res = client.post('/calculate/grid', json={'base': {'screen_count': 10}, 'axes': {'complexity': ['x']}})
+        self.assertEqual(res.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
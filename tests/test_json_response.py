@@ -0,0 +1,68 @@
+import unittest
+import asyncio
+import json
+import httpx
+import azure.functions as func
+import function_app
+import json_response
+import outsystems_api_wrapper as wrapper
+from dify_assets.code import estimate_logic as dify_logic
+
+CALCULATE_BODY = {
+    "screen_count": 12, "table_count": 3, "complexity": "high", "department": "ＤＴ第１開発部",
+    "features": ["認証・認可 (Auth/SSO)", "payment"], "phase2_items": ["basic_design"], "confidence": "low",
+}
+
+
+class TestEncoders(unittest.TestCase):
+    def setUp(self):
+        self.orig = json_response.encoder_name()
+
+    def tearDown(self):
+        json_response.set_encoder(self.orig)
+
+    def test_stdlib_output_is_compact_utf8(self):
+        body = json_response.dumps_stdlib({"部門": "ＤＴ第１開発部", "n": [1, 2.5]})
+        self.assertEqual(body, '{"部門":"ＤＴ第１開発部","n":[1,2.5]}'.encode("utf-8"))
+
+    @unittest.skipIf(json_response.orjson is None, "orjson not installed")
+    def test_orjson_matches_stdlib(self):
+        result = dify_logic.estimate(**CALCULATE_BODY)
+        fast = json_response.dumps_orjson(result)
+        self.assertEqual(json.loads(fast), json.loads(json_response.dumps_stdlib(result)))
+        self.assertEqual(json_response.dumps_orjson({1: "a"}), b'{"1":"a"}')
+        # orjson の範囲外（64bit 超）の整数は標準 json で書き出す
+        self.assertEqual(json_response.dumps_orjson({"n": 2 ** 70}), ('{"n":%d}' % 2 ** 70).encode())
+
+    def test_set_encoder(self):
+        self.assertEqual(json_response.set_encoder("stdlib"), "stdlib")
+        self.assertIs(json_response.dumps_bytes, json_response.dumps_stdlib)
+        with self.assertRaises(ValueError):
+            json_response.set_encoder("bogus")
+
+
+class TestResponses(unittest.TestCase):
+    def test_calculate_returns_compact_utf8(self):
+        async def call():
+            transport = httpx.ASGITransport(app=wrapper.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await client.post("/calculate", json=CALCULATE_BODY)
+        res = asyncio.run(call())
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["content-type"], "application/json")
+        self.assertIn("ＤＴ第１開発部".encode("utf-8"), res.content)
+        self.assertNotIn(b"\\u", res.content)
+        self.assertNotIn(b'": ', res.content)
+
+    def test_azure_route_returns_utf8_bytes(self):
+        body = {"screen_count": 12, "complexity": "high", "features": ["ユーザー認証"]}
+        req = func.HttpRequest(method="POST", url="/api/calculate_estimate", body=json.dumps(body).encode("utf-8"))
+        res = function_app.calculate_estimate.build().get_user_function()(req)
+        data = json.loads(res.get_body())
+        expected, _ = function_app.main_logic(body)
+        self.assertEqual(data, json.loads(json.dumps(expected)))
+        self.assertNotIn(b"\\u", res.get_body())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+import unittest
+import asyncio
+import copy
+import random
+import re
+import time
+import httpx
+from unittest import mock
+import metrics
+import estimate_memo
+import outsystems_api_wrapper as wrapper
+from estimate_memo import EstimateMemo
+from dify_assets.code import estimate_logic as dify_logic
+from estimate_engine import compile_ruleset
+
+FEATURES = ['auth', 'payment', '認証・認可 (Auth/SSO)', '認証・認可（Auth/SSO）', 'api_external', 'unknown_feature', '']
+PHASE2 = ['basic_design', '基本設計書作成', 'security_review', 'mystery']
+PHASE3 = ['logo_creation', 'ui_prototype', 'brand_guideline']
+
+
+def _random_request(rng):
+    req = {
+        'screen_count': rng.choice([None, 0, 5, 12]),
+        'table_count': rng.choice([None, 0, 3]),
+        'complexity': rng.choice([None, '', 'medium', 'high', 'weird']),
+        'dev_type': rng.choice([None, 'new', 'porting']),
+        'estimation_profile': rng.choice([None, 'enterprise', 'poc']),
+        'department': rng.choice([None, 'ＤＴ第１開発部', 'ＣＳ第１システム開発部']),
+        'features': rng.sample(FEATURES, rng.randint(0, 4)) * rng.randint(1, 2),
+        'phase2_items': rng.sample(PHASE2, rng.randint(0, 3)),
+        'phase3_items': rng.sample(PHASE3, rng.randint(0, 2)),
+        'confidence': rng.choice([None, 'low', 'high']),
+        'target_margin': rng.choice([None, 0.2, '15%']),
+        'tables': rng.choice([None, ['a', 'b'], ['b', 'a', 'a']]),
+    }
+    if rng.random() < 0.2:
+        req['team_ratio'] = {'Rank3': 0.5, 'Rank2': 0.5}
+    if rng.random() < 0.2:
+        req['dept_allocation'] = 'ＤＴ第１開発部: 0.6\nＣＳ第１システム開発部: 0.4'
+    return req
+
+
+class TestEstimateMemo(unittest.TestCase):
+    def setUp(self):
+        metrics.REGISTRY.clear()
+
+    def test_results_match_unmemoized_estimate(self):
+        rng = random.Random(7)
+        memo = EstimateMemo(max_entries=4096, ttl=0)
+        for _ in range(500):
+            req = _random_request(rng)
+            # 同値な変形（項目の並べ替え・重複・表記ゆれ・既定値の明示）はヒットし、結果は直接計算と一致する
+            variant = dict(req)
+            for name in ('features', 'phase2_items', 'phase3_items'):
+                variant[name] = rng.sample(req[name], len(req[name])) + req[name][:1]
+            variant['features'] = [{'auth': '認証・認可（Auth/SSO）'}.get(f, f) for f in variant['features']]
+            if req['complexity'] in (None, ''):
+                variant['complexity'] = 'medium'
+            for r in (req, variant):
+                with self.subTest(req=r):
+                    self.assertEqual(memo.estimate(dict(r)), dify_logic.estimate(**r))
+        self.assertGreaterEqual(memo.stats["hits"], 400)
+
+    def test_equivalent_requests_share_an_entry(self):
+        memo = EstimateMemo()
+        first = memo.estimate({'features': ['auth', 'payment'], 'complexity': 'medium', 'screen_count': 10})
+        second = memo.estimate({'features': ['payment', '認証・認可（Auth/SSO）', 'payment', 'nope']})
+        self.assertEqual(memo.stats["hits"], 1)
+        self.assertEqual(second['estimated_amount'], first['estimated_amount'])
+        self.assertEqual(second['input_echo']['features'], ['payment', 'auth'])
+        self.assertEqual(second['unresolved_items']['features'], ['nope'])
+        self.assertEqual(first['input_echo']['features'], ['auth', 'payment'])
+
+    def test_plan_change_invalidates(self):
+        memo = EstimateMemo()
+        memo.estimate({'screen_count': 3})
+        # 評価プランが差し替わると（係数が変わっていなくても）前のプランの結果は使わない
+        ruleset = copy.deepcopy(dify_logic.RULESET)
+        ruleset['cost']['buffer'] = 1.5
+        with mock.patch.object(dify_logic, 'PLAN', compile_ruleset(ruleset)):
+            result = memo.estimate({'screen_count': 3})
+            self.assertEqual(result, dify_logic.estimate(screen_count=3))
+        self.assertEqual(memo.stats["hits"], 0)
+        self.assertEqual(memo.stats["invalidations"], 1)
+        self.assertEqual(memo.snapshot()["entries"], 1)
+        memo.estimate({'screen_count': 3})
+        self.assertEqual(memo.stats["invalidations"], 2)
+
+    def test_results_are_private_copies(self):
+        memo = EstimateMemo()
+        req = {'screen_count': 3, 'features': ['auth'], 'team_ratio': {'Rank3': 0.5, 'Rank2': 0.5}}
+        expected = dify_logic.estimate(**req)
+        for _ in range(2):
+            # ミス・ヒットのどちらで返した結果を書き換えても、次の結果は変わらない
+            result = memo.estimate(dict(req))
+            self.assertEqual(result, expected)
+            result['profit_analysis']['sales'] = -1
+            result['input_echo']['features'].append('payment')
+            result['bs_input']['team_ratio']['Rank4'] = 1.0
+            result['man_days'].clear()
+        self.assertEqual(memo.estimate(dict(req)), expected)
+
+    def test_lru_and_ttl(self):
+        memo = EstimateMemo(max_entries=2, ttl=0)
+        for n in (1, 2, 1, 3):
+            memo.estimate({'screen_count': n})
+        self.assertEqual(memo.stats["evictions"], 1)
+        memo.estimate({'screen_count': 1})
+        self.assertEqual(memo.stats["hits"], 2)
+
+        memo = EstimateMemo(max_entries=8, ttl=0.01)
+        memo.estimate({'screen_count': 1})
+        time.sleep(0.02)
+        memo.estimate({'screen_count': 1})
+        self.assertEqual(memo.stats["expired"], 1)
+        self.assertEqual(memo.stats["hits"], 0)
+
+    def test_disabled_and_unhashable_inputs(self):
+        memo = EstimateMemo(max_entries=0)
+        memo.estimate({'screen_count': 1})
+        self.assertEqual(memo.snapshot()["entries"], 0)
+        memo = EstimateMemo()
+        req = {'screen_count': 1, 'team_ratio': {'Rank3': 1.0}, 'dept_allocation': [{'dept': 'ＤＴ第１開発部', 'share': {1}}]}
+        with self.assertRaises(TypeError):
+            memo.estimate(req)
+        self.assertEqual(memo.stats["bypassed"], 1)
+
+    def test_metrics(self):
+        memo = EstimateMemo()
+        for _ in range(3):
+            memo.estimate({'screen_count': 4})
+        self.assertEqual(metrics.MEMO_LOOKUPS.value(("hit",)), 2)
+        self.assertEqual(metrics.MEMO_LOOKUPS.value(("miss",)), 1)
+        self.assertEqual(metrics.MEMO_ENTRIES.value(), 1)
+        self.assertAlmostEqual(metrics.MEMO_HIT_RATIO.value(), 2 / 3)
+        self.assertIn("# TYPE estimate_memo_hit_ratio gauge", metrics.REGISTRY.render())
+
+    def test_key_covers_every_input_read_by_the_plan(self):
+        read = set(re.findall(r"req\.get\('(\w+)'", dify_logic.PLAN.source))
+        covered = {name for name, _ in estimate_memo.AXIS_DEFAULTS} | {name for name, _ in estimate_memo.SIZE_DEFAULTS} \
+            | {name for name, _ in estimate_memo.ITEM_INDEXES} | set(estimate_memo.PLAIN_KEYS) | {'team_ratio', 'dept_allocation'}
+        self.assertLessEqual(read, covered)
+
+
+class TestCalculateMemo(unittest.TestCase):
+    def test_route_uses_memo(self):
+        wrapper.estimate_memo.clear()
+
+        async def calls():
+            transport = httpx.ASGITransport(app=wrapper.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                body = {"screen_count": 12, "features": ["auth", "payment"]}
+                a = await client.post("/calculate", json=body)
+                b = await client.post("/calculate", json=dict(body, features=["payment", "auth"]))
+                stats = await client.get("/calculate/cache")
+                return a.json(), b.json(), stats.json()
+
+        a, b, stats = asyncio.run(calls())
+        self.assertEqual(a['estimated_amount'], b['estimated_amount'])
+        self.assertEqual(b['input_echo']['features'], ['payment', 'auth'])
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (1, 1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
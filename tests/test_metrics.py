@@ -0,0 +1,92 @@
+import unittest
+import asyncio
+import httpx
+import metrics
+import outsystems_api_wrapper as wrapper
+from gemini_client import MODEL_HEALTH, GeminiClient
+from tests.gemini_stub import GeminiStubHandler, start_stub
+
+REPORT_BODY = {"estimation_result": {"estimated_amount": "¥2,000"}, "language": "ja"}
+
+
+class TestMetricPrimitives(unittest.TestCase):
+    def test_histogram_exposition(self):
+        registry = metrics.Registry()
+        h = registry.histogram("t_seconds", "Test.", ("route",), buckets=(0.1, 1.0))
+        for v in (0.05, 0.5, 5.0):
+            h.observe(("/x",), v)
+        c = registry.counter("t_total", "Test.", ("status",))
+        c.inc(("200",))
+        c.inc(("200",))
+        text = registry.render()
+        self.assertIn('# TYPE t_seconds histogram', text)
+        self.assertIn('t_seconds_bucket{route="/x",le="0.1"} 1', text)
+        self.assertIn('t_seconds_bucket{route="/x",le="1"} 2', text)
+        self.assertIn('t_seconds_bucket{route="/x",le="+Inf"} 3', text)
+        self.assertIn('t_seconds_count{route="/x"} 3', text)
+        self.assertIn('t_seconds_sum{route="/x"} 5.55', text)
+        self.assertIn('t_total{status="200"} 2', text)
+
+    def test_label_escaping(self):
+        c = metrics.Counter("e_total", "Test.", ("v",))
+        c.inc(('a"b\\c\nd',))
+        self.assertEqual(c.render(), ['e_total{v="a\\"b\\\\c\\nd"} 1'])
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server, base_url = start_stub()
+        cls.orig = (wrapper.GEMINI_API_KEY, wrapper.GEMINI_MODEL, wrapper.gemini_client)
+        wrapper.GEMINI_API_KEY = "test-key"
+        wrapper.GEMINI_MODEL = "gemini-2.5-flash"
+        wrapper.gemini_client = GeminiClient(base_url=base_url)
+
+    @classmethod
+    def tearDownClass(cls):
+        wrapper.GEMINI_API_KEY, wrapper.GEMINI_MODEL, wrapper.gemini_client = cls.orig
+        cls.server.shutdown()
+
+    def setUp(self):
+        GeminiStubHandler.unavailable_models = set()
+        GeminiStubHandler.calls = []
+        wrapper.report_cache.clear()
+        MODEL_HEALTH.clear()
+        metrics.REGISTRY.clear()
+
+    async def _calls(self, *requests):
+        transport = httpx.ASGITransport(app=wrapper.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            for method, path, body in requests:
+                await client.request(method, path, json=body)
+            return await client.get("/metrics")
+
+    def test_http_and_stage_metrics(self):
+        res = asyncio.run(self._calls(("POST", "/calculate", {"screen_count": 5}),
+                                      ("POST", "/calculate", {"screen_count": 7}),
+                                      ("POST", "/calculate/grid", {"axes": {"bogus": None}})))
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.headers["content-type"].startswith("text/plain; version=0.0.4"))
+        text = res.text
+        self.assertIn('estimate_http_requests_total{route="/calculate",method="POST",status="200"} 2', text)
+        self.assertIn('estimate_http_requests_total{route="/calculate/grid",method="POST",status="400"} 1', text)
+        self.assertIn('estimate_http_request_duration_seconds_count{route="/calculate",method="POST"} 2', text)
+        for stage in ("parse", "axes", "resolve", "effort", "cost", "profit"):
+            self.assertIn(f'estimate_stage_duration_seconds_count{{stage="{stage}"}} 2', text)
+        # /metrics 自体は計測しない
+        self.assertNotIn('route="/metrics"', text)
+
+    def test_gemini_metrics(self):
+        GeminiStubHandler.unavailable_models = {"gemini-2.5-flash"}
+        res = asyncio.run(self._calls(("POST", "/report", REPORT_BODY)))
+        text = res.text
+        self.assertIn('estimate_http_requests_total{route="/report",method="POST",status="200"} 1', text)
+        self.assertIn('gemini_fallbacks_total{model="gemini-2.5-flash"} 1', text)
+        self.assertIn('gemini_request_duration_seconds_count{model="gemini-2.5-flash",status="404"} 1', text)
+        self.assertIn('gemini_request_duration_seconds_count{model="gemini-2.0-flash",status="200"} 1', text)
+        self.assertGreater(metrics.GEMINI_BYTES_OUT.value(("gemini-2.0-flash",)), 0)
+        self.assertGreater(metrics.GEMINI_BYTES_IN.value(("gemini-2.0-flash",)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
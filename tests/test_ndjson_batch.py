@@ -0,0 +1,94 @@
+import unittest
+import json
+import azure.functions as func
+import function_app
+import json_response
+
+REQUESTS = [
+    {"id": "a", "screen_count": 12, "complexity": "high", "features": ["crud", "payment"]},
+    {"screen_count": 3, "phase2_items": ["IA設計"], "phase3_items": ["ui_design", "unknown"]},
+    {"id": 7, "method": "step", "loc": 1000},
+]
+
+
+def _body(lines):
+    return "".join(line + "\n" for line in lines).encode("utf-8")
+
+
+def _call(body):
+    req = func.HttpRequest(method="POST", url="/api/calculate_estimate_batch", body=body, headers={}, params={})
+    return function_app.calculate_estimate_batch.build().get_user_function()(req)
+
+
+class TestIterNdjson(unittest.TestCase):
+    def test_lines_blank_crlf_and_bom(self):
+        body = b"\xef\xbb\xbf{\"a\": 1}\r\n\r\n  \n{\"b\": 2}"
+        self.assertEqual(list(function_app.iter_ndjson(body)), [(1, b'{"a": 1}'), (4, b'{"b": 2}')])
+        self.assertEqual(list(function_app.iter_ndjson(b"")), [])
+
+
+class TestCalculateNdjson(unittest.TestCase):
+    def test_results_match_single_requests_in_order(self):
+        lines = [json.loads(line) for line in _call(_body([json.dumps(r, ensure_ascii=False) for r in REQUESTS]))
+                 .get_body().splitlines()]
+        self.assertEqual([line["line"] for line in lines], [1, 2, 3])
+        self.assertEqual([line["id"] for line in lines], ["a", None, 7])
+        for request, line in zip(REQUESTS, lines):
+            body = {k: v for k, v in request.items() if k != "id"}
+            expected, status_code = function_app.main_logic(body)
+            self.assertEqual(line["status_code"], status_code)
+            self.assertEqual(line["result"], json.loads(json_response.dumps_bytes(expected)))
+        self.assertEqual(lines[2]["status_code"], 400)
+
+    def test_line_errors_are_reported_inline(self):
+        res = _call(_body(['{"screen_count": 5}', '{broken', '', '[1, 2]', '{"screen_count": 6}']))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, function_app.NDJSON_MIMETYPE)
+        self.assertIn("X-Config-Version", res.headers)
+        lines = [json.loads(line) for line in res.get_body().splitlines()]
+        self.assertEqual([(x["line"], x["status_code"]) for x in lines], [(1, 200), (2, 400), (4, 400), (5, 200)])
+        self.assertEqual(lines[1]["result"], {"status": "error", "message": "Invalid JSON"})
+        self.assertEqual(lines[3]["result"]["screen_count"], 6)
+
+    def test_snapshot_resolved_once_per_batch(self):
+        store = function_app.CONFIG_STORE
+        calls = []
+
+        class CountingStore:
+            def get(self):
+                calls.append(1)
+                return store.get()
+
+        function_app.CONFIG_STORE = CountingStore()
+        try:
+            res = _call(_body(['{"screen_count": %d}' % n for n in range(50)]))
+        finally:
+            function_app.CONFIG_STORE = store
+        self.assertEqual(len(res.get_body().splitlines()), 50)
+        self.assertEqual(len(calls), 1)
+
+    def test_oversized_body_is_rejected(self):
+        original = function_app.MAX_BATCH_BYTES
+        body = _body(['{"screen_count": %d}' % n for n in range(20)])
+        function_app.MAX_BATCH_BYTES = len(body) - 1
+        try:
+            res = _call(body)
+            self.assertEqual(res.status_code, 413)
+            self.assertEqual(json.loads(res.get_body())["status"], "error")
+            req = func.HttpRequest(method="POST", url="/api/calculate_estimate_batch", body=b"{}\n",
+                                   headers={"Content-Length": str(len(body))}, params={})
+            self.assertEqual(function_app.calculate_estimate_batch.build().get_user_function()(req).status_code, 413)
+            function_app.MAX_BATCH_BYTES = len(body)
+            self.assertEqual(_call(body).status_code, 200)
+        finally:
+            function_app.MAX_BATCH_BYTES = original
+
+    def test_results_are_yielded_lazily(self):
+        rows = function_app.calculate_ndjson(_body(['{"screen_count": 1}', '{"screen_count": 2}']))
+        first = json.loads(next(rows))
+        self.assertEqual((first["line"], first["result"]["screen_count"]), (1, 1))
+        self.assertEqual(len(list(rows)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import unittest
+import asyncio
+import os
+import threading
+from unittest import mock
+import metrics
+import outsystems_api_wrapper as wrapper
+from estimate_batch import main_batch
+from estimate_pool import EstimatePool
+from estimate_simulation import simulate
+from tests.test_batch import CASES
+
+
+class TestEstimatePool(unittest.TestCase):
+    def test_disabled_pool_runs_in_thread(self):
+        pool = EstimatePool(workers=0)
+        threads = []
+
+        def batch_in(items):
+            threads.append(threading.get_ident())
+            return main_batch(items)
+
+        async def scenario():
+            await pool.start()
+            return await pool.map_chunks("batch", batch_in, CASES * 20), await pool.run("batch", batch_in, CASES)
+
+        batch, small = asyncio.run(scenario())
+        self.assertFalse(pool.running)
+        self.assertEqual(batch, main_batch(CASES * 20))
+        self.assertEqual(small, main_batch(CASES))
+        # イベントループのスレッドでは計算しない
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.get_ident(), threads)
+        stats = pool.snapshot()
+        self.assertEqual((stats["thread_tasks"], stats["inline_tasks"]), (2, 0))
+
+    def test_chunked_results_keep_input_order(self):
+        pool = EstimatePool(workers=2, chunk_size=3, min_batch=4)
+        items = [dict(case, screen_count=n) for n, case in enumerate(CASES * 3)]
+
+        async def scenario():
+            await pool.start()
+            try:
+                # start() はワーカーの起動を待たずに戻る
+                self.assertTrue(pool.running)
+                self.assertEqual(pool.pids, [])
+                await pool.wait_ready()
+                self.assertEqual(len(pool.pids), 2)
+                self.assertNotIn(os.getpid(), pool.pids)
+                chunked = await pool.map_chunks("batch", main_batch, items)
+                small = await pool.map_chunks("batch", main_batch, items[:3])
+                with self.assertRaises(ValueError):
+                    await pool.run("simulate", simulate, {}, 0)
+                return chunked, small
+            finally:
+                await pool.shutdown()
+
+        chunked, small = asyncio.run(scenario())
+        self.assertEqual(chunked, main_batch(items))
+        self.assertEqual(small, main_batch(items[:3]))
+        stats = pool.snapshot()
+        self.assertFalse(stats["running"])
+        self.assertEqual(stats["chunks"], 7)
+        self.assertEqual(stats["inline_tasks"], 1)
+        self.assertEqual(metrics.POOL_WORKERS.value(), 0)
+
+
+class TestPoolSettings(unittest.TestCase):
+    def test_pool_is_opt_in(self):
+        environ = {k: v for k, v in os.environ.items() if k != 'ESTIMATE_POOL_WORKERS'}
+        with mock.patch.dict(os.environ, environ, clear=True):
+            self.assertEqual(EstimatePool.from_env().workers, 0)
+        with mock.patch.dict(os.environ, {'ESTIMATE_POOL_WORKERS': 'auto'}):
+            self.assertEqual(EstimatePool.from_env().workers, os.cpu_count() or 1)
+
+    def test_shutdown_does_not_block_the_event_loop(self):
+        pool = EstimatePool(workers=1)
+
+        async def scenario():
+            await pool.start()
+            await pool.wait_ready()
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.001)
+
+            task = asyncio.ensure_future(ticker())
+            await pool.shutdown()
+            task.cancel()
+            return ticks
+
+        self.assertGreater(asyncio.run(scenario()), 0)
+        self.assertFalse(pool.running)
+
+
+class TestPoolLifespan(unittest.TestCase):
+    def test_app_lifespan_starts_and_stops_pool(self):
+        from fastapi.testclient import TestClient
+        original = wrapper.estimate_pool
+        wrapper.estimate_pool = EstimatePool(workers=1, min_batch=2)
+        try:
+            with TestClient(wrapper.app) as client:
+                self.assertTrue(client.get('/calculate/pool').json()['running'])
+                reqs = [{'screen_count': n, 'features': ['auth']} for n in range(10)]
+                res = client.post('/calculate/batch', json={'requests': reqs})
+                self.assertEqual(res.status_code, 200)
+                self.assertEqual(res.json()['results'], [client.post('/calculate', json=r).json() for r in reqs])
+                res = client.post('/calculate/simulate', json={'base': {'screen_count': 10}, 'samples': 2000, 'seed': 7})
+                self.assertEqual(res.status_code, 200)
+                self.assertEqual(res.json(), simulate({'screen_count': 10}, samples=2000, seed=7))
+                res = client.post('/calculate/grid', json={'base': {'screen_count': 10}, 'axes': {'complexity': ['x']}})
+                self.assertEqual(res.status_code, 400)
+                self.assertGreaterEqual(client.get('/calculate/pool').json()['pool_tasks'], 3)
+            self.assertFalse(wrapper.estimate_pool.running)
+        finally:
+            asyncio.run(wrapper.estimate_pool.shutdown())
+            wrapper.estimate_pool = original
+
+
+if __name__ == '__main__':
+    unittest.main()
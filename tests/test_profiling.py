@@ -0,0 +1,123 @@
+import unittest
+import asyncio
+import json
+import os
+import tempfile
+import httpx
+import azure.functions as func
+import function_app
+import outsystems_api_wrapper as wrapper
+import profiling
+from profiling import ProfilingSettings
+
+CALCULATE_BODY = {
+    "screen_count": 12, "table_count": 3, "complexity": "high", "department": "ＤＴ第１開発部",
+    "features": ["auth", "payment"], "phase2_items": ["basic_design"], "confidence": "low",
+}
+AZURE_BODY = {"screen_count": 12, "complexity": "high", "features": ["crud", "payment"]}
+
+
+def _post(path, body, headers=None, params=None):
+    async def call():
+        transport = httpx.ASGITransport(app=wrapper.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post(path, json=body, headers=headers or {}, params=params or {})
+    return asyncio.run(call())
+
+
+def _azure(body, headers=None, params=None):
+    req = func.HttpRequest(method="POST", url="/api/calculate_estimate", body=json.dumps(body).encode("utf-8"),
+                           headers=headers or {}, params=params or {})
+    return function_app.calculate_estimate.build().get_user_function()(req)
+
+
+class TestRequestedMode(unittest.TestCase):
+    def test_modes(self):
+        self.assertEqual(profiling.requested_mode("1", None), "timing")
+        self.assertEqual(profiling.requested_mode(None, "TIMING"), "timing")
+        self.assertEqual(profiling.requested_mode("cprofile", None), "cprofile")
+        self.assertIsNone(profiling.requested_mode(None, None))
+        self.assertIsNone(profiling.requested_mode("bogus", None))
+
+    def test_record_stage_outside_profile_call_is_noop(self):
+        profiling.record_stage("axes", 0.1)
+        _, trace = profiling.profile_call(lambda: None, "timing", ProfilingSettings(enabled=True), "t")
+        self.assertEqual(trace["stages"], [])
+
+
+class TestCalculateProfiling(unittest.TestCase):
+    def setUp(self):
+        self.orig = wrapper.PROFILING
+
+    def tearDown(self):
+        wrapper.configure_profiling(self.orig)
+
+    def test_disabled_gate_ignores_request(self):
+        wrapper.configure_profiling(ProfilingSettings(enabled=False))
+        plain = _post("/calculate", CALCULATE_BODY)
+        res = _post("/calculate", CALCULATE_BODY, headers={profiling.PROFILE_HEADER: "cprofile"})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("profile_trace", res.json())
+        self.assertNotIn("server-timing", res.headers)
+        self.assertEqual(res.json(), plain.json())
+
+    def test_timing_trace(self):
+        wrapper.configure_profiling(ProfilingSettings(enabled=True))
+        plain = _post("/calculate", CALCULATE_BODY).json()
+        res = _post("/calculate", CALCULATE_BODY, params={"profile": "timing"})
+        body = res.json()
+        trace = body.pop("profile_trace")
+        self.assertEqual(body, plain)
+        self.assertEqual(trace["mode"], "timing")
+        self.assertEqual([s["stage"] for s in trace["stages"]],
+                         ["parse", "axes", "resolve", "effort", "cost", "profit"])
+        self.assertNotIn("cprofile", trace)
+        self.assertIn("total;dur=", res.headers["server-timing"])
+
+    def test_cprofile_top_n_and_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            wrapper.configure_profiling(ProfilingSettings(enabled=True, top_n=5, output_dir=tmp))
+            res = _post("/calculate", CALCULATE_BODY, headers={profiling.PROFILE_HEADER: "cprofile"})
+            trace = res.json()["profile_trace"]
+            self.assertEqual(len(trace["cprofile"]), 5)
+            cumtimes = [row["cumtime_ms"] for row in trace["cprofile"]]
+            self.assertEqual(cumtimes, sorted(cumtimes, reverse=True))
+            self.assertTrue(os.path.exists(trace["file"]))
+            self.assertTrue(os.path.exists(trace["file"][:-len(".json")] + ".prof"))
+            with open(trace["file"], encoding="utf-8") as f:
+                self.assertEqual(json.load(f)["mode"], "cprofile")
+
+
+class TestAzureProfiling(unittest.TestCase):
+    def setUp(self):
+        self.orig = function_app.PROFILING
+
+    def tearDown(self):
+        function_app.PROFILING = self.orig
+
+    def test_disabled_gate_ignores_request(self):
+        function_app.PROFILING = ProfilingSettings(enabled=False)
+        res = _azure(AZURE_BODY, headers={profiling.PROFILE_HEADER: "timing"})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("profile_trace", json.loads(res.get_body()))
+        self.assertNotIn("Server-Timing", res.headers)
+
+    def test_timing_trace(self):
+        function_app.PROFILING = ProfilingSettings(enabled=True)
+        plain = json.loads(_azure(AZURE_BODY).get_body())
+        res = _azure(AZURE_BODY, params={"profile": "1"})
+        body = json.loads(res.get_body())
+        trace = body.pop("profile_trace")
+        self.assertEqual(body, plain)
+        self.assertEqual([s["stage"] for s in trace["stages"]][:4], ["axes", "resolve", "effort", "cost"])
+        self.assertIn("Server-Timing", res.headers)
+
+    def test_validation_error_still_traced(self):
+        function_app.PROFILING = ProfilingSettings(enabled=True)
+        res = _azure({"method": "step", "loc": 1000}, headers={profiling.PROFILE_HEADER: "timing"})
+        self.assertEqual(res.status_code, 400)
+        self.assertIn("profile_trace", json.loads(res.get_body()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,237 @@
+import unittest
+import asyncio
+import json
+import time
+import httpx
+import outsystems_api_wrapper as wrapper
+from gemini_client import MODEL_HEALTH, GeminiClient
+from tests.gemini_stub import GeminiStubHandler, start_stub
+
+REPORT_BODY = {"estimation_result": {"estimated_amount": "¥1,000"}, "language": "ja", "output_format": "html"}
+
+
+class TestReportWithStub(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server, base_url = start_stub()
+        cls.orig = (wrapper.GEMINI_API_KEY, wrapper.GEMINI_MODEL, wrapper.gemini_client)
+        wrapper.GEMINI_API_KEY = "test-key"
+        wrapper.gemini_client = GeminiClient(base_url=base_url, max_in_flight=4)
+
+    @classmethod
+    def tearDownClass(cls):
+        wrapper.GEMINI_API_KEY, wrapper.GEMINI_MODEL, wrapper.gemini_client = cls.orig
+        cls.server.shutdown()
+
+    def setUp(self):
+        GeminiStubHandler.unavailable_models = set()
+        GeminiStubHandler.error_models = {}
+        GeminiStubHandler.delay = 0.0
+        GeminiStubHandler.model_delays = {}
+        GeminiStubHandler.stream_interval = 0.0
+        GeminiStubHandler.calls = []
+        wrapper.GEMINI_MODEL = "gemini-2.5-flash"
+        wrapper.report_cache.clear()
+        wrapper.gemini_client.hedge_after = 0
+        MODEL_HEALTH.clear()
+
+    def _run(self, coro):
+        return asyncio.run(coro)
+
+    async def _post(self, path, json=None):
+        transport = httpx.ASGITransport(app=wrapper.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            if json is None:
+                return await client.get(path)
+            return await client.post(path, json=json)
+
+    def test_report(self):
+        res = self._run(self._post("/report", REPORT_BODY))
+        self.assertEqual(res.status_code, 200)
+        data = res.json()
+        self.assertTrue(data["report_markdown"].startswith("# Report (gemini-2.5-flash)"))
+        self.assertIn("<h1>", data["report_html"])
+
+    def test_fallback_on_404(self):
+        GeminiStubHandler.unavailable_models = {"gemini-2.5-flash"}
+        res = self._run(self._post("/report", REPORT_BODY))
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("gemini-2.0-flash", res.json()["report_markdown"])
+        self.assertEqual(GeminiStubHandler.calls, ["gemini-2.5-flash", "gemini-2.0-flash"])
+
+    def test_all_models_unavailable(self):
+        GeminiStubHandler.unavailable_models = {"gemini-2.5-flash", "gemini-2.0-flash", "gemini-1.5-flash"}
+        res = self._run(self._post("/report", REPORT_BODY))
+        self.assertEqual(res.status_code, 500)
+        self.assertIn("No available Gemini model", res.json()["detail"])
+
+    def test_unavailable_model_is_skipped(self):
+        GeminiStubHandler.unavailable_models = {"gemini-2.5-flash"}
+        self._run(self._post("/report", REPORT_BODY))
+        wrapper.report_cache.clear()
+        GeminiStubHandler.calls = []
+        res = self._run(self._post("/report", REPORT_BODY))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(GeminiStubHandler.calls, ["gemini-2.0-flash"])
+        models = self._run(self._post("/report/models")).json()
+        self.assertEqual(models["unavailable"]["gemini-2.5-flash"]["status_code"], 404)
+
+    def test_all_models_skipped_still_tries_one(self):
+        GeminiStubHandler.unavailable_models = {"gemini-2.5-flash", "gemini-2.0-flash", "gemini-1.5-flash"}
+        self._run(self._post("/report", REPORT_BODY))
+        GeminiStubHandler.calls = []
+        # 全候補が利用不可の記録中でも、記録の期限が最も近いモデル（最初に記録した主モデル）には問い合わせる
+        res = self._run(self._post("/report", REPORT_BODY))
+        self.assertEqual(res.status_code, 500)
+        self.assertIn("Skipped (recently unavailable): gemini-2.0-flash, gemini-1.5-flash", res.json()["detail"])
+        self.assertEqual(GeminiStubHandler.calls, ["gemini-2.5-flash"])
+
+        # 期限前に回復していれば応答できる
+        GeminiStubHandler.unavailable_models = set()
+        GeminiStubHandler.calls = []
+        res = self._run(self._post("/report", REPORT_BODY))
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(GeminiStubHandler.calls, ["gemini-2.0-flash"])
+
+    def test_hedged_request(self):
+        wrapper.gemini_client.hedge_after = 0.1
+        GeminiStubHandler.model_delays = {"gemini-2.5-flash": 1.0}
+        started = time.perf_counter()
+        res = self._run(self._post("/report", REPORT_BODY))
+        self.assertLess(time.perf_counter() - started, 0.8)
+        self.assertIn("gemini-2.0-flash", res.json()["report_markdown"])
+        self.assertEqual(GeminiStubHandler.calls[:2], ["gemini-2.5-flash", "gemini-2.0-flash"])
+
+    def test_hedged_error_waits_for_other_request(self):
+        # 先に投げたモデルの 400 より、並行中のヘッジの成功を採用する
+        wrapper.gemini_client.hedge_after = 0.05
+        GeminiStubHandler.error_models = {"gemini-2.5-flash": 400}
+        GeminiStubHandler.model_delays = {"gemini-2.5-flash": 0.2, "gemini-2.0-flash": 0.4, "gemini-1.5-flash": 0.6}
+        res = self._run(self._post("/report", REPORT_BODY))
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("gemini-2.0-flash", res.json()["report_markdown"])
+
+        # 並行中もすべて失敗したら、フォールバック対象外のエラーを返す
+        wrapper.report_cache.clear()
+        GeminiStubHandler.calls = []
+        GeminiStubHandler.unavailable_models = {"gemini-2.0-flash", "gemini-1.5-flash"}
+        res = self._run(self._post("/report", REPORT_BODY))
+        self.assertEqual(res.status_code, 500)
+        self.assertIn("rejected the request", res.json()["detail"])
+        self.assertEqual(GeminiStubHandler.calls, ["gemini-2.5-flash", "gemini-2.0-flash", "gemini-1.5-flash"])
+
+    def test_client_is_replaced_per_event_loop(self):
+        client = GeminiClient(base_url=wrapper.gemini_client.base_url)
+
+        async def call():
+            await client.generate_content("gemini-2.5-flash", {"contents": [{"parts": [{}, {"text": "x"}]}]}, "k")
+            return client._client
+
+        first = self._run(call())
+        second = self._run(call())
+        # ループが変わったら前の接続プールは閉じる
+        self.assertIsNot(first, second)
+        self.assertTrue(first.is_closed)
+        self._run(client.aclose())
+        self.assertTrue(second.is_closed)
+
+    def test_report_is_cached(self):
+        first = self._run(self._post("/report", REPORT_BODY))
+        second = self._run(self._post("/report", REPORT_BODY))
+        self.assertEqual(first.headers["X-Report-Cache"], "miss")
+        self.assertEqual(second.headers["X-Report-Cache"], "hit")
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(GeminiStubHandler.calls, ["gemini-2.5-flash"])
+
+    async def _stream(self, path, body):
+        # ASGIアプリを直接呼び、本文の各断片の到着時刻を記録する
+        payload = json.dumps(body).encode("utf-8")
+        received = []
+        started = time.perf_counter()
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+            "root_path": "", "headers": [(b"content-type", b"application/json")],
+            "client": ("test", 1), "server": ("test", 80),
+        }
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": payload, "more_body": False}
+            await asyncio.sleep(10)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                received.append((time.perf_counter() - started, message["body"].decode("utf-8")))
+
+        await wrapper.app(scope, receive, send)
+        return received
+
+    @staticmethod
+    def _events(received):
+        events = []
+        for block in "".join(body for _, body in received).split("\n\n"):
+            if block.strip():
+                name, data = block.split("\n", 1)
+                events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+        return events
+
+    def test_report_stream(self):
+        GeminiStubHandler.stream_interval = 0.5
+        received = self._run(self._stream("/report/stream", REPORT_BODY))
+        events = self._events(received)
+        # 途中の HTML は REPORT_STREAM_HTML_INTERVAL（既定 1 秒）ごとに間引く。最後の HTML は done に入る
+        self.assertEqual([name for name, _ in events], ["meta", "markdown", "html", "markdown", "done"])
+        self.assertEqual(events[0][1]["model"], "gemini-2.5-flash")
+        self.assertIn("<h1>", events[2][1]["html"])
+        done = events[-1][1]
+        self.assertEqual(done["report_markdown"], "".join(d["text"] for n, d in events if n == "markdown").strip())
+        # 最初の断片は生成完了を待たずに届く
+        self.assertLess(received[0][0], 0.4)
+        self.assertGreater(received[-1][0], 0.4)
+
+        cached = self._events(self._run(self._stream("/report/stream", REPORT_BODY)))
+        self.assertEqual(cached[0][1]["cache"], "hit")
+        self.assertEqual(cached[-1][1], done)
+
+    def test_report_stream_html_interval(self):
+        GeminiStubHandler.stream_interval = 0.2
+        original = wrapper.REPORT_STREAM_HTML_INTERVAL
+        try:
+            wrapper.REPORT_STREAM_HTML_INTERVAL = 0
+            events = self._events(self._run(self._stream("/report/stream", REPORT_BODY)))
+        finally:
+            wrapper.REPORT_STREAM_HTML_INTERVAL = original
+        self.assertEqual([name for name, _ in events], ["meta", "markdown", "html", "markdown", "html", "done"])
+        self.assertEqual(events[4][1]["html"], events[-1][1]["report_html"])
+
+    def test_report_stream_fallback(self):
+        GeminiStubHandler.unavailable_models = {"gemini-2.5-flash"}
+        events = self._events(self._run(self._stream("/report/stream", REPORT_BODY)))
+        self.assertEqual(events[0][1]["model"], "gemini-2.0-flash")
+        self.assertEqual(events[-1][0], "done")
+
+    def test_report_does_not_block_event_loop(self):
+        GeminiStubHandler.delay = 0.5
+
+        async def scenario():
+            report = asyncio.create_task(self._post("/report", REPORT_BODY))
+            await asyncio.sleep(0.05)
+            started = time.perf_counter()
+            health = await self._post("/health")
+            elapsed = time.perf_counter() - started
+            self.assertFalse(report.done())
+            await report
+            return health, elapsed
+
+        health, elapsed = self._run(scenario())
+        self.assertEqual(health.status_code, 200)
+        self.assertLess(elapsed, 0.3)
+
+
+if __name__ == '__main__':
+    unittest.main()
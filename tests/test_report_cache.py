@@ -0,0 +1,65 @@
+import unittest
+import os
+import shutil
+import tempfile
+import time
+from report_cache import ReportCache, make_report_key
+
+
+class TestReportCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmpdir, "reports.sqlite3")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_key_is_canonical(self):
+        a = make_report_key({"a": 1, "b": [1, 2]}, None, "", "ja", "gemini-2.5-flash")
+        b = make_report_key({"b": [1, 2], "a": 1}, "", None, None, "gemini-2.5-flash")
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, make_report_key({"a": 1, "b": [1, 2]}, None, None, "ja", "gemini-2.0-flash"))
+
+    def test_lru_eviction(self):
+        cache = ReportCache(max_entries=2)
+        cache.put("a", "A")
+        cache.put("b", "B")
+        cache.get("a")
+        cache.put("c", "C")
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a").markdown, "A")
+        stats = cache.snapshot()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["hits_memory"], 2)
+        self.assertEqual(stats["misses"], 1)
+
+    def test_ttl(self):
+        cache = ReportCache(ttl=0.01)
+        cache.put("a", "A")
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.snapshot()["expired"], 1)
+
+    def test_disk_tier_survives_restart(self):
+        cache = ReportCache(db_path=self.db_path)
+        entry = cache.put("a", "# Title")
+        self.assertEqual(cache.html_for("a", entry), "<h1>Title</h1>")
+        cache.close()
+
+        restarted = ReportCache(db_path=self.db_path)
+        entry = restarted.get("a")
+        self.assertEqual(entry.markdown, "# Title")
+        self.assertEqual(entry.html, "<h1>Title</h1>")
+        self.assertEqual(restarted.snapshot()["hits_disk"], 1)
+        restarted.close()
+
+    def test_disk_tier_bounded(self):
+        cache = ReportCache(max_entries=1, db_path=self.db_path, max_db_entries=2)
+        for key in ("a", "b", "c"):
+            cache.put(key, key.upper())
+        self.assertEqual(cache.snapshot()["disk_entries"], 2)
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+import unittest
+import asyncio
+import json
+import random
+import httpx
+import json_response
+import outsystems_api_wrapper as wrapper
+from dify_assets.code import estimate_logic as dify_logic
+from estimate_schema import FieldError, InputValidationError
+from tests import legacy_logic
+
+DEPTS = ['ＤＴ第１開発部', 'ＣＳ第１システム開発部', '存在しない部門']
+
+
+def _random_legacy_inputs(n, seed=23):
+    # 移行前の parse_* でも解釈が定まる入力（区切りは半角カンマ/改行、比率はカンマ区切りのみ）
+    rng = random.Random(seed)
+    lists = [None, [], ['auth', 'なし', 'payment'], 'auth, payment\nsearch', ' a ,, b \r\n-\n', 'N/A', 5, ['x', {'k': 1}]]
+    reqs = []
+    for _ in range(n):
+        req = {
+            'features': rng.choice(lists),
+            'phase2_items': rng.choice(lists),
+            'tables': rng.choice([None, 'users, orders', ['a', 'b'], '']),
+            'screen_count': rng.choice([None, 0, 7, 2.5, '12', ' 8 ', '', 'abc', '１２']),
+            'table_count': rng.choice([None, 0, 3, '4', 'x']),
+            'target_margin': rng.choice([None, 0.2, 15, '15%', '0.2', ' 30 % ', '', 'abc', '0.5%']),
+            'department': rng.choice(DEPTS + [None, '']),
+        }
+        if rng.random() < 0.5:
+            req['team_ratio'] = rng.choice(['Rank3:0.8, Rank2:0.2', 'Rank4: 1, Rank9: 2, bogus', 'Rank1:-1', '',
+                                            'Rank2:x, Rank3:1', {'Rank3': 1.0}])
+        if rng.random() < 0.5:
+            req['dept_allocation'] = rng.choice(['ＤＴ第１開発部: 3\nＣＳ第１システム開発部: 1\n不明: 1',
+                                                 'ＤＴ第１開発部: 0\n', 'ＤＴ第１開発部: x', '',
+                                                 [{'dept': 'ＤＴ第１開発部', 'share': 1}]])
+        reqs.append(req)
+    return reqs
+
+
+class TestInputSchema(unittest.TestCase):
+    def test_matches_legacy_prepare_args(self):
+        for req in _random_legacy_inputs(400):
+            with self.subTest(req=req):
+                self.assertEqual(dify_logic.prepare_args(req), legacy_logic.dify_prepare_args(req))
+
+    def test_full_width_percent_and_mixed_separators(self):
+        args, errors = dify_logic.validate_args({
+            'screen_count': '１２', 'table_count': '３', 'target_margin': '１５％',
+            'features': 'auth、payment，なし\napi_external',
+            'team_ratio': 'Rank3：８０％\nrank2: 20%',
+            'dept_allocation': 'DT第1開発部: 3, ＣＳ第１システム開発部：１',
+            'department': 'ＤＴ 第１開発部',
+        })
+        self.assertEqual(errors, [])
+        self.assertEqual((args['screen_count'], args['table_count'], args['target_margin']), (12, 3, 0.15))
+        self.assertEqual(args['features'], ['auth', 'payment', 'api_external'])
+        self.assertEqual(args['team_ratio'], {'Rank3': 0.8, 'Rank2': 0.2})
+        self.assertEqual(args['dept_allocation'], [{'dept': 'ＤＴ第１開発部', 'share': 0.75},
+                                                   {'dept': 'ＣＳ第１システム開発部', 'share': 0.25}])
+        self.assertEqual(args['department'], 'ＤＴ第１開発部')
+
+    def test_full_width_separators_split_list_items(self):
+        # 移行前は半角カンマ/改行だけで区切っていた（全角カンマ・読点は項目名の一部）。現在はどれも区切り
+        text = 'auth、payment，search'
+        self.assertEqual(legacy_logic.dify_prepare_args({'features': text})['features'], [text])
+        self.assertEqual(dify_logic.prepare_args({'features': text})['features'], ['auth', 'payment', 'search'])
+        self.assertEqual(dify_logic.prepare_args({'tables': 'users、orders'})['tables'], ['users', 'orders'])
+
+    def test_non_finite_values_are_reported_as_text(self):
+        nan, inf = float('nan'), float('inf')
+        args, errors = dify_logic.validate_args({'screen_count': nan, 'target_margin': inf, 'team_ratio': {'Rank3': nan}})
+        self.assertEqual((args['screen_count'], args['target_margin'], args['team_ratio']),
+                         (None, None, dify_logic.DEFAULT_TEAM_RATIO))
+        self.assertEqual([(e['field'], e['value']) for e in map(FieldError.to_dict, errors)],
+                         [('screen_count', 'nan'), ('target_margin', 'inf'), ('team_ratio', {'Rank3': 'nan'})])
+        # allow_nan=False の標準 json でも出力できる
+        json.dumps(dify_logic.estimate(screen_count=nan), allow_nan=False)
+
+    def test_invalid_values_are_reported(self):
+        args, errors = dify_logic.validate_args({
+            'screen_count': 'abc', 'target_margin': 'high', 'features': 5, 'department': '謎',
+            'team_ratio': 'Rank3:0.5, Rank9:1, Rank2', 'dept_allocation': 'ＤＴ第１開発部: 1\n不明: 1',
+        })
+        self.assertEqual(args['screen_count'], None)
+        self.assertEqual(args['target_margin'], None)
+        self.assertEqual(args['features'], [])
+        self.assertEqual(args['department'], dify_logic.DEFAULT_BS_DEPT)
+        self.assertEqual(args['team_ratio'], {'Rank3': 1.0})
+        self.assertEqual(args['dept_allocation'], [{'dept': 'ＤＴ第１開発部', 'share': 1.0}])
+        self.assertEqual([(e.field, e.code) for e in errors], [
+            ('features', 'invalid_type'), ('screen_count', 'invalid_int'), ('target_margin', 'invalid_margin'),
+            ('department', 'unknown_value'), ('dept_allocation', 'unknown_department'),
+            ('team_ratio', 'unknown_key'), ('team_ratio', 'invalid_entry'),
+        ])
+        self.assertEqual(errors[1], FieldError('screen_count', 'invalid_int', "not an integer: 'abc'", 'abc'))
+
+    def test_no_valid_ratio_falls_back_to_default(self):
+        args, errors = dify_logic.validate_args({'team_ratio': 'Rank3:0, Rank2:-1'})
+        self.assertEqual(args['team_ratio'], dify_logic.DEFAULT_TEAM_RATIO)
+        self.assertEqual([e.code for e in errors], ['invalid_ratio', 'no_valid_entries'])
+        args, errors = dify_logic.validate_args({'team_ratio': ' '})
+        self.assertEqual((args['team_ratio'], errors), (dify_logic.DEFAULT_TEAM_RATIO, []))
+
+    def test_strict_parse(self):
+        self.assertEqual(dify_logic.INPUT_SCHEMA.parse({'screen_count': '5'})['screen_count'], 5)
+        with self.assertRaises(InputValidationError) as ctx:
+            dify_logic.INPUT_SCHEMA.parse({'screen_count': '5画面', 'table_count': 'x'})
+        self.assertEqual([e.field for e in ctx.exception.errors], ['screen_count', 'table_count'])
+
+    def test_estimate_returns_input_errors(self):
+        result = dify_logic.estimate(screen_count='十', features='auth')
+        self.assertEqual(result['input_errors'], [{'field': 'screen_count', 'code': 'invalid_int',
+                                                   'message': "not an integer: '十'", 'value': '十'}])
+        self.assertNotIn('input_errors', dify_logic.estimate(screen_count='10'))
+        self.assertIn('input_errors', json.loads(dify_logic.main(target_margin='x')['result']))
+
+
+def _post(body):
+    async def call():
+        transport = httpx.ASGITransport(app=wrapper.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post('/calculate', json=body)
+    return asyncio.run(call())
+
+
+def _post_raw(content):
+    async def call():
+        transport = httpx.ASGITransport(app=wrapper.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post('/calculate', content=content, headers={'content-type': 'application/json'})
+    return asyncio.run(call())
+
+
+class TestEstimationRequestSchema(unittest.TestCase):
+    def test_string_inputs_use_the_shared_schema(self):
+        body = {'screen_count': '１２', 'target_margin': '15%', 'features': 'auth, payment',
+                'team_ratio': 'Rank4:0.2, Rank3:0.8', 'dept_allocation': 'ＤＴ第１開発部: 1'}
+        res = _post(body)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(), json.loads(json.dumps(dify_logic.estimate(**body), ensure_ascii=False)))
+        self.assertEqual(res.json()['bs_input']['team_ratio'], {'Rank4': 0.2, 'Rank3': 0.8})
+
+    def test_invalid_strings_are_422_with_field_errors(self):
+        res = _post({'screen_count': 'many', 'team_ratio': 'Rank3:0.5, Rank7:0.5'})
+        self.assertEqual(res.status_code, 422)
+        detail = {d['loc'][-1]: d for d in res.json()['detail']}
+        self.assertEqual(detail['screen_count']['type'], 'invalid_int')
+        self.assertEqual(detail['team_ratio']['type'], 'unknown_key')
+        self.assertEqual(detail['team_ratio']['ctx']['errors'][0]['value'], 'Rank7:0.5')
+
+    def test_non_finite_inputs_are_422_with_the_stdlib_encoder(self):
+        orig = json_response.encoder_name()
+        json_response.set_encoder('stdlib')
+        try:
+            for body, field in ((b'{"screen_count": NaN}', 'screen_count'), (b'{"target_margin": Infinity}', 'target_margin'),
+                                (b'{"team_ratio": {"Rank3": NaN}}', 'team_ratio')):
+                res = _post_raw(body)
+                with self.subTest(body=body):
+                    self.assertEqual(res.status_code, 422)
+                    self.assertEqual(res.json()['detail'][0]['loc'], ['body', field])
+        finally:
+            json_response.set_encoder(orig)
+
+
+if __name__ == '__main__':
+    unittest.main()
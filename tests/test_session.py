@@ -0,0 +1,192 @@
+import unittest
+import asyncio
+import random
+import time
+import httpx
+from unittest import mock
+import metrics
+import estimate_session
+import outsystems_api_wrapper as wrapper
+from estimate_session import EstimateSessions, diff_results
+from dify_assets.code import estimate_logic as dify_logic
+
+# 1ターンで変える項目 → 候補値（文字列入力・表記ゆれ・不正値を含む）
+PATCHES = {
+    'screen_count': [None, 0, 5, 12, '１２', 'x'],
+    'table_count': [None, 0, 3],
+    'tables': [None, ['a', 'b'], 'users, orders, items'],
+    'complexity': [None, '', 'low', 'high', 'weird'],
+    'duration': ['short', 'long', None],
+    'dev_type': ['new', 'porting'],
+    'target_platform': ['mobile', 'web_b2c', None],
+    'estimation_profile': [None, 'poc', 'mission_critical'],
+    'department': [None, 'ＤＴ第１開発部', 'CS第1システム開発部', '謎'],
+    'dept_allocation': [None, 'ＤＴ第１開発部: 0.6\nＣＳ第１システム開発部: 0.4', [{'dept': 'ＤＴ第１開発部', 'share': 1}]],
+    'team_ratio': [None, 'Rank4:0.2, Rank3:0.8', {'Rank3': 1.0}],
+    'features': [None, 'auth', 'auth, payment', ['認証・認可（Auth/SSO）'], ['auth', 'unknown']],
+    'phase2_items': [None, ['basic_design'], '基本設計書作成, security_review'],
+    'phase3_items': [None, ['logo_creation'], ['ui_prototype', 'mystery']],
+    'confidence': [None, 'low', 'high'],
+    'target_margin': [None, 0.2, '15%', 'abc'],
+}
+
+
+class TestEstimateSessions(unittest.TestCase):
+    def setUp(self):
+        metrics.REGISTRY.clear()
+
+    def test_patches_match_full_estimate(self):
+        rng = random.Random(24)
+        sessions = EstimateSessions(ttl=0)
+        for _ in range(40):
+            kwargs = {'screen_count': rng.choice([3, 10]), 'features': rng.choice(PATCHES['features'])}
+            res = sessions.create(kwargs)
+            self.assertEqual(res['result'], dify_logic.estimate(**kwargs))
+            for _ in range(15):
+                fields = {name: rng.choice(PATCHES[name]) for name in rng.sample(list(PATCHES), rng.randint(1, 2))}
+                kwargs.update(fields)
+                before = res['result']
+                res = sessions.patch(res['session_id'], fields)
+                with self.subTest(kwargs=kwargs):
+                    self.assertEqual(res['result'], dify_logic.estimate(**kwargs))
+                    self.assertEqual(res['delta'], diff_results(before, res['result']))
+        self.assertGreater(sessions.stats['incremental'], 0)
+        self.assertEqual(sessions.stats['full'], 0)
+
+    def test_only_downstream_values_are_recomputed(self):
+        sessions = EstimateSessions()
+        kwargs = {'screen_count': 12, 'features': 'auth', 'phase3_items': ['logo_creation']}
+        sid = sessions.create(kwargs)['session_id']
+
+        res = sessions.patch(sid, {'target_margin': '20%'})
+        self.assertEqual(res['changed_inputs'], ['target_margin'])
+        self.assertEqual(res['recomputed'], ['target_margin', 'suggested_price'])
+        self.assertEqual(set(res['delta']), {'input_echo.target_margin', 'profit_analysis.target_margin_specified',
+                                             'profit_analysis.suggested_price_to_attain_target'})
+        self.assertEqual(res['result'], dify_logic.estimate(**dict(kwargs, target_margin='20%')))
+
+        res = sessions.patch(sid, {'confidence': 'low'})
+        self.assertEqual(res['recomputed'][:2], ['confidence', 'p3_cost'])
+        self.assertNotIn('dev_total', res['recomputed'])
+
+        res = sessions.patch(sid, {'complexity': 'high'}, include_result=False)
+        self.assertNotIn('result', res)
+        self.assertIn('dev_total', res['recomputed'])
+        self.assertNotIn('fp_days', res['recomputed'])
+        self.assertEqual(res['delta']['input_echo.complexity'], {'before': 'medium', 'after': 'high'})
+        expected = dify_logic.estimate(**dict(kwargs, target_margin='20%', confidence='low', complexity='high'))
+        self.assertEqual(sessions.get(sid)['result'], expected)
+
+    def test_unchanged_inputs_reuse_result(self):
+        sessions = EstimateSessions()
+        sid = sessions.create({'features': 'auth'})['session_id']
+        # 表記ゆれで解決後のキーが同じなら結果は変わらない
+        res = sessions.patch(sid, {'features': ['認証・認可（Auth/SSO）']})
+        self.assertEqual((res['changed_inputs'], res['delta']), (['features'], {}))
+        # 評価プランが読まない項目（profile）だけが変わったなら何も求め直さない
+        before = res['result']
+        res = sessions.patch(sid, {'features': '認証・認可（Auth/SSO）', 'profile': 'x'})
+        self.assertEqual((res['changed_inputs'], res['recomputed'], res['revision']), (['profile'], [], 2))
+        self.assertIs(res['result'], before)
+        self.assertEqual((sessions.stats['incremental'], sessions.stats['reused']), (1, 1))
+        # 値が同じでも input_errors が変われば結果を作り直す
+        res = sessions.patch(sid, {'screen_count': 'x'})
+        self.assertEqual((res['changed_inputs'], res['recomputed']), ([], []))
+        self.assertEqual(res['delta']['input_errors']['after'][0]['code'], 'invalid_int')
+        # tables は table_count を補完する
+        res = sessions.patch(sid, {'screen_count': None, 'tables': 'a, b'})
+        self.assertEqual(res['changed_inputs'], ['table_count', 'tables'])
+        self.assertEqual(res['recomputed'][0], 'table_count')
+        self.assertIn('input_echo.table_count', res['delta'])
+
+    def test_plan_change_recomputes_everything(self):
+        sessions = EstimateSessions()
+        sid = sessions.create({'screen_count': 4})['session_id']
+        sessions._sessions[sid].plan = None
+        sessions._sessions[sid].version = 'older'
+        res = sessions.patch(sid, {'profile': 'x'})
+        self.assertEqual(res['recomputed'], list(dify_logic.PLAN.values))
+        self.assertEqual(sessions.stats['full'], 1)
+        self.assertEqual(res['config_version'], dify_logic.CONFIG['config_version'])
+
+    def test_evaluates_outside_lock(self):
+        sessions = EstimateSessions()
+        sid = sessions.create({'screen_count': 4})['session_id']
+        recompute = estimate_session.recompute
+        calls = []
+
+        def evaluate(*args):
+            calls.append(sessions._lock.locked())
+            if len(calls) == 1:
+                # 評価中に別のパッチが先に反映される
+                sessions.patch(sid, {'complexity': 'high'})
+            return recompute(*args)
+
+        with mock.patch.object(estimate_session, 'recompute', evaluate):
+            res = sessions.patch(sid, {'screen_count': 9})
+        self.assertEqual(calls, [False, False, False])
+        self.assertEqual(sessions.stats['retries'], 1)
+        self.assertEqual(res['revision'], 2)
+        self.assertEqual(res['result'], dify_logic.estimate(screen_count=9, complexity='high'))
+
+    def test_lru_ttl_and_delete(self):
+        sessions = EstimateSessions(max_sessions=2, ttl=60)
+        first, second, third = (sessions.create({'screen_count': n})['session_id'] for n in (1, 2, 3))
+        with self.assertRaises(KeyError):
+            sessions.patch(first, {'screen_count': 5})
+        self.assertEqual(sessions.snapshot()['evictions'], 1)
+        sessions._sessions[second].touched = time.monotonic() - 61
+        with self.assertRaises(KeyError):
+            sessions.get(second)
+        sessions.delete(third)
+        with self.assertRaises(KeyError):
+            sessions.delete(third)
+        self.assertEqual(sessions.snapshot()['sessions'], 0)
+
+    def test_metrics(self):
+        sessions = EstimateSessions()
+        sid = sessions.create({})['session_id']
+        sessions.patch(sid, {'target_margin': 0.3})
+        sessions.patch(sid, {'profile': 'x'})
+        text = metrics.REGISTRY.render()
+        self.assertIn('estimate_session_patches_total{outcome="incremental"} 1', text)
+        self.assertIn('estimate_session_patches_total{outcome="reused"} 1', text)
+        self.assertIn('estimate_sessions 1', text)
+
+
+def _call(method, path, body=None):
+    async def call():
+        transport = httpx.ASGITransport(app=wrapper.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.request(method, path, json=body)
+    return asyncio.run(call())
+
+
+class TestSessionEndpoints(unittest.TestCase):
+    def test_create_patch_get_delete(self):
+        res = _call('POST', '/calculate/sessions', {'screen_count': 8, 'profile': 'poc'})
+        self.assertEqual(res.status_code, 200)
+        created = res.json()
+        sid = created['session_id']
+        self.assertEqual(created['result'], wrapper.dify_estimate(**wrapper._to_logic_args(
+            wrapper.EstimationRequest(screen_count=8, profile='poc'))))
+
+        res = _call('PATCH', f'/calculate/sessions/{sid}', {'features': 'auth, payment'})
+        self.assertEqual(res.status_code, 200)
+        patched = res.json()
+        # 送っていない項目（screen_count・profile）は前回の値のまま
+        expected = wrapper.dify_estimate(**wrapper._to_logic_args(wrapper.EstimationRequest(
+            screen_count=8, profile='poc', features=['auth', 'payment'])))
+        self.assertEqual(patched['result']['estimated_amount'], expected['estimated_amount'])
+        self.assertEqual(patched['changed_inputs'], ['features'])
+        self.assertIn('man_days.feature_based', patched['delta'])
+
+        self.assertEqual(_call('GET', f'/calculate/sessions/{sid}').json()['revision'], 1)
+        self.assertEqual(_call('PATCH', f'/calculate/sessions/{sid}', {'screen_count': 'many'}).status_code, 422)
+        self.assertEqual(_call('DELETE', f'/calculate/sessions/{sid}').status_code, 200)
+        self.assertEqual(_call('PATCH', f'/calculate/sessions/{sid}', {'screen_count': 3}).status_code, 404)
+        self.assertEqual(_call('GET', f'/calculate/sessions/{sid}').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from dify_assets.code.estimate_logic import estimate
+from estimate_simulation import simulate
+
+BASE = {'screen_count': 20, 'table_count': 5, 'features': ['auth', 'payment'],
+        'phase2_items': ['basic_design'], 'phase3_items': ['logo_creation'], 'confidence': 'low'}
+
+
+class TestSimulation(unittest.TestCase):
+    def test_seeded_runs_are_reproducible(self):
+        a = simulate(BASE, samples=5000, seed=42)
+        b = simulate(BASE, samples=5000, seed=42)
+        self.assertEqual(a, b)
+        self.assertNotEqual(a['price'], simulate(BASE, samples=5000, seed=43)['price'])
+
+    def test_fixed_distributions_match_deterministic(self):
+        fixed = {
+            'screen_count': {'dist': 'fixed', 'value': 20},
+            'table_count': {'dist': 'fixed', 'value': 5},
+            'feature_days': {'dist': 'fixed', 'value': 1.0},
+            'vendor': {'dist': 'fixed', 'value': 1.0},
+            'complexity': {'dist': 'categorical', 'weights': {'medium': 1.0}},
+        }
+        result = simulate(BASE, samples=100, seed=1, distributions=fixed)
+        price = estimate(**BASE)['profit_analysis']['sales']
+        self.assertEqual(result['deterministic_price'], price)
+        self.assertEqual(result['price'], {'mean': price, 'p10': price, 'p50': price, 'p90': price})
+        self.assertEqual(result['margin_at_risk'], 0.0)
+
+    def test_percentiles_are_ordered(self):
+        result = simulate(BASE, samples=20000, seed=7)
+        price = result['price']
+        self.assertLessEqual(price['p10'], price['p50'])
+        self.assertLessEqual(price['p50'], price['p90'])
+        self.assertGreaterEqual(result['margin_at_risk'], 0.0)
+        self.assertTrue(0.0 <= result['loss_probability'] <= 1.0)
+
+    def test_vendor_variance_from_config(self):
+        result = simulate(dict(BASE, confidence='high'), samples=10, seed=1)
+        self.assertEqual(result['distributions']['vendor'], {'dist': 'uniform', 'low': 0.9, 'high': 1.1})
+
+    def test_vendor_variance_injected_by_caller(self):
+        result = simulate(dict(BASE, confidence='high'), samples=10, seed=1, vendor_variance={'high': 0.3})
+        self.assertEqual(result['distributions']['vendor'], {'dist': 'uniform', 'low': 0.7, 'high': 1.3})
+
+    def test_unknown_complexity_falls_back_like_calculate(self):
+        # /calculate と同じく未知の難易度は既定の係数（大文字小文字は区別する）
+        for complexity in ('extreme', 'HIGH'):
+            result = simulate(dict(BASE, complexity=complexity), samples=50, seed=1,
+                              distributions={'screen_count': {'dist': 'fixed', 'value': 20},
+                                             'table_count': {'dist': 'fixed', 'value': 5},
+                                             'feature_days': {'dist': 'fixed', 'value': 1.0},
+                                             'vendor': {'dist': 'fixed', 'value': 1.0}})
+            price = estimate(**dict(BASE, complexity=complexity))['profit_analysis']['sales']
+            self.assertEqual(result['distributions']['complexity']['weights'], {complexity: 0.7})
+            self.assertEqual(result['price']['p50'], price)
+        result = simulate(BASE, samples=50, seed=1,
+                          distributions={'complexity': {'dist': 'categorical', 'weights': {'HIGH': 1.0}}})
+        self.assertEqual(result['status'], 'success')
+
+    def test_invalid_input(self):
+        with self.assertRaises(ValueError):
+            simulate(BASE, samples=0)
+        with self.assertRaises(ValueError):
+            simulate(BASE, samples=10, distributions={'budget': {'dist': 'fixed', 'value': 1}})
+        with self.assertRaises(ValueError):
+            simulate(BASE, samples=10, distributions={'vendor': {'dist': 'beta'}})
+
+
+class TestSimulationEndpoint(unittest.TestCase):
+    def test_calculate_simulate(self):
+        from fastapi.testclient import TestClient
+        from outsystems_api_wrapper import app
+        client = TestClient(app)
+        res = client.post('/calculate/simulate', json={'base': {'screen_count': 10}, 'samples': 1000, 'seed': 3})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json()['seed'], 3)
+        res = client.post('/calculate/simulate', json={'base': {'screen_count': 10}, 'samples': 10 ** 9})
+        self.assertEqual(res.status_code, 400)
+
+
+if __name__ == '__main__':
+    unittest.main()
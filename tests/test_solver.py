@@ -0,0 +1,100 @@
+import unittest
+import os
+import copy
+import itertools
+import time
+from unittest import mock
+from dify_assets.code import estimate_logic as dify_logic
+from dify_assets.code.estimate_logic import FEATURE_MAN_DAYS, PHASE2_ITEMS, estimate
+from estimate_engine import compile_ruleset
+from estimate_solver import solve_budget
+
+BASE = {'complexity': 'high', 'department': 'ＤＴ第１開発部', 'estimation_profile': 'enterprise',
+        'features': ['auth'], 'phase3_items': ['logo_creation'], 'confidence': 'low'}
+
+
+def price(**req):
+    return estimate(**req)['profit_analysis']['sales']
+
+
+class TestBudgetSolver(unittest.TestCase):
+    def test_max_screen_count(self):
+        budget = 30000000
+        result = solve_budget(budget, BASE, optional_features=[], optional_phase2=[], optional_phase3=[])
+        self.assertEqual(result['status'], 'success')
+        n = result['screen_count']
+        self.assertLessEqual(price(**dict(BASE, screen_count=n)), budget)
+        self.assertGreater(price(**dict(BASE, screen_count=n + 1)), budget)
+        self.assertEqual(result['estimated_price'], price(**dict(BASE, screen_count=n)))
+
+    def test_max_table_count(self):
+        budget = 20000000
+        base = dict(BASE, screen_count=5)
+        result = solve_budget(budget, base, maximize='table_count', optional_features=[], optional_phase2=[], optional_phase3=[])
+        n = result['table_count']
+        self.assertLessEqual(price(**dict(base, table_count=n)), budget)
+        self.assertGreater(price(**dict(base, table_count=n + 1)), budget)
+
+    def test_items_matches_brute_force(self):
+        budget = 38000000
+        base = dict(BASE, screen_count=10)
+        optional_features = ['payment', 'search_basic', 'admin_dashboard', 'offline_mode']
+        optional_phase2 = list(PHASE2_ITEMS)
+        result = solve_budget(budget, base, maximize='items', optional_features=optional_features,
+                              optional_phase2=optional_phase2, optional_phase3=[])
+        best = 0
+        for r in range(len(optional_features) + 1):
+            for fs in itertools.combinations(optional_features, r):
+                for q in range(len(optional_phase2) + 1):
+                    for ps in itertools.combinations(optional_phase2, q):
+                        p = price(**dict(base, features=['auth'] + list(fs), phase2_items=list(ps)))
+                        if p <= budget:
+                            best = max(best, p)
+        self.assertEqual(result['estimated_price'], best)
+        self.assertIn('auth', result['features'])
+        self.assertIn('logo_creation', result['phase3_items'])
+
+    def test_fills_leftover_with_optional_items(self):
+        result = solve_budget(25000000, BASE)
+        self.assertLessEqual(result['estimated_price'], 25000000)
+        for f in result['optional_selected']['features']:
+            self.assertIn(f, FEATURE_MAN_DAYS)
+
+    def test_infeasible(self):
+        result = solve_budget(100000, BASE)
+        self.assertEqual(result['status'], 'infeasible')
+        self.assertGreater(result['minimum_price'], 100000)
+
+    def test_follows_ruleset_coefficients(self):
+        # 確度倍率・バッファを変えたルールセットでも、モデルは評価プランの式で逆算する
+        ruleset = copy.deepcopy(dify_logic.RULESET)
+        ruleset['cost']['phase3_confidence'] = {'low': 2.5}
+        ruleset['cost']['buffer'] = 1.37
+        with mock.patch.object(dify_logic, 'PLAN', compile_ruleset(ruleset)):
+            for budget in (12000000, 30000000, 47000000):
+                result = solve_budget(budget, BASE, optional_features=[], optional_phase2=[], optional_phase3=[])
+                n = result['screen_count']
+                self.assertLessEqual(result['estimated_price'], budget)
+                self.assertGreater(price(**dict(BASE, screen_count=n + 1)), budget)
+
+    def test_success_is_within_budget(self):
+        for budget in range(5000000, 60000000, 2500000):
+            for maximize in ('screen_count', 'table_count', 'items'):
+                result = solve_budget(budget, dict(BASE, screen_count=4), maximize=maximize)
+                if result['status'] == 'success':
+                    self.assertLessEqual(result['estimated_price'], budget)
+                    self.assertEqual(result['estimated_price'], result['estimate']['profit_analysis']['sales'])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            solve_budget(1000000, BASE, maximize='budget')
+
+    @unittest.skipUnless(os.environ.get("RUN_TIMING_TESTS"), "wall-clock budget; set RUN_TIMING_TESTS=1 to run")
+    def test_interactive_latency(self):
+        started = time.perf_counter()
+        solve_budget(50000000, dict(BASE, features=[], phase3_items=[]))
+        self.assertLess(time.perf_counter() - started, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
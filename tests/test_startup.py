@@ -0,0 +1,67 @@
+import unittest
+import os
+import shutil
+import sys
+import tempfile
+from benchmarks import bench_suite
+from config_snapshot import ConfigStore, compile_config, compiled_path_for
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "estimate_config.yaml")
+
+
+class TestImportBudget(unittest.TestCase):
+    def test_entrypoints_defer_heavy_modules(self):
+        for module in bench_suite.IMPORT_BUDGET_MS:
+            with self.subTest(module=module):
+                loaded = bench_suite.measure_import(module)["loaded"]
+                self.assertEqual([m for m in bench_suite.LAZY_MODULES if m in loaded], [])
+
+    @unittest.skipUnless(os.environ.get("RUN_TIMING_TESTS"), "wall-clock budget; set RUN_TIMING_TESTS=1 to run")
+    def test_own_import_time_within_budget(self):
+        for module, budget_ms in bench_suite.IMPORT_BUDGET_MS.items():
+            with self.subTest(module=module):
+                # 単発の計測はぶれるため、3回の最良値で判定する
+                own_ms = min(bench_suite.measure_import(module)["own_us"] for _ in range(3)) / 1000
+                self.assertLessEqual(own_ms, budget_ms)
+
+
+class TestCompiledConfig(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "estimate_config.yaml")
+        shutil.copy(CONFIG_PATH, self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_compiled_config_matches_yaml(self):
+        from_yaml = ConfigStore(self.path, compiled_path="").get()
+        compiled = compile_config(self.path)
+        self.assertEqual(compiled, compiled_path_for(self.path))
+        from_compiled = ConfigStore(self.path).get()
+        self.assertEqual(from_compiled.raw, from_yaml.raw)
+        self.assertEqual(from_compiled.digest, from_yaml.digest)
+
+    def test_store_only_reads_artifact_and_ignores_stale_one(self):
+        # 実行時は書き出さない（生成はビルド時の compile_config だけ）
+        ConfigStore(self.path).get()
+        self.assertFalse(os.path.exists(compiled_path_for(self.path)))
+        compile_config(self.path)
+        with open(self.path, "r", encoding="utf-8") as f:
+            text = f.read()
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(text.replace('config_version: "2026-01"', 'config_version: "2026-02"'))
+        self.assertEqual(ConfigStore(self.path).get().version, "2026-02")
+
+    def test_invalid_config_is_not_compiled(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            text = f.read()
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(text.replace('buffer_multiplier: 1.1', 'buffer_multiplier: "x"'))
+        with self.assertRaises(ValueError):
+            ConfigStore(self.path).get()
+        self.assertFalse(os.path.exists(compiled_path_for(self.path)))
+
+
+if __name__ == '__main__':
+    unittest.main()